@@ -7,21 +7,65 @@ Contains implementation for the BackupApplication.
 The BackupApplication is invoked by the backup script to perform backups.
 """
 
-from argparse import ArgumentParser, Namespace, _SubParsersAction
+from argparse import ArgumentParser, ArgumentTypeError, Namespace, _SubParsersAction
+from contextlib import redirect_stderr
+from datetime import datetime
+from io import StringIO
 from logging import INFO, StreamHandler
-from os import environ
+from os import environ, getpid
 from pathlib import Path
+from socket import gethostname
+import sqlite3
 from sys import stderr
 from typing import Optional
 
 from requests import Session
 
+from .bandwidth import (
+    AdaptiveThrottle,
+    BandwidthPolicy,
+    BandwidthSchedule,
+    LatencyProbe,
+)
 from .cmd import cmdexec
+from .duration import parse_duration
+from .history import RunHistory
 from .log import logger
+from .manifest import Manifest, ManifestJob, ManifestRunner
+from .metrics import MIB
+from .priority import ProcessPriority
+from .queue import WorkQueue
 from .rclone import RcloneClient, RcloneService
+from .rclone.hashcache import ChecksumCache
+from .rclone.rcd import RcloneRcdClient
 from .restic import ResticClient, ResticService
+from .restic.cache import ResticMetadataCache
+from .restic.fingerprint import FingerprintStore
+from .restic.journal import BackupJournal
+from .restic.planner import BackupPlanner
+from .restic.schedule import ResticCheckSchedule
 from .reporter import BackupReporter, GoogleChatBackupReporter, GoogleChatReportRenderer
-from .report import BackupReport
+from .report import BackupReport, BackupReportFieldAnnotation as A
+from .state import StateDirectory
+from .tuning import CgroupLimits, RuntimeTuning
+
+
+DEADLINE_HELP = (
+    "stop starting new work once this duration has passed since the start of the "
+    "run, interrupting any work still in progress (e.g. 5h); set this shorter than "
+    "the job's own deadline to leave time for the report to be sent"
+)
+
+
+BWLIMIT_HELP = (
+    "bandwidth limit in rclone's timetable syntax, e.g. '08:00,512k 19:00,10M "
+    "23:00,off' or '10M:100M' for separate upload and download limits"
+)
+
+BWLIMIT_PROBE_HELP = (
+    "HOST:PORT whose TCP connect latency is measured before each command; the upload "
+    "limit is lowered while the latency is well above its lowest observed value"
+)
 
 
 class BackupApplication:
@@ -38,6 +82,17 @@ class BackupApplication:
         # Used for validation during test runs.
         self.backup_report: Optional[BackupReport] = None
 
+        # Settings derived from the container's resource limits. main reads the
+        # limits; until then, nothing is tuned.
+        self.tuning = RuntimeTuning(CgroupLimits(None, None))
+
+        # The tuned settings applied to restic and rclone, keyed by setting, so that
+        # they can be recorded on the report.
+        self.tuned_settings: dict[str, str] = dict()
+
+        # CPU and I/O priority that restic and rclone run with. Set by main.
+        self.priority: Optional[ProcessPriority] = None
+
     def argparser(self) -> ArgumentParser:
         """
         Returns a configured argument parser for this application.
@@ -58,13 +113,105 @@ class BackupApplication:
             required=True,
             help="The name of the backup (used during reporting).",
         )
+        a.add_argument(
+            "--history-file",
+            action="store",
+            type=Path,
+            default=None,
+            help=(
+                "SQLite database in which the results of each run are recorded; "
+                "results that deviate strongly from previous runs are flagged "
+                "in the report"
+            ),
+        )
+        self.argparser_priority(a)
         backup_mode = a.add_subparsers(help="type of backup to perform")
 
+        self.argparser_manifest(backup_mode)
         self.argparser_rclone(backup_mode)
         self.argparser_restic(backup_mode)
 
         return a
 
+    def argparser_manifest(self, a: _SubParsersAction) -> None:
+        """
+        Configures the run-manifest arguments for the argument parser.
+        """
+        run_manifest = a.add_parser(
+            "run-manifest",
+            help="run the backup jobs declared in a manifest, in dependency order",
+        )
+        run_manifest.add_argument(
+            "manifest",
+            action="store",
+            type=Path,
+            help="YAML manifest declaring the jobs and their dependencies",
+        )
+        run_manifest.add_argument(
+            "--concurrency",
+            action="store",
+            type=positive_int,
+            default=None,
+            help="maximum number of jobs to run at once (default: from the manifest)",
+        )
+        run_manifest.set_defaults(func=self.run_manifest)
+
+    def argparser_priority(self, a: ArgumentParser) -> None:
+        """
+        Configures the arguments setting the CPU and I/O priority of restic and rclone.
+        """
+        a.add_argument(
+            "--nice",
+            action="store",
+            type=int,
+            default=None,
+            help="niceness added to restic and rclone (e.g. 10)",
+        )
+        a.add_argument(
+            "--ionice-class",
+            action="store",
+            choices=list(ProcessPriority.IONICE_CLASSES),
+            default=None,
+            help="I/O scheduling class of restic and rclone",
+        )
+        a.add_argument(
+            "--ionice-level",
+            action="store",
+            type=int,
+            choices=range(8),
+            default=None,
+            help="I/O priority within the scheduling class, from 0 (highest) to 7",
+        )
+        a.add_argument(
+            "--cgroup",
+            action="store",
+            type=Path,
+            default=None,
+            help=(
+                "cgroup v2 directory, created if needed, that restic and rclone are "
+                "moved into; it must be in a delegated subtree with the cpu and io "
+                "controllers enabled"
+            ),
+        )
+        a.add_argument(
+            "--cpu-weight",
+            action="store",
+            type=int,
+            choices=range(1, 10001),
+            metavar="{1..10000}",
+            default=None,
+            help="cpu.weight of the cgroup given by --cgroup; the default is 100",
+        )
+        a.add_argument(
+            "--io-max",
+            action="append",
+            default=[],
+            help=(
+                "line written to io.max of the cgroup given by --cgroup "
+                "(e.g. '8:0 rbps=104857600'); may be given multiple times"
+            ),
+        )
+
     def argparser_rclone(self, a: _SubParsersAction) -> None:
         """
         Configures the rclone arguments for the argument parser.
@@ -73,9 +220,16 @@ class BackupApplication:
         rclone.add_argument(
             "--bwlimit",
             action="store",
-            type=str,
-            default="off",
-            help="the bwlimit to pass to rclone",
+            type=bandwidth_schedule,
+            default=BandwidthSchedule.parse("off"),
+            help=BWLIMIT_HELP,
+        )
+        rclone.add_argument(
+            "--bwlimit-probe",
+            action="store",
+            type=probe_target,
+            default=None,
+            help=BWLIMIT_PROBE_HELP,
         )
         rclone.add_argument(
             "--s3-storage-class",
@@ -84,6 +238,78 @@ class BackupApplication:
             default="STANDARD",
             help="the S3 storage class for created objects",
         )
+        rclone.add_argument(
+            "--transfers",
+            action="store",
+            type=positive_int,
+            default=None,
+            help="number of files to transfer concurrently (default: sized from limits)",
+        )
+        rclone.add_argument(
+            "--checkers",
+            action="store",
+            type=positive_int,
+            default=None,
+            help="number of files to check concurrently (default: sized from limits)",
+        )
+        rclone.add_argument(
+            "--fast-list",
+            action="store_true",
+            help=(
+                "list the destination recursively in as few requests as possible; "
+                "uses about 1 KiB of memory per object"
+            ),
+        )
+        rclone.add_argument(
+            "--compare-fast-list",
+            action="store_true",
+            help=(
+                "estimate the LIST requests of the sync with and without --fast-list "
+                "from the source directory, and record them in the report"
+            ),
+        )
+        rclone.add_argument(
+            "--s3-upload-concurrency",
+            action="store",
+            type=positive_int,
+            default=None,
+            help=(
+                "number of chunks of a file to upload concurrently "
+                "(default: sized from limits)"
+            ),
+        )
+        rclone.add_argument(
+            "--s3-chunk-size",
+            action="store",
+            type=str,
+            default=None,
+            help="size of the chunks of multipart uploads (default: sized from limits)",
+        )
+        rclone.add_argument(
+            "--s3-upload-cutoff",
+            action="store",
+            type=str,
+            default=None,
+            help="size above which files are uploaded in chunks, e.g. 200M",
+        )
+        rclone.add_argument(
+            "--rcd",
+            action="store_true",
+            help=(
+                "run every rclone command of the backup in a single, long-lived "
+                "rclone rcd process"
+            ),
+        )
+        rclone.add_argument(
+            "--checksum-cache",
+            action="store",
+            type=Path,
+            default=None,
+            help=(
+                "SQLite database in which the checksums of source files are cached, "
+                "so that unchanged files are not hashed again on the next sync"
+            ),
+        )
         rclone_sub = rclone.add_subparsers(help="rclone operations")
 
         rclone_sync = rclone_sub.add_parser("sync", help="rclone sync")
@@ -100,6 +326,25 @@ class BackupApplication:
             type=str,
             help="the destination directory for the rclone sync",
         )
+        rclone_sync.add_argument(
+            "--jobs",
+            action="store",
+            type=positive_int,
+            default=1,
+            help=(
+                "number of rclone processes to run concurrently; the largest "
+                "top-level directories of the source are synced by their own process, "
+                "and transfer settings that are not given are tuned to each process's "
+                "share of the container's resources"
+            ),
+        )
+        rclone_sync.add_argument(
+            "--deadline",
+            action="store",
+            type=parse_duration,
+            default=None,
+            help=DEADLINE_HELP,
+        )
 
     def argparser_restic(self, a: _SubParsersAction) -> None:
         """
@@ -127,13 +372,128 @@ class BackupApplication:
             required=True,
             help="path to the restic repository's password file",
         )
+        restic.add_argument(
+            "--host",
+            action="store",
+            type=str,
+            default=None,
+            help=(
+                "host name recorded in snapshots; set this to a stable name if the "
+                "job's host name changes between runs (default: the host's name)"
+            ),
+        )
+        restic.add_argument(
+            "--state-dir",
+            action="store",
+            type=Path,
+            default=None,
+            help=(
+                "path to the directory in which state is kept between runs "
+                "(default: next to the restic cache directory)"
+            ),
+        )
         restic_sub = restic.add_subparsers(help="restic operations")
 
         restic_backup = restic_sub.add_parser("backup", help="restic backup")
         restic_backup.add_argument("source", help="source directory for restic backup")
+        restic_backup.add_argument(
+            "--jobs",
+            action="store",
+            type=positive_int,
+            default=1,
+            help=(
+                "number of child directories to back up concurrently; ignored with "
+                "--queue-dir, where each process backs up one child at a time"
+            ),
+        )
+        restic_backup.add_argument(
+            "--fingerprint-max-age",
+            action="store",
+            type=parse_duration,
+            default=None,
+            help=(
+                "skip restic for child directories whose fingerprint is unchanged, "
+                "but run it anyway once their last backup is older than this duration "
+                "(e.g. 7d)"
+            ),
+        )
+        restic_backup.add_argument(
+            "--bwlimit",
+            action="store",
+            type=bandwidth_schedule,
+            default=None,
+            help=BWLIMIT_HELP,
+        )
+        restic_backup.add_argument(
+            "--bwlimit-probe",
+            action="store",
+            type=probe_target,
+            default=None,
+            help=BWLIMIT_PROBE_HELP,
+        )
+        restic_backup.add_argument(
+            "--drop-page-cache",
+            action="store_true",
+            help=(
+                "evict the data restic read from the page cache after each backup, "
+                "so that the backup does not push out the cached data of other "
+                "workloads"
+            ),
+        )
+        restic_backup.add_argument(
+            "--run-id",
+            action="store",
+            type=str,
+            default=None,
+            help=(
+                "identifies the run across retries, e.g. the name of the Kubernetes "
+                "Job; a retried run skips child directories that an earlier attempt "
+                "already backed up"
+            ),
+        )
+        restic_backup.add_argument(
+            "--queue-dir",
+            action="store",
+            type=Path,
+            default=None,
+            help=(
+                "share the child directories with other backup processes through a "
+                "work queue in this directory, which must be on a volume shared by all "
+                "of them; requires --run-id"
+            ),
+        )
+        restic_backup.add_argument(
+            "--queue-role",
+            action="store",
+            type=str,
+            choices=["coordinator", "worker"],
+            default="coordinator",
+            help=(
+                "role of this process in a queued backup; the single coordinator "
+                "populates the queue and reports on all child directories, while "
+                "workers only help back them up"
+            ),
+        )
+        restic_backup.add_argument(
+            "--deadline",
+            action="store",
+            type=parse_duration,
+            default=None,
+            help=DEADLINE_HELP,
+        )
         restic_backup.set_defaults(func=self.restic_backup)
 
         restic_check = restic_sub.add_parser("check", help="restic check")
+        restic_check.add_argument(
+            "--read-data-subsets",
+            action="store",
+            type=positive_int,
+            default=None,
+            help=(
+                "split the repository's data into this many subsets and verify "
+                "the next one on each run (default: verify all data on each run)"
+            ),
+        )
         restic_check.set_defaults(func=self.restic_check)
 
         restic_compare_latest_snapshots = restic_sub.add_parser(
@@ -149,6 +509,25 @@ class BackupApplication:
 
         self.argparser_restic_prune_repack(restic_sub)
 
+        restic_replicate = restic_sub.add_parser(
+            "replicate",
+            help="copy snapshots missing from another repository into it",
+        )
+        restic_replicate.add_argument(
+            "destination_repository", help="repository to copy snapshots to"
+        )
+        restic_replicate.add_argument(
+            "--destination-password-file",
+            action="store",
+            type=Path,
+            default=None,
+            help=(
+                "path to the destination repository's password file "
+                "(default: the source repository's password file)"
+            ),
+        )
+        restic_replicate.set_defaults(func=self.restic_replicate)
+
     def argparser_restic_prune_repack(self, a: _SubParsersAction) -> None:
         """
         Configures the restic arguments for the argument prune-repack action.
@@ -194,8 +573,54 @@ class BackupApplication:
             help="keep yearly snapshots taken within this duration",
         )
 
+        pr.add_argument(
+            "--prune-threshold",
+            type=percentage,
+            default=10.0,
+            help=(
+                "only prune if at least this percentage of the repository's data is "
+                "unused, as estimated by a dry run of the prune; 0 always prunes "
+                "(default: %(default)s)"
+            ),
+        )
+        pr.add_argument(
+            "--max-unused",
+            type=str,
+            default=None,
+            help="passed to restic prune --max-unused, e.g. 5%% or 2G",
+        )
+        pr.add_argument(
+            "--max-repack-size",
+            type=str,
+            default=None,
+            help="passed to restic prune --max-repack-size, e.g. 10G",
+        )
+        pr.add_argument(
+            "--prune-time-budget",
+            type=parse_duration,
+            default=None,
+            help=(
+                "interrupt the prune once it has run for this duration (e.g. 2h); "
+                "the next prune continues where it left off"
+            ),
+        )
+
         pr.set_defaults(func=self.restic_prune_repack)
 
+    def bandwidth_policy(
+        self, schedule: Optional[BandwidthSchedule], probe: Optional[LatencyProbe]
+    ) -> Optional[BandwidthPolicy]:
+        """
+        Returns the bandwidth policy for the given schedule and probe, or None if
+        bandwidth is not limited.
+        """
+        if probe is None:
+            return schedule
+
+        if schedule is None:
+            schedule = BandwidthSchedule.parse("off")
+        return AdaptiveThrottle(schedule, probe)
+
     def configure_logger(self) -> None:
         """
         Configures the logger for this application.
@@ -208,10 +633,15 @@ class BackupApplication:
         """
         Returns an RcloneService configured according to provided arguments.
         """
-        client = RcloneClient(cmdexec)
+        client = RcloneRcdClient(cmdexec) if args.rcd else RcloneClient(cmdexec)
+        client.bandwidth = self.bandwidth_policy(args.bwlimit, args.bwlimit_probe)
+        client.transfers = args.transfers
+        client.checkers = args.checkers
+        client.fast_list = args.fast_list
+        client.s3_upload_concurrency = args.s3_upload_concurrency
+        client.s3_chunk_size = args.s3_chunk_size
+        client.s3_upload_cutoff = args.s3_upload_cutoff
         client.sync_args = [
-            "--bwlimit",
-            args.bwlimit,
             "--checksum",
             "--delete-after",
         ]
@@ -226,16 +656,58 @@ class BackupApplication:
             args.s3_storage_class,
         ]
 
-        return RcloneService(client)
+        self.tune_rclone(client, args.jobs)
+        rclone_service = RcloneService(client)
+        rclone_service.compare_fast_list = args.compare_fast_list
+        if args.checksum_cache is not None:
+            rclone_service.checksum_cache = ChecksumCache(args.checksum_cache)
+            # rclone keeps the checksums it is given in its cache directory, which
+            # must persist between syncs along with the checksum cache.
+            client.cache_dir = args.checksum_cache.parent / "rclone-cache"
+        return rclone_service
 
     def rclone_sync(self, args: Namespace) -> BackupReport:
         """
         Backup operation for rclone sync.
         """
         rclone_service = self.rclone_service(args)
-        return rclone_service.sync(
-            name=args.name, source=args.source, destination=args.destination
-        )
+        rclone_service.shard_jobs = args.jobs
+        if args.deadline is not None:
+            rclone_service.deadline = datetime.now() + args.deadline
+
+        try:
+            return rclone_service.sync(
+                name=args.name, source=args.source, destination=args.destination
+            )
+        finally:
+            rclone_service.client.close()
+
+    def restic_state(self, args: Namespace) -> StateDirectory:
+        """
+        Returns the StateDirectory for restic operations.
+
+        Unless a state directory is given, state is kept in a directory next to
+        the restic cache directory.
+        """
+        if args.state_dir is not None:
+            return StateDirectory(args.state_dir)
+
+        # The cache directory is resolved first so that its name is known even if it
+        # is given as e.g. ".".
+        cache_dir = Path(args.cache_dir).resolve()
+        return StateDirectory(cache_dir.parent / f"{cache_dir.name}.backupjob")
+
+    def restic_processes(self, args: Namespace) -> int:
+        """
+        Returns the number of restic processes that the given arguments run at the
+        same time.
+
+        A backup with --jobs runs one restic process per job, unless the children are
+        shared through a work queue, which backs up one child at a time.
+        """
+        if getattr(args, "queue_dir", None) is not None:
+            return 1
+        return getattr(args, "jobs", 1)
 
     def restic_service(
         self,
@@ -247,6 +719,11 @@ class BackupApplication:
         client = ResticClient(
             cmdexec, args.repository, args.password_file, args.cache_dir
         )
+        client.host = args.host
+        client.metadata_cache = ResticMetadataCache(
+            self.restic_state(args), args.repository
+        )
+        self.tune_restic(client, self.restic_processes(args))
         return ResticService(client)
 
     def restic_backup(self, args: Namespace) -> BackupReport:
@@ -254,12 +731,56 @@ class BackupApplication:
         Backup operation for restic backup.
         """
         restic_service = self.restic_service(args)
+        if args.fingerprint_max_age is not None:
+            restic_service.fingerprints = FingerprintStore(
+                self.restic_state(args),
+                args.repository,
+                args.fingerprint_max_age,
+            )
+
+        # A queued backup keeps its progress in the queue rather than in a journal.
+        if args.run_id is not None and args.queue_dir is None:
+            restic_service.journal = BackupJournal(
+                self.restic_state(args),
+                args.repository,
+                Path(args.source).resolve(),
+                args.run_id,
+            )
+
+        if args.deadline is not None:
+            restic_service.deadline = datetime.now() + args.deadline
+
+        restic_service.drop_page_cache = args.drop_page_cache
+        restic_service.client.bandwidth = self.bandwidth_policy(
+            args.bwlimit, args.bwlimit_probe
+        )
+
+        # Without history, children are planned by an estimate of the size of their
+        # data, which requires listing each child's tree. That is only worth it if
+        # children have to fit before a deadline.
+        if args.history_file is not None or args.deadline is not None:
+            restic_service.planner = BackupPlanner(
+                RunHistory(args.history_file) if args.history_file is not None else None
+            )
+
+        if args.queue_dir is not None:
+            return restic_service.backup_queued(
+                name=args.name,
+                source=Path(args.source),
+                skip_if_unchanged=True,
+                exclude_files=[],
+                queue=WorkQueue(args.queue_dir, f"{gethostname()}-{getpid()}"),
+                run_id=args.run_id,
+                coordinator=args.queue_role == "coordinator",
+            )
+
         return restic_service.backup(
             name=args.name,
             source=Path(args.source),
             for_each=True,
             skip_if_unchanged=True,
             exclude_files=[],
+            jobs=args.jobs,
         )
 
     def restic_check(self, args: Namespace) -> BackupReport:
@@ -267,6 +788,13 @@ class BackupApplication:
         Backup operation for restic check.
         """
         restic_service = self.restic_service(args)
+        if args.read_data_subsets is not None:
+            restic_service.check_schedule = ResticCheckSchedule(
+                self.restic_state(args),
+                args.repository,
+                args.read_data_subsets,
+            )
+
         return restic_service.check()
 
     def restic_compare_latest_snapshots(self, args: Namespace) -> BackupReport:
@@ -274,8 +802,8 @@ class BackupApplication:
         Snapshot comparison operation for restic.
         """
         restic_service = self.restic_service(args)
-        remote_client = ResticClient(
-            cmdexec, args.remote_repository, args.password_file, None
+        remote_client = self.restic_remote_client(
+            args, args.remote_repository, args.password_file
         )
 
         return restic_service.compare_latest_snapshots(remote_client)
@@ -297,7 +825,128 @@ class BackupApplication:
             keep_within_weekly=args.keep_within_weekly,
             keep_within_monthly=args.keep_within_monthly,
             keep_within_yearly=args.keep_within_yearly,
+            prune_threshold=args.prune_threshold,
+            max_unused=args.max_unused,
+            max_repack_size=args.max_repack_size,
+            prune_time_budget=args.prune_time_budget,
+        )
+
+    def restic_remote_client(
+        self, args: Namespace, repository: str, password_file: Optional[Path]
+    ) -> ResticClient:
+        """
+        Returns a ResticClient for a repository other than the one given by
+        --repository, such as the destination of a replication.
+        """
+        client = ResticClient(cmdexec, repository, password_file, None)
+        client.metadata_cache = ResticMetadataCache(self.restic_state(args), repository)
+        self.tune_restic(client)
+        return client
+
+    def restic_replicate(self, args: Namespace) -> BackupReport:
+        """
+        Snapshot replication operation for restic.
+        """
+        restic_service = self.restic_service(args)
+        password_file = args.destination_password_file or args.password_file
+        destination = self.restic_remote_client(
+            args, args.destination_repository, password_file
+        )
+
+        return restic_service.replicate(destination)
+
+    def parse_manifest(self, argparser: ArgumentParser, args: Namespace) -> None:
+        """
+        Loads the manifest of a run-manifest invocation and parses the arguments of
+        its jobs, exiting with a usage error if either is invalid.
+
+        The manifest is kept in args.loaded_manifest and the parsed arguments of each
+        job in args.job_args, keyed by the job's name.
+        """
+        try:
+            manifest = Manifest.load(args.manifest)
+        except (OSError, ValueError) as e:
+            argparser.error(str(e))
+        if args.concurrency is not None:
+            manifest.concurrency = args.concurrency
+
+        args.loaded_manifest = manifest
+        args.job_args = {
+            job.name: self.manifest_job_args(argparser, args, job)
+            for job in manifest.jobs
+        }
+
+    def manifest_job_args(
+        self, argparser: ArgumentParser, args: Namespace, job: ManifestJob
+    ) -> Namespace:
+        """
+        Returns the parsed arguments of a manifest job.
+
+        A job's arguments are parsed as if the backup script had been invoked with
+        them, with the global options of the manifest run and the job's name. If they
+        are invalid, exits with a usage error of argparser naming the job.
+        """
+        argv = ["--reporter", args.reporter, "--name", job.name]
+        if args.history_file is not None:
+            argv.extend(["--history-file", str(args.history_file)])
+
+        # The job's own usage error is captured and reported as an error of the
+        # manifest run, rather than printed as if the job had been invoked directly.
+        job_argparser = self.argparser()
+        output = StringIO()
+        try:
+            with redirect_stderr(output):
+                job_args = job_argparser.parse_args([*argv, *job.args])
+                self.check_args(job_argparser, job_args)
+        except SystemExit:
+            lines = output.getvalue().strip().splitlines() or [""]
+            error = lines[-1].partition("error: ")[2] or " ".join(job.args)
+            argparser.error(f"invalid arguments for job {job.name!r}: {error}")
+
+        if job_args.func == self.run_manifest:
+            argparser.error(f"job {job.name!r} may not run a manifest")
+        return job_args
+
+    def run_manifest(self, args: Namespace) -> BackupReport:
+        """
+        Backup operation running the jobs of a manifest.
+
+        Jobs run in this process, so they share the process's start-up, priority and
+        reporter, and are reported in a single report. The manifest and the arguments
+        of every job are parsed along with the run's own arguments, before any job
+        runs. As up to the manifest's concurrency of jobs run at the same time, each
+        is tuned to that share of the container's resource limits.
+        """
+        manifest: Manifest = args.loaded_manifest
+        job_args: dict[str, Namespace] = args.job_args
+        self.tuning = self.tuning.share(manifest.concurrency)
+
+        def run_job(job: ManifestJob) -> BackupReport:
+            return job_args[job.name].func(job_args[job.name])
+
+        report = BackupReport(name=args.name)
+        report.new_field("Manifest", str(args.manifest), lambda _: None)
+        start_time = report.new_field("Start Time", datetime.now(), lambda _: None)
+        ManifestRunner(manifest, run_job).run(report)
+        report.new_field(
+            "Duration (s)",
+            round((datetime.now() - start_time.data).total_seconds(), 1),
+            lambda _: None,
         )
+        return report
+
+    def record_history(self, path: Path, report: BackupReport) -> None:
+        """
+        Flags anomalies in the report against the run history, then records the
+        report in the run history.
+
+        Failing to access the run history does not prevent the report from being sent.
+        """
+        history = RunHistory(path)
+        try:
+            history.flag_and_record(report, datetime.now())
+        except (OSError, sqlite3.Error) as e:
+            logger(None).warning(f"failed to record run history in {path}: {e}")
 
     def reporter(self, args: Namespace) -> BackupReporter:
         """
@@ -319,19 +968,212 @@ class BackupApplication:
                 # an error before we get here.
                 raise ValueError(f"invalid reporter type: {args.reporter}")
 
+    def parse_args(self, argparser: ArgumentParser, argv: list[str]) -> Namespace:
+        """
+        Parses the given arguments, exiting with a usage error if they are invalid,
+        including combinations of arguments the argument parser cannot check itself
+        and, for run-manifest, the manifest and the arguments of its jobs.
+        """
+        args = argparser.parse_args(argv)
+        self.check_args(argparser, args)
+        if getattr(args, "func", None) == self.run_manifest:
+            self.parse_manifest(argparser, args)
+
+        return args
+
+    def check_args(self, argparser: ArgumentParser, args: Namespace) -> None:
+        """
+        Exits with a usage error if parsed arguments combine options that the
+        argument parser cannot check itself.
+        """
+        if getattr(args, "queue_dir", None) is not None and args.run_id is None:
+            argparser.error("--queue-dir requires --run-id")
+
+    def process_priority(self, args: Namespace) -> Optional[ProcessPriority]:
+        """
+        Returns the ProcessPriority configured by the provided arguments, or None if
+        none was configured.
+
+        If the priority's cgroup cannot be set up, commands are not moved into it, but
+        still run with the rest of the priority.
+        """
+        priority = ProcessPriority()
+        priority.nice = args.nice
+        priority.ionice_class = args.ionice_class
+        priority.ionice_level = args.ionice_level
+        priority.cgroup = args.cgroup
+        priority.cpu_weight = args.cpu_weight
+        priority.io_max = args.io_max
+
+        if priority.describe() == "":
+            return None
+
+        try:
+            priority.setup()
+        except OSError as e:
+            logger(None).warning(f"failed to set up cgroup {priority.cgroup}: {e}")
+            priority.cgroup = None
+            priority.cpu_weight = None
+            priority.io_max = []
+
+        return priority
+
+    def tune_go(self, env: dict[str, str], tuning: RuntimeTuning) -> None:
+        """
+        Adds the environment variables that tune the Go runtime to env.
+        """
+        for k, v in tuning.go_env(environ).items():
+            env[k] = v
+            self.tuned_settings[k] = v
+        if tuning.processes > 1:
+            self.tuned_settings["Concurrent processes"] = str(tuning.processes)
+
+    def tune_rclone(self, client: RcloneClient, processes: int = 1) -> None:
+        """
+        Tunes an RcloneClient to its share of the container's resource limits, given
+        the number of syncs running at the same time.
+
+        Settings that were already chosen, e.g. from arguments, are left as is. If the
+        client runs concurrent syncs in a single process, that process's Go runtime
+        is tuned to the whole of the limits.
+        """
+        tuning = self.tuning.share(processes)
+        self.tune_go(client.env, self.tuning if client.shares_process else tuning)
+        client.priority = self.priority
+        if client.transfers is None and tuning.transfers is not None:
+            client.transfers = tuning.transfers
+            self.tuned_settings["rclone --transfers"] = str(client.transfers)
+        if client.checkers is None and tuning.checkers is not None:
+            client.checkers = tuning.checkers
+            self.tuned_settings["rclone --checkers"] = str(client.checkers)
+
+        concurrency = tuning.s3_upload_concurrency
+        if client.s3_upload_concurrency is None and concurrency is not None:
+            client.s3_upload_concurrency = concurrency
+            self.tuned_settings["rclone --s3-upload-concurrency"] = str(concurrency)
+
+        chunk_size = tuning.s3_chunk_size(
+            client.transfers, client.s3_upload_concurrency
+        )
+        if client.s3_chunk_size is None and chunk_size is not None:
+            client.s3_chunk_size = f"{chunk_size // MIB}M"
+            self.tuned_settings["rclone --s3-chunk-size"] = client.s3_chunk_size
+
+    def tune_restic(self, client: ResticClient, processes: int = 1) -> None:
+        """
+        Tunes a ResticClient to its share of the container's resource limits, given
+        the number of processes running at the same time.
+        """
+        tuning = self.tuning.share(processes)
+        self.tune_go(client.env, tuning)
+        client.priority = self.priority
+        client.read_concurrency = tuning.read_concurrency
+        if client.read_concurrency is not None:
+            self.tuned_settings["restic --read-concurrency"] = str(
+                client.read_concurrency
+            )
+
+        connections = tuning.s3_connections
+        if client.repository_path.startswith("s3:") and connections is not None:
+            client.options["s3.connections"] = str(connections)
+            self.tuned_settings["restic -o s3.connections"] = str(connections)
+
+    def add_tuning_field(self, report: BackupReport) -> None:
+        """
+        Adds a field to the report recording the container's resource limits and the
+        settings that were derived from them.
+        """
+        if len(self.tuned_settings) == 0:
+            return
+
+        limits = self.tuning.limits
+        lines: list[str] = list()
+        if limits.cpus is not None:
+            lines.append(f"CPU limit: {limits.cpus:g}")
+        elif self.tuning.host_cpus is not None:
+            lines.append(f"Host CPUs: {self.tuning.host_cpus}")
+        if limits.memory is not None:
+            lines.append(f"Memory limit: {limits.memory // MIB}MiB")
+        elif self.tuning.host_memory is not None:
+            lines.append(f"Host memory: {self.tuning.host_memory // MIB}MiB")
+        lines.extend(f"{k}: {v}" for k, v in self.tuned_settings.items())
+        report.new_field("Runtime Tuning", "\n".join(lines), lambda _: A.MULTILINE_TEXT)
+
     def main(self, argv: list[str]) -> int:
         """
         The entrypoint for the backup application.
         """
         self.configure_logger()
         argparser = self.argparser()
-        args = argparser.parse_args(argv)
+        args = self.parse_args(argparser, argv)
         reporter = self.reporter(args)
+        self.tuning = RuntimeTuning(CgroupLimits.read())
+        self.priority = self.process_priority(args)
         backup_report: BackupReport = args.func(args)
+        self.add_tuning_field(backup_report)
+        if self.priority is not None:
+            # Recorded next to the throughput of each backup, so that throughput can
+            # be judged against the priority it ran with.
+            backup_report.new_field(
+                "Process Priority", self.priority.describe(), lambda _: None
+            )
         self.backup_report = backup_report
+        if args.history_file is not None:
+            self.record_history(args.history_file, backup_report)
         reporter.report(backup_report)
 
         if backup_report.successful:
             return self.RC_OK
         else:
             return self.RC_BACKUP_ERROR
+
+
+def bandwidth_schedule(s: str) -> BandwidthSchedule:
+    """
+    Argument type for bandwidth limits in rclone's timetable syntax.
+    """
+    try:
+        return BandwidthSchedule.parse(s)
+    except ValueError as e:
+        raise ArgumentTypeError(str(e))
+
+
+def percentage(s: str) -> float:
+    """
+    Argument type for options that must be a percentage between 0 and 100.
+    """
+    try:
+        f = float(s.removesuffix("%"))
+    except ValueError:
+        raise ArgumentTypeError(f"invalid percentage: {s!r}")
+
+    if not 0 <= f <= 100:
+        raise ArgumentTypeError(f"must be between 0 and 100: {s!r}")
+
+    return f
+
+
+def probe_target(s: str) -> LatencyProbe:
+    """
+    Argument type for the HOST:PORT of a latency probe target.
+    """
+    host, sep, port = s.rpartition(":")
+    if sep == "" or host == "" or not port.isdigit():
+        raise ArgumentTypeError(f"invalid probe target, expected HOST:PORT: {s!r}")
+
+    return LatencyProbe(host.strip("[]"), int(port))
+
+
+def positive_int(s: str) -> int:
+    """
+    Argument type for options that must be a positive integer.
+    """
+    try:
+        i = int(s)
+    except ValueError:
+        raise ArgumentTypeError(f"invalid integer: {s!r}")
+
+    if i < 1:
+        raise ArgumentTypeError(f"must be at least 1: {s!r}")
+
+    return i
@@ -0,0 +1,384 @@
+"""
+backup.bandwidth
+================
+
+Contains code to limit the bandwidth used by restic and rclone.
+"""
+
+from datetime import datetime
+import re
+import socket
+from statistics import median
+from threading import Lock
+import time
+from typing import Optional, Self
+
+from .metrics import MIB
+
+KIB = 1024
+
+# Weekday names accepted in timetables, in the order of datetime.weekday().
+WEEKDAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+# Matches a bandwidth in rclone's syntax, e.g. "512k" or "1.5M". Without a suffix,
+# the bandwidth is in KiB/s.
+RATE_RE = re.compile(r"([0-9]+(?:\.[0-9]+)?)([bkmgtp]?)", re.IGNORECASE)
+RATE_UNITS = {
+    "b": 1,
+    "": KIB,
+    "k": KIB,
+    "m": KIB**2,
+    "g": KIB**3,
+    "t": KIB**4,
+    "p": KIB**5,
+}
+
+# Matches the time of a timetable entry, e.g. "08:00" or "Mon-08:00".
+ENTRY_TIME_RE = re.compile(r"(?:([a-z]{3})-)?([0-9]{1,2}):([0-9]{2})", re.IGNORECASE)
+
+MINUTES_PER_DAY = 24 * 60
+MINUTES_PER_WEEK = 7 * MINUTES_PER_DAY
+
+
+class BandwidthLimit:
+    """
+    Object representing upload and download bandwidth limits, in bytes per second.
+
+    A limit of None means unlimited.
+    """
+
+    def __init__(
+        self,
+        upload: Optional[int],
+        download: Optional[int],
+        note: Optional[str] = None,
+    ) -> None:
+        self.upload = upload
+        self.download = download
+
+        # Why the limit was chosen, if it differs from the schedule.
+        self.note = note
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, BandwidthLimit):
+            return NotImplemented
+        return self.upload == other.upload and self.download == other.download
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(upload={self.upload}, "
+            f"download={self.download})"
+        )
+
+    def share(self, parts: int) -> "BandwidthLimit":
+        """
+        Returns the limit for each of `parts` commands that share this limit.
+        """
+        upload = None if self.upload is None else self.upload // parts
+        download = None if self.download is None else self.download // parts
+        return BandwidthLimit(upload, download, self.note)
+
+    def describe(self) -> str:
+        """
+        Returns a description of the limit, for the backup report.
+        """
+        description = (
+            f"upload {self._describe_rate(self.upload)}, "
+            f"download {self._describe_rate(self.download)}"
+        )
+        if self.note is not None:
+            description += f" ({self.note})"
+        return description
+
+    def rclone_arg(self) -> str:
+        """
+        Returns the limit as an rclone --bwlimit value.
+        """
+        upload = self._rclone_rate(self.upload)
+        download = self._rclone_rate(self.download)
+        return upload if upload == download else f"{upload}:{download}"
+
+    def restic_args(self) -> list[str]:
+        """
+        Returns the restic arguments applying the limit.
+        """
+        args: list[str] = list()
+        # restic limits are given in whole KiB/s.
+        if self.upload is not None:
+            args.extend(["--limit-upload", str(max(self.upload // KIB, 1))])
+        if self.download is not None:
+            args.extend(["--limit-download", str(max(self.download // KIB, 1))])
+        return args
+
+    @classmethod
+    def _describe_rate(cls, rate: Optional[int]) -> str:
+        if rate is None:
+            return "unlimited"
+        return f"{rate / MIB:.2f} MiB/s"
+
+    @classmethod
+    def _rclone_rate(cls, rate: Optional[int]) -> str:
+        if rate is None:
+            return "off"
+        return f"{max(rate // KIB, 1)}k"
+
+
+class BandwidthPolicy:
+    """
+    Base class for policies choosing the bandwidth limit of restic and rclone.
+    """
+
+    def limit(self, now: datetime) -> BandwidthLimit:
+        """
+        Returns the limit to apply to a command started at the given time.
+        """
+        raise NotImplementedError(
+            f"{self.__class__.__name__} does not provide an implementation"
+        )  # pragma: nocover
+
+    def observe(self, num_bytes: int, seconds: float) -> None:
+        """
+        Records that a command transferred num_bytes in the given number of seconds.
+        """
+        pass
+
+    def rclone_bwlimit(self, limit: BandwidthLimit) -> str:
+        """
+        Returns the rclone --bwlimit value applying the policy, given the limit
+        returned by limit.
+        """
+        return limit.rclone_arg()
+
+
+class BandwidthSchedule(BandwidthPolicy):
+    """
+    Bandwidth limits that change with the time of day, given in rclone's timetable
+    syntax; see https://rclone.org/docs/#bwlimit-bandwidth-spec.
+
+    A timetable is either a single bandwidth, e.g. "10M", or a space-separated list of
+    entries, e.g. "08:00,512k 19:00,10M 23:00,off". Each entry sets the limit from its
+    time onwards, until the time of the next entry. Entries may be restricted to a day
+    of the week, e.g. "Mon-08:00,512k"; entries without a day apply to every day.
+
+    A bandwidth is either "off", a number of KiB/s, or a number with a unit suffix
+    (B, K, M, G, T, P). Separate upload and download limits are given as
+    "UPLOAD:DOWNLOAD", e.g. "10M:100M".
+    """
+
+    def __init__(self, timetable: str, slots: list[tuple[int, BandwidthLimit]]) -> None:
+        self.timetable = timetable
+
+        # The limits of the timetable, keyed by the minute of the week from which
+        # they apply and sorted by it.
+        self.slots = slots
+
+    @classmethod
+    def parse(cls, timetable: str) -> Self:
+        """
+        Parses a timetable, raising ValueError if it is invalid.
+        """
+        entries = timetable.split()
+        if len(entries) == 0:
+            raise ValueError("empty bandwidth timetable")
+
+        if len(entries) == 1 and "," not in entries[0]:
+            return cls(timetable, [(0, cls.parse_limit(entries[0]))])
+
+        slots: dict[int, BandwidthLimit] = dict()
+        for entry in entries:
+            when, sep, bandwidth = entry.partition(",")
+            m = ENTRY_TIME_RE.fullmatch(when)
+            if sep == "" or m is None:
+                raise ValueError(f"invalid bandwidth timetable entry: {entry!r}")
+
+            day, hour, minute = m.group(1), int(m.group(2)), int(m.group(3))
+            if hour > 23 or minute > 59:
+                raise ValueError(f"invalid time in bandwidth timetable: {entry!r}")
+
+            limit = cls.parse_limit(bandwidth)
+            minute_of_day = hour * 60 + minute
+            if day is not None and day.lower() not in WEEKDAYS:
+                raise ValueError(f"invalid day in bandwidth timetable: {entry!r}")
+            days = range(7) if day is None else [WEEKDAYS.index(day.lower())]
+
+            for d in days:
+                slots[d * MINUTES_PER_DAY + minute_of_day] = limit
+
+        return cls(timetable, sorted(slots.items(), key=lambda s: s[0]))
+
+    @classmethod
+    def parse_limit(cls, bandwidth: str) -> BandwidthLimit:
+        """
+        Parses a bandwidth, optionally given as "UPLOAD:DOWNLOAD".
+        """
+        upload, sep, download = bandwidth.partition(":")
+        if sep == "":
+            download = upload
+        return BandwidthLimit(cls.parse_rate(upload), cls.parse_rate(download))
+
+    @classmethod
+    def parse_rate(cls, rate: str) -> Optional[int]:
+        """
+        Parses a single bandwidth into bytes per second, or None if it is "off".
+        """
+        if rate.lower() == "off":
+            return None
+
+        m = RATE_RE.fullmatch(rate)
+        if m is None:
+            raise ValueError(f"invalid bandwidth: {rate!r}")
+
+        value = int(float(m.group(1)) * RATE_UNITS[m.group(2).lower()])
+        # rclone treats a bandwidth of zero as unlimited.
+        return value if value > 0 else None
+
+    def limit(self, now: datetime) -> BandwidthLimit:
+        minute_of_week = (
+            now.weekday() * MINUTES_PER_DAY + now.hour * 60 + now.minute
+        ) % MINUTES_PER_WEEK
+
+        # Before the week's first entry, the last entry of the previous week applies.
+        current = self.slots[-1][1]
+        for start, limit in self.slots:
+            if start > minute_of_week:
+                break
+            current = limit
+        return current
+
+    def rclone_bwlimit(self, limit: BandwidthLimit) -> str:
+        # rclone follows the timetable itself, so the limit changes during a sync.
+        return self.timetable
+
+
+class LatencyProbe:
+    """
+    Measures the latency to a target by timing TCP connections to it.
+    """
+
+    def __init__(self, host: str, port: int) -> None:
+        self.host = host
+        self.port = port
+
+        # Seconds after which a connection attempt is abandoned.
+        self.timeout = 2.0
+
+        # Number of connections timed per measurement; the median is used.
+        self.samples = 3
+
+    def measure(self) -> Optional[float]:
+        """
+        Returns the latency to the target in seconds, or None if it could not be
+        reached.
+        """
+        latencies: list[float] = list()
+        for _ in range(self.samples):
+            start = time.monotonic()
+            try:
+                with socket.create_connection((self.host, self.port), self.timeout):
+                    latencies.append(time.monotonic() - start)
+            except OSError:
+                continue
+
+        return median(latencies) if len(latencies) > 0 else None
+
+
+class AdaptiveThrottle(BandwidthPolicy):
+    """
+    Bandwidth policy that lowers the upload limit of a schedule while the uplink is
+    congested.
+
+    Before each command starts, the latency to a probe target is measured. The
+    lowest latency seen is taken as the latency of an idle uplink. If the latency has
+    risen by latency_factor or more, the upload limit is cut to a fraction of the
+    throughput the previous command achieved, if it transferred enough data for its
+    throughput to be meaningful. Otherwise, a lowered limit is raised by
+    a fixed step until it reaches the schedule's limit again.
+
+    restic and rclone cannot change their limit while running, so the limit adapts
+    between commands; e.g. between the children of a for_each backup.
+
+    Safe for use by multiple threads.
+    """
+
+    def __init__(self, schedule: BandwidthPolicy, probe: LatencyProbe) -> None:
+        self.schedule = schedule
+        self.probe = probe
+
+        # Factor by which the latency must rise over the idle latency to be
+        # considered congestion.
+        self.latency_factor = 2.0
+
+        # Factor by which the limit is cut on congestion.
+        self.decrease_factor = 0.5
+
+        # Bytes per second by which a lowered limit is raised while there is no
+        # congestion.
+        self.increase_step = 1 * MIB
+
+        # Lowest upload limit that is set, in bytes per second.
+        self.min_rate = 128 * KIB
+
+        # Fewest bytes a command must transfer for its throughput to be observed.
+        # Commands are timed as a whole, including e.g. scanning for changes, so the
+        # throughput of commands that transfer little is far below what the uplink
+        # achieves and would throttle it to the minimum rate.
+        self.min_observed_bytes = 32 * MIB
+
+        self._lock = Lock()
+        self._idle_latency: Optional[float] = None
+        self._achieved: Optional[float] = None
+        self._rate: Optional[float] = None
+
+    def limit(self, now: datetime) -> BandwidthLimit:
+        scheduled = self.schedule.limit(now)
+        latency = self.probe.measure()
+
+        with self._lock:
+            note = self._adapt(scheduled, latency)
+            if self._rate is None:
+                return BandwidthLimit(scheduled.upload, scheduled.download, note)
+
+            upload = int(self._rate)
+            if scheduled.upload is not None:
+                upload = min(upload, scheduled.upload)
+            return BandwidthLimit(upload, scheduled.download, note)
+
+    def observe(self, num_bytes: int, seconds: float) -> None:
+        if num_bytes < self.min_observed_bytes or seconds <= 0:
+            return
+
+        with self._lock:
+            self._achieved = num_bytes / seconds
+
+    def _adapt(self, scheduled: BandwidthLimit, latency: Optional[float]) -> str:
+        """
+        Adapts the upload limit to the measured latency, returning a note describing
+        the decision.
+        """
+        if latency is None:
+            return "probe unreachable"
+
+        if self._idle_latency is None or latency < self._idle_latency:
+            self._idle_latency = latency
+
+        note = f"probe latency {latency * 1000:.0f} ms"
+        if latency >= self._idle_latency * self.latency_factor:
+            base = self._achieved or self._rate or scheduled.upload
+            if base is not None:
+                self._rate = max(base * self.decrease_factor, self.min_rate)
+                return f"{note}, throttled"
+            return note
+
+        if self._rate is not None:
+            self._rate += self.increase_step
+            ceiling = scheduled.upload
+            if ceiling is None and self._achieved is not None:
+                # Without a scheduled limit, the limit is lifted once it is well
+                # above what commands achieve, as it no longer has an effect.
+                ceiling = int(self._achieved * 2)
+            if ceiling is not None and self._rate >= ceiling:
+                self._rate = None
+            else:
+                return f"{note}, recovering"
+
+        return note
@@ -5,15 +5,31 @@ backup.cmd
 Contains code to invoke commands.
 """
 
+import json
+import os
 from pathlib import Path
 from shlex import quote
+import signal
 import subprocess
-from typing import Protocol
+from threading import Event, Lock, Thread, Timer
+import time
+from typing import IO, Any, Callable, Optional, Protocol, Self
 
 from .log import logger
+from .priority import ProcessPriority
 
 log = logger("cmd")
 
+# Callback that receives a single line of command output, without the trailing newline.
+LineHandler = Callable[[bytes], None]
+
+# Callback that receives a single decoded JSON message.
+MessageHandler = Callable[[Any], None]
+
+# Number of seconds a command is given to exit after being interrupted because its
+# timeout expired, before it is killed.
+INTERRUPT_GRACE_PERIOD = 30.0
+
 
 class CommandExecutorProtocol(Protocol):
     """
@@ -21,39 +37,380 @@ class CommandExecutorProtocol(Protocol):
     """
 
     def __call__(
-        self, cmd: list[str], cwd: Path, combine_stdout_stderr: bool
+        self,
+        cmd: list[str],
+        cwd: Path,
+        combine_stdout_stderr: bool,
+        line_handler: Optional[LineHandler] = None,
+        timeout: Optional[float] = None,
+        env: Optional[dict[str, str]] = None,
+        priority: Optional[ProcessPriority] = None,
     ) -> subprocess.CompletedProcess:
         """
         Invokes the given command and returns the resulting CompletedProcess.
+
+        If line_handler is given, each line of stdout is passed to it as soon as it
+        is read and stdout is not retained; the returned CompletedProcess will have
+        empty stdout.
+
+        If timeout is given, the command is interrupted with SIGINT once it has run
+        for that many seconds, and killed if it has not exited INTERRUPT_GRACE_PERIOD
+        seconds later.
+
+        If env is given, its variables are set in the command's environment in
+        addition to those of the current process.
+
+        If priority is given, the command runs with that CPU and I/O priority.
         """
         raise NotImplementedError(
             f"{self.__class__.__name__} does not provide an implementation"
         )  # pragma: nocover
 
 
+class ResourceUsage:
+    """
+    Object representing the resources used by a command.
+    """
+
+    def __init__(
+        self,
+        wall_time: float,
+        user_time: float,
+        system_time: float,
+        max_rss: int,
+        block_input: int,
+        block_output: int,
+    ) -> None:
+        # Elapsed real time from starting the command until it exited, in seconds.
+        self.wall_time = wall_time
+
+        # CPU time spent in user and kernel mode, in seconds.
+        self.user_time = user_time
+        self.system_time = system_time
+
+        # Peak resident set size, in bytes.
+        self.max_rss = max_rss
+
+        # Number of block input and output operations performed by the file system on
+        # behalf of the command.
+        self.block_input = block_input
+        self.block_output = block_output
+
+    @property
+    def cpu_time(self) -> float:
+        """
+        Total CPU time used by the command, in seconds.
+        """
+        return self.user_time + self.system_time
+
+    @classmethod
+    def combine(cls, usages: list["ResourceUsage"]) -> Optional[Self]:
+        """
+        Returns the resources used by several commands that ran concurrently, or None
+        if there were none.
+
+        The peak memory is the sum of the commands' peaks; an upper bound, as their
+        peaks need not coincide.
+        """
+        if len(usages) == 0:
+            return None
+
+        return cls(
+            wall_time=max(u.wall_time for u in usages),
+            user_time=sum(u.user_time for u in usages),
+            system_time=sum(u.system_time for u in usages),
+            max_rss=sum(u.max_rss for u in usages),
+            block_input=sum(u.block_input for u in usages),
+            block_output=sum(u.block_output for u in usages),
+        )
+
+    @classmethod
+    def from_rusage(cls, wall_time: float, rusage: Any) -> Self:
+        """
+        Returns a ResourceUsage from the resource usage returned by os.wait4.
+        """
+        return cls(
+            wall_time=wall_time,
+            user_time=rusage.ru_utime,
+            system_time=rusage.ru_stime,
+            # On Linux, ru_maxrss is reported in kilobytes.
+            max_rss=rusage.ru_maxrss * 1024,
+            block_input=rusage.ru_inblock,
+            block_output=rusage.ru_oublock,
+        )
+
+
+class CompletedCommand(subprocess.CompletedProcess):
+    """
+    CompletedProcess that also records the resources used by the command.
+    """
+
+    def __init__(
+        self,
+        args: list[str],
+        returncode: int,
+        stdout: bytes,
+        stderr: Optional[bytes],
+        resource_usage: Optional[ResourceUsage],
+    ) -> None:
+        super().__init__(args, returncode, stdout, stderr)
+        self.resource_usage = resource_usage
+
+
+def resource_usage(proc: subprocess.CompletedProcess) -> Optional[ResourceUsage]:
+    """
+    Returns the resources used by a completed command, or None if they were not
+    recorded by the command executor.
+    """
+    if isinstance(proc, CompletedCommand):
+        return proc.resource_usage
+    return None
+
+
+class ChunkedOutputLogger:
+    """
+    Logs command output in chunks of bounded size.
+
+    Output is buffered until either max_lines lines or max_bytes bytes have been
+    collected, at which point the buffered output is written as a single log message.
+    """
+
+    def __init__(self, max_lines: int = 1000, max_bytes: int = 256 * 1024) -> None:
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self._lines: list[bytes] = list()
+        self._bytes = 0
+
+    def add(self, line: bytes) -> None:
+        """
+        Adds a line of output, logging the buffered output if it is full.
+        """
+        self._lines.append(line)
+        self._bytes += len(line)
+
+        if len(self._lines) >= self.max_lines or self._bytes >= self.max_bytes:
+            self.flush()
+
+    def flush(self) -> None:
+        """
+        Logs any buffered output.
+        """
+        if len(self._lines) == 0:
+            return
+
+        log.info(b"\n".join(self._lines).decode("utf-8", errors="replace"))
+        self._lines.clear()
+        self._bytes = 0
+
+
+def json_line_handler(
+    on_message: MessageHandler, on_invalid: Optional[LineHandler] = None
+) -> LineHandler:
+    """
+    Returns a LineHandler that decodes each line as a JSON document and passes
+    the result to on_message.
+
+    Lines that are not valid JSON are passed to on_invalid, if given, and are
+    otherwise ignored. Empty lines are always ignored.
+    """
+
+    def handler(line: bytes) -> None:
+        if line.strip() == b"":
+            return
+
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            if on_invalid is not None:
+                on_invalid(line)
+            return
+
+        on_message(message)
+
+    return handler
+
+
+def _read_lines(stream: IO[bytes], handler: LineHandler) -> None:
+    """
+    Reads lines from stream until EOF, passing each to handler. Lines include
+    their trailing newline, if any.
+    """
+    for line in stream:
+        handler(line)
+
+
+class _Interrupter:
+    """
+    Interrupts a command once its timeout expires, killing it if it does not exit
+    within a grace period.
+    """
+
+    def __init__(self, proc: subprocess.Popen, timeout: float, grace: float) -> None:
+        self.proc = proc
+        self.grace = grace
+        self._lock = Lock()
+        self._exited = Event()
+        self._timer = Timer(max(timeout, 0.0), self._interrupt)
+        self._timer.daemon = True
+
+    def start(self) -> None:
+        """
+        Starts the timeout.
+        """
+        self._timer.start()
+
+    def exited(self) -> None:
+        """
+        Records that the command exited. It is not signalled afterwards.
+
+        This must be called before the command is reaped, so that a signal is never
+        sent to another process that reuses its PID.
+        """
+        with self._lock:
+            self._exited.set()
+        self._timer.cancel()
+
+    def _interrupt(self) -> None:
+        if not self._signal(signal.SIGINT):
+            return
+
+        log.warning(
+            f"interrupted command {self.proc.pid} after its timeout expired; "
+            f"killing it if it does not exit within {self.grace:.0f}s"
+        )
+        if not self._exited.wait(self.grace):
+            self._signal(signal.SIGKILL)
+
+    def _signal(self, sig: int) -> bool:
+        with self._lock:
+            if self._exited.is_set():
+                return False
+            self.proc.send_signal(sig)
+            return True
+
+
 def cmdexec(
-    cmd: list[str], cwd: Path, combine_stdout_stderr: bool
+    cmd: list[str],
+    cwd: Path,
+    combine_stdout_stderr: bool,
+    line_handler: Optional[LineHandler] = None,
+    timeout: Optional[float] = None,
+    env: Optional[dict[str, str]] = None,
+    priority: Optional[ProcessPriority] = None,
 ) -> subprocess.CompletedProcess:
     """
     Command runner that maintains separate stdout and stderr streams.
+
+    Output is read from the child process line by line as it is produced and is
+    logged in bounded chunks. If line_handler is given, stdout lines are delivered
+    to it and are not retained, so memory use does not grow with the amount of
+    output the command produces.
+
+    If timeout is given, the command is interrupted with SIGINT once it has run for
+    that many seconds, giving it the chance to exit cleanly. It is killed if it has
+    not exited INTERRUPT_GRACE_PERIOD seconds later.
+
+    If env is given, its variables are set in the command's environment in addition
+    to those of the current process.
+
+    If priority is given, the command runs with that CPU and I/O priority. Failing to
+    move the command into the priority's cgroup is logged, but does not fail the
+    command.
+
+    The resources used by the command are recorded on the returned CompletedCommand.
     """
     if combine_stdout_stderr:
         stderr = subprocess.STDOUT
     else:
         stderr = subprocess.PIPE
 
-    log.info(f"\nexecuting command {' '.join(quote(c) for c in cmd)} in {cwd}")
-    proc = subprocess.run(cmd, cwd=str(cwd), stdout=subprocess.PIPE, stderr=stderr)
+    stdout_chunks: list[bytes] = list()
+    stderr_chunks: list[bytes] = list()
+    stdout_log = ChunkedOutputLogger()
+    stderr_log = ChunkedOutputLogger()
+
+    def on_stdout_line(line: bytes) -> None:
+        stdout_log.add(line.rstrip(b"\n"))
+        if line_handler is not None:
+            line_handler(line.rstrip(b"\n"))
+        else:
+            stdout_chunks.append(line)
+
+    def on_stderr_line(line: bytes) -> None:
+        stderr_log.add(line.rstrip(b"\n"))
+        stderr_chunks.append(line)
+
+    popen_cmd = priority.wrap(cmd) if priority is not None else cmd
+    env_prefix = "".join(f"{k}={quote(v)} " for k, v in (env or {}).items())
+    log.info(
+        f"\nexecuting command {env_prefix}{' '.join(quote(c) for c in popen_cmd)} "
+        f"in {cwd}"
+    )
     log.info(
         ">>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>>"
     )
-    log.info(proc.stdout.decode("utf-8"))
-    if not combine_stdout_stderr:
-        log.info(proc.stderr.decode("utf-8"))
+    start = time.monotonic()
+    with subprocess.Popen(
+        popen_cmd,
+        cwd=str(cwd),
+        stdout=subprocess.PIPE,
+        stderr=stderr,
+        env={**os.environ, **env} if env else None,
+    ) as proc:
+        assert proc.stdout is not None
+
+        if priority is not None:
+            try:
+                priority.attach(proc.pid)
+            except OSError as e:
+                log.warning(f"failed to move command {proc.pid} into its cgroup: {e}")
+
+        interrupter: Optional[_Interrupter] = None
+        if timeout is not None:
+            interrupter = _Interrupter(proc, timeout, INTERRUPT_GRACE_PERIOD)
+            interrupter.start()
+
+        # When stderr is kept separate, it must be drained concurrently with stdout.
+        # Otherwise, the child may block writing to a full stderr pipe while we wait
+        # for more stdout.
+        stderr_reader: Optional[Thread] = None
+        if proc.stderr is not None:
+            stderr_reader = Thread(
+                target=_read_lines, args=(proc.stderr, on_stderr_line), daemon=True
+            )
+            stderr_reader.start()
+
+        _read_lines(proc.stdout, on_stdout_line)
+
+        if stderr_reader is not None:
+            stderr_reader.join()
+
+        # Wait for the child to exit without reaping it, so that it can still be
+        # signalled safely until the interrupter knows it exited.
+        os.waitid(os.P_PID, proc.pid, os.WEXITED | os.WNOWAIT)
+        if interrupter is not None:
+            interrupter.exited()
+
+        # The child is reaped with wait4 rather than Popen.wait so that its resource
+        # usage can be collected. Setting returncode tells Popen the child was reaped.
+        _, wait_status, rusage = os.wait4(proc.pid, 0)
+        usage = ResourceUsage.from_rusage(time.monotonic() - start, rusage)
+        proc.returncode = os.waitstatus_to_exitcode(wait_status)
+        returncode = proc.returncode
+
+    stdout_log.flush()
+    stderr_log.flush()
     log.info(
         "<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<<\n"
     )
-    return proc
+
+    return CompletedCommand(
+        cmd,
+        returncode,
+        b"".join(stdout_chunks),
+        None if combine_stdout_stderr else b"".join(stderr_chunks),
+        usage,
+    )
 
 
 # Ensure cmdexec satisfies the CommandExecutorProtocol.
@@ -0,0 +1,62 @@
+"""
+backup.duration
+===============
+
+Contains helpers for working with human-readable durations.
+"""
+
+from datetime import timedelta
+from math import isfinite
+import re
+
+DURATION_RE = re.compile(r"(\d+(?:\.\d+)?)([dhms])")
+
+# The length of each unit in seconds.
+DURATION_UNITS = {
+    "d": 86400,
+    "h": 3600,
+    "m": 60,
+    "s": 1,
+}
+
+
+def parse_duration(s: str) -> timedelta:
+    """
+    Parses a duration such as "7d", "1h30m" or "90s" into a timedelta.
+
+    Supported units are d (days), h (hours), m (minutes) and s (seconds). A bare
+    number is interpreted as a number of seconds.
+
+    Note that unlike restic's retention durations, "m" means minutes, not months.
+
+    Raises ValueError if the duration is invalid, negative or out of range.
+    """
+    s = s.strip()
+
+    try:
+        seconds = float(s)
+    except ValueError:
+        seconds = _parse_duration_units(s)
+
+    if not isfinite(seconds) or seconds < 0:
+        raise ValueError(f"invalid duration: {s!r}")
+
+    try:
+        return timedelta(seconds=seconds)
+    except OverflowError:
+        raise ValueError(f"duration out of range: {s!r}")
+
+
+def _parse_duration_units(s: str) -> float:
+    pos = 0
+    seconds = 0.0
+    for m in DURATION_RE.finditer(s):
+        if m.start() != pos:
+            break
+        seconds += float(m.group(1)) * DURATION_UNITS[m.group(2)]
+        pos = m.end()
+
+    if pos == 0 or pos != len(s):
+        raise ValueError(f"invalid duration: {s!r}")
+
+    return seconds
@@ -0,0 +1,230 @@
+"""
+backup.history
+==============
+
+Contains code to keep a history of backup reports across runs.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime
+from pathlib import Path
+import sqlite3
+from statistics import median
+from typing import Generator, Optional
+
+from .metrics import MIB
+from .report import BackupReport, BackupReportFieldAnnotation as A
+
+
+# Label of the metric recording the time between a report's start and end time.
+ELAPSED = "Elapsed (s)"
+
+
+class RunHistory:
+    """
+    History of backup runs, kept in a SQLite database.
+
+    Each recorded run stores every report of the run's report tree along with the
+    numeric fields of each report, such as the data a backup added and how long it
+    took. Reports are identified by their name, so the history of a for_each child
+    is kept under the name of its subreport.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS runs (
+            id INTEGER PRIMARY KEY,
+            time TEXT NOT NULL
+        );
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY,
+            run_id INTEGER NOT NULL REFERENCES runs (id) ON DELETE CASCADE,
+            name TEXT NOT NULL,
+            successful INTEGER NOT NULL,
+            omittable INTEGER NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS reports_name ON reports (name, run_id);
+        CREATE TABLE IF NOT EXISTS metrics (
+            report_id INTEGER NOT NULL REFERENCES reports (id) ON DELETE CASCADE,
+            label TEXT NOT NULL,
+            value REAL NOT NULL,
+            PRIMARY KEY (report_id, label)
+        );
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+        # Number of previous runs that anomalies are detected against.
+        self.anomaly_window = 10
+
+        # Minimum number of previous runs required to detect anomalies.
+        self.anomaly_min_runs = 3
+
+        # Factor by which a metric must exceed its median over previous runs to be
+        # flagged as an anomaly.
+        self.anomaly_factor = 10.0
+
+        # Metrics that are checked for anomalies, along with the smallest value that
+        # is flagged. Small values are ignored so that e.g. a backup that usually adds
+        # no data and then adds a few bytes is not flagged.
+        self.anomaly_metrics: dict[str, float] = {
+            "Data Added": 64 * MIB,
+            ELAPSED: 60.0,
+        }
+
+    def flag_anomalies(self, report: BackupReport) -> int:
+        """
+        Adds an "Anomalies" field to each report of the given report tree whose
+        metrics exceed their median over previous runs by the anomaly factor.
+
+        This should be called before the report is recorded so that its own run does
+        not count towards the median. Returns the number of reports flagged.
+        """
+        with self._connect() as db:
+            return self._flag_anomalies(db, report)
+
+    def flag_and_record(self, report: BackupReport, time: datetime) -> int:
+        """
+        Flags anomalies in a run's report tree, then records it as having run at the
+        given time, using a single connection to the database.
+
+        Returns the number of reports flagged.
+        """
+        with self._connect() as db:
+            flagged = self._flag_anomalies(db, report)
+            self._record(db, report, time)
+        return flagged
+
+    def median(self, name: str, label: str, runs: int) -> Optional[float]:
+        """
+        Returns the median of a report's metric over the last `runs` runs that
+        recorded it, or None if no run recorded it.
+        """
+        values = self.values(name, label, runs)
+        if len(values) == 0:
+            return None
+        return median(v for _, v in values)
+
+    def record(self, report: BackupReport, time: datetime) -> int:
+        """
+        Records a run's report tree as having run at the given time.
+
+        Returns the ID of the recorded run.
+        """
+        with self._connect() as db:
+            return self._record(db, report, time)
+
+    def values(self, name: str, label: str, runs: int) -> list[tuple[datetime, float]]:
+        """
+        Returns a report's metric over the last `runs` runs that recorded it, oldest
+        first.
+        """
+        with self._connect() as db:
+            return self._values(db, name, label, runs)
+
+    def _flag_anomalies(self, db: sqlite3.Connection, report: BackupReport) -> int:
+        flagged = 0
+        for r in report.all_reports():
+            current = report_metrics(r)
+            anomalies: list[str] = list()
+            for label, minimum in self.anomaly_metrics.items():
+                value = current.get(label, None)
+                if value is None or value < minimum:
+                    continue
+
+                previous = self._values(db, r.name, label, self.anomaly_window)
+                if len(previous) < self.anomaly_min_runs:
+                    continue
+
+                m = median(v for _, v in previous)
+                if m > 0 and value >= m * self.anomaly_factor:
+                    anomalies.append(
+                        f"{label} is {value / m:.0f}x the median of the "
+                        f"last {len(previous)} runs"
+                    )
+
+            if len(anomalies) > 0:
+                r.new_field("Anomalies", "\n".join(anomalies), lambda _: A.WARNING)
+                flagged += 1
+
+        return flagged
+
+    @classmethod
+    def _record(
+        cls, db: sqlite3.Connection, report: BackupReport, time: datetime
+    ) -> int:
+        cursor = db.execute("INSERT INTO runs (time) VALUES (?)", (time.isoformat(),))
+        run_id = cursor.lastrowid
+        assert run_id is not None
+
+        for r in report.all_reports():
+            cursor = db.execute(
+                "INSERT INTO reports (run_id, name, successful, omittable) "
+                "VALUES (?, ?, ?, ?)",
+                (run_id, r.name, r.successful, r.omittable),
+            )
+            db.executemany(
+                "INSERT OR REPLACE INTO metrics (report_id, label, value) "
+                "VALUES (?, ?, ?)",
+                [(cursor.lastrowid, k, v) for k, v in report_metrics(r).items()],
+            )
+
+        return run_id
+
+    @classmethod
+    def _values(
+        cls, db: sqlite3.Connection, name: str, label: str, runs: int
+    ) -> list[tuple[datetime, float]]:
+        rows = db.execute(
+            "SELECT runs.time, metrics.value FROM reports "
+            "JOIN runs ON runs.id = reports.run_id "
+            "JOIN metrics ON metrics.report_id = reports.id "
+            "WHERE reports.name = ? AND metrics.label = ? "
+            "ORDER BY reports.run_id DESC LIMIT ?",
+            (name, label, runs),
+        ).fetchall()
+
+        return [(datetime.fromisoformat(t), v) for t, v in reversed(rows)]
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection]:
+        """
+        Opens the history database, creating it if necessary.
+
+        Changes are committed if the block completes and rolled back otherwise. The
+        connection is closed afterwards.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(self.path)
+        try:
+            db.execute("PRAGMA foreign_keys = ON")
+            db.executescript(self.SCHEMA)
+            with db:
+                yield db
+        finally:
+            db.close()
+
+
+def report_metrics(report: BackupReport) -> dict[str, float]:
+    """
+    Returns the numeric fields of a report, keyed by their label.
+
+    If the report has a start and end time, the time between them is included as
+    the "Elapsed (s)" metric.
+    """
+    metrics: dict[str, float] = dict()
+    times: dict[str, datetime] = dict()
+    for f in report.fields:
+        if isinstance(f.data, bool):
+            continue
+        elif isinstance(f.data, (int, float)):
+            metrics[f.label] = float(f.data)
+        elif isinstance(f.data, datetime):
+            times[f.label] = f.data
+
+    start = times.get("Start Time", None)
+    end = times.get("End Time", None)
+    if start is not None and end is not None:
+        metrics[ELAPSED] = (end - start).total_seconds()
+
+    return metrics
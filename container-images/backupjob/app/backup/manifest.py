@@ -0,0 +1,229 @@
+"""
+backup.manifest
+===============
+
+Contains code to run several backup jobs declared in a manifest.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from pathlib import Path
+import shlex
+from typing import Any, Callable, Self
+
+import yaml
+
+from .report import BackupReport, BackupReportFieldAnnotation as A
+
+
+class ManifestJob:
+    """
+    Object representing a single job of a manifest.
+    """
+
+    def __init__(self, name: str, args: list[str], after: list[str]) -> None:
+        # The name of the job, used as the name of its backup.
+        self.name = name
+
+        # The arguments of the job, as given to the backup script after its global
+        # options, e.g. ["rclone", "sync", "/data", "s3:bucket"].
+        self.args = args
+
+        # The names of the jobs that must complete successfully before this job runs.
+        self.after = after
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(name={self.name!r}, after={self.after})"
+
+
+class Manifest:
+    """
+    Object representing a manifest of backup jobs and the dependencies between them.
+
+    A manifest is a YAML document of the form:
+
+        concurrency: 2
+        jobs:
+          - name: Photos Sync
+            args: rclone sync /data/photos s3:photos
+          - name: Photos Backup
+            args: [restic, --repository, /repo, backup, /data/photos]
+            after: [Photos Sync]
+
+    The arguments of a job are given as a list or as a shell-quoted string.
+    """
+
+    def __init__(self, jobs: list[ManifestJob], concurrency: int) -> None:
+        # The jobs of the manifest, in the order in which they are reported.
+        self.jobs = jobs
+
+        # The maximum number of jobs that run at the same time.
+        self.concurrency = concurrency
+
+    @classmethod
+    def load(cls, path: Path) -> Self:
+        """
+        Loads a manifest from a YAML file, raising ValueError if it is invalid.
+        """
+        try:
+            with open(path) as f:
+                document = yaml.safe_load(f)
+        except yaml.YAMLError as e:
+            raise ValueError(f"invalid manifest {path}: {e}")
+
+        return cls.parse(document)
+
+    @classmethod
+    def parse(cls, document: Any) -> Self:
+        """
+        Returns the manifest described by a decoded YAML document, raising ValueError
+        if it is invalid.
+        """
+        if not isinstance(document, dict) or not isinstance(document.get("jobs"), list):
+            raise ValueError("manifest must be a mapping with a list of jobs")
+
+        concurrency = document.get("concurrency", 1)
+        if not isinstance(concurrency, int) or concurrency < 1:
+            raise ValueError(f"concurrency must be at least 1, got {concurrency!r}")
+
+        jobs = [cls._parse_job(j) for j in document["jobs"]]
+        manifest = cls(jobs, concurrency)
+        manifest.validate()
+        return manifest
+
+    def validate(self) -> None:
+        """
+        Raises ValueError if job names are not unique, if jobs depend on jobs that do
+        not exist, or if the dependencies between jobs form a cycle.
+        """
+        names: set[str] = set()
+        for job in self.jobs:
+            if job.name in names:
+                raise ValueError(f"duplicate job name: {job.name!r}")
+            names.add(job.name)
+
+        for job in self.jobs:
+            for dependency in job.after:
+                if dependency not in names:
+                    raise ValueError(
+                        f"job {job.name!r} depends on unknown job {dependency!r}"
+                    )
+
+        # Removes jobs whose dependencies have all been removed until none are left;
+        # if some remain, they depend on each other.
+        remaining = {job.name: set(job.after) for job in self.jobs}
+        while len(remaining) > 0:
+            ready = [name for name, after in remaining.items() if len(after) == 0]
+            if len(ready) == 0:
+                cycle = ", ".join(sorted(remaining))
+                raise ValueError(f"dependency cycle between jobs: {cycle}")
+            for name in ready:
+                del remaining[name]
+            for after in remaining.values():
+                after.difference_update(ready)
+
+    @classmethod
+    def _parse_job(cls, d: Any) -> ManifestJob:
+        if not isinstance(d, dict) or not isinstance(d.get("name"), str):
+            raise ValueError(f"manifest job must be a mapping with a name: {d!r}")
+        name = d["name"]
+
+        args = d.get("args")
+        if isinstance(args, str):
+            args = shlex.split(args)
+        if not isinstance(args, list) or len(args) == 0:
+            raise ValueError(f"job {name!r} must have a list or string of args")
+
+        after = d.get("after", [])
+        if isinstance(after, str):
+            after = [after]
+        if not isinstance(after, list):
+            raise ValueError(f"after of job {name!r} must be a list of job names")
+
+        return ManifestJob(name, [str(a) for a in args], [str(a) for a in after])
+
+
+class ManifestRunner:
+    """
+    Runs the jobs of a manifest in dependency order, running up to the manifest's
+    concurrency of jobs at the same time.
+
+    A job starts once every job it depends on has completed successfully. Jobs whose
+    dependencies failed are skipped. The subreport of each job is attached in the
+    order of the manifest, regardless of the order in which the jobs run. If a job
+    raises an exception, the other jobs still run and are reported.
+    """
+
+    def __init__(
+        self, manifest: Manifest, run_job: Callable[[ManifestJob], BackupReport]
+    ) -> None:
+        self.manifest = manifest
+
+        # Runs a single job, returning its report.
+        self.run_job = run_job
+
+    def run(self, report: BackupReport) -> None:
+        """
+        Runs every job, attaching their subreports to report.
+        """
+        jobs = {job.name: job for job in self.manifest.jobs}
+        subreports: dict[str, BackupReport] = dict()
+        pending = list(self.manifest.jobs)
+        running: dict[Future[BackupReport], ManifestJob] = dict()
+
+        with ThreadPoolExecutor(
+            max_workers=self.manifest.concurrency, thread_name_prefix="manifest-job"
+        ) as pool:
+            while len(pending) > 0 or len(running) > 0:
+                for job in list(pending):
+                    if not all(d in subreports for d in job.after):
+                        continue
+
+                    pending.remove(job)
+                    failed = [d for d in job.after if not subreports[d].successful]
+                    if len(failed) > 0:
+                        subreports[job.name] = self._skipped(job, failed)
+                    else:
+                        running[pool.submit(self.run_job, job)] = job
+
+                if len(running) == 0:
+                    # Skipping jobs may have made others ready.
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for f in done:
+                    job = running.pop(f)
+                    subreports[job.name] = self._collect(job, f)
+
+        for name in jobs:
+            report.add_subreport(subreports[name])
+
+        failed = [n for n in jobs if not subreports[n].successful]
+        report.new_field("Jobs", len(jobs), lambda _: None)
+        if len(failed) > 0:
+            report.new_field("Failed Jobs", ", ".join(failed), lambda _: A.ERROR)
+        report.successful = len(failed) == 0
+
+    @classmethod
+    def _collect(cls, job: ManifestJob, future: Future[BackupReport]) -> BackupReport:
+        """
+        Returns the report of a job that has completed.
+        """
+        try:
+            return future.result()
+        except Exception as e:
+            subreport = BackupReport(job.name)
+            subreport.new_field("Error", str(e), lambda _: A.MULTILINE_TEXT)
+            subreport.successful = False
+            return subreport
+
+    @classmethod
+    def _skipped(cls, job: ManifestJob, failed: list[str]) -> BackupReport:
+        """
+        Returns the report of a job that was skipped because dependencies failed.
+        """
+        subreport = BackupReport(job.name)
+        subreport.new_field(
+            "Skipped", f"depends on failed jobs: {', '.join(failed)}", lambda _: A.ERROR
+        )
+        subreport.successful = False
+        return subreport
@@ -0,0 +1,50 @@
+"""
+backup.metrics
+==============
+
+Contains code to add performance metrics to backup reports.
+"""
+
+from datetime import timedelta
+from typing import Optional
+
+from .cmd import ResourceUsage
+from .report import BackupReport
+
+MIB = 1024 * 1024
+
+
+def add_resource_usage_fields(
+    report: BackupReport, usage: Optional[ResourceUsage]
+) -> None:
+    """
+    Adds fields describing the resources used by a command to the report.
+
+    Nothing is added if the resource usage is not known.
+    """
+    if usage is None:
+        return
+
+    report.new_field("CPU Time (s)", round(usage.cpu_time, 1), lambda _: None)
+    report.new_field("Peak Memory (MiB)", round(usage.max_rss / MIB, 1), lambda _: None)
+
+
+def add_throughput_fields(
+    report: BackupReport, duration: timedelta, num_bytes: int, num_files: int
+) -> None:
+    """
+    Adds fields describing how long an operation took and how quickly it processed
+    data to the report.
+
+    Throughput fields are only added if the operation took a measurable amount of time.
+    """
+    seconds = duration.total_seconds()
+    report.new_field("Duration (s)", round(seconds, 1), lambda _: None)
+
+    if seconds <= 0:
+        return
+
+    report.new_field(
+        "Throughput (MB/s)", round(num_bytes / 1e6 / seconds, 2), lambda _: None
+    )
+    report.new_field("Files/s", round(num_files / seconds, 1), lambda _: None)
@@ -0,0 +1,151 @@
+"""
+backup.priority
+===============
+
+Contains code to limit the impact of backups on other workloads on the same node.
+"""
+
+from datetime import datetime
+import os
+from pathlib import Path
+import stat
+from typing import Optional
+
+
+class ProcessPriority:
+    """
+    CPU and I/O priority for the commands run by a backup.
+
+    Commands are started through nice and ionice so that they run with the given
+    priority from their first instruction, and all of their threads inherit it.
+
+    If a cgroup is given, commands are also moved into it once started. The cgroup
+    must be in a subtree delegated to the backup, with the cpu and io controllers
+    enabled, so that its cpu.weight and io.max apply.
+    """
+
+    IONICE_CLASSES = {"realtime": 1, "best-effort": 2, "idle": 3}
+
+    def __init__(self) -> None:
+        # Niceness added to commands; higher is lower priority.
+        self.nice: Optional[int] = None
+
+        # I/O scheduling class, one of IONICE_CLASSES, and the level within it.
+        # The idle class has no levels.
+        self.ionice_class: Optional[str] = None
+        self.ionice_level: Optional[int] = None
+
+        # Directory of the cgroup that commands are moved into, created if needed.
+        self.cgroup: Optional[Path] = None
+
+        # Relative CPU weight of the cgroup, between 1 and 10000; 100 is the default.
+        self.cpu_weight: Optional[int] = None
+
+        # Lines written to the cgroup's io.max, e.g. "8:0 rbps=104857600".
+        self.io_max: list[str] = list()
+
+    def attach(self, pid: int) -> None:
+        """
+        Moves the process with the given PID into the cgroup, if one is set.
+
+        Raises OSError if the process cannot be moved.
+        """
+        if self.cgroup is not None:
+            (self.cgroup / "cgroup.procs").write_text(f"{pid}\n")
+
+    def describe(self) -> str:
+        """
+        Returns a description of the priority, for the backup report.
+        """
+        parts: list[str] = list()
+        if self.nice is not None:
+            parts.append(f"nice {self.nice}")
+        if self.ionice_class is not None:
+            level = f" {self.ionice_level}" if self._ionice_has_level() else ""
+            parts.append(f"ionice {self.ionice_class}{level}")
+        if self.cgroup is not None:
+            parts.append(f"cgroup {self.cgroup}")
+        if self.cpu_weight is not None:
+            parts.append(f"cpu.weight {self.cpu_weight}")
+        parts.extend(f"io.max {line}" for line in self.io_max)
+        return ", ".join(parts)
+
+    def setup(self) -> None:
+        """
+        Creates the cgroup, if one is set, and configures its limits.
+
+        Raises OSError if the cgroup cannot be created or configured.
+        """
+        if self.cgroup is None:
+            return
+
+        self.cgroup.mkdir(parents=True, exist_ok=True)
+        if self.cpu_weight is not None:
+            (self.cgroup / "cpu.weight").write_text(f"{self.cpu_weight}\n")
+        for line in self.io_max:
+            # io.max takes one device per write.
+            (self.cgroup / "io.max").write_text(f"{line}\n")
+
+    def wrap(self, cmd: list[str]) -> list[str]:
+        """
+        Returns the given command, wrapped to run with this priority.
+        """
+        wrapped: list[str] = list()
+        if self.nice is not None:
+            wrapped.extend(["nice", "-n", str(self.nice)])
+        if self.ionice_class is not None:
+            wrapped.extend(
+                ["ionice", "-c", str(self.IONICE_CLASSES[self.ionice_class])]
+            )
+            if self._ionice_has_level():
+                wrapped.extend(["-n", str(self.ionice_level)])
+        return [*wrapped, *cmd]
+
+    def _ionice_has_level(self) -> bool:
+        return self.ionice_level is not None and self.ionice_class != "idle"
+
+
+def drop_page_cache(path: Path, since: Optional[datetime] = None) -> int:
+    """
+    Advises the kernel that the data of path, or of the files under it, is not
+    needed, so that it is evicted from the page cache rather than pushing out the
+    data of other workloads. Returns the number of files advised.
+
+    If since is given, only files modified or changed since then are advised. A
+    backup only reads the data of such files; the cached data of other files belongs
+    to other workloads and is left alone.
+
+    Dirty pages are not evicted, and files that cannot be opened are skipped.
+    """
+    threshold = since.timestamp() if since is not None else None
+    if not path.is_dir():
+        return int(_drop_file_page_cache(str(path), threshold))
+
+    advised = 0
+    for dirpath, _, filenames in os.walk(path):
+        for name in filenames:
+            if _drop_file_page_cache(os.path.join(dirpath, name), threshold):
+                advised += 1
+
+    return advised
+
+
+def _drop_file_page_cache(path: str, threshold: Optional[float]) -> bool:
+    try:
+        st = os.lstat(path)
+        if not stat.S_ISREG(st.st_mode):
+            return False
+        if threshold is not None and max(st.st_mtime, st.st_ctime) < threshold:
+            return False
+
+        fd = os.open(path, os.O_RDONLY | os.O_NOFOLLOW)
+    except OSError:
+        return False
+
+    try:
+        os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_DONTNEED)
+        return True
+    except OSError:
+        return False
+    finally:
+        os.close(fd)
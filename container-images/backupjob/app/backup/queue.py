@@ -0,0 +1,230 @@
+"""
+backup.queue
+============
+
+Contains code to share backup work between several backup processes.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import fcntl
+import json
+import os
+from pathlib import Path
+from typing import Any, Generator, Optional
+
+from .state import write_json_atomic
+
+
+class WorkQueue:
+    """
+    Queue of work items shared by several workers through a directory, such as a
+    directory on a volume that is mounted by every worker.
+
+    A coordinator populates the queue with the items of a run. Each item is a file in
+    the queue's pending directory. A worker claims an item by renaming its file into
+    the claimed directory; the rename succeeds for exactly one worker. Once the worker
+    completes the item, it writes the item's result to the done directory.
+
+    Workers refresh the modification time of their claims while they work on them.
+    Claims that have not been refreshed for a while belong to workers that died, and
+    are returned to the pending directory.
+
+    Populating the queue, claiming items and returning stale claims happen under an
+    exclusive lock on the queue's lock file.
+    """
+
+    MANIFEST = "manifest.json"
+    LOCK = "queue.lock"
+
+    def __init__(self, root: Path, worker: str) -> None:
+        self.root = root
+
+        # The name of this worker, recorded in the items it claims.
+        self.worker = worker
+
+        # How often workers check the queue while waiting for it, in seconds.
+        self.poll_interval = 10.0
+
+        # How often workers refresh their claims, in seconds.
+        self.heartbeat_interval = 30.0
+
+        # How long a claim may go without being refreshed before it is considered
+        # stale and returned to the queue.
+        self.stale_after = timedelta(minutes=5)
+
+        # How long workers wait for the coordinator to populate the queue.
+        self.wait_timeout = timedelta(minutes=10)
+
+    @property
+    def claimed_dir(self) -> Path:
+        """
+        Directory holding the items that workers are working on.
+        """
+        return self.root / "claimed"
+
+    @property
+    def done_dir(self) -> Path:
+        """
+        Directory holding the results of completed items.
+        """
+        return self.root / "done"
+
+    @property
+    def pending_dir(self) -> Path:
+        """
+        Directory holding the items that have not been claimed.
+        """
+        return self.root / "pending"
+
+    def claim(self) -> Optional[str]:
+        """
+        Claims the next pending item, returning its name, or None if no items are
+        pending.
+
+        Items are claimed in the order in which they were added to the queue.
+        """
+        items = self.items()
+        with self._lock():
+            for item in items:
+                if (self.done_dir / f"{item}.json").exists():
+                    # The item was requeued, but its original claimant completed it.
+                    continue
+
+                try:
+                    os.rename(self.pending_dir / item, self.claimed_dir / item)
+                except FileNotFoundError:
+                    # Another worker claimed the item first, or it is not pending.
+                    continue
+
+                # The rename keeps the pending file's modification time, so the claim
+                # is refreshed before the lock is released; otherwise, it could be
+                # requeued as stale right away.
+                (self.claimed_dir / item).write_text(self.worker)
+                return item
+
+        return None
+
+    def complete(self, item: str, result: Any) -> None:
+        """
+        Records the result of a claimed item and releases the claim.
+        """
+        write_json_atomic(self.done_dir / f"{item}.json", result)
+        try:
+            os.unlink(self.claimed_dir / item)
+        except FileNotFoundError:
+            # The claim was considered stale and returned to the queue; the item is
+            # complete regardless.
+            pass
+
+    def finished(self) -> bool:
+        """
+        Returns True if every item of the run has a result.
+        """
+        return all((self.done_dir / f"{item}.json").exists() for item in self.items())
+
+    def heartbeat(self, item: str) -> None:
+        """
+        Refreshes a claim, so that it is not considered stale.
+        """
+        try:
+            os.utime(self.claimed_dir / item)
+        except FileNotFoundError:
+            pass
+
+    def items(self) -> list[str]:
+        """
+        Returns the names of all items of the run, in the order in which they were
+        added to the queue.
+        """
+        manifest = self.manifest()
+        return manifest["items"] if manifest is not None else []
+
+    def manifest(self) -> Optional[dict]:
+        """
+        Returns the queue's manifest, or None if the queue was never populated.
+        """
+        try:
+            with open(self.root / self.MANIFEST, "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return None
+
+    def populate(self, run_id: str, items: list[str]) -> bool:
+        """
+        Populates the queue with the items of the given run, discarding the items and
+        results of any previous run.
+
+        If the queue already holds the given run, e.g. because the coordinator was
+        restarted, it is left as is. Returns True if the queue was populated.
+        """
+        with self._lock():
+            manifest = self.manifest()
+            if manifest is not None and manifest["run_id"] == run_id:
+                return False
+
+            # The manifest is removed first so that workers do not claim items of the
+            # previous run while the queue is repopulated.
+            (self.root / self.MANIFEST).unlink(missing_ok=True)
+            for d in (self.pending_dir, self.claimed_dir, self.done_dir):
+                d.mkdir(parents=True, exist_ok=True)
+                for p in d.iterdir():
+                    p.unlink()
+
+            for item in items:
+                (self.pending_dir / item).touch()
+
+            write_json_atomic(
+                self.root / self.MANIFEST, {"run_id": run_id, "items": items}
+            )
+            return True
+
+    def requeue_stale(self, now: datetime) -> list[str]:
+        """
+        Returns claims that have not been refreshed within stale_after to the queue,
+        returning the names of the requeued items.
+        """
+        requeued: list[str] = list()
+        with self._lock():
+            for p in self.claimed_dir.iterdir():
+                try:
+                    mtime = datetime.fromtimestamp(p.stat().st_mtime)
+                    if now - mtime < self.stale_after:
+                        continue
+                    os.rename(p, self.pending_dir / p.name)
+                except FileNotFoundError:
+                    # The claim was completed in the meantime.
+                    continue
+                requeued.append(p.name)
+
+        return requeued
+
+    def results(self) -> dict[str, Any]:
+        """
+        Returns the results of the run's completed items, keyed by item name.
+        """
+        results: dict[str, Any] = dict()
+        for item in self.items():
+            try:
+                with open(self.done_dir / f"{item}.json", "r") as f:
+                    results[item] = json.load(f)
+            except FileNotFoundError:
+                continue
+        return results
+
+    def run_id(self) -> Optional[str]:
+        """
+        Returns the ID of the run the queue holds, or None if it was never populated.
+        """
+        manifest = self.manifest()
+        return manifest["run_id"] if manifest is not None else None
+
+    @contextmanager
+    def _lock(self) -> Generator[None]:
+        self.root.mkdir(parents=True, exist_ok=True)
+        with open(self.root / self.LOCK, "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
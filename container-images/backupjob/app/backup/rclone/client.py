@@ -5,11 +5,14 @@ backup.rclone.client
 Contains the implementation for the rclone client.
 """
 
-import json
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Type, TypeVar
+from typing import Optional, Sequence, Type, TypeVar
 
-from ..cmd import CommandExecutorProtocol
+from ..bandwidth import BandwidthLimit, BandwidthPolicy
+from ..cmd import CommandExecutorProtocol, resource_usage
+from ..priority import ProcessPriority
+from .logparser import RcloneLog
 from .model import RcloneResult, RcloneSyncResult
 
 
@@ -28,39 +31,191 @@ class RcloneClient:
         self.provider_args: list[str] = list()
         self.sync_args: list[str] = list()
 
+        # Additional environment variables set for rclone, such as GOMAXPROCS.
+        self.env: dict[str, str] = dict()
+
+        # CPU and I/O priority that rclone runs with.
+        self.priority: Optional[ProcessPriority] = None
+
+        # Number of file transfers and checks run concurrently during a sync. If None,
+        # rclone's defaults are used.
+        self.transfers: Optional[int] = None
+        self.checkers: Optional[int] = None
+
+        # If True, destinations are listed recursively in as few requests as possible
+        # rather than one directory at a time, at the cost of holding the whole
+        # listing in memory.
+        self.fast_list = False
+
+        # Number of chunks of a single file uploaded concurrently, the size of those
+        # chunks, and the size above which files are uploaded in chunks, for S3
+        # destinations. Sizes are given in rclone's syntax, e.g. "64M". If None,
+        # rclone's defaults are used.
+        self.s3_upload_concurrency: Optional[int] = None
+        self.s3_chunk_size: Optional[str] = None
+        self.s3_upload_cutoff: Optional[str] = None
+
+        # If set, chooses the bandwidth limit of each sync.
+        self.bandwidth: Optional[BandwidthPolicy] = None
+
+        # True if concurrent syncs run in the same rclone process, and so share a
+        # single bandwidth limit.
+        self.shares_process = False
+
+        # Directory in which rclone keeps its caches, such as the database of the
+        # hasher overlay. If None, rclone's default is used.
+        self.cache_dir: Optional[Path] = None
+
+    def close(self) -> None:
+        """
+        Releases any resources held by the client, such as long-lived rclone
+        processes.
+        """
+        pass
+
     def full_cmd(self, *cmd: str) -> list[str]:
         """
         Given an rclone subcommand, returns the full rclone command to be invoked.
         """
+        cache_args: list[str] = list()
+        if self.cache_dir is not None:
+            cache_args = ["--cache-dir", str(self.cache_dir)]
+
         return [
             "rclone",
             "--verbose",
             "--use-json-log",
+            *cache_args,
             *cmd,
         ]
 
+    def hasher_remote(self, path: Path) -> str:
+        """
+        Returns an rclone remote that overlays the local directory at path with a
+        persistent cache of MD5 checksums.
+
+        Cached checksums never expire; they are invalidated when a file's size or
+        modification time change.
+        """
+        quoted = '"' + str(path.absolute()).replace('"', '""') + '"'
+        return f":hasher,remote={quoted},hashes=md5,max_age=off:"
+
+    def import_hashes(self, remote: str, sums: Path) -> RcloneResult:
+        """
+        Imports the MD5 checksums in the md5sum format file sums into the cache of a
+        remote returned by hasher_remote.
+        """
+        return self.run(
+            "backend",
+            "import",
+            remote,
+            "md5",
+            str(sums),
+            result_type=RcloneResult,
+            cwd=None,
+        )
+
     def run(self, *cmd: str, result_type: Type[RR], cwd: Optional[Path]) -> RR:
         """
-        Runs rclone with the given command, returning all the messages produced by rclone.
+        Runs rclone with the given command, returning the messages produced by rclone.
+
+        rclone's output is parsed as it is produced and only a bounded part of it is
+        retained; see RcloneLog.
         """
         if cwd is None:
             cwd = Path.cwd()
         full_cmd = self.full_cmd(*cmd)
-        proc = self.cmdexec(full_cmd, cwd, combine_stdout_stderr=True)
-        messages = list(map(lambda ln: json.loads(ln), proc.stdout.splitlines(b"\n")))
+        log = RcloneLog()
+        proc = self.cmdexec(
+            full_cmd,
+            cwd,
+            combine_stdout_stderr=True,
+            line_handler=log.feed,
+            env=self.env,
+            priority=self.priority,
+        )
 
-        return result_type(list(cmd), full_cmd, proc.returncode, messages)
+        result = result_type(list(cmd), full_cmd, proc.returncode, log.messages)
+        result.resource_usage = resource_usage(proc)
+        result.log = log
+        return result
 
-    def sync(self, source: str, destination: str) -> RcloneSyncResult:
+    def sync(
+        self,
+        source: str,
+        destination: str,
+        max_duration: Optional[timedelta] = None,
+        exclude: Sequence[str] = (),
+        bandwidth_limit: Optional[BandwidthLimit] = None,
+    ) -> RcloneSyncResult:
         """
         Performs a sync using rclone.
+
+        If max_duration is given, rclone stops transferring files once it has run for
+        that long, leaving the remaining files for the next sync.
+
+        Paths matching the rclone filter patterns in exclude are neither synced nor
+        deleted from the destination.
+
+        If bandwidth_limit is given, it is applied instead of the limit chosen by the
+        bandwidth policy, and the policy does not observe the sync; the caller is
+        responsible for that.
         """
-        return self.run(
+        optional_args: list[str] = list()
+        if max_duration is not None:
+            seconds = max(int(max_duration.total_seconds()), 1)
+            optional_args.extend(["--max-duration", f"{seconds}s"])
+
+        optional_args.extend(self.transfer_args())
+
+        for pattern in exclude:
+            optional_args.extend(["--exclude", pattern])
+
+        limit = bandwidth_limit
+        if limit is not None:
+            optional_args.extend(["--bwlimit", limit.rclone_arg()])
+        elif self.bandwidth is not None:
+            limit = self.bandwidth.limit(datetime.now())
+            optional_args.extend(["--bwlimit", self.bandwidth.rclone_bwlimit(limit)])
+
+        result = self.run(
             *self.provider_args,
             "sync",
             *self.sync_args,
+            *optional_args,
             source,
             destination,
             result_type=RcloneSyncResult,
             cwd=None,
         )
+
+        result.bandwidth_limit = limit
+        if self.bandwidth is not None and bandwidth_limit is None:
+            self.bandwidth.observe(result.stats.bytes, result.stats.elapsed_time)
+
+        return result
+
+    def transfer_args(self) -> list[str]:
+        """
+        Returns the arguments tuning how rclone transfers files during a sync.
+        """
+        args: list[str] = list()
+        if self.transfers is not None:
+            args.extend(["--transfers", str(self.transfers)])
+
+        if self.checkers is not None:
+            args.extend(["--checkers", str(self.checkers)])
+
+        if self.fast_list:
+            args.append("--fast-list")
+
+        if self.s3_upload_concurrency is not None:
+            args.extend(["--s3-upload-concurrency", str(self.s3_upload_concurrency)])
+
+        if self.s3_chunk_size is not None:
+            args.extend(["--s3-chunk-size", self.s3_chunk_size])
+
+        if self.s3_upload_cutoff is not None:
+            args.extend(["--s3-upload-cutoff", self.s3_upload_cutoff])
+
+        return args
@@ -0,0 +1,211 @@
+"""
+backup.rclone.hashcache
+=======================
+
+Contains code to avoid re-hashing unchanged files during checksum syncs.
+"""
+
+from contextlib import contextmanager
+from hashlib import md5
+import os
+from pathlib import Path
+import sqlite3
+from typing import Generator, IO, Iterable, Optional
+
+from .walk import SourceWalk
+
+# Size of the blocks in which files are read while hashing them.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+class ChecksumCacheStats:
+    """
+    Object representing how well a ChecksumCache served an update.
+    """
+
+    def __init__(self) -> None:
+        # Number of files whose checksum was found in the cache, and their size.
+        self.hits = 0
+        self.bytes_skipped = 0
+
+        # Number of files that had to be hashed, and their size.
+        self.misses = 0
+        self.bytes_hashed = 0
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        """
+        Share of files whose checksum was found in the cache, from 0 to 1, or None
+        if there were no files.
+        """
+        files = self.hits + self.misses
+        if files == 0:
+            return None
+        return self.hits / files
+
+
+class ChecksumCache:
+    """
+    Persistent cache of the MD5 checksums of the files of sync sources, kept in a
+    SQLite database.
+
+    A cached checksum is reused as long as the file's (device, inode, size, mtime_ns)
+    are unchanged, so unchanged files are never read again. Any write to a file
+    changes its mtime, and replacing a file changes its inode.
+
+    Only the rows of files that changed are written, in short transactions, so that
+    several syncs can share a cache without waiting on each other for long.
+    """
+
+    SCHEMA = """
+        CREATE TABLE IF NOT EXISTS files (
+            source TEXT NOT NULL,
+            path TEXT NOT NULL,
+            device INTEGER NOT NULL,
+            inode INTEGER NOT NULL,
+            size INTEGER NOT NULL,
+            mtime_ns INTEGER NOT NULL,
+            md5 TEXT NOT NULL,
+            PRIMARY KEY (source, path)
+        );
+        CREATE TEMP TABLE IF NOT EXISTS seen (
+            path TEXT PRIMARY KEY
+        );
+    """
+
+    def __init__(self, path: Path) -> None:
+        self.path = path
+
+        # Number of files after which the rows of changed files are written.
+        self.batch_size = 1000
+
+        # Seconds to wait for another connection to finish writing to the cache.
+        self.busy_timeout = 60.0
+
+    def update(
+        self,
+        source: Path,
+        sums: IO[str],
+        files: Optional[Iterable[tuple[str, os.stat_result]]] = None,
+    ) -> ChecksumCacheStats:
+        """
+        Brings the checksums of the files under source up to date, hashing only the
+        files that changed since they were cached, and writes the checksums to sums
+        in md5sum format, with paths relative to source.
+
+        files are the regular files under source along with their lstat() results,
+        as yielded by SourceWalk.files(); if None, source is walked.
+
+        Files that no longer exist are removed from the cache. Files whose names
+        cannot be written in md5sum format, and files that cannot be read, are left
+        out.
+        """
+        if files is None:
+            files = SourceWalk(source).files()
+
+        stats = ChecksumCacheStats()
+        key = str(source.absolute())
+        seen: list[tuple[str]] = list()
+        changed: list[tuple] = list()
+
+        with self._connect() as db:
+            for rel, st in files:
+                if "\n" in rel or "\\" in rel:
+                    continue
+
+                try:
+                    checksum = self._checksum(db, key, rel, st, changed, stats)
+                except OSError:
+                    continue
+
+                sums.write(f"{checksum}  {rel}\n")
+                seen.append((rel,))
+                if len(seen) >= self.batch_size:
+                    self._write(db, seen, changed)
+
+            self._write(db, seen, changed)
+            with db:
+                db.execute(
+                    "DELETE FROM files WHERE source = ? "
+                    "AND path NOT IN (SELECT path FROM temp.seen)",
+                    (key,),
+                )
+
+        return stats
+
+    def _checksum(
+        self,
+        db: sqlite3.Connection,
+        source: str,
+        path: str,
+        st: os.stat_result,
+        changed: list[tuple],
+        stats: ChecksumCacheStats,
+    ) -> str:
+        """
+        Returns the checksum of a file, from the cache if it is unchanged. If the
+        file changed, its new row is added to changed.
+        """
+        fingerprint = (st.st_dev, st.st_ino, st.st_size, st.st_mtime_ns)
+        row = db.execute(
+            "SELECT device, inode, size, mtime_ns, md5 FROM files "
+            "WHERE source = ? AND path = ?",
+            (source, path),
+        ).fetchone()
+
+        if row is not None and tuple(row[:4]) == fingerprint:
+            stats.hits += 1
+            stats.bytes_skipped += st.st_size
+            return row[4]
+
+        checksum = self._hash(os.path.join(source, path))
+        stats.misses += 1
+        stats.bytes_hashed += st.st_size
+        changed.append((source, path, *fingerprint, checksum))
+        return checksum
+
+    @classmethod
+    def _write(
+        cls, db: sqlite3.Connection, seen: list[tuple[str]], changed: list[tuple]
+    ) -> None:
+        """
+        Writes a batch of seen paths and changed rows in a single transaction,
+        emptying both lists.
+        """
+        with db:
+            db.executemany("INSERT OR IGNORE INTO temp.seen (path) VALUES (?)", seen)
+            db.executemany(
+                "INSERT OR REPLACE INTO files "
+                "(source, path, device, inode, size, mtime_ns, md5) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?)",
+                changed,
+            )
+        seen.clear()
+        changed.clear()
+
+    @classmethod
+    def _hash(cls, path: str) -> str:
+        h = md5()
+        with open(path, "rb") as f:
+            while block := f.read(HASH_BLOCK_SIZE):
+                h.update(block)
+        return h.hexdigest()
+
+    @contextmanager
+    def _connect(self) -> Generator[sqlite3.Connection]:
+        """
+        Opens the cache database, creating it if necessary. The connection is closed
+        afterwards.
+
+        Changes are committed by the transactions of the block. The database is
+        switched to write-ahead logging so that readers and a writer do not block each
+        other.
+        """
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        db = sqlite3.connect(self.path, timeout=self.busy_timeout)
+        try:
+            db.execute("PRAGMA journal_mode = WAL")
+            db.executescript(self.SCHEMA)
+            yield db
+        finally:
+            db.close()
@@ -0,0 +1,70 @@
+"""
+backup.rclone.listing
+=====================
+
+Contains code to estimate the cost of listing a sync's destination.
+"""
+
+from math import ceil
+from pathlib import Path
+from typing import Self
+
+from .walk import SourceWalk
+
+
+class ListingEstimate:
+    """
+    Estimate of the S3 LIST requests needed to list a sync's destination, derived
+    from the directory tree of its source.
+
+    Without --fast-list, rclone lists each directory separately, so every directory
+    costs at least one request, and more if it holds more entries than fit in a page.
+    With --fast-list, rclone lists the whole destination recursively, so requests
+    are only spent on pages of objects. In exchange, rclone holds the whole listing
+    in memory.
+    """
+
+    # Maximum number of keys S3 returns per LIST request.
+    PAGE_SIZE = 1000
+
+    # Approximate memory rclone uses per object when listing with --fast-list.
+    FAST_LIST_BYTES_PER_OBJECT = 1024
+
+    def __init__(self, objects: int, directory_entries: list[int]) -> None:
+        # Number of files, which become objects at the destination.
+        self.objects = objects
+
+        # Number of entries (files and subdirectories) in each directory.
+        self.directory_entries = directory_entries
+
+    @classmethod
+    def walk(cls, source: Path) -> Self:
+        """
+        Estimates the listing of the destination of a sync from source.
+
+        Directories that cannot be read are counted as empty.
+        """
+        return cls.from_walk(SourceWalk.complete(source))
+
+    @classmethod
+    def from_walk(cls, walk: SourceWalk) -> Self:
+        """
+        Estimates the listing of the destination of a sync from a finished walk of
+        its source.
+        """
+        return cls(walk.objects, list(walk.directory_entries))
+
+    @property
+    def fast_list_memory(self) -> int:
+        """
+        Approximate memory in bytes rclone needs to list with --fast-list.
+        """
+        return self.objects * self.FAST_LIST_BYTES_PER_OBJECT
+
+    def requests(self, fast_list: bool) -> int:
+        """
+        Returns the estimated number of LIST requests, with or without --fast-list.
+        """
+        if fast_list:
+            return max(ceil(self.objects / self.PAGE_SIZE), 1)
+        return sum(max(ceil(n / self.PAGE_SIZE), 1) for n in self.directory_entries)
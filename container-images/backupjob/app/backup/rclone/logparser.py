@@ -0,0 +1,159 @@
+"""
+backup.rclone.logparser
+=======================
+
+Contains code to parse the JSON log rclone writes while it runs.
+"""
+
+import json
+import re
+from typing import Any, Optional, Self
+
+# Match the level and message of a log line, so that lines about single files can be
+# counted without decoding them.
+LEVEL_RE = re.compile(rb'"level":\s*"(\w+)"')
+MSG_RE = re.compile(rb'"msg":\s*"((?:[^"\\]|\\.)*)"')
+
+# Levels at which rclone logs a message for each file it transfers or deletes.
+FILE_EVENT_LEVELS = {b"info", b"debug"}
+
+
+class RcloneLog:
+    """
+    Incremental parser of the log rclone writes with --use-json-log, retaining a
+    bounded amount of it.
+
+    With --verbose, rclone logs a message for every file it transfers or deletes, so
+    the log of a large sync is too large to keep. Those messages are recognized
+    without being decoded, counted by their message (e.g. "Copied (new)"), and only
+    the first few are kept as a sample. Statistics, errors and notices are decoded
+    and kept, up to a limit. Of the statistics, only the latest are kept.
+
+    rclone's output may contain lines that are not JSON, such as panics or output
+    from wrapper commands. They are counted and the first few are kept, rather than
+    being lost.
+    """
+
+    def __init__(
+        self, max_messages: int = 1000, max_samples: int = 20, max_unparsed: int = 20
+    ) -> None:
+        self.max_messages = max_messages
+        self.max_samples = max_samples
+        self.max_unparsed = max_unparsed
+
+        # Decoded messages other than statistics and file events, and the number of
+        # messages that were dropped once max_messages were kept.
+        self.kept: list[dict[str, Any]] = list()
+        self.dropped = 0
+
+        # The latest message carrying statistics.
+        self.stats: Optional[dict[str, Any]] = None
+
+        # Number of file events by message, and the first file events.
+        self.file_events: dict[str, int] = dict()
+        self.samples: list[dict[str, Any]] = list()
+
+        # The first lines that could not be parsed, and the number of such lines.
+        self.unparsed: list[str] = list()
+        self.unparsed_count = 0
+
+    @property
+    def messages(self) -> list[dict[str, Any]]:
+        """
+        The kept messages, followed by the latest statistics if there were any.
+        """
+        if self.stats is None:
+            return list(self.kept)
+        return [*self.kept, self.stats]
+
+    @classmethod
+    def combine(cls, logs: list["RcloneLog"]) -> Self:
+        """
+        Returns a log combining the logs of several rclone commands, such as the shards
+        of a sync, within the limits of the first log.
+
+        The combined log has no statistics; they cannot be combined without knowing
+        their meaning.
+        """
+        combined = cls()
+        if len(logs) > 0:
+            combined.max_messages = logs[0].max_messages
+            combined.max_samples = logs[0].max_samples
+            combined.max_unparsed = logs[0].max_unparsed
+
+        for log in logs:
+            kept = log.kept[: max(combined.max_messages - len(combined.kept), 0)]
+            combined.kept.extend(kept)
+            combined.dropped += log.dropped + len(log.kept) - len(kept)
+
+            for msg, n in log.file_events.items():
+                combined.file_events[msg] = combined.file_events.get(msg, 0) + n
+            samples = log.samples[
+                : max(combined.max_samples - len(combined.samples), 0)
+            ]
+            combined.samples.extend(samples)
+
+            unparsed = log.unparsed[
+                : max(combined.max_unparsed - len(combined.unparsed), 0)
+            ]
+            combined.unparsed.extend(unparsed)
+            combined.unparsed_count += log.unparsed_count
+
+        return combined
+
+    def feed(self, line: bytes) -> None:
+        """
+        Parses a single line of rclone's output.
+        """
+        if line.strip() == b"":
+            return
+
+        if self._is_file_event(line):
+            self._file_event(line)
+            return
+
+        try:
+            message = json.loads(line)
+        except json.JSONDecodeError:
+            message = None
+
+        if not isinstance(message, dict):
+            self._unparsed(line)
+        elif "stats" in message:
+            self.stats = message
+        elif len(self.kept) < self.max_messages:
+            self.kept.append(message)
+        else:
+            self.dropped += 1
+
+    @classmethod
+    def _is_file_event(cls, line: bytes) -> bool:
+        """
+        Returns True if the line is a message about a single file.
+        """
+        if not line.startswith(b"{") or b'"object":' not in line:
+            return False
+        if b'"stats":' in line:
+            return False
+
+        m = LEVEL_RE.search(line)
+        return m is not None and m.group(1) in FILE_EVENT_LEVELS
+
+    def _file_event(self, line: bytes) -> None:
+        m = MSG_RE.search(line)
+        try:
+            msg = json.loads(b'"' + m.group(1) + b'"') if m is not None else ""
+        except json.JSONDecodeError:
+            msg = ""
+        self.file_events[msg] = self.file_events.get(msg, 0) + 1
+
+        if len(self.samples) < self.max_samples:
+            try:
+                self.samples.append(json.loads(line))
+            except json.JSONDecodeError:
+                self._unparsed(line)
+
+    def _unparsed(self, line: bytes) -> None:
+        self.unparsed_count += 1
+        if len(self.unparsed) < self.max_unparsed:
+            self.unparsed.append(line.decode("utf-8", errors="replace"))
@@ -5,7 +5,23 @@ backup.rclone.model
 Contains the implementation for rclone models.
 """
 
-from typing import Any
+from enum import IntEnum
+from typing import Any, Optional, Self
+
+from ..bandwidth import BandwidthLimit
+from ..cmd import ResourceUsage
+from .logparser import RcloneLog
+
+
+class RcloneReturnCode(IntEnum):
+    """
+    Enum defining exit codes used by rclone.
+
+    See https://rclone.org/docs/#exit-code.
+    """
+
+    RC_OK = 0
+    RC_DURATION_EXCEEDED = 10
 
 
 class RcloneResult:
@@ -30,9 +46,19 @@ class RcloneResult:
         # The return code of the rclone binary.
         self.returncode = returncode
 
-        # The list of all JSON-encoded messages emitted by rclone when the command was run.
+        # The JSON-encoded messages emitted by rclone when the command was run. If the
+        # output was parsed by an RcloneLog, these are the messages it kept.
         self.messages = messages
 
+        # The resources used by the rclone process, if they were recorded.
+        self.resource_usage: Optional[ResourceUsage] = None
+
+        # The bandwidth limit rclone ran with, if one was set.
+        self.bandwidth_limit: Optional[BandwidthLimit] = None
+
+        # The parsed output of rclone, if it was recorded.
+        self.log: Optional[RcloneLog] = None
+
 
 class RcloneSyncStatistics:
     """
@@ -44,6 +70,18 @@ class RcloneSyncStatistics:
     def __init__(self, raw: dict) -> None:
         self.raw = raw
 
+    @classmethod
+    def merge(cls, stats: list["RcloneSyncStatistics"]) -> Self:
+        """
+        Returns the combined statistics of several syncs that ran concurrently.
+        """
+        raw: dict[str, Any] = {
+            k: sum(s.raw.get(k, 0) for s in stats)
+            for k in ["bytes", "checks", "deletes", "errors", "transfers"]
+        }
+        raw["elapsedTime"] = max((s.elapsed_time for s in stats), default=0.0)
+        return cls(raw)
+
     @property
     def bytes(self) -> int:
         """
@@ -58,6 +96,13 @@ class RcloneSyncStatistics:
         """
         return self.raw["deletes"]
 
+    @property
+    def elapsed_time(self) -> float:
+        """
+        Seconds the sync has been running for.
+        """
+        return self.raw.get("elapsedTime", 0.0)
+
     @property
     def errors(self) -> int:
         """
@@ -88,3 +133,35 @@ class RcloneSyncResult(RcloneResult):
         super().__init__(cmd, full_cmd, returncode, messages)
 
         self.stats = RcloneSyncStatistics(messages[-1]["stats"])
+
+    @classmethod
+    def merge(cls, results: list["RcloneSyncResult"]) -> Self:
+        """
+        Returns the combined result of several syncs that ran concurrently, such as
+        the shards of a sync. The command of the first result is kept.
+
+        The combined return code is the first that is neither RC_OK nor
+        RC_DURATION_EXCEEDED, if any; otherwise, it is RC_DURATION_EXCEEDED if any
+        sync ran out of time.
+        """
+        codes = [r.returncode for r in results]
+        returncode: int = RcloneReturnCode.RC_OK
+        if RcloneReturnCode.RC_DURATION_EXCEEDED in codes:
+            returncode = RcloneReturnCode.RC_DURATION_EXCEEDED
+        for c in codes:
+            if c not in (RcloneReturnCode.RC_OK, RcloneReturnCode.RC_DURATION_EXCEEDED):
+                returncode = c
+                break
+
+        stats = RcloneSyncStatistics.merge([r.stats for r in results])
+        messages = [m for r in results for m in r.messages]
+        messages.append({"stats": stats.raw})
+
+        merged = cls(results[0].cmd, results[0].full_cmd, returncode, messages)
+        merged.resource_usage = ResourceUsage.combine(
+            [r.resource_usage for r in results if r.resource_usage is not None]
+        )
+        logs = [r.log for r in results if r.log is not None]
+        if len(logs) > 0:
+            merged.log = RcloneLog.combine(logs)
+        return merged
@@ -0,0 +1,385 @@
+"""
+backup.rclone.rcd
+=================
+
+Contains code to drive a long-lived rclone process over its remote control API.
+"""
+
+from base64 import b64encode
+from collections import deque
+from datetime import datetime, timedelta
+from hashlib import sha1
+from pathlib import Path
+import os
+import re
+import secrets
+import shutil
+import signal
+import subprocess
+import tempfile
+from threading import Event, Lock, Thread
+import time
+from typing import Any, Optional, Self, Sequence
+
+from requests import RequestException, Session
+
+from ..bandwidth import BandwidthLimit
+from ..cmd import CommandExecutorProtocol, json_line_handler
+from ..log import logger
+from ..priority import ProcessPriority
+from .client import RcloneClient
+from .model import (
+    RcloneResult,
+    RcloneReturnCode,
+    RcloneSyncResult,
+    RcloneSyncStatistics,
+)
+
+# Matches the message rclone logs once its remote control API is listening, capturing
+# its address.
+LISTENING_RE = re.compile(r"Serving remote control on \[?(http://[^\s/\]]+)")
+
+
+class RcloneRcError(Exception):
+    """
+    Raised when the rclone remote control API cannot be reached or a call fails.
+    """
+
+
+class RcloneDaemon:
+    """
+    Long-lived `rclone rcd` process, driven over rclone's remote control API.
+
+    rclone's startup, configuration parsing and remote setup are paid once, rather
+    than once per command. The API listens on a random port of the loopback
+    interface and requires a password that is generated for each daemon and never
+    leaves this process; rclone is given only its hash.
+
+    The daemon runs through a command executor on a background thread, so it is
+    logged and prioritized like any other command.
+    """
+
+    USER = "backupjob"
+
+    def __init__(self, cmdexec: CommandExecutorProtocol, args: list[str]) -> None:
+        self.cmdexec = cmdexec
+
+        # Global rclone flags, such as provider and transfer settings, that apply to
+        # every call.
+        self.args = args
+
+        # Additional environment variables set for rclone, such as GOMAXPROCS.
+        self.env: dict[str, str] = dict()
+
+        # CPU and I/O priority that rclone runs with.
+        self.priority: Optional[ProcessPriority] = None
+
+        # Seconds to wait for the API to start listening.
+        self.startup_timeout = 30.0
+
+        # Seconds after which a single API request is abandoned.
+        self.request_timeout = 60.0
+
+        # Base URL of the API, once it is listening.
+        self.url: Optional[str] = None
+
+        self.log = logger("rclone.RcloneDaemon")
+        self.session = Session()
+        self._password = secrets.token_urlsafe(32)
+        self._dir: Optional[Path] = None
+        self._thread: Optional[Thread] = None
+        self._listening = Event()
+        self._proc: Optional[subprocess.CompletedProcess] = None
+
+        # Process ID of rclone, used to kill it if it does not quit when asked.
+        self._pid: Optional[int] = None
+
+        # The last lines rclone logged, reported if it fails to start.
+        self._output: deque[str] = deque(maxlen=20)
+
+    def __enter__(self) -> Self:
+        self.start()
+        return self
+
+    def __exit__(self, *_: Any) -> None:
+        self.stop()
+
+    @property
+    def running(self) -> bool:
+        """
+        True if the daemon has been started and has not exited.
+        """
+        return self._thread is not None and self._proc is None
+
+    def call(self, method: str, params: Optional[dict[str, Any]] = None) -> dict:
+        """
+        Calls a remote control method, e.g. "core/stats", returning its output.
+
+        See https://rclone.org/rc/#supported-commands.
+        """
+        if self.url is None:
+            raise RcloneRcError(f"{method}: rclone rcd is not running")
+
+        try:
+            response = self.session.post(
+                f"{self.url}/{method}",
+                json=params or {},
+                auth=(self.USER, self._password),
+                timeout=self.request_timeout,
+            )
+        except RequestException as e:
+            raise RcloneRcError(f"{method}: {e}") from e
+
+        try:
+            output = response.json()
+        except ValueError:
+            output = {"error": response.text}
+
+        if not response.ok:
+            raise RcloneRcError(f"{method}: {output.get('error', response.reason)}")
+        return output
+
+    def start(self) -> None:
+        """
+        Starts rclone rcd, returning once its API is listening.
+        """
+        if self._thread is not None:
+            return
+
+        self._dir = Path(tempfile.mkdtemp(prefix="rclone-rcd-"))
+        htpasswd = self._dir / "htpasswd"
+        digest = b64encode(sha1(self._password.encode("utf-8")).digest()).decode()
+        htpasswd.write_text(f"{self.USER}:{{SHA}}{digest}\n")
+
+        cmd = [
+            "rclone",
+            "rcd",
+            "--rc-addr",
+            "127.0.0.1:0",
+            "--rc-htpasswd",
+            str(htpasswd),
+            "--verbose",
+            "--use-json-log",
+            *self.args,
+        ]
+        self._thread = Thread(
+            target=self._run, args=(cmd,), name="rclone-rcd", daemon=True
+        )
+        self._thread.start()
+
+        if not self._listening.wait(self.startup_timeout) or self.url is None:
+            self.stop()
+            output = "\n".join(self._output)
+            raise RcloneRcError(f"rclone rcd failed to start:\n{output}")
+
+        try:
+            self._pid = self.call("core/pid").get("pid")
+        except RcloneRcError as e:
+            self.log.warning(f"failed to get the process ID of rclone rcd: {e}")
+
+    def stop(self) -> None:
+        """
+        Asks rclone rcd to exit and waits for it to do so, killing it if it cannot be
+        asked or does not exit in time.
+        """
+        if self._thread is None:
+            return
+
+        asked = False
+        if self.running and self.url is not None:
+            try:
+                self.call("core/quit")
+                asked = True
+            except RcloneRcError as e:
+                self.log.warning(f"failed to stop rclone rcd: {e}")
+        if asked:
+            self._thread.join(self.request_timeout)
+        if self.running:
+            self._kill()
+            self._thread.join(self.request_timeout)
+        self.url = None
+
+        if self._dir is not None:
+            shutil.rmtree(self._dir, ignore_errors=True)
+            self._dir = None
+
+    def _kill(self) -> None:
+        """
+        Kills rclone, if its process ID is known.
+        """
+        if self._pid is None:
+            self.log.warning("cannot kill rclone rcd: its process ID is unknown")
+            return
+
+        self.log.warning(f"killing rclone rcd (pid {self._pid})")
+        try:
+            os.kill(self._pid, signal.SIGKILL)
+        except ProcessLookupError:
+            pass
+
+    def _on_message(self, message: Any) -> None:
+        msg = message.get("msg", "") if isinstance(message, dict) else ""
+        self._output.append(msg)
+
+        m = LISTENING_RE.search(msg)
+        if m is not None and self.url is None:
+            self.url = m.group(1)
+            self._listening.set()
+
+    def _on_invalid(self, line: bytes) -> None:
+        self._output.append(line.decode("utf-8", errors="replace"))
+
+    def _run(self, cmd: list[str]) -> None:
+        try:
+            self._proc = self.cmdexec(
+                cmd,
+                Path.cwd(),
+                combine_stdout_stderr=True,
+                line_handler=json_line_handler(self._on_message, self._on_invalid),
+                env=self.env,
+                priority=self.priority,
+            )
+        except OSError as e:
+            self._output.append(str(e))
+        finally:
+            if self._proc is None:
+                self._proc = subprocess.CompletedProcess(cmd, -1)
+            # Wakes up start() if rclone exited before it started listening.
+            self._listening.set()
+
+
+class RcloneRcdClient(RcloneClient):
+    """
+    Client that runs rclone commands as jobs of a single, long-lived rclone rcd
+    process rather than as separate rclone processes.
+
+    The daemon is started on first use with the client's settings, such as its
+    provider and transfer arguments; changing them afterwards has no effect until
+    the client is closed. Syncs are submitted as asynchronous jobs whose progress is
+    polled and logged while they run.
+    """
+
+    def __init__(self, cmdexec: CommandExecutorProtocol) -> None:
+        super().__init__(cmdexec)
+        self.shares_process = True
+
+        # The daemon running the client's commands, once it has been started.
+        self.daemon: Optional[RcloneDaemon] = None
+
+        # Seconds between polls of the progress of a running job.
+        self.poll_interval = 5.0
+
+        self.log = logger("rclone.RcloneRcdClient")
+        self._lock = Lock()
+
+    def close(self) -> None:
+        # Stops the daemon, if it is running.
+        if self.daemon is not None:
+            self.daemon.stop()
+            self.daemon = None
+
+    def import_hashes(self, remote: str, sums: Path) -> RcloneResult:
+        cmd = ["backend", "import", remote, "md5", str(sums)]
+        try:
+            output = self._daemon().call(
+                "backend/command",
+                {"command": "import", "fs": remote, "arg": ["md5", str(sums)]},
+            )
+        except RcloneRcError as e:
+            return RcloneResult(cmd, self._rc_cmd(*cmd), 1, [{"msg": str(e)}])
+        return RcloneResult(cmd, self._rc_cmd(*cmd), 0, [output])
+
+    def sync(
+        self,
+        source: str,
+        destination: str,
+        max_duration: Optional[timedelta] = None,
+        exclude: Sequence[str] = (),
+        bandwidth_limit: Optional[BandwidthLimit] = None,
+    ) -> RcloneSyncResult:
+        daemon = self._daemon()
+        params: dict[str, Any] = {
+            "srcFs": source,
+            "dstFs": destination,
+            "_async": True,
+        }
+        if max_duration is not None:
+            # Durations are given to the API in nanoseconds.
+            seconds = max(int(max_duration.total_seconds()), 1)
+            params["_config"] = {"MaxDuration": seconds * 10**9}
+        if len(exclude) > 0:
+            params["_filter"] = {"ExcludeRule": list(exclude)}
+
+        limit = bandwidth_limit
+        if limit is not None:
+            daemon.call("core/bwlimit", {"rate": limit.rclone_arg()})
+        elif self.bandwidth is not None:
+            limit = self.bandwidth.limit(datetime.now())
+            rate = self.bandwidth.rclone_bwlimit(limit)
+            daemon.call("core/bwlimit", {"rate": rate})
+
+        cmd = ["sync", source, destination]
+        job = daemon.call("sync/sync", params)["jobid"]
+        status, stats = self._wait(job)
+
+        messages: list[dict[str, Any]] = list()
+        returncode: int = RcloneReturnCode.RC_OK
+        if not status.get("success", False):
+            error = status.get("error", "")
+            messages.append({"level": "error", "msg": error})
+            returncode = 1
+            if "duration" in error.lower():
+                returncode = RcloneReturnCode.RC_DURATION_EXCEEDED
+        messages.append({"level": "info", "msg": "stats", "stats": stats.raw})
+
+        result = RcloneSyncResult(cmd, self._rc_cmd(*cmd), returncode, messages)
+        result.bandwidth_limit = limit
+        if self.bandwidth is not None and bandwidth_limit is None:
+            self.bandwidth.observe(result.stats.bytes, result.stats.elapsed_time)
+
+        return result
+
+    def _daemon(self) -> RcloneDaemon:
+        """
+        Returns the daemon, starting it if necessary.
+        """
+        with self._lock:
+            if self.daemon is None:
+                args = [*self.provider_args, *self.sync_args, *self.transfer_args()]
+                if self.cache_dir is not None:
+                    args = ["--cache-dir", str(self.cache_dir), *args]
+
+                daemon = RcloneDaemon(self.cmdexec, args)
+                daemon.env = self.env
+                daemon.priority = self.priority
+                daemon.start()
+                self.daemon = daemon
+            return self.daemon
+
+    def _rc_cmd(self, *cmd: str) -> list[str]:
+        """
+        Returns a description of an rclone command run through the daemon.
+        """
+        return ["rclone", "rcd", *cmd]
+
+    def _wait(self, job: int) -> tuple[dict, RcloneSyncStatistics]:
+        """
+        Waits for a job to finish, logging its progress, and returns its status and
+        final statistics.
+        """
+        daemon = self._daemon()
+        while True:
+            status = daemon.call("job/status", {"jobid": job})
+            stats = RcloneSyncStatistics(
+                daemon.call("core/stats", {"group": f"job/{job}"})
+            )
+            if status.get("finished", False):
+                return status, stats
+
+            total = stats.raw.get("totalBytes", 0)
+            self.log.info(
+                f"job {job}: {stats.raw.get('bytes', 0)} of {total} bytes, "
+                f"{stats.raw.get('transfers', 0)} files transferred, "
+                f"{stats.raw.get('errors', 0)} errors"
+            )
+            time.sleep(self.poll_interval)
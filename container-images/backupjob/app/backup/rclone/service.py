@@ -5,11 +5,23 @@ backup.rclone.service
 Contains the implementation for the rclone service.
 """
 
-from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from pathlib import Path
+import sqlite3
+from tempfile import NamedTemporaryFile
+from typing import Optional
 
+from ..bandwidth import BandwidthLimit
+from ..metrics import MIB, add_resource_usage_fields, add_throughput_fields
 from ..report import BackupReport, BackupReportFieldAnnotation as A
 from .client import RcloneClient
-from .model import RcloneResult
+from .hashcache import ChecksumCache
+from .listing import ListingEstimate
+from .logparser import RcloneLog
+from .model import RcloneResult, RcloneReturnCode, RcloneSyncResult
+from .shard import ShardPlan, SyncShard, join_remote
+from .walk import SourceWalk
 
 
 class RcloneService:
@@ -20,6 +32,22 @@ class RcloneService:
     def __init__(self, client: RcloneClient) -> None:
         self.client = client
 
+        # If set, syncs stop transferring files at the deadline. The files that were
+        # not transferred are left for the next sync.
+        self.deadline: Optional[datetime] = None
+
+        # If True, syncs from a local directory estimate the LIST requests needed to
+        # list the destination with and without --fast-list.
+        self.compare_fast_list = False
+
+        # If set, syncs from a local directory reuse the checksums of files that are
+        # unchanged since the previous sync rather than having rclone hash them.
+        self.checksum_cache: Optional[ChecksumCache] = None
+
+        # Number of rclone processes that sync a local directory concurrently. If
+        # greater than 1, the sync is split into shards planned by ShardPlan.
+        self.shard_jobs = 1
+
     def sync(
         self, name: str, source: str, destination: str
     ) -> BackupReport[RcloneResult]:
@@ -30,10 +58,37 @@ class RcloneService:
         report = BackupReport(name=f"rclone sync / {name}")
         report.new_field("Source", source, lambda _: None)
         report.new_field("Destination", destination, lambda _: None)
-        report.new_field("Start Time", datetime.now(), lambda _: None)
+        start_time = report.new_field("Start Time", datetime.now(), lambda _: None)
         end_time = report.new_field("End Time", datetime.now(), lambda _: None)
 
-        result = self.client.sync(source, destination)
+        transfer_args = self.client.transfer_args()
+        if len(transfer_args) > 0:
+            report.new_field(
+                "Transfer Settings", " ".join(transfer_args), lambda _: None
+            )
+
+        # The source is walked once for everything that needs to visit its files.
+        walk: Optional[SourceWalk] = None
+        if Path(source).is_dir() and (
+            self.compare_fast_list
+            or self.checksum_cache is not None
+            or self.shard_jobs > 1
+        ):
+            walk = SourceWalk(Path(source))
+
+        sync_source = source
+        if self.checksum_cache is not None and walk is not None:
+            sync_source = self._cache_checksums(walk, report)
+        if walk is not None:
+            walk.finish()
+
+        if self.compare_fast_list and walk is not None:
+            self._compare_fast_list(ListingEstimate.from_walk(walk), report)
+
+        if self.shard_jobs > 1 and walk is not None:
+            result = self._sync_sharded(walk, sync_source, destination, report)
+        else:
+            result = self.client.sync(sync_source, destination, self._max_duration())
         report.result = result
 
         report.successful = result.stats.errors == 0
@@ -43,6 +98,214 @@ class RcloneService:
         report.new_field("Bytes Transferred", result.stats.bytes, lambda _: None)
         report.new_field("Files Transferred", result.stats.transfers, lambda _: None)
         report.new_field("Deletes", result.stats.deletes, lambda _: None)
+        if result.returncode == RcloneReturnCode.RC_DURATION_EXCEEDED:
+            report.new_field("Deadline Reached", True, lambda _: A.WARNING)
 
         end_time.data = datetime.now()
+        add_throughput_fields(
+            report,
+            end_time.data - start_time.data,
+            result.stats.bytes,
+            result.stats.transfers,
+        )
+        add_resource_usage_fields(report, result.resource_usage)
+        if result.bandwidth_limit is not None:
+            report.new_field(
+                "Bandwidth Limit", result.bandwidth_limit.describe(), lambda _: None
+            )
+        if result.log is not None:
+            self._add_log_fields(result.log, report)
         return report
+
+    def _add_log_fields(self, log: RcloneLog, report: BackupReport) -> None:
+        """
+        Adds fields summarizing rclone's output to the report.
+        """
+        if len(log.file_events) > 0:
+            counts = sorted(log.file_events.items(), key=lambda e: (-e[1], e[0]))
+            report.new_field(
+                "File Events",
+                ", ".join(f"{msg}: {n}" for msg, n in counts),
+                lambda _: None,
+            )
+            report.new_field(
+                "File Event Sample",
+                "\n".join(f"{m.get('msg')}: {m.get('object')}" for m in log.samples),
+                lambda _: A.MULTILINE_TEXT,
+            )
+
+        if log.dropped > 0:
+            report.new_field("Log Messages Dropped", log.dropped, lambda _: A.WARNING)
+
+        if log.unparsed_count > 0:
+            report.new_field(
+                "Unparsed Output Lines", log.unparsed_count, lambda _: A.WARNING
+            )
+            report.new_field(
+                "Unparsed Output", "\n".join(log.unparsed), lambda _: A.MULTILINE_TEXT
+            )
+
+    def _max_duration(self) -> Optional[timedelta]:
+        """
+        Returns the time left until the deadline, if one is set.
+        """
+        if self.deadline is None:
+            return None
+        return self.deadline - datetime.now()
+
+    def _sync_sharded(
+        self,
+        walk: SourceWalk,
+        sync_source: str,
+        destination: str,
+        report: BackupReport,
+    ) -> RcloneSyncResult:
+        """
+        Syncs the local directory of a finished walk in shards, running up to
+        shard_jobs rclone processes concurrently, and returns their combined result.
+
+        sync_source is the remote the shards read from; the directory itself, or an
+        overlay of it. If a bandwidth policy is set, its limit is chosen once and
+        split evenly between the concurrent processes, unless they share a process,
+        so it does not follow a timetable during the sync. If a shard raises an
+        exception, it is raised once every shard has finished.
+
+        The client's transfer settings apply to each process; they should be tuned
+        to a process's share of the resources, see RuntimeTuning.
+        """
+        plan = ShardPlan.plan(walk, self.shard_jobs)
+        shards = plan.all
+        processes = min(self.shard_jobs, len(shards))
+
+        limit: Optional[BandwidthLimit] = None
+        if self.client.bandwidth is not None:
+            limit = self.client.bandwidth.limit(datetime.now())
+        shard_limit = limit
+        if limit is not None and not self.client.shares_process:
+            shard_limit = limit.share(processes)
+
+        with ThreadPoolExecutor(
+            max_workers=processes, thread_name_prefix="rclone-sync"
+        ) as pool:
+            futures = [
+                pool.submit(
+                    self._sync_shard, plan, shard, sync_source, destination, shard_limit
+                )
+                for shard in shards
+            ]
+        results = [f.result() for f in futures]
+
+        # The top-level shard's command is the one kept in the combined result.
+        top_level = shards.index(plan.top_level)
+        merged = RcloneSyncResult.merge(
+            [results[top_level], *results[:top_level], *results[top_level + 1 :]]
+        )
+        merged.bandwidth_limit = limit
+        if self.client.bandwidth is not None:
+            self.client.bandwidth.observe(merged.stats.bytes, merged.stats.elapsed_time)
+
+        report.new_field("Shards", len(shards), lambda _: None)
+        failed = [
+            shard.name
+            for shard, result in zip(shards, results)
+            if result.stats.errors > 0
+        ]
+        if len(failed) > 0:
+            report.new_field("Failed Shards", ", ".join(failed), lambda _: A.ERROR)
+
+        return merged
+
+    def _sync_shard(
+        self,
+        plan: ShardPlan,
+        shard: SyncShard,
+        sync_source: str,
+        destination: str,
+        limit: Optional[BandwidthLimit],
+    ) -> RcloneSyncResult:
+        """
+        Syncs a single shard of a sharded sync.
+        """
+        if shard.directory is None:
+            return self.client.sync(
+                sync_source,
+                destination,
+                self._max_duration(),
+                exclude=plan.top_level_excludes(),
+                bandwidth_limit=limit,
+            )
+
+        return self.client.sync(
+            join_remote(sync_source, shard.directory),
+            join_remote(destination, shard.directory),
+            self._max_duration(),
+            bandwidth_limit=limit,
+        )
+
+    def _cache_checksums(self, walk: SourceWalk, report: BackupReport) -> str:
+        """
+        Brings the checksum cache up to date for the files of a walk and hands the
+        checksums to rclone, returning the remote to sync from.
+
+        If the cache cannot be updated or the checksums cannot be handed to rclone,
+        the sync falls back to having rclone hash every file.
+        """
+        assert self.checksum_cache is not None
+
+        source = walk.source
+        remote = self.client.hasher_remote(source)
+        with NamedTemporaryFile("w", suffix=".md5") as sums:
+            try:
+                stats = self.checksum_cache.update(source, sums, walk.files())
+            except (OSError, sqlite3.Error) as e:
+                report.new_field(
+                    "Checksum Cache Error",
+                    f"failed to update checksum cache: {e}",
+                    lambda _: A.WARNING,
+                )
+                return str(source)
+
+            sums.flush()
+            result = self.client.import_hashes(remote, Path(sums.name))
+
+        hit_rate = stats.hit_rate
+        report.new_field(
+            "Checksum Cache Hit Rate (%)",
+            round(hit_rate * 100, 1) if hit_rate is not None else None,
+            lambda _: None,
+        )
+        report.new_field("Bytes Hashed", stats.bytes_hashed, lambda _: None)
+        report.new_field("Bytes Hash Skipped", stats.bytes_skipped, lambda _: None)
+
+        if result.returncode != 0:
+            report.new_field(
+                "Checksum Cache Error",
+                "failed to import checksums into rclone; rclone hashed every file",
+                lambda _: A.WARNING,
+            )
+            return str(source)
+
+        return remote
+
+    def _compare_fast_list(
+        self, estimate: ListingEstimate, report: BackupReport
+    ) -> None:
+        """
+        Adds fields comparing the estimated LIST requests with and without --fast-list
+        to the report.
+        """
+        report.new_field(
+            "LIST Requests without --fast-list (est.)",
+            estimate.requests(False),
+            lambda _: None,
+        )
+        report.new_field(
+            "LIST Requests with --fast-list (est.)",
+            estimate.requests(True),
+            lambda _: None,
+        )
+        report.new_field(
+            "Fast List Memory (est. MiB)",
+            round(estimate.fast_list_memory / MIB, 1),
+            lambda _: None,
+        )
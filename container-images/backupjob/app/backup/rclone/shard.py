@@ -0,0 +1,132 @@
+"""
+backup.rclone.shard
+===================
+
+Contains code to split an rclone sync into several concurrent syncs.
+"""
+
+import re
+from typing import Optional, Self
+
+from .walk import SourceWalk
+
+# Characters with a special meaning in rclone filter patterns.
+GLOB_SPECIAL_RE = re.compile(r"([\\*?\[\]{}])")
+
+
+class SyncShard:
+    """
+    Object representing a part of a sync's source that is synced by its own rclone
+    process.
+    """
+
+    def __init__(self, directory: Optional[str], size: int) -> None:
+        # Name of the top-level directory the shard syncs, or None for the shard that
+        # syncs everything that is not synced by another shard.
+        self.directory = directory
+
+        # Total size of the files the shard syncs, in bytes.
+        self.size = size
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(directory={self.directory!r}, "
+            f"size={self.size})"
+        )
+
+    @property
+    def name(self) -> str:
+        """
+        Name of the shard, for the backup report.
+        """
+        return self.directory if self.directory is not None else "(top level)"
+
+
+class ShardPlan:
+    """
+    Plan splitting a sync of a local directory into shards that run concurrently.
+
+    The largest top-level directories are split off into shards of their own. Each is
+    synced to the same directory under the destination by a separate rclone process,
+    so listing and checking them run in parallel. Everything else, including the files
+    at the top level, is synced by a top-level shard that excludes the directories of
+    the other shards.
+
+    Deletes remain correct: each directory shard deletes within its own directory,
+    and the top-level shard deletes everything else that is no longer in the source,
+    including directories that were removed from the source entirely. Excluded paths
+    are never deleted by rclone, so shards do not interfere with each other.
+
+    Directories are split off largest first until the top-level shard is no larger
+    than a worker's share of the source, so that no shard holds up the end of the
+    sync while other workers are idle.
+    """
+
+    def __init__(self, shards: list[SyncShard], top_level: SyncShard) -> None:
+        # The directory shards, largest first.
+        self.shards = shards
+
+        self.top_level = top_level
+
+    @classmethod
+    def plan(cls, walk: SourceWalk, jobs: int, max_shards: int = 256) -> Self:
+        """
+        Plans the shards of a sync of a walk's source by up to `jobs` concurrent
+        rclone processes, splitting off at most max_shards directories. The walk must
+        be finished.
+
+        Symbolic links to directories are left to the top-level shard; rclone does
+        not follow them, but would if one were the source of a shard.
+        """
+        top_level_size = walk.sizes.get(None, 0)
+        directories = [
+            SyncShard(name, size)
+            for name, size in sorted(walk.sizes.items(), key=lambda i: str(i[0]))
+            if name is not None
+        ]
+
+        total = top_level_size + sum(d.size for d in directories)
+        top_level_size = total
+        shards: list[SyncShard] = list()
+        for d in sorted(directories, key=lambda d: -d.size):
+            if len(shards) >= max_shards or top_level_size * jobs <= total:
+                break
+            shards.append(d)
+            top_level_size -= d.size
+
+        return cls(shards, SyncShard(None, top_level_size))
+
+    @property
+    def all(self) -> list[SyncShard]:
+        """
+        Every shard of the plan, largest first.
+        """
+        return sorted([*self.shards, self.top_level], key=lambda s: -s.size)
+
+    def top_level_excludes(self) -> list[str]:
+        """
+        Returns the rclone filter patterns excluding the directory shards from the
+        top-level shard.
+        """
+        return [
+            f"/{escape_glob(s.directory)}/**"
+            for s in self.shards
+            if s.directory is not None
+        ]
+
+
+def escape_glob(name: str) -> str:
+    """
+    Escapes name so that it is matched literally in an rclone filter pattern.
+    """
+    return GLOB_SPECIAL_RE.sub(r"\\\1", name)
+
+
+def join_remote(remote: str, name: str) -> str:
+    """
+    Returns the path of name under an rclone remote path, such as "s3:bucket" or
+    ":hasher,remote=/data:".
+    """
+    if remote.endswith(":") or remote.endswith("/"):
+        return remote + name
+    return f"{remote}/{name}"
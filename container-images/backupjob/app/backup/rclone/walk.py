@@ -0,0 +1,87 @@
+"""
+backup.rclone.walk
+==================
+
+Contains code to walk the tree of a local sync source once for everything that
+prepares the sync.
+"""
+
+import os
+from pathlib import Path
+import stat
+from typing import Generator, Optional, Self
+
+
+class SourceWalk:
+    """
+    Single walk over the tree of a local sync source.
+
+    Estimating the listing of the destination, caching checksums and planning shards
+    each need to visit every file of the source. Rather than walking the tree once
+    for each, the files are visited once: the checksum cache consumes them from
+    files(), while the walk gathers the statistics the others need as it goes.
+
+    Symbolic links are not followed, as rclone does not follow them.
+    """
+
+    def __init__(self, source: Path) -> None:
+        self.source = source
+
+        # Number of files, which become objects at the destination.
+        self.objects = 0
+
+        # Number of entries (files and subdirectories) in each directory.
+        self.directory_entries: list[int] = list()
+
+        # Total size of the regular files under each top-level directory, keyed by
+        # its name, and of the regular files at the top level, keyed by None.
+        self.sizes: dict[Optional[str], int] = dict()
+
+        self._files: Optional[Generator[tuple[str, os.stat_result]]] = None
+
+    @classmethod
+    def complete(cls, source: Path) -> Self:
+        """
+        Returns a finished walk of source.
+        """
+        walk = cls(source)
+        walk.finish()
+        return walk
+
+    def files(self) -> Generator[tuple[str, os.stat_result]]:
+        """
+        Returns a generator walking the source, yielding the path relative to the
+        source and the lstat() result of each regular file.
+
+        The walk is only done once; every call returns the same generator. Its
+        statistics are complete once the generator is exhausted. Files and
+        directories that cannot be read are skipped.
+        """
+        if self._files is None:
+            self._files = self._walk()
+        return self._files
+
+    def finish(self) -> None:
+        """
+        Completes the walk, visiting the files that were not consumed from files().
+        """
+        for _ in self.files():
+            pass
+
+    def _walk(self) -> Generator[tuple[str, os.stat_result]]:
+        for dirpath, dirnames, filenames in os.walk(self.source):
+            self.objects += len(filenames)
+            self.directory_entries.append(len(dirnames) + len(filenames))
+
+            reldir = os.path.relpath(dirpath, self.source)
+            top = None if reldir == "." else reldir.split(os.sep, 1)[0]
+            for name in filenames:
+                try:
+                    st = os.lstat(os.path.join(dirpath, name))
+                except OSError:
+                    continue
+                if not stat.S_ISREG(st.st_mode):
+                    continue
+
+                self.sizes[top] = self.sizes.get(top, 0) + st.st_size
+                yield (name if top is None else os.path.join(reldir, name)), st
@@ -5,6 +5,7 @@ backup.report
 Contains backup reporting code.
 """
 
+from datetime import datetime
 from enum import Enum
 from typing import Any, Callable, Generator, Optional, Self, TypeVar
 
@@ -68,6 +69,39 @@ class BackupReportField[T]:
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}(label={self.label})"
 
+    def to_dict(self) -> dict:
+        """
+        Returns a dictionary representation of this field suitable for JSON encoding.
+
+        The field's annotation is evaluated; the annotator itself is not kept.
+        """
+        annotation = self.annotation
+        d: dict[str, Any] = {
+            "label": self.label,
+            "data": self.data,
+            "annotation": annotation.value if annotation is not None else None,
+        }
+        if isinstance(self.data, datetime):
+            d["data"] = self.data.isoformat()
+            d["type"] = "datetime"
+        return d
+
+    @classmethod
+    def from_dict(cls, d: dict) -> Self:
+        """
+        Returns a BackupReportField from its dictionary representation. The field's
+        annotator returns the evaluated annotation.
+        """
+        data = d["data"]
+        if d.get("type", None) == "datetime":
+            data = datetime.fromisoformat(data)
+
+        annotation: Optional[BackupReportFieldAnnotation] = None
+        if d.get("annotation", None) is not None:
+            annotation = BackupReportFieldAnnotation(d["annotation"])
+
+        return cls(d["label"], data, lambda _: annotation)
+
 
 class BackupReport[T]:
     """
@@ -147,6 +181,35 @@ class BackupReport[T]:
         self.add_subreport(subreport)
         return subreport
 
+    def to_dict(self) -> dict:
+        """
+        Returns a dictionary representation of this report and its subreports suitable
+        for JSON encoding.
+
+        The command execution result the report is based on is not included.
+        """
+        return {
+            "name": self.name,
+            "fields": [f.to_dict() for f in self.fields],
+            "subreports": [r.to_dict() for r in self.subreports],
+            "omittable": self.omittable,
+            "successful": self.successful,
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> Self:
+        """
+        Returns a BackupReport from its dictionary representation.
+        """
+        report = cls(d["name"])
+        for f in d["fields"]:
+            report.add_field(BackupReportField.from_dict(f))
+        for r in d["subreports"]:
+            report.add_subreport(cls.from_dict(r))
+        report.omittable = d["omittable"]
+        report.successful = d["successful"]
+        return report
+
     def all_reports(self) -> Generator[Self]:
         """
         Iterates over all reports contained in this one, including the top level report.
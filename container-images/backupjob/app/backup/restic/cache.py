@@ -0,0 +1,159 @@
+"""
+backup.restic.cache
+===================
+
+Contains a persistent cache of restic repository metadata.
+"""
+
+from datetime import datetime, timedelta
+from threading import RLock
+from typing import Iterable, Optional
+
+from ..state import StateDirectory
+
+
+class ResticMetadataCache:
+    """
+    Persistent cache of metadata about a single restic repository.
+
+    The cache remembers whether the repository has been initialized and keeps the
+    JSON representation of every snapshot that has been read from the repository.
+    That the repository is initialized is only trusted for `initialized_max_age`,
+    after which it is verified again.
+    Snapshots are immutable in restic, so a cached snapshot never needs to be read
+    again; only the set of snapshot IDs in the repository must be checked.
+
+    Safe for use by multiple threads.
+    """
+
+    STATE_KIND = "restic-metadata"
+
+    def __init__(self, state: StateDirectory, repository: str) -> None:
+        self.state = state
+        self.repository = repository
+        self.initialized_max_age = timedelta(days=1)
+
+        self._lock = RLock()
+        self._loaded = False
+        self._initialized: Optional[datetime] = None
+        self._snapshots: dict[str, dict] = dict()
+
+        # Whether the cached snapshots are known to match the repository. Cached
+        # snapshots are verified against the repository at most once per process,
+        # unless this client changes the repository's snapshots.
+        self._snapshots_fresh = False
+
+    @property
+    def initialized(self) -> bool:
+        """
+        Whether the repository is known to be initialized.
+        """
+        with self._lock:
+            self._load()
+            return (
+                self._initialized is not None
+                and datetime.now() - self._initialized < self.initialized_max_age
+            )
+
+    @initialized.setter
+    def initialized(self, value: bool) -> None:
+        with self._lock:
+            self._load()
+            if value:
+                self._initialized = datetime.now()
+            elif self._initialized is not None:
+                self._initialized = None
+                self._snapshots.clear()
+                self._snapshots_fresh = False
+            else:
+                return
+            self.save()
+
+    @property
+    def snapshots_fresh(self) -> bool:
+        """
+        Whether the cached snapshots are known to match the repository's snapshots.
+        """
+        with self._lock:
+            return self._snapshots_fresh
+
+    def invalidate_snapshots(self) -> None:
+        """
+        Marks the cached snapshots as possibly out of date, e.g. because a backup
+        created a new snapshot.
+        """
+        with self._lock:
+            self._snapshots_fresh = False
+
+    def remove_snapshots(self, ids: Iterable[str]) -> None:
+        """
+        Removes the snapshots with the given IDs from the cache.
+        """
+        with self._lock:
+            self._load()
+            for i in ids:
+                self._snapshots.pop(i, None)
+            self.save()
+
+    def snapshots(self) -> list[dict]:
+        """
+        Returns the cached snapshots.
+        """
+        with self._lock:
+            self._load()
+            return list(self._snapshots.values())
+
+    def snapshot_ids(self) -> set[str]:
+        """
+        Returns the IDs of the cached snapshots.
+        """
+        with self._lock:
+            self._load()
+            return set(self._snapshots.keys())
+
+    def update_snapshots(self, current_ids: set[str], new: list[dict]) -> None:
+        """
+        Updates the cache to match the repository, given the IDs of all snapshots
+        currently in the repository and the snapshots that are not yet cached.
+        """
+        with self._lock:
+            self._load()
+            for i in set(self._snapshots.keys()) - current_ids:
+                del self._snapshots[i]
+            for s in new:
+                self._snapshots[s["id"]] = s
+            self._snapshots_fresh = True
+            self.save()
+
+    def save(self) -> None:
+        """
+        Persists the cache.
+        """
+        with self._lock:
+            self.state.write_json(
+                self.STATE_KIND,
+                self.repository,
+                {
+                    "repository": self.repository,
+                    "initialized": (
+                        self._initialized.isoformat()
+                        if self._initialized is not None
+                        else None
+                    ),
+                    "snapshots": self._snapshots,
+                },
+            )
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+
+        raw = self.state.read_json(self.STATE_KIND, self.repository, {})
+        initialized = raw.get("initialized", None)
+        self._initialized = (
+            datetime.fromisoformat(initialized)
+            if isinstance(initialized, str)
+            else None
+        )
+        self._snapshots = raw.get("snapshots", {})
+        self._loaded = True
@@ -5,25 +5,53 @@ backup.restic.client
 Contains the implementation for the restic client.
 """
 
+from datetime import datetime
 import json
 from pathlib import Path
-from typing import Optional, Type, TypeVar
-
-from ..cmd import CommandExecutorProtocol
+import re
+from typing import Optional, Sequence, Type, TypeVar
+
+from ..bandwidth import BandwidthLimit, BandwidthPolicy
+from ..cmd import (
+    CommandExecutorProtocol,
+    LineHandler,
+    json_line_handler,
+    resource_usage,
+)
 from ..log import logger
+from ..priority import ProcessPriority
+from .cache import ResticMetadataCache
 from .error import ResticError, InvalidResticRepositoryPasswordError
 from .model import (
     ResticResult,
     ResticBackupResult,
     ResticCheckResult,
     ResticForgetResult,
+    ResticPruneResult,
+    ResticPruneStats,
+    ResticSnapshot,
     ResticSnapshotsResult,
     ResticReturnCode,
+    ResticStatusDigest,
 )
 
 
 RR = TypeVar("RR", bound=ResticResult)
 
+# Matches the message_type field of a JSON-encoded restic message.
+#
+# restic always writes message_type as the first field of a message, so only the
+# beginning of each line needs to be searched.
+MESSAGE_TYPE_RE = re.compile(rb'"message_type"\s*:\s*"([a-z_]+)"')
+MESSAGE_TYPE_SEARCH_LENGTH = 64
+
+# The maximum number of snapshots that are read by ID in a single invocation. If more
+# snapshots need to be read, all snapshots are listed instead.
+MAX_SNAPSHOT_IDS_PER_CALL = 256
+
+# Matches a restic object ID, as written by `restic list`.
+OBJECT_ID_RE = re.compile(rb"^[0-9a-f]{64}$")
+
 
 class ResticClient:
     """
@@ -45,11 +73,51 @@ class ResticClient:
         self.password_file = password_file
         self.cache_dir = cache_dir
 
+        # The host name recorded in snapshots created by this client. If None, restic
+        # uses the system's host name.
+        #
+        # When running in a container, the system's host name is typically different
+        # for every run, so a stable host name should be set.
+        self.host: Optional[str] = None
+
+        # If False, restic "status" messages are not decoded. They are instead folded into
+        # a ResticStatusDigest on the result, which retains only the most recent few.
+        #
+        # Status messages are by far the most numerous message type emitted during a
+        # backup, and nothing but progress reporting uses them.
+        self.decode_status_messages = False
+        self.status_history_size = 16
+
+        # If set, read-only repository metadata is cached between runs.
+        self.metadata_cache: Optional[ResticMetadataCache] = None
+
+        # Additional environment variables set for restic, such as GOMAXPROCS.
+        self.env: dict[str, str] = dict()
+
+        # CPU and I/O priority that restic runs with.
+        self.priority: Optional[ProcessPriority] = None
+
+        # Extended options passed to restic with -o, such as s3.connections.
+        self.options: dict[str, str] = dict()
+
+        # Number of files read concurrently during a backup. If None, restic's
+        # default is used.
+        self.read_concurrency: Optional[int] = None
+
+        # If set, chooses the bandwidth limit of each backup.
+        self.bandwidth: Optional[BandwidthPolicy] = None
+
     def repository_is_initialized(self) -> bool:
         """
         Convenience function that determines if a repository has been initialized according to
         https://restic.readthedocs.io/en/stable/075_scripting.html#exit-codes.
+
+        If the repository is known to be initialized from the metadata cache, restic is
+        not invoked.
         """
+        if self.metadata_cache is not None and self.metadata_cache.initialized:
+            return True
+
         result = self.run(
             "cat", "config", result_type=ResticResult, single_json_document=True
         )
@@ -57,6 +125,8 @@ class ResticClient:
         # See https://restic.readthedocs.io/en/stable/075_scripting.html#exit-codes.
         match result.returncode:
             case ResticReturnCode.RC_REPOSITORY_INITIALIZED:
+                if self.metadata_cache is not None:
+                    self.metadata_cache.initialized = True
                 return True
 
             case ResticReturnCode.RC_REPOSITORY_NOT_INITIALIZED:
@@ -73,16 +143,74 @@ class ResticClient:
                     self.log.error(f"restic error: {str(m)}")
                 raise ResticError("unhandled error from restic", result)
 
+    def all_snapshots(self) -> list[ResticSnapshot]:
+        """
+        Returns all of the repository's snapshots.
+
+        If a metadata cache is set, only snapshots that are not yet cached are read
+        from the repository, all in a single `restic snapshots` invocation. If many
+        snapshots are missing from the cache, all snapshots are listed instead.
+        Without a metadata cache, every snapshot is listed.
+
+        Raises ResticError if the snapshots cannot be read.
+        """
+        if self.metadata_cache is None:
+            return self._snapshots_or_raise().snapshots
+
+        cache = self.metadata_cache
+        if not cache.snapshots_fresh:
+            ids_result, ids = self.list_ids("snapshots")
+            if ids_result.returncode != ResticReturnCode.RC_OK:
+                raise ResticError("failed listing snapshot IDs", ids_result)
+
+            missing = sorted(ids - cache.snapshot_ids())
+            if len(missing) > MAX_SNAPSHOT_IDS_PER_CALL:
+                result = self._snapshots_or_raise()
+                ids = {s["id"] for s in result.messages}
+                cache.update_snapshots(ids, result.messages)
+            elif len(missing) > 0:
+                result = self._snapshots_or_raise(ids=missing)
+                cache.update_snapshots(ids, result.messages)
+            else:
+                cache.update_snapshots(ids, [])
+
+        return [ResticSnapshot.from_dict(d) for d in cache.snapshots()]
+
     def backup(
-        self, source: Path, skip_if_unchanged: bool, exclude_files: list[Path]
+        self,
+        source: Path,
+        skip_if_unchanged: bool,
+        exclude_files: list[Path],
+        parent: Optional[str] = None,
+        timeout: Optional[float] = None,
     ) -> ResticBackupResult:
         """
         Performs a restic backup for the given source directory.
+
+        If parent is given, restic uses the snapshot with that ID to detect unchanged
+        files, rather than searching for a parent snapshot itself.
+
+        If timeout is given, restic is interrupted once it has run for that many
+        seconds. An interrupted backup does not produce a snapshot.
         """
         optional_args: list[str] = list()
         if skip_if_unchanged:
             optional_args.append("--skip-if-unchanged")
 
+        if self.host is not None:
+            optional_args.extend(["--host", self.host])
+
+        if parent is not None:
+            optional_args.extend(["--parent", parent])
+
+        if self.read_concurrency is not None:
+            optional_args.extend(["--read-concurrency", str(self.read_concurrency)])
+
+        limit: Optional[BandwidthLimit] = None
+        if self.bandwidth is not None:
+            limit = self.bandwidth.limit(datetime.now())
+            optional_args.extend(limit.restic_args())
+
         for p in exclude_files:
             optional_args.extend(["--exclude-file", str(p)])
 
@@ -99,22 +227,44 @@ class ResticClient:
         # be running in a container via Kubernetes.
         #
         # [1]: https://restic.readthedocs.io/en/latest/040_backup.html#skip-creating-snapshots-if-unchanged
-        return self.run(
+        result = self.run(
             "backup",
             *optional_args,
             backup_src,
             result_type=ResticBackupResult,
             cwd=cwd,
             single_json_document=False,
+            timeout=timeout,
         )
 
-    def check(self, read_data: bool) -> ResticCheckResult:
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate_snapshots()
+
+        result.bandwidth_limit = limit
+        if self.bandwidth is not None and result.summary is not None:
+            self.bandwidth.observe(
+                result.summary.data_added_packed,
+                (
+                    result.summary.backup_end - result.summary.backup_start
+                ).total_seconds(),
+            )
+
+        return result
+
+    def check(
+        self, read_data: bool, read_data_subset: Optional[str] = None
+    ) -> ResticCheckResult:
         """
         Performs a repository check.
+
+        If read_data_subset is given (e.g. "2/7"), only that subset of the repository's
+        data is read and verified. It takes precedence over read_data.
         """
         optional_args: list[str] = list()
 
-        if read_data:
+        if read_data_subset is not None:
+            optional_args.extend(["--read-data-subset", read_data_subset])
+        elif read_data:
             optional_args.append("--read-data")
 
         return self.run(
@@ -124,6 +274,34 @@ class ResticClient:
             single_json_document=False,
         )
 
+    def copy(self, source: "ResticClient", snapshot_ids: Sequence[str]) -> ResticResult:
+        """
+        Copies the snapshots with the given IDs from the source client's repository into
+        this client's repository.
+
+        `restic copy` does not write JSON, so its output is logged rather than decoded
+        into messages.
+        """
+        if len(snapshot_ids) == 0:
+            raise ValueError("no snapshots to copy")
+
+        def on_line(line: bytes) -> None:
+            self.log.info(f"restic copy: {line.decode('utf-8', errors='replace')}")
+
+        result = self.run(
+            "copy",
+            *self.from_repo_args(source),
+            *snapshot_ids,
+            result_type=ResticResult,
+            single_json_document=False,
+            line_handler=on_line,
+        )
+
+        if self.metadata_cache is not None:
+            self.metadata_cache.invalidate_snapshots()
+
+        return result
+
     def forget(
         self,
         keep_last: Optional[int] = None,
@@ -171,7 +349,7 @@ class ResticClient:
             optional_args.append("--repack-small")
 
         # --quiet is necessary here, otherwise restic will write non-JSON.
-        return self.run(
+        result = self.run(
             "forget",
             "--quiet",
             *optional_args,
@@ -179,6 +357,23 @@ class ResticClient:
             single_json_document=True,
         )
 
+        if self.metadata_cache is not None:
+            self.metadata_cache.remove_snapshots(s.id for s in result.removed_snapshots)
+            self.metadata_cache.invalidate_snapshots()
+
+        return result
+
+    @classmethod
+    def from_repo_args(cls, source: "ResticClient") -> list[str]:
+        """
+        Returns the arguments that make restic read from the source client's
+        repository, for subcommands such as `copy` that use two repositories.
+        """
+        args = ["--from-repo", source.repository_path]
+        if source.password_file is not None:
+            args.extend(["--from-password-file", str(source.password_file)])
+        return args
+
     def full_cmd(self, *subcmd: str) -> list[str]:
         """
         Given a restic subcommand (e.g. `cat config` or `backup /path/to/source`), returns the
@@ -193,17 +388,124 @@ class ResticClient:
         if self.password_file is not None:
             cmd_common.extend(["--password-file", str(self.password_file)])
 
+        for k, v in self.options.items():
+            cmd_common.extend(["-o", f"{k}={v}"])
+
         cmd_common.append("--json")
 
         return [*cmd_common, *subcmd]
 
-    def init(self) -> ResticResult:
+    def init(
+        self, copy_chunker_params_from: Optional["ResticClient"] = None
+    ) -> ResticResult:
         """
         Initializes the repository.
+
+        If copy_chunker_params_from is given, the new repository uses the same chunker
+        parameters as that client's repository. Snapshots copied between repositories
+        with the same chunker parameters deduplicate as well as the original snapshots.
         """
-        result = self.run("init", result_type=ResticResult, single_json_document=False)
+        optional_args: list[str] = list()
+        if copy_chunker_params_from is not None:
+            optional_args.extend(
+                [
+                    "--copy-chunker-params",
+                    *self.from_repo_args(copy_chunker_params_from),
+                ]
+            )
+
+        result = self.run(
+            "init",
+            *optional_args,
+            result_type=ResticResult,
+            single_json_document=False,
+        )
         if result.returncode != ResticReturnCode.RC_OK:
             raise ResticError("failed initializing repository", result)
+        if self.metadata_cache is not None:
+            self.metadata_cache.initialized = True
+        return result
+
+    def list_ids(self, kind: str) -> tuple[ResticResult, set[str]]:
+        """
+        Lists the IDs of all objects of the given kind (e.g. "snapshots") in the
+        repository.
+
+        `restic list` writes plain IDs rather than JSON, so the IDs are returned
+        alongside the result rather than as its messages. restic's stderr is combined
+        with its stdout, so lines that are not object IDs, such as warnings about
+        locks, are ignored.
+        """
+        ids: set[str] = set()
+
+        def on_line(line: bytes) -> None:
+            line = line.strip()
+            if OBJECT_ID_RE.match(line) is not None:
+                ids.add(line.decode("ascii"))
+
+        result = self.run(
+            "list",
+            kind,
+            result_type=ResticResult,
+            single_json_document=False,
+            line_handler=on_line,
+        )
+        return result, ids
+
+    @classmethod
+    def message_type(cls, line: bytes) -> Optional[str]:
+        """
+        Returns the message_type of a raw, JSON-encoded restic message without decoding
+        the message. Returns None if the message type cannot be determined.
+        """
+        m = MESSAGE_TYPE_RE.search(line, 0, MESSAGE_TYPE_SEARCH_LENGTH)
+        if m is None:
+            return None
+        return m.group(1).decode("ascii")
+
+    def prune(
+        self,
+        dry_run: bool = False,
+        max_unused: Optional[str] = None,
+        max_repack_size: Optional[str] = None,
+        repack_small: bool = False,
+        timeout: Optional[float] = None,
+    ) -> ResticPruneResult:
+        """
+        Removes data that no snapshot uses from the repository.
+
+        If dry_run is True, only determines what would be removed. max_unused and
+        max_repack_size are passed to restic as is, e.g. "5%" or "2G". If timeout is
+        given, restic is interrupted once it has run for that many seconds; an
+        interrupted prune leaves the repository intact and is continued by the next
+        prune.
+
+        `restic prune` does not write JSON, so the statistics it prints are read from
+        its output.
+        """
+        optional_args: list[str] = list()
+        if dry_run:
+            optional_args.append("--dry-run")
+
+        if max_unused is not None:
+            optional_args.extend(["--max-unused", max_unused])
+
+        if max_repack_size is not None:
+            optional_args.extend(["--max-repack-size", max_repack_size])
+
+        if repack_small:
+            optional_args.append("--repack-small")
+
+        stats = ResticPruneStats()
+        result = self.run(
+            "prune",
+            *optional_args,
+            result_type=ResticPruneResult,
+            single_json_document=False,
+            line_handler=stats.add_line,
+            timeout=timeout,
+        )
+        result.stats = stats
         return result
 
     def run(
@@ -212,41 +514,104 @@ class ResticClient:
         result_type: Type[RR],
         single_json_document: bool,
         cwd: Optional[Path] = None,
+        line_handler: Optional[LineHandler] = None,
+        timeout: Optional[float] = None,
     ) -> RR:
         """
         Runs restic with the given command, returning all the messages produced by restic.
+
+        If line_handler is given, restic's output is passed to it line by line rather
+        than being decoded into messages. If timeout is given, restic is interrupted
+        once it has run for that many seconds.
         """
         if cwd is None:
             cwd = Path.cwd()
         assert isinstance(cwd, Path)
 
         full_cmd = self.full_cmd(*cmd)
-        proc = self.cmdexec(full_cmd, cwd=cwd, combine_stdout_stderr=True)
-        try:
-            if single_json_document:
+        messages: list = list()
+        status = ResticStatusDigest(self.status_history_size)
+
+        if line_handler is not None:
+            proc = self.cmdexec(
+                full_cmd,
+                cwd=cwd,
+                combine_stdout_stderr=True,
+                line_handler=line_handler,
+                timeout=timeout,
+                env=self.env,
+                priority=self.priority,
+            )
+        elif single_json_document:
+            proc = self.cmdexec(
+                full_cmd,
+                cwd=cwd,
+                combine_stdout_stderr=True,
+                timeout=timeout,
+                env=self.env,
+                priority=self.priority,
+            )
+            try:
                 json_obj = json.loads(proc.stdout)
                 if isinstance(json_obj, list):
                     messages = json_obj
                 else:
                     messages = [json_obj]
-            else:
-                messages = list(
-                    map(lambda ln: json.loads(ln), proc.stdout.splitlines(b"\n"))
-                )
-        except json.JSONDecodeError:
-            messages = []
-
-        return result_type(
+            except json.JSONDecodeError:
+                messages = []
+        else:
+            # Messages are decoded as restic emits them rather than after the
+            # command exits, so the raw output is never held in memory.
+            invalid_lines: list[bytes] = list()
+            decode = json_line_handler(messages.append, invalid_lines.append)
+
+            def on_line(line: bytes) -> None:
+                if (
+                    not self.decode_status_messages
+                    and self.message_type(line) == "status"
+                ):
+                    status.add(line)
+                else:
+                    decode(line)
+
+            proc = self.cmdexec(
+                full_cmd,
+                cwd=cwd,
+                combine_stdout_stderr=True,
+                line_handler=on_line,
+                timeout=timeout,
+                env=self.env,
+                priority=self.priority,
+            )
+            if len(invalid_lines) > 0:
+                messages = []
+
+        # The repository may have been removed or replaced since it was cached as
+        # initialized.
+        if self.metadata_cache is not None and proc.returncode in (
+            ResticReturnCode.RC_REPOSITORY_NOT_INITIALIZED,
+            ResticReturnCode.RC_BAD_REPOSITORY_PASSWORD,
+        ):
+            self.metadata_cache.initialized = False
+
+        result = result_type(
             repository=self.repository_path,
             cmd=list(cmd),
             full_cmd=full_cmd,
             returncode=proc.returncode,
             messages=messages,
+            status=status,
         )
+        result.resource_usage = resource_usage(proc)
+        return result
 
-    def snapshots(self, latest: Optional[int] = None) -> ResticSnapshotsResult:
+    def snapshots(
+        self, latest: Optional[int] = None, ids: Sequence[str] = ()
+    ) -> ResticSnapshotsResult:
         """
         Lists the repository's snapshots.
+
+        If IDs are given, only the snapshots with those IDs are listed.
         """
         optional_args: list[str] = list()
         if latest is not None:
@@ -255,6 +620,13 @@ class ResticClient:
         return self.run(
             "snapshots",
             *optional_args,
+            *ids,
             result_type=ResticSnapshotsResult,
             single_json_document=True,
         )
+
+    def _snapshots_or_raise(self, ids: Sequence[str] = ()) -> ResticSnapshotsResult:
+        result = self.snapshots(ids=ids)
+        if result.returncode != ResticReturnCode.RC_OK:
+            raise ResticError("failed listing snapshots", result)
+        return result
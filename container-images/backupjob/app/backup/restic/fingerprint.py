@@ -0,0 +1,272 @@
+"""
+backup.restic.fingerprint
+=========================
+
+Contains code to detect whether a backup source has changed without invoking restic.
+"""
+
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from hashlib import blake2b
+import os
+from pathlib import Path
+from threading import Lock
+from typing import Iterable, Optional, Self
+
+from ..state import StateDirectory
+
+# Fingerprints are combined by addition modulo 2**256, which makes the combined
+# fingerprint independent of the order in which entries are visited.
+FINGERPRINT_MODULUS = 2**256
+
+
+class TreeFingerprint:
+    """
+    Object representing the fingerprint of a directory tree.
+
+    The fingerprint is an aggregate of the (path, size, mtime, inode) of every entry in
+    the tree. If any entry is added, removed, renamed, resized or modified, the
+    fingerprint changes. File contents are not read.
+    """
+
+    def __init__(self, digest: str, entries: int, size: int) -> None:
+        self.digest = digest
+        self.entries = entries
+        self.size = size
+
+    def __eq__(self, other: object) -> bool:
+        if not isinstance(other, TreeFingerprint):
+            return False
+        return self.digest == other.digest
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(digest={self.digest}, "
+            f"entries={self.entries}, size={self.size})"
+        )
+
+    @classmethod
+    def compute(
+        cls, path: Path, extra_files: Iterable[Path] = (), workers: int = 8
+    ) -> Self:
+        """
+        Computes the fingerprint of the tree rooted at path.
+
+        Directories are scanned concurrently using up to `workers` threads.
+        The metadata of extra_files, such as exclude files that live outside of the
+        tree, is included in the fingerprint.
+        """
+        acc = _FingerprintAccumulator(path)
+
+        for p in extra_files:
+            acc.add_stat(f"extra:{p}", os.stat(p))
+
+        st = os.stat(path, follow_symlinks=False)
+        acc.add_stat(".", st)
+
+        if not path.is_dir():
+            return acc.result()
+
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="fingerprint"
+        ) as pool:
+            pending: set[Future[list[Path]]] = {pool.submit(acc.scan, path)}
+            while len(pending) > 0:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for f in done:
+                    for d in f.result():
+                        pending.add(pool.submit(acc.scan, d))
+
+        return acc.result()
+
+
+class _FingerprintAccumulator:
+    """
+    Accumulates the fingerprint of a directory tree. Safe for use by multiple threads.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+        self._lock = Lock()
+        self._total = 0
+        self._entries = 0
+        self._size = 0
+
+    def add_stat(self, relpath: str, st: os.stat_result) -> None:
+        """
+        Adds an entry with the given stat result to the fingerprint.
+        """
+        self._add(self._entry_value(relpath, st), 1, st.st_size)
+
+    def scan(self, directory: Path) -> list[Path]:
+        """
+        Adds the entries of a single directory to the fingerprint, returning the
+        subdirectories that were found.
+        """
+        total = 0
+        entries = 0
+        size = 0
+        subdirs: list[Path] = list()
+
+        with os.scandir(directory) as it:
+            for e in it:
+                st = e.stat(follow_symlinks=False)
+                relpath = os.path.relpath(e.path, self.root)
+                total += self._entry_value(relpath, st)
+                entries += 1
+                size += st.st_size
+                if e.is_dir(follow_symlinks=False):
+                    subdirs.append(Path(e.path))
+
+        self._add(total, entries, size)
+        return subdirs
+
+    def result(self) -> TreeFingerprint:
+        """
+        Returns the accumulated fingerprint.
+        """
+        with self._lock:
+            digest = (self._total % FINGERPRINT_MODULUS).to_bytes(32, "big").hex()
+            return TreeFingerprint(digest, self._entries, self._size)
+
+    def _add(self, value: int, entries: int, size: int) -> None:
+        with self._lock:
+            self._total += value
+            self._entries += entries
+            self._size += size
+
+    @classmethod
+    def _entry_value(cls, relpath: str, st: os.stat_result) -> int:
+        h = blake2b(digest_size=32)
+        h.update(
+            f"{relpath}\0{st.st_size}\0{st.st_mtime_ns}\0{st.st_ino}".encode(
+                "utf-8", errors="surrogateescape"
+            )
+        )
+        return int.from_bytes(h.digest(), "big")
+
+
+class FingerprintRecord:
+    """
+    Object representing the recorded fingerprint of a backup source as of its last
+    successful backup.
+    """
+
+    def __init__(
+        self, digest: str, snapshot_id: Optional[str], verified: datetime
+    ) -> None:
+        self.digest = digest
+
+        # The ID of the last snapshot restic produced for the source, if known.
+        self.snapshot_id = snapshot_id
+
+        # When restic last ran for the source. Fingerprint matches are only trusted
+        # for a limited time after this, after which restic is run regardless.
+        self.verified = verified
+
+    def to_dict(self) -> dict:
+        """
+        Returns a dictionary representation of this record suitable for JSON encoding.
+        """
+        return {
+            "digest": self.digest,
+            "snapshot_id": self.snapshot_id,
+            "verified": self.verified.isoformat(),
+        }
+
+    @classmethod
+    def from_dict(cls, d: dict) -> Self:
+        """
+        Returns a FingerprintRecord from its dictionary representation.
+        """
+        return cls(
+            digest=d["digest"],
+            snapshot_id=d.get("snapshot_id", None),
+            verified=datetime.fromisoformat(d["verified"]),
+        )
+
+
+class FingerprintStore:
+    """
+    Persistent store of backup source fingerprints for a single restic repository.
+
+    Safe for use by multiple threads.
+    """
+
+    STATE_KIND = "fingerprints"
+
+    def __init__(
+        self, state: StateDirectory, repository: str, max_age: timedelta
+    ) -> None:
+        self.state = state
+        self.repository = repository
+
+        # The maximum time a fingerprint match is trusted for. Once a source's record
+        # is older than this, restic is run for the source even if it appears to be
+        # unchanged, guarding against changes the fingerprint cannot detect.
+        self.max_age = max_age
+
+        self._lock = Lock()
+        self._records: Optional[dict[str, FingerprintRecord]] = None
+
+    def get(self, source: Path) -> Optional[FingerprintRecord]:
+        """
+        Returns the recorded fingerprint for the source, or None if there is none.
+        """
+        with self._lock:
+            return self._load().get(str(source), None)
+
+    def is_unchanged(
+        self, source: Path, fingerprint: TreeFingerprint, now: datetime
+    ) -> bool:
+        """
+        Returns True if the source's fingerprint matches its recorded fingerprint and
+        the record is recent enough to be trusted.
+        """
+        record = self.get(source)
+        if record is None:
+            return False
+
+        return (
+            record.digest == fingerprint.digest and now - record.verified < self.max_age
+        )
+
+    def record(
+        self,
+        source: Path,
+        fingerprint: TreeFingerprint,
+        snapshot_id: Optional[str],
+        verified: datetime,
+    ) -> None:
+        """
+        Records the fingerprint of a source that was successfully backed up.
+
+        If snapshot_id is None (restic did not create a snapshot because nothing
+        changed), the previously-recorded snapshot ID is kept.
+        """
+        with self._lock:
+            records = self._load()
+            previous = records.get(str(source), None)
+            if snapshot_id is None and previous is not None:
+                snapshot_id = previous.snapshot_id
+            records[str(source)] = FingerprintRecord(
+                fingerprint.digest, snapshot_id, verified
+            )
+
+    def save(self) -> None:
+        """
+        Persists the recorded fingerprints.
+        """
+        with self._lock:
+            records = self._load()
+            self.state.write_json(
+                self.STATE_KIND,
+                self.repository,
+                {k: v.to_dict() for k, v in records.items()},
+            )
+
+    def _load(self) -> dict[str, FingerprintRecord]:
+        if self._records is None:
+            raw = self.state.read_json(self.STATE_KIND, self.repository, {})
+            self._records = {k: FingerprintRecord.from_dict(v) for k, v in raw.items()}
+        return self._records
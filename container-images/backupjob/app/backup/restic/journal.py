@@ -0,0 +1,101 @@
+"""
+backup.restic.journal
+=====================
+
+Contains code to resume partially completed for_each backups.
+"""
+
+from pathlib import Path
+from threading import Lock
+from typing import Optional
+
+from ..report import BackupReport
+from ..state import StateDirectory
+
+
+class BackupJournal:
+    """
+    Persistent journal of the children of a for_each backup that completed during a
+    run, so that a retried run can resume where an earlier attempt stopped.
+
+    A run is identified by a run ID that stays the same across retries of the run,
+    such as the name of the Kubernetes Job that performs it. The journal is kept per
+    repository and source; starting a run with a different ID discards the journal of
+    the previous run.
+
+    Safe for use by multiple threads.
+    """
+
+    STATE_KIND = "backup-journal"
+
+    def __init__(
+        self, state: StateDirectory, repository: str, source: Path, run_id: str
+    ) -> None:
+        self.state = state
+        self.repository = repository
+        self.source = source
+        self.run_id = run_id
+
+        self._lock = Lock()
+        self._attempt = 0
+        self._completed: Optional[dict[str, dict]] = None
+
+    @property
+    def attempt(self) -> int:
+        """
+        The 1-based number of the current attempt at the run.
+        """
+        with self._lock:
+            self._load()
+            return self._attempt
+
+    def completed(self) -> dict[str, BackupReport]:
+        """
+        Returns the reports of the children that completed during earlier attempts at
+        the run, keyed by child name.
+        """
+        with self._lock:
+            return {k: BackupReport.from_dict(v) for k, v in self._load().items()}
+
+    def record(self, child: str, report: BackupReport) -> None:
+        """
+        Records that a child completed, persisting the journal immediately so that the
+        child is not backed up again if this attempt dies.
+        """
+        with self._lock:
+            self._load()[child] = report.to_dict()
+            self._save()
+
+    def start(self) -> None:
+        """
+        Records the start of an attempt at the run.
+        """
+        with self._lock:
+            self._load()
+            self._attempt += 1
+            self._save()
+
+    def _key(self) -> str:
+        return f"{self.repository}\n{self.source}"
+
+    def _load(self) -> dict[str, dict]:
+        if self._completed is None:
+            raw = self.state.read_json(self.STATE_KIND, self._key(), {})
+            if raw.get("run_id", None) == self.run_id:
+                self._attempt = raw.get("attempt", 0)
+                self._completed = raw.get("completed", {})
+            else:
+                self._attempt = 0
+                self._completed = {}
+        return self._completed
+
+    def _save(self) -> None:
+        self.state.write_json(
+            self.STATE_KIND,
+            self._key(),
+            {
+                "run_id": self.run_id,
+                "attempt": self._attempt,
+                "completed": self._load(),
+            },
+        )
@@ -5,11 +5,17 @@ backup.restic.model
 Contains models for restic data.
 """
 
+from collections import deque
 from datetime import datetime
 from enum import IntEnum
+import json
 from pathlib import Path
+import re
 from typing import Any, Optional, Self
 
+from ..bandwidth import BandwidthLimit
+from ..cmd import ResourceUsage
+
 
 class ResticReturnCode(IntEnum):
     """
@@ -21,6 +27,50 @@ class ResticReturnCode(IntEnum):
     RC_OK = RC_REPOSITORY_INITIALIZED = 0
     RC_REPOSITORY_NOT_INITIALIZED = 10
     RC_BAD_REPOSITORY_PASSWORD = 12
+    RC_INTERRUPTED = 130
+
+
+class ResticStatusDigest:
+    """
+    Object summarizing the "status" messages emitted by a restic invocation.
+
+    restic emits status messages several times per second while it works. Rather than
+    keeping every one of them, a digest counts them and retains only the most recent
+    few in their raw, undecoded form. They are decoded only when they are accessed.
+    """
+
+    def __init__(self, max_recent: int = 16) -> None:
+        # The total number of status messages emitted.
+        self.count = 0
+
+        # The total size, in bytes, of all status messages emitted.
+        self.total_bytes = 0
+
+        self._recent: deque[bytes] = deque(maxlen=max_recent)
+
+    def add(self, raw: bytes) -> None:
+        """
+        Adds a raw, JSON-encoded status message to the digest.
+        """
+        self.count += 1
+        self.total_bytes += len(raw)
+        self._recent.append(raw)
+
+    @property
+    def latest(self) -> Optional[dict[str, Any]]:
+        """
+        The most recent status message, or None if no status message was emitted.
+        """
+        if len(self._recent) == 0:
+            return None
+        return json.loads(self._recent[-1])
+
+    @property
+    def recent(self) -> list[dict[str, Any]]:
+        """
+        The most recent status messages, oldest first.
+        """
+        return [json.loads(r) for r in self._recent]
 
 
 class ResticResult:
@@ -35,6 +85,7 @@ class ResticResult:
         full_cmd: list[str],
         returncode: int,
         messages: list[dict[str, Any]],
+        status: Optional[ResticStatusDigest] = None,
     ) -> None:
         # The restic repository that produced the result.
         self.repository = repository
@@ -50,8 +101,23 @@ class ResticResult:
         self.returncode = returncode
 
         # The list of all JSON-encoded messages emitted by restic when the command was run.
+        #
+        # When restic's "status" messages are digested rather than decoded, they are not
+        # included in this list. See `status`.
         self.messages = messages
 
+        # Digest of the "status" messages emitted by restic, if they were not decoded
+        # into messages.
+        if status is None:
+            status = ResticStatusDigest()
+        self.status = status
+
+        # The resources used by the restic process, if they were recorded.
+        self.resource_usage: Optional[ResourceUsage] = None
+
+        # The bandwidth limit restic ran with, if one was set.
+        self.bandwidth_limit: Optional[BandwidthLimit] = None
+
         # The "summary" message. A summary message is not returned by every command. When it
         # is, it contains very useful information.
         self._summary_dict: Optional[dict] = self.find_summary_dict(messages)
@@ -153,6 +219,7 @@ class ResticBackupResult(ResticResult):
         full_cmd: list[str],
         returncode: int,
         messages: list[dict[str, Any]],
+        status: Optional[ResticStatusDigest] = None,
     ) -> None:
         super().__init__(
             repository=repository,
@@ -160,6 +227,7 @@ class ResticBackupResult(ResticResult):
             full_cmd=full_cmd,
             returncode=returncode,
             messages=messages,
+            status=status,
         )
 
         self.summary: Optional[ResticBackupSummary] = None
@@ -212,6 +280,7 @@ class ResticCheckResult(ResticResult):
         full_cmd: list[str],
         returncode: int,
         messages: list[dict[str, Any]],
+        status: Optional[ResticStatusDigest] = None,
     ) -> None:
         super().__init__(
             repository=repository,
@@ -219,6 +288,7 @@ class ResticCheckResult(ResticResult):
             full_cmd=full_cmd,
             returncode=returncode,
             messages=messages,
+            status=status,
         )
 
         self.summary: Optional[ResticCheckSummary] = None
@@ -262,6 +332,7 @@ class ResticForgetResult(ResticResult):
         full_cmd: list[str],
         returncode: int,
         messages: list[dict[str, Any]],
+        status: Optional[ResticStatusDigest] = None,
     ) -> None:
         super().__init__(
             repository=repository,
@@ -269,6 +340,7 @@ class ResticForgetResult(ResticResult):
             full_cmd=full_cmd,
             returncode=returncode,
             messages=messages,
+            status=status,
         )
 
         self.kept_snapshots: list[ResticSnapshot] = list()
@@ -286,6 +358,129 @@ class ResticForgetResult(ResticResult):
                     self.removed_snapshots.append(ResticSnapshot.from_dict(snap_raw))
 
 
+class ResticPruneStats:
+    """
+    Object representing the statistics `restic prune` prints about the repository's
+    data and the data it prunes.
+
+    `restic prune` does not produce JSON output. Its statistics are read from lines of
+    the following form:
+
+        unused:          74 blobs / 1.072 MiB
+        total:        16181 blobs / 39.075 MiB
+        to repack:       69 blobs / 1.078 MiB
+        total prune:     74 blobs / 1.072 MiB
+        remaining:    16107 blobs / 38.003 MiB
+        unused size after prune: 0 B (0.00% of remaining size)
+
+    Sizes are in bytes. A size is None if restic did not print it.
+    """
+
+    LINE_PATTERN = re.compile(
+        r"^\s*(?P<label>[a-z][a-z ]*?):\s+(?:\d+ blobs / )?"
+        r"(?P<size>\d+(?:\.\d+)?) (?P<unit>[KMGTP]?i?B)\b"
+    )
+    UNITS = {
+        "B": 1,
+        "KiB": 1024,
+        "MiB": 1024**2,
+        "GiB": 1024**3,
+        "TiB": 1024**4,
+        "PiB": 1024**5,
+    }
+
+    def __init__(self) -> None:
+        self.sizes: dict[str, int] = dict()
+
+    def add_line(self, line: bytes) -> None:
+        """
+        Reads the statistic on a line of restic's output, if there is one.
+        """
+        m = self.LINE_PATTERN.match(line.decode("utf-8", errors="replace"))
+        if m is None or m.group("unit") not in self.UNITS:
+            return
+
+        size = float(m.group("size")) * self.UNITS[m.group("unit")]
+        self.sizes[m.group("label")] = int(size)
+
+    @property
+    def freed(self) -> Optional[int]:
+        """
+        The amount of data the prune removes from the repository.
+        """
+        return self.sizes.get("total prune", None)
+
+    @property
+    def repacked(self) -> Optional[int]:
+        """
+        The amount of data the prune repacks.
+        """
+        return self.sizes.get("to repack", None)
+
+    @property
+    def total(self) -> Optional[int]:
+        """
+        The amount of data in the repository before the prune.
+        """
+        if "total" in self.sizes:
+            return self.sizes["total"]
+        if "remaining" in self.sizes and self.freed is not None:
+            return self.sizes["remaining"] + self.freed
+        return None
+
+    @property
+    def unused(self) -> Optional[int]:
+        """
+        The amount of data in the repository that no snapshot uses, before the prune.
+        """
+        if "unused" in self.sizes:
+            return self.sizes["unused"]
+        if "unused size after prune" in self.sizes and self.freed is not None:
+            return self.sizes["unused size after prune"] + self.freed
+        return None
+
+    @property
+    def unused_percent(self) -> Optional[float]:
+        """
+        The percentage of the repository's data that no snapshot uses.
+        """
+        unused = self.unused
+        total = self.total
+        if unused is None or total is None:
+            return None
+        if total == 0:
+            return 0.0
+        return unused / total * 100
+
+
+class ResticPruneResult(ResticResult):
+    """
+    Object representing the result of a `restic prune` invocation.
+    """
+
+    def __init__(
+        self,
+        repository: str,
+        cmd: list[str],
+        full_cmd: list[str],
+        returncode: int,
+        messages: list[dict[str, Any]],
+        status: Optional[ResticStatusDigest] = None,
+    ) -> None:
+        super().__init__(
+            repository=repository,
+            cmd=cmd,
+            full_cmd=full_cmd,
+            returncode=returncode,
+            messages=messages,
+            status=status,
+        )
+
+        # The statistics restic printed. Set by the client, since they are not part of
+        # restic's JSON output.
+        self.stats = ResticPruneStats()
+
+
 class ResticSnapshot:
     """
     Object representing an individual restic snapshot.
@@ -303,6 +498,8 @@ class ResticSnapshot:
         id: str,
         short_id: str,
         summary: ResticBackupSummary,
+        tags: Optional[list[str]] = None,
+        original: Optional[str] = None,
     ) -> None:
         self.time = time
         self.parent = parent
@@ -314,6 +511,19 @@ class ResticSnapshot:
         self.id = id
         self.short_id = short_id
         self.summary = summary
+        self.tags = tags if tags is not None else list()
+
+        # If the snapshot was copied from another repository by `restic copy`, the ID
+        # of the snapshot that was originally created by `restic backup`.
+        self.original = original
+
+    @property
+    def origin_id(self) -> str:
+        """
+        The ID of the snapshot this snapshot is a copy of, or its own ID if it is not
+        a copy. A snapshot and all of its copies share the same origin ID.
+        """
+        return self.original if self.original is not None else self.id
 
     @classmethod
     def from_dict(cls, d: dict) -> Self:
@@ -332,9 +542,93 @@ class ResticSnapshot:
             id=d["id"],
             short_id=d["short_id"],
             summary=ResticBackupSummary.from_dict(snapshot_id=d["id"], d=d["summary"]),
+            tags=d.get("tags", None),
+            original=d.get("original", None),
         )
 
 
+# Key identifying a group of snapshots of the same paths with the same tags.
+SnapshotGroupKey = tuple[tuple[Path, ...], tuple[str, ...]]
+
+
+class ResticSnapshotIndex:
+    """
+    Index of restic snapshots by the paths they contain and the host that created them.
+    """
+
+    def __init__(self, snapshots: list[ResticSnapshot]) -> None:
+        self._by_host_paths: dict[tuple[str, tuple[Path, ...]], ResticSnapshot] = dict()
+        self._by_paths: dict[tuple[Path, ...], ResticSnapshot] = dict()
+        self._by_group: dict[SnapshotGroupKey, ResticSnapshot] = dict()
+
+        for s in snapshots:
+            paths = self.paths_key(s.paths)
+            self._keep_latest(self._by_host_paths, (s.hostname, paths), s)
+            self._keep_latest(self._by_paths, paths, s)
+            self._keep_latest(self._by_group, self.group_key(s), s)
+
+    def latest(
+        self, paths: list[Path], host: Optional[str] = None
+    ) -> Optional[ResticSnapshot]:
+        """
+        Returns the latest snapshot of exactly the given paths, or None if there is none.
+
+        If a host is given, the latest snapshot created by that host is preferred. If
+        that host has never created a snapshot of the paths, the latest snapshot created
+        by any host is returned instead.
+        """
+        key = self.paths_key(paths)
+        if host is not None:
+            snapshot = self._by_host_paths.get((host, key), None)
+            if snapshot is not None:
+                return snapshot
+
+        return self._by_paths.get(key, None)
+
+    def latest_by_group(self) -> dict[SnapshotGroupKey, ResticSnapshot]:
+        """
+        Returns the latest snapshot of each group of snapshots with the same paths
+        and tags.
+
+        Snapshots are not grouped by host, since the host that backs up a path may
+        change between runs.
+        """
+        return dict(self._by_group)
+
+    @classmethod
+    def group_key(cls, snapshot: ResticSnapshot) -> SnapshotGroupKey:
+        """
+        Returns a key identifying the group of snapshots the given snapshot belongs to.
+        """
+        return (cls.paths_key(snapshot.paths), tuple(sorted(snapshot.tags)))
+
+    @classmethod
+    def group_label(cls, key: SnapshotGroupKey) -> str:
+        """
+        Returns a human-readable label for a group of snapshots.
+        """
+        paths, tags = key
+        label = ", ".join(str(p) for p in paths)
+        if len(tags) > 0:
+            label += f" [{', '.join(tags)}]"
+        return label
+
+    @classmethod
+    def paths_key(cls, paths: list[Path]) -> tuple[Path, ...]:
+        """
+        Returns a key identifying a set of snapshot paths.
+        """
+        return tuple(sorted(paths))
+
+    @classmethod
+    def _keep_latest(
+        cls, d: dict[Any, ResticSnapshot], key: Any, snapshot: ResticSnapshot
+    ) -> None:
+        existing = d.get(key, None)
+        if existing is None or existing.time < snapshot.time:
+            d[key] = snapshot
+
+
 class ResticSnapshotsResult(ResticResult):
     """
     Object representing the result of a `restic snapshots` invocation.
@@ -347,6 +641,7 @@ class ResticSnapshotsResult(ResticResult):
         full_cmd: list[str],
         returncode: int,
         messages: list[dict[str, Any]],
+        status: Optional[ResticStatusDigest] = None,
     ) -> None:
         super().__init__(
             repository=repository,
@@ -354,6 +649,7 @@ class ResticSnapshotsResult(ResticResult):
             full_cmd=full_cmd,
             returncode=returncode,
             messages=messages,
+            status=status,
         )
 
         self.snapshots: list[ResticSnapshot] = list()
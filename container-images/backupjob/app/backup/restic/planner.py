@@ -0,0 +1,116 @@
+"""
+backup.restic.planner
+=====================
+
+Contains code to plan the order in which the children of a for_each backup run.
+"""
+
+import os
+from pathlib import Path
+import sqlite3
+from typing import Optional
+
+from ..history import ELAPSED, RunHistory
+
+
+class BackupPrediction:
+    """
+    Object representing the predicted duration of the backup of a single child.
+    """
+
+    HISTORY = "history"
+    SIZE_ESTIMATE = "size estimate"
+
+    def __init__(self, path: Path, seconds: float, basis: str) -> None:
+        self.path = path
+        self.seconds = seconds
+
+        # What the prediction is based on; one of HISTORY or SIZE_ESTIMATE.
+        self.basis = basis
+
+    def __repr__(self) -> str:
+        return (
+            f"{self.__class__.__name__}(path={self.path}, seconds={self.seconds}, "
+            f"basis={self.basis})"
+        )
+
+
+class BackupPlanner:
+    """
+    Plans the order in which the children of a for_each backup run.
+
+    Children are ordered longest first, so that a long-running child does not start
+    last and hold up the end of the run while other workers are idle. The duration of
+    a child's backup is predicted from the median time it took over its previous runs.
+    Children without any history are predicted from an estimate of the size of their
+    data.
+    """
+
+    def __init__(self, history: Optional[RunHistory]) -> None:
+        self.history = history
+
+        # Number of previous runs that predictions are based on.
+        self.history_runs = 5
+
+        # Rate in bytes per second at which a child without history is assumed to be
+        # backed up. This assumes that all of the child's data has to be read.
+        self.assumed_throughput = 50e6
+
+        # Maximum number of directory entries that are examined to estimate the size
+        # of a child's data. Larger children are estimated from the entries examined,
+        # which is enough to tell them apart from small ones.
+        self.max_estimate_entries = 100_000
+
+    def order(self, report_name: str, children: list[Path]) -> list[BackupPrediction]:
+        """
+        Returns predictions for the given children of a for_each backup, in the order
+        in which they should be backed up.
+
+        report_name is the name of the for_each backup's report; the history of each
+        child is kept under the name of its subreport.
+        """
+        predictions = [self.predict(f"{report_name} / {p.name}", p) for p in children]
+        return sorted(predictions, key=lambda p: (-p.seconds, p.path.name))
+
+    def predict(self, name: str, path: Path) -> BackupPrediction:
+        """
+        Predicts the duration of the backup of path, whose report has the given name.
+        """
+        if self.history is not None:
+            try:
+                seconds = self.history.median(name, ELAPSED, self.history_runs)
+            except sqlite3.Error:
+                seconds = None
+
+            if seconds is not None:
+                return BackupPrediction(path, seconds, BackupPrediction.HISTORY)
+
+        size = self.estimate_size(path)
+        return BackupPrediction(
+            path, size / self.assumed_throughput, BackupPrediction.SIZE_ESTIMATE
+        )
+
+    def estimate_size(self, path: Path) -> int:
+        """
+        Estimates the size of the data under path from the sizes of up to
+        max_estimate_entries directory entries, without reading any files. Symbolic
+        links are not followed and entries that cannot be read are skipped.
+        """
+        size = 0
+        entries = 0
+        pending = [path]
+        while len(pending) > 0 and entries < self.max_estimate_entries:
+            try:
+                with os.scandir(pending.pop()) as it:
+                    for entry in it:
+                        entries += 1
+                        if entries > self.max_estimate_entries:
+                            break
+                        if entry.is_dir(follow_symlinks=False):
+                            pending.append(Path(entry.path))
+                        elif entry.is_file(follow_symlinks=False):
+                            size += entry.stat(follow_symlinks=False).st_size
+            except OSError:
+                continue
+
+        return size
@@ -0,0 +1,127 @@
+"""
+backup.restic.schedule
+======================
+
+Contains code to schedule partial verification of restic repository data.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+from ..state import StateDirectory
+
+
+class ResticCheckSchedule:
+    """
+    Persistent schedule that rotates `restic check --read-data-subset` through the
+    slices of a repository's data.
+
+    The repository's pack files are split into a fixed number of slices. Each check
+    verifies the next slice, so that the repository's data is fully verified once
+    every `slices` successful checks. A slice whose check fails is checked again by
+    the next run.
+    """
+
+    STATE_KIND = "check-schedule"
+
+    def __init__(self, state: StateDirectory, repository: str, slices: int) -> None:
+        if slices < 1:
+            raise ValueError(f"slices must be at least 1; got {slices}")
+
+        self.state = state
+        self.repository = repository
+        self.slices = slices
+
+        self._loaded = False
+        self._next_slice = 1
+        self._cycle_started: Optional[datetime] = None
+        self._last_full_coverage: Optional[datetime] = None
+
+    @property
+    def cycle_started(self) -> Optional[datetime]:
+        """
+        When the first slice of the current cycle was checked, or None if the next
+        check starts a new cycle.
+        """
+        self._load()
+        return self._cycle_started
+
+    @property
+    def last_full_coverage(self) -> Optional[datetime]:
+        """
+        When the last full cycle over all slices completed, or None if no cycle has
+        completed.
+        """
+        self._load()
+        return self._last_full_coverage
+
+    @property
+    def next_slice(self) -> int:
+        """
+        The 1-based number of the slice the next check verifies.
+        """
+        self._load()
+        return self._next_slice
+
+    def read_data_subset(self) -> str:
+        """
+        Returns the `--read-data-subset` argument for the next check.
+        """
+        return f"{self.next_slice}/{self.slices}"
+
+    def complete(self, now: datetime) -> None:
+        """
+        Records that the next slice was checked successfully at the given time, moving
+        the schedule on to the following slice.
+        """
+        self._load()
+        if self._next_slice == 1:
+            self._cycle_started = now
+
+        if self._next_slice == self.slices:
+            self._next_slice = 1
+            self._cycle_started = None
+            self._last_full_coverage = now
+        else:
+            self._next_slice += 1
+
+        self.save()
+
+    def save(self) -> None:
+        """
+        Persists the schedule.
+        """
+        self._load()
+        self.state.write_json(
+            self.STATE_KIND,
+            self.repository,
+            {
+                "slices": self.slices,
+                "next_slice": self._next_slice,
+                "cycle_started": _isoformat(self._cycle_started),
+                "last_full_coverage": _isoformat(self._last_full_coverage),
+            },
+        )
+
+    def _load(self) -> None:
+        if self._loaded:
+            return
+
+        raw = self.state.read_json(self.STATE_KIND, self.repository, {})
+        self._last_full_coverage = _fromisoformat(raw.get("last_full_coverage", None))
+
+        # If the number of slices changed, the slice boundaries changed as well, so the
+        # current cycle has to start over.
+        if raw.get("slices", None) == self.slices:
+            self._next_slice = raw.get("next_slice", 1)
+            self._cycle_started = _fromisoformat(raw.get("cycle_started", None))
+
+        self._loaded = True
+
+
+def _isoformat(d: Optional[datetime]) -> Optional[str]:
+    return d.isoformat() if d is not None else None
+
+
+def _fromisoformat(s: Optional[str]) -> Optional[datetime]:
+    return datetime.fromisoformat(s) if s is not None else None
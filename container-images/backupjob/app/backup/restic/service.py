@@ -5,10 +5,17 @@ backup.restic.service
 Contains the implementation for the restic service.
 """
 
-from datetime import datetime
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
 from pathlib import Path
-from typing import Optional, Tuple
+from threading import Event, Thread
+import time
+from typing import Generator, Optional, Tuple
 
+from ..metrics import add_resource_usage_fields, add_throughput_fields
+from ..priority import drop_page_cache
+from ..queue import WorkQueue
 from ..report import (
     BackupReport,
     BackupReportField as F,
@@ -16,7 +23,18 @@ from ..report import (
 )
 from .client import ResticClient
 from .error import ResticError
-from .model import ResticCheckResult, ResticResult, ResticReturnCode
+from .fingerprint import FingerprintStore, TreeFingerprint
+from .journal import BackupJournal
+from .planner import BackupPlanner, BackupPrediction
+from .schedule import ResticCheckSchedule
+from .model import (
+    ResticBackupResult,
+    ResticCheckResult,
+    ResticResult,
+    ResticReturnCode,
+    ResticSnapshot,
+    ResticSnapshotIndex,
+)
 
 
 class ResticService:
@@ -27,6 +45,41 @@ class ResticService:
     def __init__(self, client: ResticClient) -> None:
         self.client = client
         self.implicit_exclude_file_name = "backupignore"
+        self.implicit_priority_file_name = "backuppriority"
+
+        # If set, for_each backups record each child as it completes, and skip the
+        # children that completed during earlier attempts at the same run.
+        self.journal: Optional[BackupJournal] = None
+
+        # If set, backups stop starting new work once there is not enough time left
+        # to finish it before the deadline, and restic is interrupted if it is still
+        # running at the deadline.
+        self.deadline: Optional[datetime] = None
+
+        # If set, for_each backups skip invoking restic for children whose
+        # fingerprint has not changed since their last successful backup.
+        self.fingerprints: Optional[FingerprintStore] = None
+
+        # If True, the parent snapshot of each backup is resolved from an index of
+        # the repository's snapshots and passed to restic explicitly.
+        self.resolve_parents = True
+
+        # If set, the children of for_each backups are backed up in the order the
+        # planner chooses rather than in name order.
+        self.planner: Optional[BackupPlanner] = None
+
+        # If set, checks verify a rotating subset of the repository's data rather
+        # than all of it.
+        self.check_schedule: Optional[ResticCheckSchedule] = None
+
+        # If True, the data restic read during each backup is evicted from the page
+        # cache afterwards, so that the backup does not push out the cached data of
+        # other workloads.
+        self.drop_page_cache = False
+
+        # Index of the repository's latest snapshots, used to resolve parent snapshots.
+        # Loaded once at the beginning of each backup.
+        self._snapshot_index: Optional[ResticSnapshotIndex] = None
 
     def backup(
         self,
@@ -35,14 +88,19 @@ class ResticService:
         for_each: bool,
         skip_if_unchanged: bool,
         exclude_files: list[Path],
+        jobs: int = 1,
     ) -> BackupReport:
         """
         Performs a backup of the source directory, performing any required
         repository initialization first.
 
         If for_each is True, runs one backup for each directory and regular
-        file that is a child of the source directory.
+        file that is a child of the source directory. Up to `jobs` of these
+        backups are run concurrently.
         """
+        if jobs < 1:
+            raise ValueError(f"jobs must be at least 1, got {jobs}")
+
         report = BackupReport(name=name)
         report.new_field("Repository", self.client.repository_path, lambda _: None)
         report.new_field("Directory", str(source), lambda _: None)
@@ -61,9 +119,11 @@ class ResticService:
                 report.result = result
                 return report
 
+            self._snapshot_index = self._load_snapshot_index()
+
             if for_each:
                 self._backup_for_each(
-                    source, skip_if_unchanged, exclude_files.copy(), report
+                    source, skip_if_unchanged, exclude_files.copy(), report, jobs
                 )
             else:
                 self._backup_single(
@@ -74,17 +134,126 @@ class ResticService:
         finally:
             end_time.data = datetime.now()
 
+    def backup_queued(
+        self,
+        name: str,
+        source: Path,
+        skip_if_unchanged: bool,
+        exclude_files: list[Path],
+        queue: WorkQueue,
+        run_id: str,
+        coordinator: bool,
+    ) -> BackupReport:
+        """
+        Performs one restic backup for each directory and regular file that is a child
+        of the source directory, sharing the children with other backup processes,
+        e.g. on other nodes, through a work queue.
+
+        The coordinator initializes the repository if necessary and populates the
+        queue with the children in the order in which they should be backed up.
+        Workers wait for the queue to be populated for the given run. The coordinator
+        and the workers then claim children from the queue and back them up until none
+        are left, publishing a subreport for each child to the queue.
+
+        The coordinator waits until every child has been backed up, backing up any
+        children whose worker died, and attaches the subreports of all children to its
+        report. A worker's report only summarizes its own work; it is omittable if the
+        worker's backups succeeded.
+        """
+        report = BackupReport(name=name)
+        report.new_field("Repository", self.client.repository_path, lambda _: None)
+        report.new_field("Directory", str(source), lambda _: None)
+        report.new_field("Worker", queue.worker, lambda _: None)
+        report.new_field("Start Time", datetime.now(), lambda _: None)
+        end_time = report.new_field("End Time", datetime.now(), lambda _: None)
+
+        exclude_files = exclude_files.copy()
+        self._add_implicit_exclude_file(source, exclude_files)
+
+        try:
+            if coordinator:
+                new_backup_repo = report.new_field(
+                    "New Repo", False, lambda x: A.OK if not x else A.WARNING
+                )
+                init_ok = report.new_field(
+                    "Init OK", False, lambda x: A.OK if x else A.ERROR
+                )
+                inited, result = self._init_repo(new_backup_repo, init_ok)
+                if not inited:
+                    report.result = result
+                    return report
+
+                children = sorted(
+                    p for p in source.iterdir() if p.is_file() or p.is_dir()
+                )
+                planned = self._plan(children, report)
+                queue.populate(run_id, [p.name for p, _ in planned])
+            elif not self._wait_for_queue(queue, run_id):
+                report.new_field(
+                    "Error",
+                    f"queue was not populated for run {run_id}",
+                    lambda _: A.ERROR,
+                )
+                return report
+
+            self._snapshot_index = self._load_snapshot_index()
+            subreports = self._work_queue(
+                source, skip_if_unchanged, exclude_files, queue, name
+            )
+            report.new_field("Children Backed Up", len(subreports), lambda _: None)
+
+            if not coordinator:
+                report.successful = all(r.successful for r in subreports)
+                report.omittable = report.successful
+                return report
+
+            while not queue.finished():
+                remaining = self._remaining_seconds()
+                if remaining is not None and remaining <= 0:
+                    break
+
+                time.sleep(queue.poll_interval)
+                queue.requeue_stale(datetime.now())
+                self._work_queue(source, skip_if_unchanged, exclude_files, queue, name)
+
+            self._aggregate_queue(queue, report)
+            return report
+        finally:
+            end_time.data = datetime.now()
+            if self.fingerprints is not None:
+                self.fingerprints.save()
+
     def check(self) -> BackupReport[ResticCheckResult]:
         """
         Performs a restic repository check.
+
+        If a check schedule is set, only the schedule's next subset of the repository's
+        data is verified. Otherwise, all of the repository's data is verified.
         """
         report = BackupReport("Repository Check")
         report.new_field("Repository", self.client.repository_path, lambda _: None)
         report.new_field("Start Time", datetime.now(), lambda _: None)
         end_time = report.new_field("End Time", datetime.now(), lambda _: None)
 
-        result = self.client.check(read_data=True)
+        read_data_subset: Optional[str] = None
+        full_coverage: Optional[F] = None
+        if self.check_schedule is not None:
+            read_data_subset = self.check_schedule.read_data_subset()
+            report.new_field("Data Subset", read_data_subset, lambda _: None)
+            report.new_field(
+                "Cycle Started",
+                self.check_schedule.cycle_started or "(this check)",
+                lambda _: None,
+            )
+            full_coverage = report.new_field(
+                "Last Full Coverage",
+                self.check_schedule.last_full_coverage or "(never)",
+                lambda _: None,
+            )
+
+        result = self.client.check(read_data=True, read_data_subset=read_data_subset)
         report.result = result
+        add_resource_usage_fields(report, result.resource_usage)
 
         if result.returncode != ResticReturnCode.RC_OK:
             report.new_field(
@@ -115,6 +284,9 @@ class ResticService:
 
         if summary.num_errors == 0:
             report.successful = True
+            if self.check_schedule is not None and full_coverage is not None:
+                self.check_schedule.complete(datetime.now())
+                full_coverage.data = self.check_schedule.last_full_coverage or "(never)"
 
         end_time.data = datetime.now()
 
@@ -122,12 +294,18 @@ class ResticService:
 
     def compare_latest_snapshots(self, remote_client: ResticClient) -> BackupReport:
         """
-        Compares the most recent snapshot between the local repository
+        Compares the most recent snapshots between the local repository
         (accessed this service object's ResticClient) and a remote
         repository (accessed via the remote_client).
 
-        The report is successful if the local and remote repositories' latest
-        snapshots are the same.
+        Snapshots are grouped by their paths and tags. The latest local snapshot of
+        each group is compared with the latest remote snapshot of the same group; they
+        match if they are the same snapshot or copies of the same snapshot. A subreport
+        is produced for each group that does not match. Groups that only exist in the
+        remote repository are ignored.
+
+        The report is successful if the local repository has snapshots and the latest
+        snapshot of every group matches.
         """
         report = BackupReport("Snapshot Comparison")
         report.new_field(
@@ -138,20 +316,22 @@ class ResticService:
         )
         report.new_field("Start Time", datetime.now(), lambda _: None)
         end_time = report.new_field("End Time", datetime.now(), lambda _: None)
-        local_snap_result = self.client.snapshots(latest=1)
-        remote_snap_result = remote_client.snapshots(latest=1)
         no_snapshot = "(none)"
 
-        report.result = (local_snap_result, remote_snap_result)
-
-        local_snap_id = no_snapshot
-        if len(local_snap_result.snapshots) > 0:
-            local_snap_id = local_snap_result.snapshots[-1].id
-
-        remote_snap_id = no_snapshot
-        if len(remote_snap_result.snapshots) > 0:
-            remote_snap_id = remote_snap_result.snapshots[-1].id
+        try:
+            local_snapshots, remote_snapshots = self._all_snapshots(
+                self.client, remote_client
+            )
+        except ResticError as e:
+            report.result = e.result
+            report.new_field("Error", str(e), lambda _: A.ERROR)
+            end_time.data = datetime.now()
+            return report
 
+        local_latest = self._latest_snapshot(local_snapshots)
+        remote_latest = self._latest_snapshot(remote_snapshots)
+        local_snap_id = local_latest.id if local_latest is not None else no_snapshot
+        remote_snap_id = remote_latest.id if remote_latest is not None else no_snapshot
         report.new_field(
             "Local Snapshot ID",
             local_snap_id,
@@ -163,7 +343,39 @@ class ResticService:
             lambda x: A.ERROR if local_snap_id == no_snapshot else None,
         )
 
-        if local_snap_id == remote_snap_id and local_snap_id != no_snapshot:
+        local_groups = ResticSnapshotIndex(local_snapshots).latest_by_group()
+        remote_groups = ResticSnapshotIndex(remote_snapshots).latest_by_group()
+        mismatched = 0
+        for key in sorted(local_groups.keys()):
+            local = local_groups[key]
+            remote = remote_groups.get(key, None)
+            if remote is not None and local.origin_id == remote.origin_id:
+                continue
+
+            mismatched += 1
+            label = ResticSnapshotIndex.group_label(key)
+            subreport = BackupReport(f"{report.name} / {label}")
+            subreport.new_field("Paths", label, lambda _: None)
+            subreport.new_field("Local Snapshot ID", local.id, lambda _: None)
+            subreport.new_field("Local Snapshot Time", local.time, lambda _: None)
+            subreport.new_field(
+                "Remote Snapshot ID",
+                remote.id if remote is not None else no_snapshot,
+                lambda _: A.ERROR,
+            )
+            subreport.new_field(
+                "Remote Snapshot Time",
+                remote.time if remote is not None else no_snapshot,
+                lambda _: None,
+            )
+            report.add_subreport(subreport)
+
+        report.new_field("Paths Compared", len(local_groups), lambda _: None)
+        report.new_field(
+            "Mismatched Paths", mismatched, lambda x: A.OK if x == 0 else A.ERROR
+        )
+
+        if local_latest is not None and mismatched == 0:
             report.successful = True
 
         end_time.data = datetime.now()
@@ -179,14 +391,30 @@ class ResticService:
         keep_within_weekly: Optional[str],
         keep_within_monthly: Optional[str],
         keep_within_yearly: Optional[str],
+        prune_threshold: float = 0.0,
+        max_unused: Optional[str] = None,
+        max_repack_size: Optional[str] = None,
+        prune_time_budget: Optional[timedelta] = None,
     ) -> BackupReport:
         """
-        Prunes snapshots and repacks objects in the restic repository.
+        Forgets snapshots in accordance with the retention policy, then prunes and
+        repacks objects in the restic repository if enough of its data is unused.
+
+        Pruning rewrites much of the repository, which is expensive on remote storage.
+        If prune_threshold is above 0, a dry run of the prune first estimates the
+        percentage of the repository's data that is unused, and the repository is only
+        pruned if it is at least prune_threshold. If the estimate cannot be made, the
+        repository is pruned.
+
+        max_unused and max_repack_size are passed to `restic prune`. If a time budget
+        is given, the prune is interrupted once it is used up; the next prune continues
+        where it left off.
         """
         report = BackupReport(name)
 
         report.new_field("Repository", self.client.repository_path, lambda _: None)
         report.new_field("Start Time", datetime.now(), lambda _: None)
+        end_time = report.new_field("End Time", datetime.now(), lambda _: None)
 
         result = self.client.forget(
             keep_last=keep_last,
@@ -195,11 +423,9 @@ class ResticService:
             keep_within_weekly=keep_within_weekly,
             keep_within_monthly=keep_within_monthly,
             keep_within_yearly=keep_within_yearly,
-            prune=True,
-            repack_small=True,
         )
+        report.result = result
 
-        report.new_field("End Time", datetime.now(), lambda _: None)
         num_kept_snapshots = len(result.kept_snapshots)
         num_removed_snapshots = len(result.removed_snapshots)
 
@@ -210,50 +436,609 @@ class ResticService:
             lambda x: A.WARNING if x > 10 else None,
         )
 
-        if result.returncode == ResticReturnCode.RC_OK:
+        if result.returncode != ResticReturnCode.RC_OK:
+            report.new_field("Error", "forget failed", lambda _: A.ERROR)
+            end_time.data = datetime.now()
+            return report
+
+        if prune_threshold > 0 and not self._prune_needed(
+            report, prune_threshold, max_unused, max_repack_size
+        ):
+            report.new_field("Pruned", False, lambda _: None)
+            report.successful = True
+            end_time.data = datetime.now()
+            return report
+
+        prune_start = datetime.now()
+        prune_result = self.client.prune(
+            max_unused=max_unused,
+            max_repack_size=max_repack_size,
+            repack_small=True,
+            timeout=(
+                prune_time_budget.total_seconds()
+                if prune_time_budget is not None
+                else None
+            ),
+        )
+        end_time.data = datetime.now()
+        report.result = prune_result
+
+        report.new_field("Pruned", True, lambda _: None)
+        report.new_field(
+            "Prune Duration (s)",
+            round((end_time.data - prune_start).total_seconds(), 1),
+            lambda _: None,
+        )
+        add_resource_usage_fields(report, prune_result.resource_usage)
+
+        if prune_result.returncode == ResticReturnCode.RC_INTERRUPTED:
+            report.new_field(
+                "Prune Interrupted", "time budget used up", lambda _: A.WARNING
+            )
             report.successful = True
+            return report
+
+        report.new_field("Bytes Repacked", prune_result.stats.repacked, lambda _: None)
+        report.new_field("Bytes Freed", prune_result.stats.freed, lambda _: None)
+
+        if prune_result.returncode == ResticReturnCode.RC_OK:
+            report.successful = True
+        else:
+            report.new_field("Error", "prune failed", lambda _: A.ERROR)
+
+        return report
+
+    def replicate(self, destination: ResticClient) -> BackupReport:
+        """
+        Copies the snapshots of this service's repository that are missing from the
+        destination repository into the destination repository.
+
+        A snapshot is missing if neither it nor a copy of it is in the destination
+        repository. If the destination repository is not initialized, it is
+        initialized with the same chunker parameters as this service's repository so
+        that copied data deduplicates.
+
+        The report is successful if no snapshots are missing from the destination
+        repository once the copy completes.
+        """
+        report = BackupReport("Snapshot Replication")
+        report.new_field(
+            "Source Repository", self.client.repository_path, lambda _: None
+        )
+        report.new_field(
+            "Destination Repository", destination.repository_path, lambda _: None
+        )
+        report.new_field("Start Time", datetime.now(), lambda _: None)
+        end_time = report.new_field("End Time", datetime.now(), lambda _: None)
+
+        try:
+            if not destination.repository_is_initialized():
+                destination.init(copy_chunker_params_from=self.client)
+                report.new_field("Destination Initialized", True, lambda _: None)
+
+            source_snapshots, destination_snapshots = self._all_snapshots(
+                self.client, destination
+            )
+            missing = self._missing_snapshots(source_snapshots, destination_snapshots)
+
+            if len(missing) > 0:
+                result = destination.copy(self.client, [s.id for s in missing])
+                report.result = result
+                if result.returncode != ResticReturnCode.RC_OK:
+                    raise ResticError("failed copying snapshots", result)
+
+                destination_snapshots = destination.all_snapshots()
+        except ResticError as e:
+            report.result = e.result
+            report.new_field("Error", str(e), lambda _: A.ERROR)
+            return report
+        finally:
+            end_time.data = datetime.now()
+
+        still_missing = self._missing_snapshots(missing, destination_snapshots)
+        still_missing_ids = {s.id for s in still_missing}
+        copied = [s for s in missing if s.id not in still_missing_ids]
+        report.new_field("Snapshots Copied", len(copied), lambda _: None)
+        report.new_field(
+            "Copied Snapshot IDs",
+            self._snapshot_id_list(copied),
+            lambda _: None,
+        )
+
+        # restic copy does not report how much data it copied. Each snapshot's
+        # summary records how much data its backup added to the repository, which
+        # approximates the data that copying the snapshot adds.
+        report.new_field(
+            "Bytes Copied (estimated)",
+            sum(s.summary.data_added_packed for s in copied),
+            lambda _: None,
+        )
+        report.new_field(
+            "Snapshots Missing",
+            len(still_missing),
+            lambda x: A.OK if x == 0 else A.ERROR,
+        )
+
+        report.successful = len(still_missing) == 0
 
         return report
 
+    @classmethod
+    def _all_snapshots(
+        cls, a: ResticClient, b: ResticClient
+    ) -> Tuple[list[ResticSnapshot], list[ResticSnapshot]]:
+        """
+        Returns all snapshots of two repositories.
+
+        Both repositories are read at the same time; for remote repositories, most of
+        the time is spent waiting on the network.
+        """
+        with ThreadPoolExecutor(
+            max_workers=2, thread_name_prefix="restic-snapshots"
+        ) as pool:
+            a_future = pool.submit(a.all_snapshots)
+            b_future = pool.submit(b.all_snapshots)
+
+        return a_future.result(), b_future.result()
+
+    @classmethod
+    def _missing_snapshots(
+        cls, source: list[ResticSnapshot], destination: list[ResticSnapshot]
+    ) -> list[ResticSnapshot]:
+        """
+        Returns the snapshots of source that are missing from destination, oldest first.
+        """
+        present = {s.origin_id for s in destination}
+        return sorted(
+            (s for s in source if s.origin_id not in present), key=lambda s: s.time
+        )
+
+    @classmethod
+    def _snapshot_id_list(cls, snapshots: list[ResticSnapshot], limit: int = 10) -> str:
+        """
+        Returns a human-readable list of the short IDs of the given snapshots, listing
+        at most `limit` snapshots.
+        """
+        if len(snapshots) == 0:
+            return "(none)"
+
+        ids = ", ".join(s.short_id for s in snapshots[:limit])
+        if len(snapshots) > limit:
+            ids += f" and {len(snapshots) - limit} more"
+        return ids
+
     def _backup_for_each(
         self,
         source: Path,
         skip_if_unchanged: bool,
         exclude_files: list[Path],
         report: BackupReport,
+        jobs: int,
     ) -> None:
         """
-        Performs one restic backup for each directory inside source.
+        Performs one restic backup for each directory inside source, running up to
+        `jobs` backups concurrently.
+
+        restic takes only a non-exclusive lock on the repository during a backup, so
+        several backups may safely run against the same repository at once.
 
         A subreport is produced for each backed-up directory if there were changes.
+        If a planner is set, backups start in the order it chooses. Subreports are
+        attached in order of the backed-up directories' names, regardless of the order
+        in which the backups start or finish. If the backup of one directory raises an
+        exception, the backups of the others still complete and are reported.
+
+        If a journal is set, directories that were backed up by an earlier attempt at
+        the same run are not backed up again; their subreports from that attempt are
+        attached instead.
         """
         all_subreports: list[BackupReport] = list()
         self._add_implicit_exclude_file(source, exclude_files)
+        pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="restic-backup")
 
         try:
-            for p in source.iterdir():
-                if p.is_file() or p.is_dir():
-                    subreport = BackupReport(f"{report.name} / {p.name}")
-                    all_subreports.append(subreport)
-                    subreport.new_field("Directory", str(p), lambda _: None)
-                    subreport.new_field("Start Time", datetime.now(), lambda _: None)
-                    backup_end = subreport.new_field(
-                        "End Time", datetime.now(), lambda _: None
+            children = sorted(p for p in source.iterdir() if p.is_file() or p.is_dir())
+            futures: dict[Path, Future] = dict()
+            subreports: dict[Path, BackupReport] = dict()
+            resumed = self._resume(report)
+            pending: list[Path] = list()
+
+            for p in children:
+                if p.name in resumed:
+                    subreports[p] = resumed[p.name]
+                    subreports[p].new_field(
+                        "Resumed", "completed by an earlier attempt", lambda _: None
+                    )
+                else:
+                    subreports[p] = BackupReport(f"{report.name} / {p.name}")
+                    pending.append(p)
+                all_subreports.append(subreports[p])
+
+            # Backups start in the planned order. Their subreports are still attached
+            # in name order below.
+            for p, prediction in self._plan(pending, report):
+                if prediction is not None:
+                    subreports[p].new_field(
+                        "Predicted Duration (s)",
+                        round(prediction.seconds, 1),
+                        lambda _: None,
+                    )
+                    subreports[p].new_field(
+                        "Prediction Basis", prediction.basis, lambda _: None
                     )
-                    try:
-                        self._backup_single(
-                            p, skip_if_unchanged, exclude_files.copy(), subreport
-                        )
-                        report.add_subreport(subreport)
-                    finally:
-                        backup_end.data = datetime.now()
+                futures[p] = pool.submit(
+                    self._backup_child,
+                    p,
+                    skip_if_unchanged,
+                    exclude_files.copy(),
+                    subreports[p],
+                    prediction,
+                )
+
+            # Every child's outcome is collected, even if another child's backup
+            # raised, so that the report reflects every backup that ran.
+            for p in children:
+                subreport = subreports[p]
+                try:
+                    if p in futures:
+                        futures[p].result()
+                except Exception as e:
+                    subreport.new_field("Error", str(e), lambda _: A.ERROR)
+                    subreport.successful = False
+                report.add_subreport(subreport)
+
+            deferred = [p.name for p in children if self._deferred(subreports[p])]
+            if len(deferred) > 0:
+                report.new_field("Deferred", ", ".join(deferred), lambda _: A.WARNING)
         except Exception as e:
             report.new_field("Error", str(e), lambda _: None)
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            if self.fingerprints is not None:
+                self.fingerprints.save()
 
         report.successful = (
             all(r.successful for r in all_subreports) and len(all_subreports) > 0
         )
 
+    def _aggregate_queue(self, queue: WorkQueue, report: BackupReport) -> None:
+        """
+        Attaches the subreports every worker published to a queue to the report, in
+        order of the children's names.
+
+        Children that were not backed up, because the deadline passed before their
+        workers finished, are reported as deferred.
+        """
+        results = queue.results()
+        subreports: list[BackupReport] = list()
+        for item in sorted(queue.items()):
+            if item in results:
+                subreport = BackupReport.from_dict(results[item])
+            else:
+                subreport = BackupReport(f"{report.name} / {item}")
+                subreport.new_field(
+                    "Deferred", "not completed before the deadline", lambda _: A.WARNING
+                )
+                subreport.successful = True
+            subreports.append(subreport)
+            report.add_subreport(subreport)
+
+        deferred = [r.name for r in subreports if self._deferred(r)]
+        if len(deferred) > 0:
+            report.new_field("Deferred", ", ".join(deferred), lambda _: A.WARNING)
+
+        report.successful = (
+            all(r.successful for r in subreports) and len(subreports) > 0
+        )
+
+    def _backup_child(
+        self,
+        source: Path,
+        skip_if_unchanged: bool,
+        exclude_files: list[Path],
+        report: BackupReport,
+        prediction: Optional[BackupPrediction] = None,
+    ) -> None:
+        """
+        Performs the backup of a single child of a for_each backup's source directory.
+
+        If a deadline is set and the child's backup is not predicted to finish before
+        it, the backup is deferred to a later run.
+        """
+        report.new_field("Directory", str(source), lambda _: None)
+        start = datetime.now()
+        report.new_field("Start Time", start, lambda _: None)
+        backup_end = report.new_field("End Time", datetime.now(), lambda _: None)
+        try:
+            fingerprint: Optional[TreeFingerprint] = None
+            if self.fingerprints is not None and skip_if_unchanged:
+                fingerprint = self._fingerprint(source, exclude_files)
+                if fingerprint is not None and self._skip_unchanged_fingerprint(
+                    source, fingerprint, report
+                ):
+                    return
+
+            if self._defer(prediction, report):
+                return
+
+            # The fingerprint is taken before restic runs. If the source changes while
+            # restic runs, the recorded fingerprint will not match on the next run.
+            verified = datetime.now()
+            self._backup_single(source, skip_if_unchanged, exclude_files, report)
+
+            if (
+                self.fingerprints is not None
+                and fingerprint is not None
+                and report.successful
+            ):
+                self.fingerprints.record(
+                    source, fingerprint, self._snapshot_id(report), verified
+                )
+        finally:
+            backup_end.data = datetime.now()
+            if self.planner is not None:
+                report.new_field(
+                    "Actual Duration (s)",
+                    round((backup_end.data - start).total_seconds(), 1),
+                    lambda _: None,
+                )
+
+            if (
+                self.journal is not None
+                and report.successful
+                and not self._deferred(report)
+            ):
+                self.journal.record(source.name, report)
+
+    @contextmanager
+    def _claim_heartbeat(self, queue: WorkQueue, item: str) -> Generator[None]:
+        """
+        Refreshes the claim on a queue item in the background for the duration of the
+        block, so that other workers do not consider it stale.
+        """
+        stop = Event()
+
+        def beat() -> None:
+            while not stop.wait(queue.heartbeat_interval):
+                queue.heartbeat(item)
+
+        heartbeat = Thread(target=beat, name="queue-heartbeat", daemon=True)
+        heartbeat.start()
+        try:
+            yield
+        finally:
+            stop.set()
+            heartbeat.join()
+
+    def _defer(
+        self, prediction: Optional[BackupPrediction], report: BackupReport
+    ) -> bool:
+        """
+        Determines whether a child's backup should be deferred because it is not
+        predicted to finish before the deadline. If so, marks the report as deferred.
+
+        Without a prediction, a backup is only deferred once the deadline has passed.
+        """
+        remaining = self._remaining_seconds()
+        if remaining is None:
+            return False
+
+        predicted = prediction.seconds if prediction is not None else 0.0
+        if remaining > predicted:
+            return False
+
+        report.new_field(
+            "Deferred",
+            f"{max(remaining, 0):.0f}s left before the deadline",
+            lambda _: A.WARNING,
+        )
+        report.successful = True
+        return True
+
+    def _deferred(self, report: BackupReport) -> bool:
+        """
+        Determines whether the backup a report describes was deferred.
+        """
+        return report.find_one_field(lambda f: f.label == "Deferred") is not None
+
+    def _wait_for_queue(self, queue: WorkQueue, run_id: str) -> bool:
+        """
+        Waits for the coordinator to populate the queue for the given run.
+
+        Returns False if the queue was not populated within the queue's wait timeout.
+        """
+        waited_until = datetime.now() + queue.wait_timeout
+        while queue.run_id() != run_id:
+            if datetime.now() >= waited_until:
+                return False
+            time.sleep(queue.poll_interval)
+        return True
+
+    def _work_queue(
+        self,
+        source: Path,
+        skip_if_unchanged: bool,
+        exclude_files: list[Path],
+        queue: WorkQueue,
+        report_name: str,
+    ) -> list[BackupReport]:
+        """
+        Claims children of source from the queue and backs them up until none are
+        left, publishing the subreport of each child to the queue.
+
+        Returns the subreports of the children this worker backed up.
+        """
+        subreports: list[BackupReport] = list()
+        while (item := queue.claim()) is not None:
+            subreport = BackupReport(f"{report_name} / {item}")
+            with self._claim_heartbeat(queue, item):
+                try:
+                    self._backup_child(
+                        source / item,
+                        skip_if_unchanged,
+                        exclude_files.copy(),
+                        subreport,
+                    )
+                except Exception as e:
+                    subreport.new_field("Error", str(e), lambda _: A.ERROR)
+                    subreport.successful = False
+
+            subreport.new_field("Worker", queue.worker, lambda _: None)
+            queue.complete(item, subreport.to_dict())
+            subreports.append(subreport)
+
+        return subreports
+
+    def _resume(self, report: BackupReport) -> dict[str, BackupReport]:
+        """
+        Starts a new attempt at the run the journal belongs to, returning the reports
+        of the children that completed during earlier attempts keyed by child name.
+
+        Returns an empty dictionary if no journal is set.
+        """
+        if self.journal is None:
+            return dict()
+
+        self.journal.start()
+        completed = self.journal.completed()
+        report.new_field(
+            "Attempt", self.journal.attempt, lambda x: A.WARNING if x > 1 else None
+        )
+        if len(completed) > 0:
+            report.new_field("Resumed", len(completed), lambda _: None)
+        return completed
+
+    def _plan(
+        self, children: list[Path], report: BackupReport
+    ) -> list[tuple[Path, Optional[BackupPrediction]]]:
+        """
+        Returns the children of a for_each backup in the order in which they should be
+        backed up, along with the predicted duration of each child's backup.
+
+        Children with a higher priority are backed up first. Among children of the
+        same priority, the planner's order is used if a planner is set; otherwise,
+        children are backed up in the given order without predictions.
+
+        The order is added to the report if it was planned or any child has a priority.
+        """
+        planned: list[tuple[Path, Optional[BackupPrediction]]]
+        if self.planner is None:
+            planned = [(p, None) for p in children]
+        else:
+            planned = [(p.path, p) for p in self.planner.order(report.name, children)]
+
+        priorities = {p: self._priority(p) for p in children}
+        planned.sort(key=lambda x: -priorities[x[0]])
+
+        if self.planner is None and all(x == 0 for x in priorities.values()):
+            return planned
+
+        lines: list[str] = list()
+        for p, prediction in planned:
+            line = p.name
+            if priorities[p] != 0:
+                line += f" [priority {priorities[p]}]"
+            if prediction is not None:
+                line += f": {prediction.seconds:.0f}s ({prediction.basis})"
+            lines.append(line)
+
+        report.new_field("Backup Order", "\n".join(lines), lambda _: A.MULTILINE_TEXT)
+        return planned
+
+    def _priority(self, source: Path) -> int:
+        """
+        Returns the priority of a child of a for_each backup's source directory.
+
+        The priority is read from the implicit priority file at the root of the child,
+        which contains a single integer. Children with a higher priority are backed
+        up first. Children without a valid priority file have priority 0.
+        """
+        try:
+            return int((source / self.implicit_priority_file_name).read_text().strip())
+        except (OSError, ValueError):
+            return 0
+
+    def _prune_needed(
+        self,
+        report: BackupReport,
+        prune_threshold: float,
+        max_unused: Optional[str],
+        max_repack_size: Optional[str],
+    ) -> bool:
+        """
+        Estimates the percentage of the repository's data that is unused with a dry
+        run of the prune, adding it to the report. Returns True if the repository
+        should be pruned.
+        """
+        dry_run = self.client.prune(
+            dry_run=True, max_unused=max_unused, max_repack_size=max_repack_size
+        )
+        unused_percent = dry_run.stats.unused_percent
+        if dry_run.returncode != ResticReturnCode.RC_OK or unused_percent is None:
+            report.new_field("Unused Data (%)", "(unknown)", lambda _: A.WARNING)
+            return True
+
+        report.new_field("Unused Data", dry_run.stats.unused, lambda _: None)
+        report.new_field("Unused Data (%)", round(unused_percent, 2), lambda _: None)
+        report.new_field("Prune Threshold (%)", prune_threshold, lambda _: None)
+        return unused_percent >= prune_threshold
+
+    def _remaining_seconds(self) -> Optional[float]:
+        """
+        Returns the number of seconds left before the deadline, or None if no deadline
+        is set. The result is negative if the deadline has passed.
+        """
+        if self.deadline is None:
+            return None
+        return (self.deadline - datetime.now()).total_seconds()
+
+    def _fingerprint(
+        self, source: Path, exclude_files: list[Path]
+    ) -> Optional[TreeFingerprint]:
+        """
+        Computes the fingerprint of a backup source, including the implicit exclude
+        file and any other exclude files.
+
+        Returns None if the fingerprint cannot be computed, e.g. because part of the
+        source is unreadable. restic will report any such problem itself.
+        """
+        extra_files = exclude_files.copy()
+        self._add_implicit_exclude_file(source, extra_files)
+        try:
+            return TreeFingerprint.compute(source, extra_files)
+        except OSError:
+            return None
+
+    def _skip_unchanged_fingerprint(
+        self, source: Path, fingerprint: TreeFingerprint, report: BackupReport
+    ) -> bool:
+        """
+        Determines whether the backup of source can be skipped because its fingerprint
+        is unchanged since its last successful backup. If so, marks the report as a
+        successful, omittable no-op.
+        """
+        assert self.fingerprints is not None
+        if not self.fingerprints.is_unchanged(source, fingerprint, datetime.now()):
+            return False
+
+        record = self.fingerprints.get(source)
+        assert record is not None
+        report.new_field("Skipped", "unchanged fingerprint", lambda _: None)
+        report.new_field("Snapshot ID", record.snapshot_id, lambda _: None)
+        report.omittable = True
+        report.successful = True
+        return True
+
+    @classmethod
+    def _snapshot_id(cls, report: BackupReport) -> Optional[str]:
+        """
+        Returns the ID of the snapshot produced by the backup a report describes.
+        """
+        result = report.result
+        if not isinstance(result, ResticBackupResult) or result.summary is None:
+            return None
+        return result.summary.snapshot_id
+
     def _backup_single(
         self,
         source: Path,
@@ -265,19 +1050,53 @@ class ResticService:
         Performs a single directory backup.
         """
         self._add_implicit_exclude_file(source, exclude_files)
+        parent = self._parent_snapshot(source)
+        report.new_field(
+            "Parent Snapshot",
+            parent.short_id if parent is not None else "(none)",
+            lambda _: None,
+        )
 
         try:
+            remaining = self._remaining_seconds()
             result = self.client.backup(
-                source, skip_if_unchanged, exclude_files=exclude_files
+                source,
+                skip_if_unchanged,
+                exclude_files=exclude_files,
+                parent=parent.id if parent is not None else None,
+                timeout=max(remaining, 0) if remaining is not None else None,
             )
         except Exception as e:  # pragma: nocover
             report.new_field("Error", str(e), lambda x: A.MULTILINE_TEXT)
             return
 
         report.result = result
+        add_resource_usage_fields(report, result.resource_usage)
+        if result.bandwidth_limit is not None:
+            report.new_field(
+                "Bandwidth Limit", result.bandwidth_limit.describe(), lambda _: None
+            )
 
         summary = result.summary
 
+        if self.drop_page_cache:
+            # restic only reads the data of files that changed since the parent
+            # snapshot; without one, it reads every file. If its summary shows that
+            # no file was new or changed, it read no file data at all.
+            dropped = 0
+            if summary is None or summary.files_new + summary.files_changed > 0:
+                since = parent.time if parent is not None else None
+                dropped = drop_page_cache(source, since)
+            report.new_field("Page Cache Dropped (files)", dropped, lambda _: None)
+
+        if result.returncode == ResticReturnCode.RC_INTERRUPTED:
+            report.new_field(
+                "Error",
+                "backup interrupted",
+                lambda _: A.ERROR,
+            )
+            return
+
         if result.returncode != ResticReturnCode.RC_OK:
             report.new_field(
                 "Error",
@@ -314,12 +1133,58 @@ class ResticService:
             snapshot_id,
             lambda x: A.ERROR if x is None else None,
         )
+        add_throughput_fields(
+            report,
+            summary.backup_end - summary.backup_start,
+            summary.total_bytes_processed,
+            summary.total_files_processed,
+        )
 
         if skip_if_unchanged and snapshot_id is None:
             report.omittable = True
 
         report.successful = True
 
+    @classmethod
+    def _latest_snapshot(
+        cls, snapshots: list[ResticSnapshot]
+    ) -> Optional[ResticSnapshot]:
+        """
+        Returns the latest of the given snapshots, or None if there are none.
+        """
+        return max(snapshots, key=lambda s: s.time, default=None)
+
+    def _load_snapshot_index(self) -> Optional[ResticSnapshotIndex]:
+        """
+        Loads an index of the repository's latest snapshots for resolving parents.
+
+        Returns None if parents are not resolved or the snapshots cannot be listed, in
+        which case restic chooses parent snapshots itself.
+        """
+        if not self.resolve_parents:
+            return None
+
+        try:
+            return ResticSnapshotIndex(self.client.all_snapshots())
+        except Exception:
+            return None
+
+    def _parent_snapshot(self, source: Path) -> Optional[ResticSnapshot]:
+        """
+        Returns the snapshot to use as the parent for a backup of source, or None if
+        restic should choose the parent itself.
+
+        The latest snapshot of the source created by this client's host is preferred.
+        Otherwise, the latest snapshot of the source created by any host is used. This
+        lets a backup use the snapshots of a previous run as its parent even if the host
+        name changed between runs.
+        """
+        if self._snapshot_index is None:
+            return None
+
+        # restic records the absolute path of a backup's target in its snapshots.
+        return self._snapshot_index.latest([source.absolute()], self.client.host)
+
     def _add_implicit_exclude_file(
         self, source: Path, exclude_files: list[Path]
     ) -> None:
@@ -0,0 +1,69 @@
+"""
+backup.state
+============
+
+Contains code to persist application state between backup runs.
+"""
+
+from hashlib import sha256
+import json
+import os
+from pathlib import Path
+from tempfile import mkstemp
+from typing import Any
+
+
+class StateDirectory:
+    """
+    Directory in which the backup application persists state between runs.
+
+    State is kept in files named after the kind of state and a key, such as the
+    restic repository the state belongs to. Keys are hashed so that arbitrary
+    strings (e.g. S3 URLs) can be used.
+    """
+
+    def __init__(self, root: Path) -> None:
+        self.root = root
+
+    def path(self, kind: str, key: str, suffix: str = ".json") -> Path:
+        """
+        Returns the path to the state file of the given kind for the given key.
+        """
+        key_hash = sha256(key.encode("utf-8")).hexdigest()[:16]
+        return self.root / f"{kind}-{key_hash}{suffix}"
+
+    def read_json(self, kind: str, key: str, default: Any) -> Any:
+        """
+        Reads the JSON state file of the given kind for the given key.
+
+        Returns default if the state file does not exist or cannot be decoded.
+        """
+        try:
+            with open(self.path(kind, key), "r") as f:
+                return json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            return default
+
+    def write_json(self, kind: str, key: str, data: Any) -> None:
+        """
+        Atomically writes the JSON state file of the given kind for the given key.
+        """
+        write_json_atomic(self.path(kind, key), data)
+
+
+def write_json_atomic(path: Path, data: Any) -> None:
+    """
+    Writes data as JSON to path, replacing any existing file atomically.
+
+    Readers see either the previous contents of the file or the new contents, never
+    a partially-written file.
+    """
+    path.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = mkstemp(prefix=f".{path.name}.", dir=path.parent)
+    try:
+        with os.fdopen(fd, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp, path)
+    except BaseException:
+        os.unlink(tmp)
+        raise
@@ -0,0 +1,300 @@
+"""
+backup.tuning
+=============
+
+Contains code to tune restic and rclone to the resource limits of the container.
+"""
+
+from copy import copy
+from math import ceil
+import os
+from pathlib import Path
+from typing import Optional, Self
+
+from .metrics import MIB
+
+
+class CgroupLimits:
+    """
+    Object representing the CPU and memory limits of a cgroup v2 control group.
+    """
+
+    def __init__(self, cpus: Optional[float], memory: Optional[int]) -> None:
+        # Number of CPUs the control group may use, derived from its CPU quota, or
+        # None if it is not limited.
+        self.cpus = cpus
+
+        # Maximum memory the control group may use in bytes, or None if it is not
+        # limited.
+        self.memory = memory
+
+    def __repr__(self) -> str:
+        return f"{self.__class__.__name__}(cpus={self.cpus}, memory={self.memory})"
+
+    @classmethod
+    def read(
+        cls,
+        root: Path = Path("/sys/fs/cgroup"),
+        proc_cgroup: Path = Path("/proc/self/cgroup"),
+    ) -> Self:
+        """
+        Returns the limits of the control group of the current process.
+
+        The limits of a control group's ancestors also apply to it, so the tightest
+        limit between the process's control group and the root is returned. Limits
+        that cannot be read are considered unlimited.
+        """
+        cpus: Optional[float] = None
+        memory: Optional[int] = None
+        for d in cls._hierarchy(root, proc_cgroup):
+            c = cls._read_cpus(d / "cpu.max")
+            if c is not None and (cpus is None or c < cpus):
+                cpus = c
+
+            m = cls._read_memory(d / "memory.max")
+            if m is not None and (memory is None or m < memory):
+                memory = m
+
+        return cls(cpus, memory)
+
+    @classmethod
+    def _hierarchy(cls, root: Path, proc_cgroup: Path) -> list[Path]:
+        """
+        Returns the directories of the process's control group and its ancestors.
+        """
+        cgroup = "/"
+        try:
+            for line in proc_cgroup.read_text().splitlines():
+                # On cgroup v2, the process's only entry is of the form "0::/path".
+                if line.startswith("0::"):
+                    cgroup = line.removeprefix("0::")
+        except OSError:
+            pass
+
+        # In a container with its own cgroup namespace, the process's control group
+        # is mounted at the root and its path is reported as "/".
+        d = root / cgroup.lstrip("/")
+        if not d.is_dir():
+            d = root
+
+        hierarchy = [d]
+        while d != root and root in d.parents:
+            d = d.parent
+            hierarchy.append(d)
+        return hierarchy
+
+    @classmethod
+    def _read_cpus(cls, path: Path) -> Optional[float]:
+        # cpu.max holds "$MAX $PERIOD", where $MAX is "max" if there is no quota.
+        try:
+            quota, period = path.read_text().split()
+            if quota == "max":
+                return None
+            return int(quota) / int(period)
+        except (OSError, ValueError):
+            return None
+
+    @classmethod
+    def _read_memory(cls, path: Path) -> Optional[int]:
+        try:
+            value = path.read_text().strip()
+            return None if value == "max" else int(value)
+        except (OSError, ValueError):
+            return None
+
+
+class RuntimeTuning:
+    """
+    Settings for restic and rclone derived from the container's resource limits.
+
+    restic and rclone are Go programs. The Go runtime sizes its scheduler from the
+    number of CPUs on the host rather than from the container's CPU quota, which
+    leads to heavy throttling, and it does not collect garbage any sooner when it
+    approaches the container's memory limit. GOMAXPROCS and GOMEMLIMIT are set to
+    match the limits instead.
+
+    The concurrency of restic and rclone is scaled with the number of CPUs and capped
+    so that the memory buffered by concurrent uploads fits within the memory limit.
+    Without a limit, it is sized from the host's CPUs and memory instead; the Go
+    runtime is only tuned to limits, as it already sizes itself from the host.
+
+    If several restic or rclone processes run at the same time, e.g. to back up
+    several directories concurrently, the limits are shared evenly between them, so
+    that each process is tuned to its share.
+
+    Settings are None if they are left to restic, rclone, or the Go runtime to choose.
+    """
+
+    def __init__(self, limits: CgroupLimits, processes: int = 1) -> None:
+        if processes < 1:
+            raise ValueError(f"processes must be at least 1; got {processes}")
+
+        self.limits = limits
+
+        # Number of processes that share the limits.
+        self.processes = processes
+
+        # Number of CPUs and bytes of memory of the host, used in place of limits
+        # that are not set, or None if they are not known.
+        self.host_cpus: Optional[int] = os.cpu_count()
+        self.host_memory: Optional[int] = host_memory()
+
+        # Share of the memory limit that the Go heap is allowed to use. The rest is
+        # left for memory the Go runtime does not manage, and for this process.
+        self.memory_fraction = 0.8
+
+        # Memory buffered by a single concurrent upload; a restic pack file or an
+        # rclone multipart upload chunk along with its read buffer.
+        self.upload_memory = 64 * MIB
+
+        self.max_read_concurrency = 8
+        self.max_connections = 16
+        self.max_transfers = 16
+        self.max_checkers = 32
+
+        # Range of the size of the chunks rclone uploads to S3. Larger chunks need
+        # fewer requests, but are buffered in memory by every concurrent upload.
+        self.min_s3_chunk_size = 5 * MIB
+        self.max_s3_chunk_size = 64 * MIB
+
+    @property
+    def checkers(self) -> Optional[int]:
+        """
+        Number of files rclone checks concurrently.
+        """
+        if self.cpus is None:
+            return None
+        return min(4 * self.cpus, self.max_checkers)
+
+    @property
+    def cpus(self) -> Optional[int]:
+        """
+        Number of CPUs available to each process, rounded up.
+        """
+        cpus = self.limits.cpus if self.limits.cpus is not None else self.host_cpus
+        if cpus is None:
+            return None
+        return max(ceil(cpus / self.processes), 1)
+
+    @property
+    def gomaxprocs(self) -> Optional[int]:
+        """
+        Maximum number of threads that run Go code simultaneously.
+        """
+        if self.limits.cpus is None:
+            return None
+        return self.cpus
+
+    @property
+    def gomemlimit(self) -> Optional[int]:
+        """
+        Soft memory limit of the Go runtime of each process, in bytes.
+        """
+        if self.limits.memory is None:
+            return None
+        return self.memory
+
+    @property
+    def memory(self) -> Optional[int]:
+        """
+        Memory each process may use for its heap, in bytes.
+        """
+        memory = self.limits.memory
+        if memory is None:
+            memory = self.host_memory
+        if memory is None:
+            return None
+        return int(memory * self.memory_fraction / self.processes)
+
+    @property
+    def read_concurrency(self) -> Optional[int]:
+        """
+        Number of files restic reads concurrently during a backup.
+        """
+        if self.cpus is None:
+            return None
+        return min(max(self.cpus, 2), self.max_read_concurrency)
+
+    @property
+    def s3_connections(self) -> Optional[int]:
+        """
+        Number of concurrent connections restic makes to an S3 repository.
+        """
+        return self._uploads(2, 5, self.max_connections)
+
+    @property
+    def s3_upload_concurrency(self) -> Optional[int]:
+        """
+        Number of chunks of a single file rclone uploads to S3 concurrently.
+        """
+        if self.cpus is None:
+            return None
+        return min(max(self.cpus, 2), 8)
+
+    @property
+    def transfers(self) -> Optional[int]:
+        """
+        Number of files rclone transfers concurrently.
+        """
+        return self._uploads(2, 4, self.max_transfers)
+
+    def share(self, processes: int) -> Self:
+        """
+        Returns tuning for each of the given number of processes sharing this
+        tuning's share of the limits.
+        """
+        tuning = copy(self)
+        tuning.processes = self.processes * processes
+        return tuning
+
+    def go_env(self, environ: dict[str, str]) -> dict[str, str]:
+        """
+        Returns the environment variables that tune the Go runtime.
+
+        Variables that are already set in environ are not overridden.
+        """
+        env: dict[str, str] = dict()
+        if self.gomaxprocs is not None:
+            env["GOMAXPROCS"] = str(self.gomaxprocs)
+        if self.gomemlimit is not None:
+            env["GOMEMLIMIT"] = f"{self.gomemlimit // MIB}MiB"
+        return {k: v for k, v in env.items() if k not in environ}
+
+    def s3_chunk_size(
+        self, transfers: Optional[int], concurrency: Optional[int]
+    ) -> Optional[int]:
+        """
+        Size in bytes of the chunks rclone uploads to S3, sized so that the chunks
+        buffered by the given number of transfers, each uploading the given number of
+        chunks concurrently, fit within the memory limit.
+        """
+        if self.memory is None or transfers is None or concurrency is None:
+            return None
+
+        size = self.memory // (transfers * concurrency)
+        size = min(max(size, self.min_s3_chunk_size), self.max_s3_chunk_size)
+        # Chunk sizes are passed to rclone in whole MiB.
+        return size // MIB * MIB
+
+    def _uploads(self, per_cpu: int, default: int, maximum: int) -> Optional[int]:
+        """
+        Returns the number of concurrent uploads for each process's share of the
+        limits, given the number of uploads per CPU and the number used if CPUs are not limited.
+        """
+        if self.cpus is None and self.memory is None:
+            return None
+
+        uploads = default if self.cpus is None else per_cpu * self.cpus
+        if self.memory is not None:
+            uploads = min(uploads, self.memory // self.upload_memory)
+        return min(max(uploads, 1), maximum)
+
+
+def host_memory() -> Optional[int]:
+    """
+    Returns the physical memory of the host in bytes, or None if it is not known.
+    """
+    try:
+        return os.sysconf("SC_PHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError):
+        return None
@@ -0,0 +1,113 @@
+"""
+Tests the ChecksumCache class.
+"""
+
+from hashlib import md5
+from io import StringIO
+import os
+from pathlib import Path
+import sqlite3
+
+from backup.rclone.hashcache import ChecksumCache
+
+
+def test_update(tmp_path: Path) -> None:
+    """
+    Tests that every file's checksum is written in md5sum format, and that a second
+    update hashes nothing.
+    """
+    source = tmp_path / "source"
+    (source / "d").mkdir(parents=True)
+    (source / "a").write_bytes(b"a" * 100)
+    (source / "d" / "b").write_bytes(b"b" * 50)
+    cache = ChecksumCache(tmp_path / "state" / "checksums.db")
+
+    sums = StringIO()
+    stats = cache.update(source, sums)
+
+    assert sorted(sums.getvalue().splitlines()) == [
+        f"{md5(b'a' * 100).hexdigest()}  a",
+        f"{md5(b'b' * 50).hexdigest()}  d/b",
+    ]
+    assert (stats.hits, stats.misses, stats.bytes_hashed) == (0, 2, 150)
+    assert stats.hit_rate == 0
+
+    sums = StringIO()
+    stats = cache.update(source, sums)
+
+    assert len(sums.getvalue().splitlines()) == 2
+    assert (stats.hits, stats.misses, stats.bytes_skipped) == (2, 0, 150)
+    assert stats.hit_rate == 1
+
+
+def test_update_changed(tmp_path: Path) -> None:
+    """
+    Tests that a modified file is hashed again, and that deleted files are removed
+    from the cache.
+    """
+    (tmp_path / "a").write_bytes(b"old")
+    (tmp_path / "b").write_bytes(b"b")
+    (tmp_path / "c").write_bytes(b"c")
+    cache = ChecksumCache(tmp_path.parent / f"{tmp_path.name}.db")
+    cache.update(tmp_path, StringIO())
+
+    (tmp_path / "a").write_bytes(b"new")
+    # Ensures the modification is detected on filesystems with coarse timestamps.
+    os.utime(tmp_path / "a", ns=(0, 0))
+    (tmp_path / "c").unlink()
+
+    sums = StringIO()
+    stats = cache.update(tmp_path, sums)
+
+    assert f"{md5(b'new').hexdigest()}  a\n" in sums.getvalue()
+    assert (stats.hits, stats.misses) == (1, 1)
+    with sqlite3.connect(cache.path) as db:
+        paths = db.execute("SELECT path FROM files ORDER BY path").fetchall()
+    assert paths == [("a",), ("b",)]
+
+
+def test_update_unsupported_name(tmp_path: Path) -> None:
+    """
+    Tests that files whose names cannot be written in md5sum format are left out.
+    """
+    (tmp_path / "line\nbreak").touch()
+    (tmp_path / "ok").touch()
+    cache = ChecksumCache(tmp_path.parent / f"{tmp_path.name}.db")
+
+    sums = StringIO()
+    stats = cache.update(tmp_path, sums)
+
+    assert sums.getvalue().endswith("  ok\n")
+    assert len(sums.getvalue().splitlines()) == 1
+    assert stats.hit_rate == 0
+
+
+def test_update_writes_changed_rows(tmp_path: Path) -> None:
+    """
+    Tests that only the rows of changed files are written, in batches.
+    """
+    for name in ("a", "b", "c"):
+        (tmp_path / name).write_bytes(name.encode("utf-8"))
+    cache = ChecksumCache(tmp_path.parent / f"{tmp_path.name}.db")
+    cache.batch_size = 1
+    cache.update(tmp_path, StringIO())
+
+    with sqlite3.connect(cache.path) as db:
+        db.executescript(
+            "CREATE TABLE writes (path TEXT);"
+            "CREATE TRIGGER files_written AFTER INSERT ON files "
+            "BEGIN INSERT INTO writes VALUES (NEW.path); END;"
+        )
+    (tmp_path / "b").write_bytes(b"new")
+    os.utime(tmp_path / "b", ns=(0, 0))
+
+    sums = StringIO()
+    stats = cache.update(tmp_path, sums)
+
+    assert (stats.hits, stats.misses) == (2, 1)
+    assert len(sums.getvalue().splitlines()) == 3
+    with sqlite3.connect(cache.path) as db:
+        writes = db.execute("SELECT path FROM writes").fetchall()
+        paths = db.execute("SELECT path FROM files ORDER BY path").fetchall()
+    assert writes == [("b",)]
+    assert paths == [("a",), ("b",), ("c",)]
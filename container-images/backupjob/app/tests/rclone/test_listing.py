@@ -0,0 +1,35 @@
+"""
+Tests the ListingEstimate class.
+"""
+
+from pathlib import Path
+
+from backup.rclone.listing import ListingEstimate
+
+
+def test_walk(tmp_path: Path) -> None:
+    """
+    Tests that objects and directory entries are counted from the source tree.
+    """
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    for i in range(3):
+        (tmp_path / "a" / f"{i}").touch()
+    (tmp_path / "x").touch()
+
+    estimate = ListingEstimate.walk(tmp_path)
+
+    assert estimate.objects == 4
+    assert sorted(estimate.directory_entries) == [0, 2, 4]
+
+
+def test_requests() -> None:
+    """
+    Tests that --fast-list needs requests for pages of objects only, while listing
+    each directory needs at least one request per directory.
+    """
+    estimate = ListingEstimate(2500, [1, 1, 1, 2497, 0])
+
+    assert estimate.requests(fast_list=True) == 3
+    assert estimate.requests(fast_list=False) == 7
+    assert estimate.fast_list_memory == 2500 * 1024
+    assert ListingEstimate(0, [0]).requests(fast_list=True) == 1
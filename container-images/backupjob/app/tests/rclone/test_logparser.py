@@ -0,0 +1,82 @@
+"""
+Tests the RcloneLog class.
+"""
+
+import json
+
+from backup.rclone.logparser import RcloneLog
+
+
+def line(**message: object) -> bytes:
+    return json.dumps(message).encode("utf-8")
+
+
+def test_feed() -> None:
+    """
+    Tests that file events are counted and sampled, that other messages are kept,
+    and that only the latest statistics are kept.
+    """
+    log = RcloneLog(max_samples=2)
+    for i in range(3):
+        log.feed(line(level="info", msg="Copied (new)", object=f"f{i}"))
+    log.feed(line(level="info", msg="Deleted", object="old"))
+    log.feed(line(level="error", msg="Failed to copy", object="bad"))
+    log.feed(line(level="info", msg="stats", stats={"bytes": 1}))
+    log.feed(line(level="notice", msg="Nothing to do"))
+    log.feed(line(level="info", msg="stats", stats={"bytes": 2}))
+    log.feed(b"")
+
+    assert log.file_events == {"Copied (new)": 3, "Deleted": 1}
+    assert [s["object"] for s in log.samples] == ["f0", "f1"]
+    assert [m["msg"] for m in log.messages] == [
+        "Failed to copy",
+        "Nothing to do",
+        "stats",
+    ]
+    assert log.messages[-1]["stats"] == {"bytes": 2}
+    assert log.unparsed_count == 0
+
+
+def test_feed_unparsed() -> None:
+    """
+    Tests that lines that are not JSON objects are counted and the first are kept.
+    """
+    log = RcloneLog(max_unparsed=2)
+    for text in [b"panic: runtime error", b"goroutine 1", b"[1, 2]", b'{"level":']:
+        log.feed(text)
+    log.feed(line(level="info", msg="stats", stats={"bytes": 0}))
+
+    assert log.unparsed_count == 4
+    assert log.unparsed == ["panic: runtime error", "goroutine 1"]
+    assert log.messages == [{"level": "info", "msg": "stats", "stats": {"bytes": 0}}]
+
+
+def test_feed_bounded() -> None:
+    """
+    Tests that messages beyond max_messages are dropped.
+    """
+    log = RcloneLog(max_messages=2)
+    for i in range(5):
+        log.feed(line(level="error", msg=f"error {i}"))
+
+    assert [m["msg"] for m in log.messages] == ["error 0", "error 1"]
+    assert log.dropped == 3
+
+
+def test_combine() -> None:
+    """
+    Tests that the logs of several commands are combined within the limits.
+    """
+    a = RcloneLog(max_samples=1)
+    a.feed(line(level="info", msg="Copied (new)", object="a"))
+    a.feed(b"stray")
+    b = RcloneLog()
+    b.feed(line(level="info", msg="Copied (new)", object="b"))
+    b.feed(line(level="info", msg="Deleted", object="c"))
+
+    combined = RcloneLog.combine([a, b])
+
+    assert combined.file_events == {"Copied (new)": 2, "Deleted": 1}
+    assert [s["object"] for s in combined.samples] == ["a"]
+    assert combined.unparsed == ["stray"]
+    assert combined.stats is None
@@ -0,0 +1,161 @@
+"""
+Tests the RcloneDaemon and RcloneRcdClient classes.
+"""
+
+from datetime import timedelta
+from pathlib import Path
+import subprocess
+from threading import Thread
+from typing import Any, Optional
+
+import pytest
+
+from backup.bandwidth import BandwidthSchedule
+from backup.cmd import cmdexec
+from backup.rclone.model import RcloneReturnCode
+from backup.rclone.rcd import RcloneDaemon, RcloneRcError, RcloneRcdClient
+
+from testlib.cmd import MockCommandExecutor
+
+
+class FakeDaemon:
+    """
+    Stands in for an RcloneDaemon, answering calls with canned outputs.
+    """
+
+    def __init__(self, outputs: dict[str, list[dict]]) -> None:
+        self.outputs = outputs
+        self.calls: list[tuple[str, dict]] = list()
+
+    def call(self, method: str, params: Optional[dict[str, Any]] = None) -> dict:
+        self.calls.append((method, params or {}))
+        outputs = self.outputs[method]
+        return outputs.pop(0) if len(outputs) > 1 else outputs[0]
+
+    def stop(self) -> None:
+        pass
+
+
+def test_daemon_start(mock_cmd_executor: MockCommandExecutor) -> None:
+    """
+    Tests that the address of the API is taken from rclone's log, and that rclone is
+    not given the password.
+    """
+    msg = "Serving remote control on http://127.0.0.1:40123/"
+    mock_cmd_executor.set_result_json_messages(0, [{"level": "notice", "msg": msg}])
+    daemon = RcloneDaemon(mock_cmd_executor, ["--checksum"])
+
+    daemon.start()
+    daemon.stop()
+
+    cmd = mock_cmd_executor.invoked_commands[-1].cmd
+    assert daemon.url is None
+    assert cmd[:3] == ["rclone", "rcd", "--rc-addr"]
+    assert cmd[-1] == "--checksum"
+    assert "--rc-htpasswd" in cmd
+    assert not any(daemon._password in c for c in cmd)
+
+
+def test_daemon_start_failed(mock_cmd_executor: MockCommandExecutor) -> None:
+    """
+    Tests that rclone's output is reported if it exits without listening.
+    """
+    mock_cmd_executor.set_result(1, b"Fatal error: bad flag\n", None)
+    daemon = RcloneDaemon(mock_cmd_executor, [])
+
+    with pytest.raises(RcloneRcError, match="Fatal error: bad flag"):
+        daemon.start()
+
+
+def test_daemon_stop_kills(monkeypatch: pytest.MonkeyPatch) -> None:
+    """
+    Tests that rclone is killed if it cannot be asked to quit.
+    """
+    proc = subprocess.Popen(["sleep", "60"])
+    daemon = RcloneDaemon(MockCommandExecutor(), [])
+
+    def run() -> None:
+        daemon._proc = subprocess.CompletedProcess(["sleep"], proc.wait())
+
+    def call(method: str, params: Optional[dict[str, Any]] = None) -> dict:
+        raise RcloneRcError(f"{method}: connection refused")
+
+    monkeypatch.setattr(daemon, "call", call)
+    daemon.url = "http://127.0.0.1:40123"
+    daemon._pid = proc.pid
+    daemon._thread = Thread(target=run)
+    daemon._thread.start()
+
+    daemon.stop()
+
+    assert not daemon.running
+    assert proc.returncode == -9
+
+
+def test_sync(mock_cmd_executor: MockCommandExecutor) -> None:
+    """
+    Tests that a sync is submitted as a job, and that its result is built from the
+    job's status and statistics.
+    """
+    stats = {"bytes": 10, "deletes": 1, "errors": 0, "transfers": 2}
+    daemon = FakeDaemon(
+        {
+            "core/bwlimit": [{}],
+            "sync/sync": [{"jobid": 7}],
+            "job/status": [
+                {"finished": False},
+                {"finished": True, "success": False, "error": "max duration reached"},
+            ],
+            "core/stats": [stats],
+        }
+    )
+    client = RcloneRcdClient(mock_cmd_executor)
+    client.daemon = daemon  # type: ignore
+    client.poll_interval = 0
+    client.bandwidth = BandwidthSchedule.parse("08:00,1M")
+
+    result = client.sync("/src", "s3:bucket", timedelta(minutes=1), exclude=["/big/**"])
+
+    assert daemon.calls[0] == ("core/bwlimit", {"rate": "08:00,1M"})
+    assert daemon.calls[1] == (
+        "sync/sync",
+        {
+            "srcFs": "/src",
+            "dstFs": "s3:bucket",
+            "_async": True,
+            "_config": {"MaxDuration": 60 * 10**9},
+            "_filter": {"ExcludeRule": ["/big/**"]},
+        },
+    )
+    assert ("core/stats", {"group": "job/7"}) in daemon.calls
+    assert len([c for c in daemon.calls if c[0] == "job/status"]) == 2
+    assert result.returncode == RcloneReturnCode.RC_DURATION_EXCEEDED
+    assert result.stats.bytes == 10
+    assert result.stats.transfers == 2
+    assert mock_cmd_executor.invoked_commands == []
+
+
+def test_sync_local(rclone_source_dir: Path, rclone_destination_dir: Path) -> None:
+    """
+    Tests that several syncs run through the same rclone rcd process.
+    """
+    (rclone_source_dir / "a").write_bytes(b"a")
+    (rclone_destination_dir / "stale").write_bytes(b"x")
+    client = RcloneRcdClient(cmdexec)
+    client.poll_interval = 0.1
+
+    try:
+        first = client.sync(str(rclone_source_dir), str(rclone_destination_dir))
+        daemon = client.daemon
+        (rclone_source_dir / "b").write_bytes(b"bb")
+        second = client.sync(str(rclone_source_dir), str(rclone_destination_dir))
+    finally:
+        client.close()
+
+    assert client.daemon is None and daemon is not None
+    assert (first.stats.transfers, first.stats.deletes) == (1, 1)
+    assert (second.stats.transfers, second.stats.bytes) == (1, 2)
+    assert sorted(p.name for p in Path(rclone_destination_dir).iterdir()) == [
+        "a",
+        "b",
+    ]
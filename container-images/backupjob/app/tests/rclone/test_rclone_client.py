@@ -2,8 +2,10 @@
 Tests the RcloneClient class.
 """
 
+from datetime import timedelta
 from pathlib import Path
 
+from backup.bandwidth import BandwidthLimit, BandwidthSchedule
 from backup.rclone import RcloneClient
 
 from testlib.cmd import MockCommandExecutor
@@ -162,3 +164,133 @@ class TestRcloneClientMockCommandExecutor:
         assert sync_result.stats.deletes == 0
         assert sync_result.stats.errors == 0
         assert sync_result.stats.transfers == 8
+
+    def test_sync_max_duration(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+        rclone_destination_dir: Path,
+    ) -> None:
+        """
+        Tests that a sync with a maximum duration passes it to rclone.
+        """
+        mock_cmd_executor.set_result_json_messages(
+            10, [{"level": "info", "msg": "stats", "stats": {"bytes": 0}}]
+        )
+
+        rclone_client_mock_cmd.sync(
+            str(rclone_source_dir),
+            str(rclone_destination_dir),
+            max_duration=timedelta(minutes=5, seconds=0.5),
+        )
+
+        cmd = mock_cmd_executor.invoked_commands[-1].cmd
+        assert cmd[-4:] == [
+            "--max-duration",
+            "300s",
+            str(rclone_source_dir),
+            str(rclone_destination_dir),
+        ]
+
+    def test_sync_tuned(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+        rclone_destination_dir: Path,
+    ) -> None:
+        """
+        Tests that tuned settings are passed to rclone.
+        """
+        rclone_client_mock_cmd.env = {"GOMEMLIMIT": "800MiB"}
+        rclone_client_mock_cmd.transfers = 4
+        rclone_client_mock_cmd.checkers = 8
+        mock_cmd_executor.set_result_json_messages(
+            0, [{"level": "info", "msg": "stats", "stats": {"bytes": 0}}]
+        )
+
+        rclone_client_mock_cmd.sync(str(rclone_source_dir), str(rclone_destination_dir))
+
+        invoked = mock_cmd_executor.invoked_commands[-1]
+        assert invoked.env == {"GOMEMLIMIT": "800MiB"}
+        assert invoked.cmd[-6:-2] == ["--transfers", "4", "--checkers", "8"]
+
+    def test_sync_bandwidth(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+        rclone_destination_dir: Path,
+    ) -> None:
+        """
+        Tests that rclone is given the bandwidth timetable, and that the limit in
+        effect when the sync starts is recorded on the result.
+        """
+        rclone_client_mock_cmd.bandwidth = BandwidthSchedule.parse("00:00,1M")
+        mock_cmd_executor.set_result_json_messages(
+            0, [{"level": "info", "msg": "stats", "stats": {"bytes": 0}}]
+        )
+
+        result = rclone_client_mock_cmd.sync(
+            str(rclone_source_dir), str(rclone_destination_dir)
+        )
+
+        cmd = mock_cmd_executor.invoked_commands[-1].cmd
+        assert cmd[-4:-2] == ["--bwlimit", "00:00,1M"]
+        assert result.bandwidth_limit == BandwidthLimit(1024 * 1024, 1024 * 1024)
+
+    def test_transfer_args(self, rclone_client_mock_cmd: RcloneClient) -> None:
+        """
+        Tests that each transfer setting is passed to rclone.
+        """
+        rclone_client_mock_cmd.checkers = 32
+        rclone_client_mock_cmd.fast_list = True
+        rclone_client_mock_cmd.s3_upload_concurrency = 8
+        rclone_client_mock_cmd.s3_chunk_size = "64M"
+        rclone_client_mock_cmd.s3_upload_cutoff = "200M"
+
+        assert rclone_client_mock_cmd.transfer_args() == [
+            "--checkers",
+            "32",
+            "--fast-list",
+            "--s3-upload-concurrency",
+            "8",
+            "--s3-chunk-size",
+            "64M",
+            "--s3-upload-cutoff",
+            "200M",
+        ]
+
+    def test_hasher_remote(self, rclone_client_mock_cmd: RcloneClient) -> None:
+        """
+        Tests that the path of a hasher overlay is quoted.
+        """
+        remote = rclone_client_mock_cmd.hasher_remote(Path('/data/a,"b"'))
+
+        assert remote == ':hasher,remote="/data/a,""b""",hashes=md5,max_age=off:'
+
+    def test_cache_dir(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+    ) -> None:
+        """
+        Tests that the cache directory is passed to every rclone command.
+        """
+        rclone_client_mock_cmd.cache_dir = Path("/state/rclone-cache")
+        mock_cmd_executor.set_result_json_messages(0, [])
+
+        rclone_client_mock_cmd.import_hashes(":hasher:", Path("/tmp/sums.md5"))
+
+        assert mock_cmd_executor.invoked_commands[-1].cmd[1:] == [
+            "--verbose",
+            "--use-json-log",
+            "--cache-dir",
+            "/state/rclone-cache",
+            "backend",
+            "import",
+            ":hasher:",
+            "md5",
+            "/tmp/sums.md5",
+        ]
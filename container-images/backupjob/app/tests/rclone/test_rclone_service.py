@@ -2,13 +2,19 @@
 Tests the RcloneService class.
 """
 
+import json
+import os
 from pathlib import Path
+from typing import Any
 
 import pytest
 
+from backup.bandwidth import BandwidthSchedule
 from backup.rclone import RcloneClient, RcloneService
+from backup.rclone.hashcache import ChecksumCache
 
 from testlib import BackupSourceInfo
+from testlib.cmd import MockCommandExecutor
 
 
 @pytest.fixture
@@ -61,3 +67,255 @@ class TestRcloneService:
         assert bytes_transferred.data == backup_src_info.total_size
         assert files_transferred.data == backup_src_info.total_count
         assert deletes.data == 0
+
+    def test_sync_sharded_deletes(
+        self,
+        rclone_source_dir: Path,
+        rclone_destination_dir: Path,
+        rclone_service: RcloneService,
+    ) -> None:
+        """
+        Tests that a sharded sync deletes files within shards, at the top level, and
+        in directories that were removed from the source.
+        """
+        (rclone_source_dir / "big").mkdir()
+        (rclone_source_dir / "big" / "keep").write_bytes(b"x" * 1000)
+        (rclone_source_dir / "top").write_bytes(b"x")
+        for p in ["big/stale", "removed/stale", "stale"]:
+            (rclone_destination_dir / p).parent.mkdir(parents=True, exist_ok=True)
+            (rclone_destination_dir / p).write_bytes(b"x")
+        rclone_service.shard_jobs = 2
+
+        report = rclone_service.sync(
+            "test", str(rclone_source_dir), str(rclone_destination_dir)
+        )
+
+        remaining = sorted(
+            str(p.relative_to(rclone_destination_dir))
+            for p in Path(rclone_destination_dir).rglob("*")
+            if p.is_file()
+        )
+        assert report.successful
+        assert remaining == ["big/keep", "top"]
+        assert report.find_one_field(lambda f: f.label == "Deletes").data == 3
+
+    def test_sync_sharded(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+    ) -> None:
+        """
+        Tests that the largest directory is synced to its own prefix, that the
+        top-level sync excludes it, and that the statistics are combined.
+        """
+        (rclone_source_dir / "big").mkdir()
+        (rclone_source_dir / "big" / "f").write_bytes(b"x" * 1000)
+        (rclone_source_dir / "small").write_bytes(b"x")
+
+        def result(cmd: list[str], cwd: Path, combine: bool) -> tuple[int, bytes, None]:
+            n = 2 if "--exclude" in cmd else 3
+            stats = {"bytes": n, "deletes": n, "errors": 0, "transfers": n}
+            return (0, json.dumps({"stats": stats}).encode("utf-8"), None)
+
+        mock_cmd_executor.cmd_result_factory = result
+        rclone_client_mock_cmd.bandwidth = BandwidthSchedule.parse("10M")
+        service = RcloneService(rclone_client_mock_cmd)
+        service.shard_jobs = 2
+
+        report = service.sync("test", str(rclone_source_dir), "s3:bucket")
+        fields = {f.label: f.data for f in report.fields}
+
+        cmds = sorted(c.cmd[-6:] for c in mock_cmd_executor.invoked_commands)
+        assert cmds == [
+            [
+                "--exclude",
+                "/big/**",
+                "--bwlimit",
+                "5120k",
+                str(rclone_source_dir),
+                "s3:bucket",
+            ],
+            [
+                "--use-json-log",
+                "sync",
+                "--bwlimit",
+                "5120k",
+                f"{rclone_source_dir}/big",
+                "s3:bucket/big",
+            ],
+        ]
+        assert report.successful
+        assert fields["Shards"] == 2
+        assert fields["Bytes Transferred"] == 5
+        assert fields["Deletes"] == 5
+
+    def test_sync_walks_source_once(
+        self,
+        tmp_path: Path,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """
+        Tests that the source is walked once to estimate the listing, cache checksums
+        and plan shards.
+        """
+        (rclone_source_dir / "big").mkdir()
+        (rclone_source_dir / "big" / "f").write_bytes(b"x" * 1000)
+        (rclone_source_dir / "small").write_bytes(b"x")
+        stats = {"bytes": 0, "deletes": 0, "errors": 0, "transfers": 0}
+        mock_cmd_executor.set_result_json_messages(0, [{"stats": stats}])
+        service = RcloneService(rclone_client_mock_cmd)
+        service.compare_fast_list = True
+        service.checksum_cache = ChecksumCache(tmp_path / "checksums.db")
+        service.shard_jobs = 2
+
+        walked: list[str] = list()
+        walk = os.walk
+
+        def counting_walk(top: str, *args: Any, **kwargs: Any) -> Any:
+            walked.append(str(top))
+            return walk(top, *args, **kwargs)
+
+        monkeypatch.setattr(os, "walk", counting_walk)
+        report = service.sync("test", str(rclone_source_dir), "s3:bucket")
+        fields = {f.label: f.data for f in report.fields}
+
+        assert walked == [str(rclone_source_dir)]
+        assert fields["Shards"] == 2
+        assert fields["Bytes Hashed"] == 1001
+        assert fields["LIST Requests without --fast-list (est.)"] == 2
+
+    def test_sync_log_summary(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+        rclone_destination_dir: Path,
+    ) -> None:
+        """
+        Tests that file events and output that is not JSON are summarized in the
+        report, and do not prevent the statistics from being read.
+        """
+        stats = {"bytes": 2, "deletes": 0, "errors": 0, "transfers": 2}
+        output = [
+            b"Starting rclone",
+            *[
+                json.dumps(
+                    {"level": "info", "msg": "Copied (new)", "object": f"f{i}"}
+                ).encode("utf-8")
+                for i in range(2)
+            ],
+            json.dumps({"level": "info", "msg": "stats", "stats": stats}).encode(
+                "utf-8"
+            ),
+        ]
+        mock_cmd_executor.set_result(0, b"\n".join(output), None)
+        service = RcloneService(rclone_client_mock_cmd)
+
+        report = service.sync(
+            "test", str(rclone_source_dir), str(rclone_destination_dir)
+        )
+        fields = {f.label: f.data for f in report.fields}
+
+        assert report.successful
+        assert fields["Files Transferred"] == 2
+        assert fields["File Events"] == "Copied (new): 2"
+        assert fields["File Event Sample"] == "Copied (new): f0\nCopied (new): f1"
+        assert fields["Unparsed Output Lines"] == 1
+        assert fields["Unparsed Output"] == "Starting rclone"
+
+    def test_sync_transfer_settings(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+        rclone_destination_dir: Path,
+    ) -> None:
+        """
+        Tests that the transfer settings and the estimated LIST requests with and
+        without --fast-list are recorded in the report.
+        """
+        (rclone_source_dir / "d").mkdir()
+        (rclone_source_dir / "d" / "f").touch()
+        stats = {"bytes": 0, "deletes": 0, "errors": 0, "transfers": 0}
+        mock_cmd_executor.set_result_json_messages(0, [{"stats": stats}])
+        rclone_client_mock_cmd.transfers = 16
+        rclone_client_mock_cmd.fast_list = True
+        service = RcloneService(rclone_client_mock_cmd)
+        service.compare_fast_list = True
+
+        report = service.sync(
+            "test", str(rclone_source_dir), str(rclone_destination_dir)
+        )
+        fields = {f.label: f.data for f in report.fields}
+
+        assert report.successful
+        assert fields["Transfer Settings"] == "--transfers 16 --fast-list"
+        assert fields["LIST Requests without --fast-list (est.)"] == 2
+        assert fields["LIST Requests with --fast-list (est.)"] == 1
+        assert "--fast-list" in mock_cmd_executor.invoked_commands[-1].cmd
+
+    def test_sync_checksum_cache(
+        self,
+        tmp_path: Path,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+        rclone_destination_dir: Path,
+    ) -> None:
+        """
+        Tests that cached checksums are imported into a hasher overlay of the source,
+        which is synced in place of the source.
+        """
+        (rclone_source_dir / "f").write_bytes(b"f" * 10)
+        stats = {"bytes": 0, "deletes": 0, "errors": 0, "transfers": 0}
+        mock_cmd_executor.set_result_json_messages(0, [{"stats": stats}])
+        service = RcloneService(rclone_client_mock_cmd)
+        service.checksum_cache = ChecksumCache(tmp_path / "checksums.db")
+
+        service.sync("test", str(rclone_source_dir), str(rclone_destination_dir))
+        report = service.sync(
+            "test", str(rclone_source_dir), str(rclone_destination_dir)
+        )
+        fields = {f.label: f.data for f in report.fields}
+
+        remote = rclone_client_mock_cmd.hasher_remote(rclone_source_dir)
+        import_cmd = mock_cmd_executor.invoked_commands[-2].cmd
+        sync_cmd = mock_cmd_executor.invoked_commands[-1].cmd
+        assert import_cmd[-5:-1] == ["backend", "import", remote, "md5"]
+        assert sync_cmd[-2:] == [remote, str(rclone_destination_dir)]
+        assert fields["Checksum Cache Hit Rate (%)"] == 100
+        assert fields["Bytes Hashed"] == 0
+        assert fields["Bytes Hash Skipped"] == 10
+
+    def test_sync_checksum_cache_import_failed(
+        self,
+        tmp_path: Path,
+        mock_cmd_executor: MockCommandExecutor,
+        rclone_client_mock_cmd: RcloneClient,
+        rclone_source_dir: Path,
+        rclone_destination_dir: Path,
+    ) -> None:
+        """
+        Tests that the source is synced directly if the checksums cannot be imported.
+        """
+        stats = {"bytes": 0, "deletes": 0, "errors": 0, "transfers": 0}
+
+        def result(cmd: list[str], cwd: Path, combine: bool) -> tuple[int, bytes, None]:
+            returncode = 1 if "import" in cmd else 0
+            return (returncode, json.dumps({"stats": stats}).encode("utf-8"), None)
+
+        mock_cmd_executor.cmd_result_factory = result
+        service = RcloneService(rclone_client_mock_cmd)
+        service.checksum_cache = ChecksumCache(tmp_path / "checksums.db")
+
+        report = service.sync(
+            "test", str(rclone_source_dir), str(rclone_destination_dir)
+        )
+
+        sync_cmd = mock_cmd_executor.invoked_commands[-1].cmd
+        assert sync_cmd[-2:] == [str(rclone_source_dir), str(rclone_destination_dir)]
+        assert report.find_one_field(lambda f: f.label == "Checksum Cache Error")
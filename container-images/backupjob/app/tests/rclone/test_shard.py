@@ -0,0 +1,61 @@
+"""
+Tests the ShardPlan class.
+"""
+
+from pathlib import Path
+
+from backup.rclone.shard import ShardPlan, SyncShard, join_remote
+from backup.rclone.walk import SourceWalk
+
+
+def test_plan(tmp_path: Path) -> None:
+    """
+    Tests that the largest directories are split off until the top-level shard is no
+    larger than a worker's share of the source.
+    """
+    for name, size in [("big", 600), ("medium", 250), ("small", 100)]:
+        (tmp_path / name / "sub").mkdir(parents=True)
+        (tmp_path / name / "sub" / "f").write_bytes(b"x" * size)
+    (tmp_path / "top").write_bytes(b"x" * 50)
+    (tmp_path / "link").symlink_to(tmp_path / "big")
+
+    plan = ShardPlan.plan(SourceWalk.complete(tmp_path), jobs=4)
+
+    assert [(s.directory, s.size) for s in plan.shards] == [
+        ("big", 600),
+        ("medium", 250),
+    ]
+    assert plan.top_level.size == 150
+    assert [s.name for s in plan.all] == ["big", "medium", "(top level)"]
+
+
+def test_plan_single_job(tmp_path: Path) -> None:
+    """
+    Tests that nothing is split off if there is a single worker.
+    """
+    (tmp_path / "d").mkdir()
+    (tmp_path / "d" / "f").write_bytes(b"x")
+
+    plan = ShardPlan.plan(SourceWalk.complete(tmp_path), jobs=1)
+
+    assert plan.shards == []
+    assert plan.top_level.size == 1
+
+
+def test_top_level_excludes() -> None:
+    """
+    Tests that directory names are matched literally by the exclude patterns.
+    """
+    plan = ShardPlan([SyncShard("a", 2), SyncShard("b*[1]", 1)], SyncShard(None, 0))
+
+    assert plan.top_level_excludes() == ["/a/**", "/b\\*\\[1\\]/**"]
+
+
+def test_join_remote() -> None:
+    """
+    Tests that paths are joined onto remotes with and without a path.
+    """
+    assert join_remote("s3:bucket", "a") == "s3:bucket/a"
+    assert join_remote("s3:bucket/", "a") == "s3:bucket/a"
+    assert join_remote(':hasher,remote="/data":', "a") == ':hasher,remote="/data":a'
+    assert join_remote("/data", "a") == "/data/a"
@@ -0,0 +1,42 @@
+"""
+Tests the SourceWalk class.
+"""
+
+from pathlib import Path
+
+from backup.rclone.walk import SourceWalk
+
+
+def test_walk(tmp_path: Path) -> None:
+    """
+    Tests that regular files are yielded once, and that the statistics of the tree
+    are gathered while they are consumed.
+    """
+    (tmp_path / "a" / "b").mkdir(parents=True)
+    (tmp_path / "a" / "b" / "f").write_bytes(b"x" * 10)
+    (tmp_path / "a" / "g").write_bytes(b"x" * 5)
+    (tmp_path / "top").write_bytes(b"x")
+    (tmp_path / "link").symlink_to(tmp_path / "top")
+
+    walk = SourceWalk(tmp_path)
+    files = {rel: st.st_size for rel, st in walk.files()}
+    walk.finish()
+
+    assert files == {"a/b/f": 10, "a/g": 5, "top": 1}
+    assert walk.sizes == {"a": 15, None: 1}
+    assert walk.objects == 4
+    assert sorted(walk.directory_entries) == [1, 2, 3]
+    assert list(walk.files()) == []
+
+
+def test_complete(tmp_path: Path) -> None:
+    """
+    Tests that a completed walk has its statistics without consuming its files.
+    """
+    (tmp_path / "d").mkdir()
+    (tmp_path / "d" / "f").write_bytes(b"x" * 3)
+
+    walk = SourceWalk.complete(tmp_path)
+
+    assert walk.sizes == {"d": 3}
+    assert walk.objects == 1
@@ -7,9 +7,10 @@ from pathlib import Path
 import pytest
 
 from backup.cmd import CommandExecutorProtocol, cmdexec
-from backup.restic import ResticClient
+from backup.restic import ResticClient, ResticService
 
-from testlib.restic import ExpectedResticCommand
+from testlib.cmd import MockCommandExecutor
+from testlib.restic import ExpectedResticCommand, MockResticRepository
 
 
 @pytest.fixture
@@ -73,6 +74,61 @@ def restic_client_mock_cmd(
     )
 
 
+@pytest.fixture
+def mock_restic_repository(
+    mock_cmd_executor: MockCommandExecutor,
+) -> MockResticRepository:
+    """
+    In-memory restic repository that answers commands sent to the mock command executor.
+    """
+    repository = MockResticRepository()
+    mock_cmd_executor.cmd_result_factory = repository
+
+    return repository
+
+
+@pytest.fixture
+def restic_service_mock_cmd(
+    mock_restic_repository: MockResticRepository,
+    restic_client_mock_cmd: ResticClient,
+) -> ResticService:
+    """
+    ResticService using a mock command executor backed by a MockResticRepository.
+    The restic binary is *not* invoked by this service.
+    """
+    return ResticService(restic_client_mock_cmd)
+
+
+@pytest.fixture
+def remote_mock_restic_repository() -> MockResticRepository:
+    """
+    In-memory restic repository that stands in for a "remote" repository.
+    """
+    return MockResticRepository()
+
+
+@pytest.fixture
+def remote_restic_client_mock_cmd(
+    remote_mock_restic_repository: MockResticRepository,
+    restic_remote_repository_path: str,
+    restic_password_file: Path,
+    restic_remote_cache_dir: Path,
+) -> ResticClient:
+    """
+    ResticClient for the "remote" repository using its own mock command executor,
+    backed by the remote MockResticRepository.
+    """
+    executor = MockCommandExecutor()
+    executor.cmd_result_factory = remote_mock_restic_repository
+
+    return ResticClient(
+        cmdexec=executor,
+        repository_path=restic_remote_repository_path,
+        password_file=restic_password_file,
+        cache_dir=restic_remote_cache_dir,
+    )
+
+
 @pytest.fixture
 def restic_dir(tmpdir: Path) -> Path:
     """
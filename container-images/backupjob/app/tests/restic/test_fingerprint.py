@@ -0,0 +1,134 @@
+"""
+Tests backup source fingerprinting.
+"""
+
+from datetime import datetime, timedelta
+import os
+from pathlib import Path
+
+import pytest
+
+from backup.restic.fingerprint import FingerprintStore, TreeFingerprint
+from backup.state import StateDirectory
+
+from testlib import BackupSourceInfo
+
+
+@pytest.fixture
+def state_dir(tmpdir: Path) -> StateDirectory:
+    """
+    StateDirectory in a temporary directory.
+    """
+    return StateDirectory(tmpdir / "state")
+
+
+class TestTreeFingerprint:
+    """
+    Tests the TreeFingerprint class.
+    """
+
+    def test_unchanged_tree(self, backup_src_info: BackupSourceInfo) -> None:
+        """
+        Tests that fingerprinting an unchanged tree produces the same fingerprint.
+        """
+        fp1 = TreeFingerprint.compute(backup_src_info.path)
+        fp2 = TreeFingerprint.compute(backup_src_info.path, workers=1)
+
+        assert fp1 == fp2
+        assert fp1.size >= backup_src_info.total_size
+        assert fp1.entries > backup_src_info.total_count
+
+    def test_modified_file(self, backup_src_info: BackupSourceInfo) -> None:
+        """
+        Tests that modifying a file changes the fingerprint.
+        """
+        d = backup_src_info.path / backup_src_info.directories[0].path
+        f = next(d.iterdir())
+        fp1 = TreeFingerprint.compute(backup_src_info.path)
+
+        st = f.stat()
+        os.utime(f, ns=(st.st_atime_ns, st.st_mtime_ns + 1))
+        fp2 = TreeFingerprint.compute(backup_src_info.path)
+
+        assert fp1 != fp2
+
+    def test_renamed_file(self, backup_src_info: BackupSourceInfo) -> None:
+        """
+        Tests that renaming a file changes the fingerprint.
+        """
+        d = backup_src_info.path / backup_src_info.directories[0].path
+        f = next(d.iterdir())
+        fp1 = TreeFingerprint.compute(backup_src_info.path)
+
+        f.rename(d / "renamed")
+        fp2 = TreeFingerprint.compute(backup_src_info.path)
+
+        assert fp1 != fp2
+
+    def test_extra_files(self, backup_src_info: BackupSourceInfo, tmpdir: Path) -> None:
+        """
+        Tests that changes to extra files change the fingerprint.
+        """
+        extra = tmpdir / "backupignore.global"
+        extra.write_text("*.tmp\n")
+        fp1 = TreeFingerprint.compute(backup_src_info.path, [extra])
+
+        extra.write_text("*.tmp\n*.bak\n")
+        fp2 = TreeFingerprint.compute(backup_src_info.path, [extra])
+
+        assert fp1 != fp2
+
+
+class TestFingerprintStore:
+    """
+    Tests the FingerprintStore class.
+    """
+
+    def test_record_and_reload(
+        self, backup_src_info: BackupSourceInfo, state_dir: StateDirectory
+    ) -> None:
+        """
+        Tests that recorded fingerprints are persisted and reloaded.
+        """
+        now = datetime.now()
+        fp = TreeFingerprint.compute(backup_src_info.path)
+        store = FingerprintStore(state_dir, "/repo", timedelta(days=7))
+        store.record(backup_src_info.path, fp, "abc123", now)
+        store.save()
+
+        reloaded = FingerprintStore(state_dir, "/repo", timedelta(days=7))
+        other_repo = FingerprintStore(state_dir, "/other-repo", timedelta(days=7))
+
+        assert reloaded.is_unchanged(backup_src_info.path, fp, now)
+        assert not other_repo.is_unchanged(backup_src_info.path, fp, now)
+
+    def test_expired_record(
+        self, backup_src_info: BackupSourceInfo, state_dir: StateDirectory
+    ) -> None:
+        """
+        Tests that a matching fingerprint is not trusted once its record is too old.
+        """
+        now = datetime.now()
+        fp = TreeFingerprint.compute(backup_src_info.path)
+        store = FingerprintStore(state_dir, "/repo", timedelta(days=7))
+        store.record(backup_src_info.path, fp, "abc123", now - timedelta(days=8))
+
+        assert not store.is_unchanged(backup_src_info.path, fp, now)
+
+    def test_record_keeps_snapshot_id(
+        self, backup_src_info: BackupSourceInfo, state_dir: StateDirectory
+    ) -> None:
+        """
+        Tests that recording a fingerprint without a snapshot ID keeps the previously
+        recorded snapshot ID.
+        """
+        now = datetime.now()
+        fp = TreeFingerprint.compute(backup_src_info.path)
+        store = FingerprintStore(state_dir, "/repo", timedelta(days=7))
+        store.record(backup_src_info.path, fp, "abc123", now)
+        store.record(backup_src_info.path, fp, None, now)
+
+        record = store.get(backup_src_info.path)
+
+        assert record is not None
+        assert record.snapshot_id == "abc123"
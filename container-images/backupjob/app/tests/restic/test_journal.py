@@ -0,0 +1,53 @@
+"""
+Tests the BackupJournal class.
+"""
+
+from pathlib import Path
+
+from backup.report import BackupReport
+from backup.restic.journal import BackupJournal
+from backup.state import StateDirectory
+
+
+def child_report(name: str) -> BackupReport:
+    report = BackupReport(f"backup / {name}")
+    report.new_field("Snapshot ID", f"{name}-snapshot", lambda _: None)
+    report.successful = True
+    return report
+
+
+def test_resume_same_run(tmp_path: Path) -> None:
+    """
+    Tests that children recorded by an attempt are returned to later attempts at the
+    same run.
+    """
+    state = StateDirectory(tmp_path)
+    journal = BackupJournal(state, "repo", Path("/source"), "run-1")
+    journal.start()
+    journal.record("a", child_report("a"))
+
+    retry = BackupJournal(state, "repo", Path("/source"), "run-1")
+    retry.start()
+    completed = retry.completed()
+
+    assert retry.attempt == 2
+    assert list(completed.keys()) == ["a"]
+    assert completed["a"].fields == child_report("a").fields
+    assert completed["a"].successful
+
+
+def test_new_run_discards_journal(tmp_path: Path) -> None:
+    """
+    Tests that a run with a different ID starts from scratch.
+    """
+    state = StateDirectory(tmp_path)
+    journal = BackupJournal(state, "repo", Path("/source"), "run-1")
+    journal.start()
+    journal.record("a", child_report("a"))
+
+    next_run = BackupJournal(state, "repo", Path("/source"), "run-2")
+    next_run.start()
+
+    assert next_run.attempt == 1
+    assert next_run.completed() == {}
+    assert BackupJournal(state, "repo", Path("/other"), "run-1").completed() == {}
@@ -0,0 +1,88 @@
+"""
+Tests the BackupPlanner class.
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from backup.history import RunHistory
+from backup.report import BackupReport
+from backup.restic.planner import BackupPlanner, BackupPrediction
+
+
+def make_child(parent: Path, name: str, size: int) -> Path:
+    child = parent / name
+    child.mkdir()
+    with open(child / "data", "wb") as f:
+        f.write(b"\0" * size)
+    return child
+
+
+def record_run(history: RunHistory, elapsed: dict[str, int]) -> None:
+    start = datetime(2024, 6, 1)
+    report = BackupReport("backup")
+    for name, seconds in elapsed.items():
+        child = report.new_subreport(name)
+        child.new_field("Start Time", start, lambda _: None)
+        child.new_field("End Time", start + timedelta(seconds=seconds), lambda _: None)
+    history.record(report, start)
+
+
+def test_order_by_size(tmp_path: Path) -> None:
+    """
+    Tests that children without history are ordered largest first.
+    """
+    small = make_child(tmp_path, "a", 10)
+    large = make_child(tmp_path, "b", 1000)
+    planner = BackupPlanner(None)
+    planner.assumed_throughput = 100
+
+    planned = planner.order("backup", [small, large])
+
+    assert [p.path for p in planned] == [large, small]
+    assert all(p.basis == BackupPrediction.SIZE_ESTIMATE for p in planned)
+    assert planned[1].seconds >= 0.1
+
+
+def test_order_by_history(tmp_path: Path) -> None:
+    """
+    Tests that children are predicted from the median of their previous runs in
+    preference to their size, and that children without history fall back to their
+    size.
+    """
+    history = RunHistory(tmp_path / "history.sqlite")
+    for seconds in (100, 300, 200):
+        record_run(history, {"a": seconds, "b": 10})
+
+    source = tmp_path / "source"
+    source.mkdir()
+    a = make_child(source, "a", 10)
+    b = make_child(source, "b", 1000)
+    c = make_child(source, "c", 5000)
+    planner = BackupPlanner(history)
+    planner.assumed_throughput = 100
+
+    planned = planner.order("backup", [a, b, c])
+
+    assert [(p.path, p.seconds, p.basis) for p in planned] == [
+        (a, 200.0, BackupPrediction.HISTORY),
+        (c, planned[1].seconds, BackupPrediction.SIZE_ESTIMATE),
+        (b, 10.0, BackupPrediction.HISTORY),
+    ]
+    assert 50 <= planned[1].seconds < 200
+
+
+def test_estimate_size(tmp_path: Path) -> None:
+    """
+    Tests that the size estimate sums the sizes of files, and stops examining
+    entries once the limit is reached.
+    """
+    child = make_child(tmp_path, "a", 1000)
+    make_child(child, "nested", 500)
+    planner = BackupPlanner(None)
+
+    assert planner.estimate_size(child) == 1500
+    assert planner.estimate_size(tmp_path / "missing") == 0
+
+    planner.max_estimate_entries = 1
+    assert planner.estimate_size(child) in (0, 1000)
@@ -13,12 +13,15 @@ from backup.restic import (
     ResticClient,
     ResticError,
 )
+from backup.bandwidth import BandwidthLimit, BandwidthSchedule
+from backup.restic.cache import ResticMetadataCache
+from backup.state import StateDirectory
 
 from testlib.cmd import (
     MockCommandExecutor,
     MockInvokedCommand,
 )
-from testlib.restic import ExpectedResticCommand
+from testlib.restic import ExpectedResticCommand, MockResticRepository
 
 
 @pytest.fixture
@@ -175,6 +178,130 @@ class TestResticClientMockCommandExecutor:
         assert summary.snapshot_id == snapshot_id
         assert expected_invocation in mock_cmd_executor.invoked_commands
 
+    def test_backup_host_and_parent(
+        self,
+        expected_restic_cmd: ExpectedResticCommand,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_client_mock_cmd: ResticClient,
+    ) -> None:
+        """
+        Tests that the backup method passes the client's host and the given parent
+        snapshot to restic.
+        """
+        parent = "0000000200000000000000000000000000000000000000000000000000000000"
+        mock_cmd_executor.set_result_json_messages(1, [])
+        restic_client_mock_cmd.host = "backupjob-data"
+        source_path = Path("/home/user/important-data")
+        expected_cmd = expected_restic_cmd(
+            [
+                "backup",
+                "--host",
+                "backupjob-data",
+                "--parent",
+                parent,
+                source_path.name,
+            ]
+        )
+
+        restic_client_mock_cmd.backup(
+            source_path, False, exclude_files=[], parent=parent
+        )
+
+        assert expected_cmd in mock_cmd_executor.invoked_commands
+
+    def test_backup_status_messages_digested(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_client_mock_cmd: ResticClient,
+    ) -> None:
+        """
+        Tests that status messages emitted during a backup are folded into the result's
+        status digest rather than decoded into its messages.
+        """
+        rc = 0
+        status_messages = [
+            {"message_type": "status", "percent_done": i / 100, "files_done": i}
+            for i in range(100)
+        ]
+        summary_msg = {
+            "message_type": "summary",
+            "files_new": 19,
+            "files_changed": 0,
+            "files_unmodified": 0,
+            "dirs_new": 5,
+            "dirs_changed": 0,
+            "dirs_unmodified": 0,
+            "data_blobs": 19,
+            "tree_blobs": 6,
+            "data_added": 22215,
+            "data_added_packed": 10440,
+            "total_files_processed": 19,
+            "total_bytes_processed": 10549,
+            "total_duration": 0.714634746,
+            "backup_start": "2025-10-18T19:02:51.792880666-05:00",
+            "backup_end": "2025-10-18T19:02:52.507515422-05:00",
+            "snapshot_id": None,
+        }
+        error_msg = {
+            "message_type": "error",
+            "error": {"message": "permission denied"},
+            "during": "archival",
+            "item": "/data/locked",
+        }
+        mock_cmd_executor.set_result_json_messages(
+            rc, [*status_messages, error_msg, summary_msg]
+        )
+        restic_client_mock_cmd.status_history_size = 4
+
+        result = restic_client_mock_cmd.backup(
+            Path("/home/user/important-data"), True, exclude_files=[]
+        )
+
+        assert result.summary is not None
+        assert result.messages == [error_msg, summary_msg]
+        assert result.status.count == 100
+        assert result.status.recent == status_messages[-4:]
+        assert result.status.latest == status_messages[-1]
+
+    def test_backup_status_messages_decoded(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_client_mock_cmd: ResticClient,
+    ) -> None:
+        """
+        Tests that status messages are decoded into the result's messages when
+        decode_status_messages is set.
+        """
+        rc = 1
+        status_messages = [
+            {"message_type": "status", "percent_done": i / 10} for i in range(10)
+        ]
+        mock_cmd_executor.set_result_json_messages(rc, status_messages)
+        restic_client_mock_cmd.decode_status_messages = True
+
+        result = restic_client_mock_cmd.backup(
+            Path("/home/user/important-data"), True, exclude_files=[]
+        )
+
+        assert result.messages == status_messages
+        assert result.status.count == 0
+        assert result.status.latest is None
+
+    @pytest.mark.parametrize(
+        "line, expected",
+        [
+            (b'{"message_type":"status","percent_done":0.5}', "status"),
+            (b'{"message_type": "summary", "files_new": 1}', "summary"),
+            (b'{"version":2,"id":"21ae9b84"}', None),
+            (b"not json", None),
+        ],
+    )
+    def test_message_type(self, line: bytes, expected: str | None) -> None:
+        """
+        Tests that the message type is extracted from raw restic messages.
+        """
+        assert ResticClient.message_type(line) == expected
+
     def test_check_no_read_data(
         self,
         expected_restic_cmd: ExpectedResticCommand,
@@ -229,6 +356,108 @@ class TestResticClientMockCommandExecutor:
         assert summary.num_errors == 0
         assert expected_cmd in mock_cmd_executor.invoked_commands
 
+    def test_check_with_read_data_subset(
+        self,
+        expected_restic_cmd: ExpectedResticCommand,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_client_mock_cmd: ResticClient,
+    ) -> None:
+        """
+        Tests the check method reading a subset of the repository's data.
+        """
+        msg = {
+            "message_type": "summary",
+            "num_errors": 0,
+            "broken_packs": None,
+            "suggest_repair_index": False,
+            "suggest_prune": False,
+        }
+        mock_cmd_executor.set_result_json_messages(0, messages=[msg])
+        expected_cmd = expected_restic_cmd(["check", "--read-data-subset", "2/7"])
+
+        restic_client_mock_cmd.check(read_data=True, read_data_subset="2/7")
+
+        assert expected_cmd in mock_cmd_executor.invoked_commands
+
+    def test_tuned_backup(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_client_mock_cmd: ResticClient,
+        tmp_path: Path,
+    ) -> None:
+        """
+        Tests that tuned settings are passed to restic.
+        """
+        restic_client_mock_cmd.env = {"GOMAXPROCS": "2"}
+        restic_client_mock_cmd.options = {"s3.connections": "4"}
+        restic_client_mock_cmd.read_concurrency = 3
+        # Only the command matters here; a failed backup needs no summary.
+        mock_cmd_executor.set_result_json_messages(1, [])
+
+        restic_client_mock_cmd.backup(tmp_path, False, [])
+
+        invoked = mock_cmd_executor.invoked_commands[-1]
+        assert invoked.env == {"GOMAXPROCS": "2"}
+        assert invoked.cmd[-3:] == ["--read-concurrency", "3", "."]
+        o = invoked.cmd.index("-o")
+        assert invoked.cmd[o : o + 2] == ["-o", "s3.connections=4"]
+        assert invoked.cmd.index("--json") > o
+
+    def test_backup_bandwidth(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_client_mock_cmd: ResticClient,
+        tmp_path: Path,
+    ) -> None:
+        """
+        Tests that the bandwidth limit in effect when a backup starts is passed to
+        restic and recorded on the result.
+        """
+        restic_client_mock_cmd.bandwidth = BandwidthSchedule.parse("1M:off")
+        mock_cmd_executor.set_result_json_messages(1, [])
+
+        result = restic_client_mock_cmd.backup(tmp_path, False, [])
+
+        assert mock_cmd_executor.invoked_commands[-1].cmd[-3:] == [
+            "--limit-upload",
+            "1024",
+            ".",
+        ]
+        assert result.bandwidth_limit == BandwidthLimit(1024 * 1024, None)
+
+    def test_prune(
+        self,
+        expected_restic_cmd: ExpectedResticCommand,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_client_mock_cmd: ResticClient,
+    ) -> None:
+        """
+        Tests that the prune method passes its options to restic and reads the
+        statistics restic prints.
+        """
+        mock_cmd_executor.set_result(
+            0, b"to repack: 69 blobs / 1 KiB\ntotal prune: 74 blobs / 2 KiB\n", None
+        )
+        expected_cmd = expected_restic_cmd(
+            [
+                "prune",
+                "--dry-run",
+                "--max-unused",
+                "5%",
+                "--max-repack-size",
+                "1G",
+                "--repack-small",
+            ]
+        )
+
+        result = restic_client_mock_cmd.prune(
+            dry_run=True, max_unused="5%", max_repack_size="1G", repack_small=True
+        )
+
+        assert expected_cmd in mock_cmd_executor.invoked_commands
+        assert result.stats.repacked == 1024
+        assert result.stats.freed == 2048
+
     def test_forget_comprehensive(
         self,
         expected_restic_cmd: ExpectedResticCommand,
@@ -748,3 +977,197 @@ class TestResticClientMockCommandExecutor:
             expected_restic_cmd(["snapshots", "--latest", str(latest)])
             in mock_cmd_executor.invoked_commands
         )
+
+
+class TestResticClientMetadataCache:
+    """
+    Contains tests for the ResticClient's use of a ResticMetadataCache.
+
+    The actual restic binary is not invoked for these tests.
+    """
+
+    @pytest.fixture
+    def metadata_cache(
+        self, tmp_path: Path, restic_repository_path: str
+    ) -> ResticMetadataCache:
+        return ResticMetadataCache(
+            StateDirectory(tmp_path / "state"), restic_repository_path
+        )
+
+    @pytest.fixture
+    def cached_client(
+        self,
+        restic_client_mock_cmd: ResticClient,
+        metadata_cache: ResticMetadataCache,
+    ) -> ResticClient:
+        restic_client_mock_cmd.metadata_cache = metadata_cache
+        return restic_client_mock_cmd
+
+    def test_repository_is_initialized_cached(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        mock_restic_repository: MockResticRepository,
+        cached_client: ResticClient,
+        metadata_cache: ResticMetadataCache,
+        restic_repository_path: str,
+    ) -> None:
+        """
+        Ensures that restic is not invoked to check whether the repository is
+        initialized once it is known to be.
+        """
+        assert cached_client.repository_is_initialized()
+        assert len(mock_cmd_executor.invoked_commands) == 1
+
+        # A new cache for the same state directory and repository.
+        cached_client.metadata_cache = ResticMetadataCache(
+            metadata_cache.state, restic_repository_path
+        )
+        assert cached_client.repository_is_initialized()
+        assert len(mock_cmd_executor.invoked_commands) == 1
+
+    def test_all_snapshots_reads_only_new_snapshots(
+        self,
+        tmp_path: Path,
+        mock_cmd_executor: MockCommandExecutor,
+        mock_restic_repository: MockResticRepository,
+        cached_client: ResticClient,
+    ) -> None:
+        """
+        Ensures that all_snapshots only reads snapshots that are not yet cached, and
+        that snapshots created by backups are picked up.
+        """
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+            cached_client.backup(tmp_path / name, True, [])
+
+        snapshots = cached_client.all_snapshots()
+        assert {s.id for s in snapshots} == {
+            s["id"] for s in mock_restic_repository.snapshots
+        }
+        assert snapshots[0].short_id == snapshots[0].id[:8]
+
+        # The cached snapshots are fresh; restic is not invoked again.
+        invoked = len(mock_cmd_executor.invoked_commands)
+        cached_client.all_snapshots()
+        assert len(mock_cmd_executor.invoked_commands) == invoked
+
+        for name in ("c", "d"):
+            (tmp_path / name).mkdir()
+            cached_client.backup(tmp_path / name, True, [])
+        invoked = len(mock_cmd_executor.invoked_commands)
+        snapshots = cached_client.all_snapshots()
+
+        # Both new snapshots are read in a single invocation.
+        subcmds = [
+            MockResticRepository.subcommand(c.cmd)
+            for c in mock_cmd_executor.invoked_commands[invoked:]
+        ]
+        new_ids = sorted(s["id"] for s in mock_restic_repository.snapshots[2:])
+        assert len(snapshots) == 4
+        assert subcmds == [["list", "snapshots"], ["snapshots", *new_ids]]
+
+    def test_all_snapshots_lists_all_when_many_missing(
+        self,
+        tmp_path: Path,
+        mock_cmd_executor: MockCommandExecutor,
+        mock_restic_repository: MockResticRepository,
+        cached_client: ResticClient,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """
+        Ensures that all snapshots are listed rather than read by ID when many
+        snapshots are missing from the cache.
+        """
+        monkeypatch.setattr("backup.restic.client.MAX_SNAPSHOT_IDS_PER_CALL", 1)
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+            cached_client.backup(tmp_path / name, True, [])
+        invoked = len(mock_cmd_executor.invoked_commands)
+
+        snapshots = cached_client.all_snapshots()
+
+        subcmds = [
+            MockResticRepository.subcommand(c.cmd)
+            for c in mock_cmd_executor.invoked_commands[invoked:]
+        ]
+        assert len(snapshots) == 2
+        assert subcmds == [["list", "snapshots"], ["snapshots"]]
+
+    def test_all_snapshots_drops_removed_snapshots(
+        self,
+        tmp_path: Path,
+        mock_restic_repository: MockResticRepository,
+        cached_client: ResticClient,
+        metadata_cache: ResticMetadataCache,
+    ) -> None:
+        """
+        Ensures that snapshots removed from the repository are dropped from the cache.
+        """
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+            cached_client.backup(tmp_path / name, True, [])
+        cached_client.all_snapshots()
+
+        removed = mock_restic_repository.snapshots.pop(0)
+        metadata_cache.invalidate_snapshots()
+
+        assert [s.id for s in cached_client.all_snapshots()] == [
+            mock_restic_repository.snapshots[0]["id"]
+        ]
+        assert removed["id"] not in metadata_cache.snapshot_ids()
+
+    def test_all_snapshots_ignores_list_warnings(
+        self,
+        tmp_path: Path,
+        mock_restic_repository: MockResticRepository,
+        cached_client: ResticClient,
+    ) -> None:
+        """
+        Ensures that lines restic writes to stderr while listing snapshots are not
+        mistaken for snapshot IDs.
+        """
+        for name in ("a", "b"):
+            (tmp_path / name).mkdir()
+            cached_client.backup(tmp_path / name, True, [])
+        mock_restic_repository.list_stderr = ["repo already locked, waiting up to 0s"]
+
+        _, ids = cached_client.list_ids("snapshots")
+        assert ids == {s["id"] for s in mock_restic_repository.snapshots}
+        assert len(cached_client.all_snapshots()) == 2
+
+    def test_repository_is_initialized_cache_expires(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        mock_restic_repository: MockResticRepository,
+        cached_client: ResticClient,
+        metadata_cache: ResticMetadataCache,
+    ) -> None:
+        """
+        Ensures that the repository is checked again once the cached initialized flag
+        is older than its maximum age.
+        """
+        assert cached_client.repository_is_initialized()
+        metadata_cache.initialized_max_age = timedelta(0)
+
+        assert cached_client.repository_is_initialized()
+        assert len(mock_cmd_executor.invoked_commands) == 2
+
+    @pytest.mark.parametrize("returncode", [10, 12])
+    def test_repository_is_initialized_cache_cleared(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        cached_client: ResticClient,
+        metadata_cache: ResticMetadataCache,
+        returncode: int,
+    ) -> None:
+        """
+        Ensures that the cached initialized flag is cleared when restic reports that
+        the repository does not exist or the password is wrong.
+        """
+        metadata_cache.initialized = True
+        msg = {"message_type": "exit_error", "code": returncode, "message": "Fatal"}
+        mock_cmd_executor.set_result_json_messages(returncode, [msg])
+
+        cached_client.snapshots()
+
+        assert not metadata_cache.initialized
@@ -0,0 +1,163 @@
+"""
+Tests restic models.
+"""
+
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+from backup.restic.model import (
+    ResticBackupSummary,
+    ResticPruneStats,
+    ResticSnapshot,
+    ResticSnapshotIndex,
+)
+
+
+def snapshot(id: str, hostname: str, paths: list[str], age: int) -> ResticSnapshot:
+    """
+    Returns a ResticSnapshot with the given properties. Snapshots with a higher
+    age are older.
+    """
+    time = datetime(2025, 11, 1, tzinfo=timezone.utc) - timedelta(hours=age)
+    return ResticSnapshot(
+        time=time,
+        parent=None,
+        tree="0" * 64,
+        paths=[Path(p) for p in paths],
+        hostname=hostname,
+        username="root",
+        program_version="restic 0.18.1",
+        id=id,
+        short_id=id[:8],
+        summary=ResticBackupSummary(
+            None, time, time, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0, 0
+        ),
+    )
+
+
+class TestResticSnapshotIndex:
+    """
+    Tests the ResticSnapshotIndex class.
+    """
+
+    def test_latest_prefers_host(self) -> None:
+        """
+        Tests that the latest snapshot of the given host is preferred over newer
+        snapshots created by other hosts.
+        """
+        index = ResticSnapshotIndex(
+            [
+                snapshot("host-a-old", "a", ["/data/1"], 3),
+                snapshot("host-a-new", "a", ["/data/1"], 2),
+                snapshot("host-b", "b", ["/data/1"], 1),
+            ]
+        )
+
+        latest_a = index.latest([Path("/data/1")], "a")
+        latest_any = index.latest([Path("/data/1")])
+
+        assert latest_a is not None
+        assert latest_a.id == "host-a-new"
+        assert latest_any is not None
+        assert latest_any.id == "host-b"
+
+    def test_latest_falls_back_to_any_host(self) -> None:
+        """
+        Tests that the latest snapshot of any host is returned if the given host has
+        no snapshot of the paths.
+        """
+        index = ResticSnapshotIndex([snapshot("host-b", "b", ["/data/1"], 1)])
+
+        latest = index.latest([Path("/data/1")], "a")
+
+        assert latest is not None
+        assert latest.id == "host-b"
+
+    def test_latest_no_match(self) -> None:
+        """
+        Tests that no snapshot is returned for paths that were never backed up.
+        """
+        index = ResticSnapshotIndex([snapshot("multi", "a", ["/data/1", "/data/2"], 1)])
+
+        assert index.latest([Path("/data/1")], "a") is None
+        assert index.latest([Path("/data/2"), Path("/data/1")], "a") is not None
+
+    def test_latest_by_group(self) -> None:
+        """
+        Tests that snapshots are grouped by paths and tags regardless of host.
+        """
+        tagged = snapshot("tagged", "a", ["/data/1"], 1)
+        tagged.tags = ["weekly"]
+        index = ResticSnapshotIndex(
+            [
+                snapshot("old", "a", ["/data/1"], 3),
+                snapshot("new", "b", ["/data/1"], 2),
+                tagged,
+            ]
+        )
+
+        groups = index.latest_by_group()
+
+        assert {k: s.id for k, s in groups.items()} == {
+            ((Path("/data/1"),), ()): "new",
+            ((Path("/data/1"),), ("weekly",)): "tagged",
+        }
+        assert (
+            ResticSnapshotIndex.group_label(((Path("/data/1"),), ("weekly",)))
+            == "/data/1 [weekly]"
+        )
+
+
+class TestResticPruneStats:
+    """
+    Tests the ResticPruneStats class.
+    """
+
+    def stats(self, output: str) -> ResticPruneStats:
+        stats = ResticPruneStats()
+        for line in output.splitlines():
+            stats.add_line(line.encode("utf-8"))
+        return stats
+
+    def test_parse(self) -> None:
+        """
+        Tests that the statistics printed by restic prune are read.
+        """
+        stats = self.stats(
+            "loading indexes...\n"
+            "unused:          74 blobs / 1.500 MiB\n"
+            "total:        16181 blobs / 30 MiB\n"
+            "unused size: 5.00% of total size\n"
+            "to repack:       69 blobs / 2 KiB\n"
+            "total prune:     74 blobs / 1.000 MiB\n"
+        )
+
+        assert stats.unused == 1536 * 1024
+        assert stats.total == 30 * 1024 * 1024
+        assert stats.unused_percent == 5.0
+        assert stats.repacked == 2048
+        assert stats.freed == 1024 * 1024
+
+    def test_parse_without_totals(self) -> None:
+        """
+        Tests that the unused and total data are derived from what remains after the
+        prune if restic does not print them.
+        """
+        stats = self.stats(
+            "total prune:     74 blobs / 1 GiB\n"
+            "remaining:    16107 blobs / 3 GiB\n"
+            "unused size after prune: 0 B (0.00% of remaining size)\n"
+        )
+
+        assert stats.unused == 1024**3
+        assert stats.total == 4 * 1024**3
+        assert stats.unused_percent == 25.0
+
+    def test_parse_no_statistics(self) -> None:
+        """
+        Tests that no estimate is made if restic printed no statistics.
+        """
+        stats = self.stats("Fatal: unable to open repository\n")
+
+        assert stats.unused_percent is None
+        assert stats.freed is None
@@ -2,15 +2,25 @@
 Tests the ResticService class.
 """
 
-from os import geteuid
+from datetime import datetime, timedelta
+from os import geteuid, walk
 from pathlib import Path
 
 import pytest
 
 from backup.cmd import cmdexec
+from backup.queue import WorkQueue
+from backup.report import BackupReport
 from backup.restic import ResticClient, ResticService
+from backup.restic.cache import ResticMetadataCache
+from backup.restic.fingerprint import FingerprintStore
+from backup.restic.journal import BackupJournal
+from backup.restic.planner import BackupPlanner
+from backup.restic.schedule import ResticCheckSchedule
+from backup.state import StateDirectory
 
-from testlib import BackupSourceInfo
+from testlib import BackupSourceInfo, MockCommandExecutor
+from testlib.restic import MockResticRepository
 
 
 @pytest.fixture
@@ -419,3 +429,912 @@ class TestResticServiceIntegration:
 
         assert snapshots_removed is not None
         assert snapshots_removed.data == 1
+
+    @pytest.mark.slow
+    def test_replicate_local_directory(
+        self,
+        backup_src_info: BackupSourceInfo,
+        restic_remote_cache_dir: Path,
+        restic_remote_repository_path: str,
+        restic_password_file: Path,
+        restic_service: ResticService,
+    ) -> None:
+        """
+        Tests replicating snapshots into a repository in a local directory.
+        """
+        destination = ResticClient(
+            cmdexec,
+            restic_remote_repository_path,
+            restic_password_file,
+            restic_remote_cache_dir,
+        )
+        restic_service.backup(
+            name="test_replicate_local_directory",
+            source=backup_src_info.path,
+            for_each=True,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+
+        report = restic_service.replicate(destination)
+        again = restic_service.replicate(destination)
+        compare_report = restic_service.compare_latest_snapshots(destination)
+
+        copied = report.find_one_field(lambda f: f.label == "Snapshots Copied")
+        copied_again = again.find_one_field(lambda f: f.label == "Snapshots Copied")
+
+        assert report.successful
+        assert copied is not None
+        assert copied.data == len(backup_src_info.directories)
+        assert copied_again is not None
+        assert copied_again.data == 0
+        assert compare_report.successful
+
+
+class TestResticServiceMockCommandExecutor:
+    """
+    Tests the ResticService class where the underlying client uses a mock command
+    executor. The restic binary is not invoked for these tests.
+    """
+
+    @pytest.mark.parametrize("jobs", [1, 2, 8])
+    def test_backup_for_each_jobs(
+        self,
+        backup_src_info: BackupSourceInfo,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+        jobs: int,
+    ) -> None:
+        """
+        Tests that a for_each backup backs up every child regardless of the number of
+        concurrent jobs, and that subreports are attached in order of child name.
+        """
+        report = restic_service_mock_cmd.backup(
+            name="test_backup_for_each_jobs",
+            source=backup_src_info.path,
+            for_each=True,
+            skip_if_unchanged=False,
+            exclude_files=[],
+            jobs=jobs,
+        )
+
+        expected_names = sorted(
+            f"test_backup_for_each_jobs / {d.path.name}"
+            for d in backup_src_info.directories
+        )
+        backup_cwds = sorted(
+            c.cwd for c in mock_cmd_executor.invoked_commands if "backup" in c.cmd
+        )
+
+        assert report.successful
+        assert [r.name for r in report.subreports] == expected_names
+        assert backup_cwds == sorted(
+            backup_src_info.path / d.path for d in backup_src_info.directories
+        )
+
+    def test_backup_for_each_jobs_child_failure(
+        self,
+        backup_src_info: BackupSourceInfo,
+        mock_restic_repository: MockResticRepository,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that a failed child backup fails the report without preventing other
+        children from being backed up.
+        """
+        failing = backup_src_info.path / backup_src_info.directories[0].path
+        mock_restic_repository.failing_paths.add(failing)
+
+        report = restic_service_mock_cmd.backup(
+            name="test_backup_for_each_jobs_child_failure",
+            source=backup_src_info.path,
+            for_each=True,
+            skip_if_unchanged=False,
+            exclude_files=[],
+            jobs=2,
+        )
+
+        assert not report.successful
+        assert len(report.subreports) == backup_src_info.total_top_level_backup_targets
+        assert len(mock_restic_repository.snapshots) == len(report.subreports) - 1
+
+    def test_backup_invalid_jobs(
+        self,
+        backup_src_info: BackupSourceInfo,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that a backup with fewer than one job raises an exception.
+        """
+        with pytest.raises(ValueError):
+            restic_service_mock_cmd.backup(
+                name="test_backup_invalid_jobs",
+                source=backup_src_info.path,
+                for_each=True,
+                skip_if_unchanged=False,
+                exclude_files=[],
+                jobs=0,
+            )
+
+    def test_backup_for_each_unchanged_fingerprint(
+        self,
+        backup_src_info: BackupSourceInfo,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+        tmpdir: Path,
+    ) -> None:
+        """
+        Tests that restic is not invoked for children whose fingerprint is unchanged,
+        and that their subreports are omittable.
+        """
+        restic_service_mock_cmd.fingerprints = FingerprintStore(
+            StateDirectory(tmpdir / "state"),
+            restic_service_mock_cmd.client.repository_path,
+            timedelta(days=7),
+        )
+        changed = backup_src_info.path / backup_src_info.directories[0].path
+
+        def backup() -> BackupReport:
+            return restic_service_mock_cmd.backup(
+                name="test_backup_for_each_unchanged_fingerprint",
+                source=backup_src_info.path,
+                for_each=True,
+                skip_if_unchanged=True,
+                exclude_files=[],
+            )
+
+        def backup_cwds() -> list[Path]:
+            return [
+                c.cwd for c in mock_cmd_executor.invoked_commands if "backup" in c.cmd
+            ]
+
+        backup()
+        first_cwds = backup_cwds()
+        (changed / "new-file").write_text("new data")
+        mock_cmd_executor.invoked_commands.clear()
+        report = backup()
+
+        omittable = [r for r in report.subreports if r.omittable]
+
+        assert len(first_cwds) == backup_src_info.total_top_level_backup_targets
+        assert backup_cwds() == [changed]
+        assert report.successful
+        assert len(omittable) == backup_src_info.total_top_level_backup_targets - 1
+        assert all(
+            r.find_one_field(lambda f: f.label == "Snapshot ID") is not None
+            for r in omittable
+        )
+
+    def test_backup_resolves_parent_snapshot(
+        self,
+        backup_src_info: BackupSourceInfo,
+        mock_restic_repository: MockResticRepository,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that a backup passes the latest snapshot of the same path as its parent,
+        even if that snapshot was created by a different host.
+        """
+        client = restic_service_mock_cmd.client
+
+        def backup() -> BackupReport:
+            return restic_service_mock_cmd.backup(
+                name="test_backup_resolves_parent_snapshot",
+                source=backup_src_info.path,
+                for_each=False,
+                skip_if_unchanged=False,
+                exclude_files=[],
+            )
+
+        client.host = "old-pod-name"
+        first = backup()
+        client.host = "backupjob-test"
+        second = backup()
+        third = backup()
+
+        snapshots = mock_restic_repository.snapshots
+        parents = [
+            r.find_one_field(lambda f: f.label == "Parent Snapshot")
+            for r in [first, second, third]
+        ]
+
+        assert [p.data if p is not None else None for p in parents] == [
+            "(none)",
+            snapshots[0]["short_id"],
+            snapshots[1]["short_id"],
+        ]
+        assert [s["hostname"] for s in snapshots] == [
+            "old-pod-name",
+            "backupjob-test",
+            "backupjob-test",
+        ]
+
+    def test_backup_drop_page_cache(
+        self,
+        backup_src_info: BackupSourceInfo,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that the data of the backed up files is dropped from the page cache
+        after the backup if requested.
+        """
+        restic_service_mock_cmd.drop_page_cache = True
+
+        report = restic_service_mock_cmd.backup(
+            name="test_backup_drop_page_cache",
+            source=backup_src_info.path,
+            for_each=False,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+
+        files = sum(
+            1
+            for d, _, names in walk(backup_src_info.path)
+            for n in names
+            if (Path(d) / n).is_file() and not (Path(d) / n).is_symlink()
+        )
+        dropped = report.find_one_field(
+            lambda f: f.label == "Page Cache Dropped (files)"
+        )
+
+        assert report.successful
+        assert dropped is not None
+        assert dropped.data == files
+
+    def test_backup_drop_page_cache_unchanged(
+        self,
+        backup_src_info: BackupSourceInfo,
+        mock_restic_repository: MockResticRepository,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that the page cache is left alone if restic read no file data because
+        no file was new or changed.
+        """
+        restic_service_mock_cmd.drop_page_cache = True
+        mock_restic_repository.backup_summary = {"files_new": 0, "files_changed": 0}
+
+        report = restic_service_mock_cmd.backup(
+            name="test_backup_drop_page_cache_unchanged",
+            source=backup_src_info.path,
+            for_each=False,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+        dropped = report.find_one_field(
+            lambda f: f.label == "Page Cache Dropped (files)"
+        )
+
+        assert report.successful
+        assert dropped is not None
+        assert dropped.data == 0
+
+    def test_check_with_schedule(
+        self,
+        tmp_path: Path,
+        mock_restic_repository: MockResticRepository,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that scheduled checks verify successive subsets of the repository's data
+        and report when the repository was last fully verified.
+        """
+        restic_service_mock_cmd.check_schedule = ResticCheckSchedule(
+            StateDirectory(tmp_path / "state"), "repo", 2
+        )
+
+        first = restic_service_mock_cmd.check()
+        second = restic_service_mock_cmd.check()
+
+        def field(report: BackupReport, label: str) -> object:
+            return report.find_one_field(lambda f: f.label == label).data
+
+        assert first.successful and second.successful
+        assert [
+            MockResticRepository.option(c, "--read-data-subset")
+            for c in mock_restic_repository.checks
+        ] == ["1/2", "2/2"]
+        assert field(first, "Data Subset") == "1/2"
+        assert field(first, "Last Full Coverage") == "(never)"
+        assert field(first, "Cycle Started") == "(this check)"
+        assert field(second, "Data Subset") == "2/2"
+        assert isinstance(field(second, "Cycle Started"), datetime)
+        assert isinstance(field(second, "Last Full Coverage"), datetime)
+
+    def test_check_with_schedule_failure(
+        self,
+        tmp_path: Path,
+        mock_restic_repository: MockResticRepository,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that a subset whose check found errors is checked again by the next run.
+        """
+        schedule = ResticCheckSchedule(StateDirectory(tmp_path / "state"), "repo", 2)
+        restic_service_mock_cmd.check_schedule = schedule
+        mock_restic_repository.check_summary["num_errors"] = 1
+
+        report = restic_service_mock_cmd.check()
+
+        assert not report.successful
+        assert schedule.read_data_subset() == "1/2"
+
+    def test_backup_for_each_jobs_child_exception(
+        self,
+        backup_src_info: BackupSourceInfo,
+        restic_service_mock_cmd: ResticService,
+        monkeypatch: pytest.MonkeyPatch,
+    ) -> None:
+        """
+        Tests that the subreports of every child are attached even if the backup of
+        one child raises an exception.
+        """
+        failing = backup_src_info.path / backup_src_info.directories[0].path
+        backup_child = restic_service_mock_cmd._backup_child
+
+        def f(source: Path, *args, **kwargs) -> None:
+            if source == failing:
+                raise RuntimeError("boom")
+            backup_child(source, *args, **kwargs)
+
+        monkeypatch.setattr(restic_service_mock_cmd, "_backup_child", f)
+
+        report = restic_service_mock_cmd.backup(
+            name="test_backup_for_each_jobs_child_exception",
+            source=backup_src_info.path,
+            for_each=True,
+            skip_if_unchanged=False,
+            exclude_files=[],
+            jobs=2,
+        )
+
+        failed = [r for r in report.subreports if not r.successful]
+        assert not report.successful
+        assert len(report.subreports) == len(backup_src_info.directories)
+        assert [r.name.endswith(failing.name) for r in failed] == [True]
+
+    def test_compare_latest_snapshots_uses_metadata_cache(
+        self,
+        tmp_path: Path,
+        backup_src_info: BackupSourceInfo,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that compare_latest_snapshots reads snapshots through the client's
+        metadata cache.
+        """
+        client = restic_service_mock_cmd.client
+        client.metadata_cache = ResticMetadataCache(
+            StateDirectory(tmp_path / "state"), client.repository_path
+        )
+        restic_service_mock_cmd.backup(
+            name="test_compare_latest_snapshots_uses_metadata_cache",
+            source=backup_src_info.path,
+            for_each=False,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+        invoked = len(mock_cmd_executor.invoked_commands)
+
+        report = restic_service_mock_cmd.compare_latest_snapshots(client)
+
+        subcmds = [
+            MockResticRepository.subcommand(c.cmd)[0]
+            for c in mock_cmd_executor.invoked_commands[invoked:]
+        ]
+        assert report.successful
+        assert subcmds == ["list", "snapshots"]
+
+    def test_compare_latest_snapshots_per_path(
+        self,
+        mock_restic_repository: MockResticRepository,
+        remote_mock_restic_repository: MockResticRepository,
+        remote_restic_client_mock_cmd: ResticClient,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that the latest snapshot of each path is compared, and that a subreport
+        is produced for each path whose latest snapshots do not match.
+        """
+        local = mock_restic_repository
+        remote = remote_mock_restic_repository
+
+        # /data/a: the latest snapshot was copied to the remote repository.
+        remote.add_snapshot(
+            Path("/data/a"), original=local.add_snapshot(Path("/data/a"))["id"]
+        )
+        local_a = local.add_snapshot(Path("/data/a"))
+        remote.add_snapshot(Path("/data/a"), original=local_a["id"])
+
+        # /data/b: the remote repository lags behind.
+        remote_b = remote.add_snapshot(
+            Path("/data/b"), original=local.add_snapshot(Path("/data/b"))["id"]
+        )
+        local_b = local.add_snapshot(Path("/data/b"))
+
+        # /data/c: the remote repository has no snapshot.
+        local_c = local.add_snapshot(Path("/data/c"))
+
+        # /data/d: only in the remote repository; ignored.
+        remote.add_snapshot(Path("/data/d"))
+
+        report = restic_service_mock_cmd.compare_latest_snapshots(
+            remote_restic_client_mock_cmd
+        )
+
+        def field(report: BackupReport, label: str) -> object:
+            f = report.find_one_field(lambda f: f.label == label)
+            assert f is not None
+            return f.data
+
+        assert not report.successful
+        assert field(report, "Paths Compared") == 3
+        assert field(report, "Mismatched Paths") == 2
+        assert [field(r, "Local Snapshot ID") for r in report.subreports] == [
+            local_b["id"],
+            local_c["id"],
+        ]
+        assert field(report.subreports[0], "Remote Snapshot ID") == remote_b["id"]
+        assert field(report.subreports[1], "Remote Snapshot ID") == "(none)"
+
+    def test_compare_latest_snapshots_all_paths_match(
+        self,
+        mock_restic_repository: MockResticRepository,
+        remote_mock_restic_repository: MockResticRepository,
+        remote_restic_client_mock_cmd: ResticClient,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that the comparison is successful if the latest snapshot of every path
+        was copied to the remote repository.
+        """
+        for p in ("/data/a", "/data/b"):
+            snapshot = mock_restic_repository.add_snapshot(Path(p))
+            remote_mock_restic_repository.add_snapshot(Path(p), original=snapshot["id"])
+
+        report = restic_service_mock_cmd.compare_latest_snapshots(
+            remote_restic_client_mock_cmd
+        )
+
+        assert report.successful
+        assert report.subreports == []
+
+    def test_replicate(
+        self,
+        mock_restic_repository: MockResticRepository,
+        remote_mock_restic_repository: MockResticRepository,
+        remote_restic_client_mock_cmd: ResticClient,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that replication initializes the destination repository and copies
+        only the snapshots that are missing from it.
+        """
+        local = mock_restic_repository
+        remote = remote_mock_restic_repository
+        remote.initialized = False
+        remote.peers[restic_service_mock_cmd.client.repository_path] = local
+        for p in ("/data/a", "/data/b"):
+            local.add_snapshot(Path(p))
+
+        first = restic_service_mock_cmd.replicate(remote_restic_client_mock_cmd)
+        local.add_snapshot(Path("/data/a"))
+        second = restic_service_mock_cmd.replicate(remote_restic_client_mock_cmd)
+        third = restic_service_mock_cmd.replicate(remote_restic_client_mock_cmd)
+
+        def field(report: BackupReport, label: str) -> object:
+            f = report.find_one_field(lambda f: f.label == label)
+            assert f is not None
+            return f.data
+
+        assert first.successful and second.successful and third.successful
+        assert remote.init_args is not None
+        assert "--copy-chunker-params" in remote.init_args
+        assert field(first, "Snapshots Copied") == 2
+        assert field(first, "Bytes Copied (estimated)") == 1024
+        assert field(second, "Snapshots Copied") == 1
+        assert field(second, "Copied Snapshot IDs") == local.snapshots[2]["short_id"]
+        assert field(third, "Snapshots Copied") == 0
+        assert [s["original"] for s in remote.snapshots] == [
+            s["id"] for s in local.snapshots
+        ]
+
+        compare_report = restic_service_mock_cmd.compare_latest_snapshots(
+            remote_restic_client_mock_cmd
+        )
+        assert compare_report.successful
+
+    def test_backup_throughput_fields(
+        self,
+        backup_src_info: BackupSourceInfo,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that backup reports include the duration and throughput of each backup,
+        as recorded in restic's summary.
+        """
+        report = restic_service_mock_cmd.backup(
+            name="test_backup_throughput_fields",
+            source=backup_src_info.path,
+            for_each=False,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+
+        fields = {f.label: f.data for f in report.fields}
+        assert fields["Duration (s)"] == 10.0
+        assert fields["Files/s"] == 0.1
+        assert "Throughput (MB/s)" in fields
+
+    def test_backup_for_each_planned_order(
+        self,
+        tmp_path: Path,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that for_each children are backed up in the planner's order, and that
+        their subreports are still attached in order of child name.
+        """
+        source = tmp_path / "source"
+        for name, size in (("a", 10), ("b", 1000), ("c", 100)):
+            (source / name).mkdir(parents=True)
+            (source / name / "data").write_bytes(b"\0" * size)
+
+        restic_service_mock_cmd.planner = BackupPlanner(None)
+        report = restic_service_mock_cmd.backup(
+            name="test",
+            source=source,
+            for_each=True,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+
+        backup_cwds = [
+            c.cwd for c in mock_cmd_executor.invoked_commands if "backup" in c.cmd
+        ]
+        fields = {f.label: f.data for f in report.fields}
+        child_fields = {f.label: f.data for f in report.subreports[1].fields}
+
+        assert report.successful
+        assert backup_cwds == [source / "b", source / "c", source / "a"]
+        assert [r.name for r in report.subreports] == [
+            "test / a",
+            "test / b",
+            "test / c",
+        ]
+        assert fields["Backup Order"].splitlines()[0] == "b: 0s (size estimate)"
+        assert child_fields["Prediction Basis"] == "size estimate"
+        assert "Predicted Duration (s)" in child_fields
+        assert "Actual Duration (s)" in child_fields
+
+    def test_backup_for_each_priority(
+        self,
+        tmp_path: Path,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that for_each children with a higher priority are backed up first.
+        """
+        source = tmp_path / "source"
+        for name in ("a", "b", "c"):
+            (source / name).mkdir(parents=True)
+        (source / "c" / "backuppriority").write_text("10\n")
+        (source / "b" / "backuppriority").write_text("not a number")
+
+        report = restic_service_mock_cmd.backup(
+            name="test",
+            source=source,
+            for_each=True,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+
+        backup_cwds = [
+            c.cwd for c in mock_cmd_executor.invoked_commands if "backup" in c.cmd
+        ]
+        fields = {f.label: f.data for f in report.fields}
+
+        assert report.successful
+        assert backup_cwds == [source / "c", source / "a", source / "b"]
+        assert fields["Backup Order"] == "c [priority 10]\na\nb"
+
+    def test_backup_for_each_deadline(
+        self,
+        tmp_path: Path,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that for_each children that are not predicted to finish before the
+        deadline are deferred, and that restic is given the time left as its timeout.
+        """
+        source = tmp_path / "source"
+        for name, size in (("a", 100), ("b", 100_000)):
+            (source / name).mkdir(parents=True)
+            (source / name / "data").write_bytes(b"\0" * size)
+
+        restic_service_mock_cmd.planner = BackupPlanner(None)
+        restic_service_mock_cmd.planner.assumed_throughput = 1000
+        restic_service_mock_cmd.deadline = datetime.now() + timedelta(seconds=60)
+        report = restic_service_mock_cmd.backup(
+            name="test",
+            source=source,
+            for_each=True,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+
+        backups = [c for c in mock_cmd_executor.invoked_commands if "backup" in c.cmd]
+        fields = {f.label: f.data for f in report.fields}
+        deferred = {f.label: f.data for f in report.subreports[1].fields}
+
+        assert report.successful
+        assert [c.cwd for c in backups] == [source / "a"]
+        assert backups[0].timeout is not None and 0 < backups[0].timeout <= 60
+        assert fields["Deferred"] == "b"
+        assert deferred["Deferred"].endswith("s left before the deadline")
+        assert "Snapshot ID" not in deferred
+
+    def test_backup_deadline_passed(
+        self,
+        backup_src_info: BackupSourceInfo,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that no children are backed up once the deadline has passed, even
+        without predictions.
+        """
+        restic_service_mock_cmd.deadline = datetime.now() - timedelta(seconds=1)
+        report = restic_service_mock_cmd.backup(
+            name="test",
+            source=backup_src_info.path,
+            for_each=True,
+            skip_if_unchanged=False,
+            exclude_files=[],
+        )
+
+        fields = {f.label: f.data for f in report.fields}
+
+        assert not any("backup" in c.cmd for c in mock_cmd_executor.invoked_commands)
+        assert fields["Deferred"] == ", ".join(
+            sorted(d.path.name for d in backup_src_info.directories)
+        )
+
+    def test_backup_for_each_resume(
+        self,
+        tmp_path: Path,
+        backup_src_info: BackupSourceInfo,
+        mock_cmd_executor: MockCommandExecutor,
+        mock_restic_repository: MockResticRepository,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that a retried run only backs up the children that did not complete
+        during the earlier attempt, and reports the results of both attempts.
+        """
+        state = StateDirectory(tmp_path / "state")
+        failing = backup_src_info.path / backup_src_info.directories[0].path
+        mock_restic_repository.failing_paths.add(failing)
+
+        def backup() -> BackupReport:
+            restic_service_mock_cmd.journal = BackupJournal(
+                state, "repo", backup_src_info.path, "run-1"
+            )
+            return restic_service_mock_cmd.backup(
+                name="test",
+                source=backup_src_info.path,
+                for_each=True,
+                skip_if_unchanged=False,
+                exclude_files=[],
+            )
+
+        first = backup()
+        mock_restic_repository.failing_paths.clear()
+        mock_cmd_executor.invoked_commands.clear()
+        second = backup()
+
+        backup_cwds = [
+            c.cwd for c in mock_cmd_executor.invoked_commands if "backup" in c.cmd
+        ]
+        fields = {f.label: f.data for f in second.fields}
+        resumed = [
+            r.name
+            for r in second.subreports
+            if r.find_one_field(lambda f: f.label == "Resumed") is not None
+        ]
+
+        assert not first.successful
+        assert second.successful
+        assert backup_cwds == [failing]
+        assert fields["Attempt"] == 2
+        assert fields["Resumed"] == len(backup_src_info.directories) - 1
+        assert [r.name for r in second.subreports] == [r.name for r in first.subreports]
+        assert len(resumed) == len(backup_src_info.directories) - 1
+        assert f"test / {failing.name}" not in resumed
+
+    def test_backup_queued_coordinator(
+        self,
+        tmp_path: Path,
+        backup_src_info: BackupSourceInfo,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that a coordinator without workers backs up every child through the
+        queue and reports on all of them.
+        """
+        queue = WorkQueue(tmp_path / "queue", "coordinator")
+        report = restic_service_mock_cmd.backup_queued(
+            name="test",
+            source=backup_src_info.path,
+            skip_if_unchanged=False,
+            exclude_files=[],
+            queue=queue,
+            run_id="run-1",
+            coordinator=True,
+        )
+
+        expected_names = sorted(
+            f"test / {d.path.name}" for d in backup_src_info.directories
+        )
+
+        assert report.successful
+        assert queue.finished()
+        assert [r.name for r in report.subreports] == expected_names
+        assert all(r.successful for r in report.subreports)
+
+    def test_backup_queued_worker(
+        self,
+        tmp_path: Path,
+        backup_src_info: BackupSourceInfo,
+        mock_cmd_executor: MockCommandExecutor,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that a worker backs up the children of a populated queue, and that the
+        coordinator reports on children backed up by workers without backing them up
+        again.
+        """
+        children = sorted(d.path.name for d in backup_src_info.directories)
+        WorkQueue(tmp_path / "queue", "coordinator").populate("run-1", children)
+
+        worker_report = restic_service_mock_cmd.backup_queued(
+            name="test",
+            source=backup_src_info.path,
+            skip_if_unchanged=False,
+            exclude_files=[],
+            queue=WorkQueue(tmp_path / "queue", "worker"),
+            run_id="run-1",
+            coordinator=False,
+        )
+        backups = len(
+            [c for c in mock_cmd_executor.invoked_commands if "backup" in c.cmd]
+        )
+
+        report = restic_service_mock_cmd.backup_queued(
+            name="test",
+            source=backup_src_info.path,
+            skip_if_unchanged=False,
+            exclude_files=[],
+            queue=WorkQueue(tmp_path / "queue", "coordinator"),
+            run_id="run-1",
+            coordinator=True,
+        )
+
+        worker_fields = {f.label: f.data for f in worker_report.fields}
+        child_fields = {f.label: f.data for f in report.subreports[0].fields}
+
+        assert worker_report.successful and worker_report.omittable
+        assert worker_report.subreports == []
+        assert worker_fields["Children Backed Up"] == len(children)
+        assert backups == len(children)
+        assert (
+            len([c for c in mock_cmd_executor.invoked_commands if "backup" in c.cmd])
+            == backups
+        )
+        assert report.successful
+        assert [r.name for r in report.subreports] == [f"test / {c}" for c in children]
+        assert child_fields["Worker"] == "worker"
+
+    def test_backup_queued_worker_without_queue(
+        self,
+        tmp_path: Path,
+        backup_src_info: BackupSourceInfo,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that a worker gives up if the queue is not populated for its run.
+        """
+        queue = WorkQueue(tmp_path / "queue", "worker")
+        queue.poll_interval = 0.01
+        queue.wait_timeout = timedelta(seconds=0.05)
+
+        report = restic_service_mock_cmd.backup_queued(
+            name="test",
+            source=backup_src_info.path,
+            skip_if_unchanged=False,
+            exclude_files=[],
+            queue=queue,
+            run_id="run-1",
+            coordinator=False,
+        )
+
+        assert not report.successful
+        assert report.find_one_field(lambda f: f.label == "Error") is not None
+
+    @pytest.mark.parametrize(
+        "threshold, pruned", [(0.0, True), (2.5, True), (3.0, False)]
+    )
+    def test_prune_repack_threshold(
+        self,
+        mock_restic_repository: MockResticRepository,
+        restic_service_mock_cmd: ResticService,
+        threshold: float,
+        pruned: bool,
+    ) -> None:
+        """
+        Tests that the repository is only pruned if the share of unused data estimated
+        by a dry run reaches the threshold, and that forgetting snapshots does not
+        prune.
+        """
+        report = restic_service_mock_cmd.prune_repack(
+            name="test",
+            keep_last=1,
+            keep_within_hourly=None,
+            keep_within_daily=None,
+            keep_within_weekly=None,
+            keep_within_monthly=None,
+            keep_within_yearly=None,
+            prune_threshold=threshold,
+            max_unused="5%",
+        )
+
+        fields = {f.label: f.data for f in report.fields}
+        prunes = [p for p in mock_restic_repository.prunes if "--dry-run" not in p]
+        dry_runs = [p for p in mock_restic_repository.prunes if "--dry-run" in p]
+
+        assert report.successful
+        assert fields["Pruned"] is pruned
+        assert len(prunes) == (1 if pruned else 0)
+        assert len(dry_runs) == (0 if threshold == 0 else 1)
+        if threshold > 0:
+            assert fields["Unused Data (%)"] == 2.74
+            assert dry_runs[0][dry_runs[0].index("--max-unused") + 1] == "5%"
+        if pruned:
+            assert fields["Bytes Repacked"] == int(1.078 * 1024 * 1024)
+            assert fields["Bytes Freed"] == int(1.072 * 1024 * 1024)
+            assert "Prune Duration (s)" in fields
+
+    def test_prune_repack_time_budget(
+        self,
+        mock_cmd_executor: MockCommandExecutor,
+        mock_restic_repository: MockResticRepository,
+        restic_service_mock_cmd: ResticService,
+    ) -> None:
+        """
+        Tests that the prune is given the time budget as its timeout, and that a prune
+        interrupted when the budget is used up is not a failure.
+        """
+        mock_restic_repository.prune_returncode = 130
+        report = restic_service_mock_cmd.prune_repack(
+            name="test",
+            keep_last=1,
+            keep_within_hourly=None,
+            keep_within_daily=None,
+            keep_within_weekly=None,
+            keep_within_monthly=None,
+            keep_within_yearly=None,
+            prune_time_budget=timedelta(hours=2),
+        )
+
+        prune = [c for c in mock_cmd_executor.invoked_commands if "prune" in c.cmd][-1]
+        fields = {f.label: f.data for f in report.fields}
+
+        assert prune.timeout == 7200
+        assert report.successful
+        assert fields["Prune Interrupted"] == "time budget used up"
@@ -0,0 +1,69 @@
+"""
+Tests the ResticCheckSchedule class.
+"""
+
+from datetime import datetime
+from pathlib import Path
+
+import pytest
+
+from backup.restic.schedule import ResticCheckSchedule
+from backup.state import StateDirectory
+
+
+@pytest.fixture
+def state(tmp_path: Path) -> StateDirectory:
+    return StateDirectory(tmp_path / "state")
+
+
+def test_schedule_rotates_through_slices(state: StateDirectory) -> None:
+    """
+    Ensures that the schedule moves through every slice and records full coverage
+    once the last slice has been checked.
+    """
+    schedule = ResticCheckSchedule(state, "repo", 3)
+    subsets = list()
+    for day in range(1, 5):
+        subsets.append(schedule.read_data_subset())
+        schedule.complete(datetime(2025, 11, day))
+
+    assert subsets == ["1/3", "2/3", "3/3", "1/3"]
+    assert schedule.last_full_coverage == datetime(2025, 11, 3)
+    assert schedule.cycle_started == datetime(2025, 11, 4)
+    assert schedule.next_slice == 2
+
+
+def test_schedule_is_persisted(state: StateDirectory) -> None:
+    """
+    Ensures that the schedule's position is persisted between instances.
+    """
+    ResticCheckSchedule(state, "repo", 3).complete(datetime(2025, 11, 1))
+
+    schedule = ResticCheckSchedule(state, "repo", 3)
+    assert schedule.read_data_subset() == "2/3"
+    assert schedule.cycle_started == datetime(2025, 11, 1)
+    assert ResticCheckSchedule(state, "other-repo", 3).read_data_subset() == "1/3"
+
+
+def test_schedule_restarts_when_slices_change(state: StateDirectory) -> None:
+    """
+    Ensures that the cycle starts over if the number of slices changes, but the time
+    of the last full coverage is kept.
+    """
+    schedule = ResticCheckSchedule(state, "repo", 1)
+    schedule.complete(datetime(2025, 11, 1))
+    schedule = ResticCheckSchedule(state, "repo", 2)
+    schedule.complete(datetime(2025, 11, 2))
+
+    schedule = ResticCheckSchedule(state, "repo", 4)
+    assert schedule.read_data_subset() == "1/4"
+    assert schedule.cycle_started is None
+    assert schedule.last_full_coverage == datetime(2025, 11, 1)
+
+
+def test_schedule_invalid_slices(state: StateDirectory) -> None:
+    """
+    Ensures that a schedule requires at least one slice.
+    """
+    with pytest.raises(ValueError):
+        ResticCheckSchedule(state, "repo", 0)
@@ -2,6 +2,8 @@
 Tests the backup commandline application.
 """
 
+from argparse import Namespace
+from datetime import timedelta
 from os import environ
 from pathlib import Path
 import random
@@ -12,6 +14,11 @@ from typing import Generator
 import pytest
 
 from backup.application import BackupApplication
+from backup.bandwidth import AdaptiveThrottle
+from backup.metrics import MIB
+from backup.rclone.rcd import RcloneRcdClient
+from backup.report import BackupReport
+from backup.tuning import CgroupLimits, RuntimeTuning
 
 from testlib.backupsrc import BackupSourceInfo
 
@@ -287,3 +294,464 @@ class TestBackupApplicationIntegration:
                 str(restic_backup_source),
             ]
         )
+
+
+class TestBackupApplicationArguments:
+    """
+    Tests the backup application's argument parsing.
+    """
+
+    def restic_backup_argv(self, *args: str) -> list[str]:
+        return [
+            "--name",
+            "Data Backup",
+            "--reporter",
+            "googlechat",
+            "restic",
+            "--repository",
+            "/tmp/repository",
+            "--cache-dir",
+            "/tmp/cache",
+            "--password-file",
+            "/tmp/password",
+            "backup",
+            *args,
+            "/tmp/source",
+        ]
+
+    def test_jobs(self) -> None:
+        """
+        Tests that --jobs is parsed as an integer.
+        """
+        args = (
+            BackupApplication()
+            .argparser()
+            .parse_args(self.restic_backup_argv("--jobs", "4"))
+        )
+
+        assert args.jobs == 4
+
+    @pytest.mark.parametrize("jobs", ["0", "-1", "two"])
+    def test_jobs_invalid(self, jobs: str) -> None:
+        """
+        Tests that --jobs values below 1 are rejected as usage errors.
+        """
+        with pytest.raises(SystemExit):
+            BackupApplication().argparser().parse_args(
+                self.restic_backup_argv("--jobs", jobs)
+            )
+
+    def test_queue_dir_requires_run_id(self) -> None:
+        """
+        Tests that --queue-dir without --run-id is rejected as a usage error.
+        """
+        app = BackupApplication()
+        argparser = app.argparser()
+        argv = self.restic_backup_argv("--queue-dir", "/tmp/queue")
+
+        with pytest.raises(SystemExit) as e:
+            app.parse_args(argparser, argv)
+        assert e.value.code == 2
+
+        args = app.parse_args(argparser, [*argv[:-1], "--run-id", "1", argv[-1]])
+        assert args.run_id == "1"
+
+    @pytest.mark.parametrize("fingerprint_max_age", ["-5", "inf", "1e400", "7x"])
+    def test_fingerprint_max_age_invalid(self, fingerprint_max_age: str) -> None:
+        """
+        Tests that invalid --fingerprint-max-age values are rejected as usage errors.
+        """
+        with pytest.raises(SystemExit):
+            BackupApplication().argparser().parse_args(
+                self.restic_backup_argv("--fingerprint-max-age", fingerprint_max_age)
+            )
+
+    def test_deadline(self) -> None:
+        """
+        Tests that --deadline is parsed as a duration.
+        """
+        args = (
+            BackupApplication()
+            .argparser()
+            .parse_args(self.restic_backup_argv("--deadline", "5h"))
+        )
+
+        assert args.deadline == timedelta(hours=5)
+
+    @pytest.mark.parametrize("value, expected", [("10", 10.0), ("2.5%", 2.5)])
+    def test_prune_threshold(self, value: str, expected: float) -> None:
+        """
+        Tests that --prune-threshold is parsed as a percentage.
+        """
+        argv = self.restic_backup_argv()
+        argv = argv[: argv.index("backup")] + [
+            "prune-repack",
+            "--keep-last",
+            "1",
+            "--prune-threshold",
+            value,
+        ]
+        args = BackupApplication().argparser().parse_args(argv)
+
+        assert args.prune_threshold == expected
+
+    def test_runtime_tuning(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """
+        Tests that restic is tuned to the container's limits and that the tuned
+        settings are recorded on the report.
+        """
+        monkeypatch.delenv("GOMAXPROCS", raising=False)
+        monkeypatch.delenv("GOMEMLIMIT", raising=False)
+        app = BackupApplication()
+        app.tuning = RuntimeTuning(CgroupLimits(2.0, 1000 * MIB))
+        argv = self.restic_backup_argv()
+        argv[argv.index("/tmp/repository")] = "s3:s3.amazonaws.com/bucket"
+
+        service = app.restic_service(app.argparser().parse_args(argv))
+        report = BackupReport("test")
+        app.add_tuning_field(report)
+
+        assert service.client.env == {
+            "GOMAXPROCS": "2",
+            "GOMEMLIMIT": "800MiB",
+        }
+        assert service.client.read_concurrency == 2
+        assert service.client.options == {"s3.connections": "4"}
+        assert report.fields[0].data == (
+            "CPU limit: 2\n"
+            "Memory limit: 1000MiB\n"
+            "GOMAXPROCS: 2\n"
+            "GOMEMLIMIT: 800MiB\n"
+            "restic --read-concurrency: 2\n"
+            "restic -o s3.connections: 4"
+        )
+
+    def test_runtime_tuning_jobs(self, monkeypatch: pytest.MonkeyPatch) -> None:
+        """
+        Tests that restic processes backing up children concurrently share the
+        container's limits.
+        """
+        monkeypatch.delenv("GOMAXPROCS", raising=False)
+        monkeypatch.delenv("GOMEMLIMIT", raising=False)
+        app = BackupApplication()
+        app.tuning = RuntimeTuning(CgroupLimits(2.0, 1000 * MIB))
+        argv = self.restic_backup_argv("--jobs", "2")
+        argv[argv.index("/tmp/repository")] = "s3:s3.amazonaws.com/bucket"
+
+        service = app.restic_service(app.argparser().parse_args(argv))
+
+        assert service.client.env == {
+            "GOMAXPROCS": "1",
+            "GOMEMLIMIT": "400MiB",
+        }
+        assert service.client.options == {"s3.connections": "2"}
+        assert app.tuned_settings["Concurrent processes"] == "2"
+
+    def test_process_priority(self, tmp_path: Path) -> None:
+        """
+        Tests that the priority options are parsed, and that a cgroup that cannot be
+        set up is left out of the priority.
+        """
+        (tmp_path / "file").touch()
+        argv = [
+            "--nice",
+            "10",
+            "--ionice-class",
+            "idle",
+            "--cgroup",
+            str(tmp_path / "file" / "backup"),
+            "--cpu-weight",
+            "50",
+            *self.restic_backup_argv(),
+        ]
+        app = BackupApplication()
+        priority = app.process_priority(app.argparser().parse_args(argv))
+
+        assert priority is not None
+        assert priority.describe() == "nice 10, ionice idle"
+
+    def test_process_priority_unset(self) -> None:
+        """
+        Tests that no priority is set unless one is configured.
+        """
+        app = BackupApplication()
+        args = app.argparser().parse_args(self.restic_backup_argv())
+
+        assert app.process_priority(args) is None
+
+    def test_record_history_unwritable(self, tmp_path: Path) -> None:
+        """
+        Tests that failing to create the run history does not raise, so that the
+        report is still sent.
+        """
+        (tmp_path / "file").touch()
+        report = BackupReport("test")
+
+        BackupApplication().record_history(tmp_path / "file" / "h.sqlite", report)
+
+        assert report.fields == []
+
+    def test_rclone_transfer_settings(self) -> None:
+        """
+        Tests that rclone transfer settings given as arguments take precedence over
+        those derived from the container's limits.
+        """
+        app = BackupApplication()
+        app.tuning = RuntimeTuning(CgroupLimits(2.0, 1000 * MIB))
+        argv = [
+            "--name",
+            "Data Backup",
+            "--reporter",
+            "googlechat",
+            "rclone",
+            "--transfers",
+            "16",
+            "--fast-list",
+            "sync",
+            "/tmp/source",
+            "s3:bucket",
+        ]
+
+        service = app.rclone_service(app.argparser().parse_args(argv))
+
+        assert service.client.transfers == 16
+        assert service.client.checkers == 8
+        assert service.client.fast_list
+        assert service.client.s3_upload_concurrency == 2
+        assert service.client.s3_chunk_size == "25M"
+        assert "rclone --transfers" not in app.tuned_settings
+        assert app.tuned_settings["rclone --s3-chunk-size"] == "25M"
+
+    @pytest.mark.parametrize("rcd, gomemlimit", [(False, "400MiB"), (True, "800MiB")])
+    def test_rclone_jobs_tuning(
+        self, monkeypatch: pytest.MonkeyPatch, rcd: bool, gomemlimit: str
+    ) -> None:
+        """
+        Tests that the rclone processes of a sharded sync are each tuned to their
+        share of the container's limits, and that a single rclone rcd process running
+        every shard keeps the whole memory limit.
+        """
+        monkeypatch.delenv("GOMAXPROCS", raising=False)
+        monkeypatch.delenv("GOMEMLIMIT", raising=False)
+        app = BackupApplication()
+        app.tuning = RuntimeTuning(CgroupLimits(4.0, 1000 * MIB))
+        argv = [
+            "--name",
+            "Data Backup",
+            "--reporter",
+            "googlechat",
+            "rclone",
+            *(["--rcd"] if rcd else []),
+            "sync",
+            "--jobs",
+            "2",
+            "/tmp/source",
+            "s3:bucket",
+        ]
+
+        service = app.rclone_service(app.argparser().parse_args(argv))
+
+        assert service.client.env["GOMEMLIMIT"] == gomemlimit
+        assert service.client.transfers == 4
+        assert service.client.checkers == 8
+        assert service.client.s3_upload_concurrency == 2
+        assert service.client.s3_chunk_size == "50M"
+
+    def test_rclone_checksum_cache(self) -> None:
+        """
+        Tests that --checksum-cache keeps rclone's cache directory next to the
+        checksum cache.
+        """
+        app = BackupApplication()
+        argv = [
+            "--name",
+            "Data Backup",
+            "--reporter",
+            "googlechat",
+            "rclone",
+            "--checksum-cache",
+            "/state/checksums.db",
+            "sync",
+            "/tmp/source",
+            "s3:bucket",
+        ]
+
+        service = app.rclone_service(app.argparser().parse_args(argv))
+
+        assert service.checksum_cache is not None
+        assert service.checksum_cache.path == Path("/state/checksums.db")
+        assert service.client.cache_dir == Path("/state/rclone-cache")
+
+    def test_rclone_rcd(self) -> None:
+        """
+        Tests that --rcd runs rclone through a long-lived rclone rcd process.
+        """
+        app = BackupApplication()
+        argv = [
+            "--name",
+            "Data Backup",
+            "--reporter",
+            "googlechat",
+            "rclone",
+            "--rcd",
+            "sync",
+            "/tmp/source",
+            "s3:bucket",
+        ]
+
+        service = app.rclone_service(app.argparser().parse_args(argv))
+
+        assert isinstance(service.client, RcloneRcdClient)
+        assert service.client.daemon is None
+
+    def test_run_manifest(self, tmp_path: Path) -> None:
+        """
+        Tests that the jobs of a manifest are parsed like separate invocations and
+        reported under a single report.
+        """
+        manifest = tmp_path / "jobs.yml"
+        manifest.write_text(
+            "jobs:\n"
+            "  - name: Photos Sync\n"
+            "    args: rclone --transfers 8 sync /data/photos s3:photos\n"
+            "  - name: Photos Sync 2\n"
+            "    args: [rclone, sync, /data/photos, s3:photos-2]\n"
+            "    after: [Photos Sync]\n"
+        )
+        app = BackupApplication()
+        synced: list[tuple[str, int, str]] = list()
+
+        def rclone_sync(args: Namespace) -> BackupReport:
+            synced.append((args.name, args.transfers, args.destination))
+            r = BackupReport(args.name)
+            r.successful = True
+            return r
+
+        app.rclone_sync = rclone_sync  # type: ignore
+        argv = [
+            "--name",
+            "Nightly",
+            "--reporter",
+            "googlechat",
+            "run-manifest",
+            str(manifest),
+        ]
+        args = app.parse_args(app.argparser(), argv)
+
+        report = args.func(args)
+
+        assert report.successful
+        assert [r.name for r in report.subreports] == ["Photos Sync", "Photos Sync 2"]
+        assert synced == [
+            ("Photos Sync", 8, "s3:photos"),
+            ("Photos Sync 2", None, "s3:photos-2"),
+        ]
+
+    def test_run_manifest_invalid_job(
+        self, tmp_path: Path, capsys: pytest.CaptureFixture
+    ) -> None:
+        """
+        Tests that invalid arguments of a job are a usage error naming the job, found
+        before any job runs.
+        """
+        manifest = tmp_path / "jobs.yml"
+        manifest.write_text(
+            "jobs:\n"
+            "  - name: Sync\n"
+            "    args: rclone sync /data s3:data\n"
+            "  - name: Broken\n"
+            "    args: rclone --no-such-flag sync /data s3:data\n"
+        )
+        app = BackupApplication()
+        argv = [
+            "--name",
+            "N",
+            "--reporter",
+            "googlechat",
+            "run-manifest",
+            str(manifest),
+        ]
+
+        with pytest.raises(SystemExit) as e:
+            app.parse_args(app.argparser(), argv)
+
+        assert e.value.code == 2
+        error = capsys.readouterr().err.strip().splitlines()[-1]
+        assert "invalid arguments for job 'Broken'" in error
+        assert "--no-such-flag" in error
+
+    def test_run_manifest_tuning(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """
+        Tests that jobs running concurrently share the container's limits.
+        """
+        monkeypatch.delenv("GOMAXPROCS", raising=False)
+        monkeypatch.delenv("GOMEMLIMIT", raising=False)
+        manifest = tmp_path / "jobs.yml"
+        manifest.write_text(
+            "concurrency: 2\n"
+            "jobs:\n"
+            "  - name: Sync\n"
+            "    args: rclone sync /data s3:data\n"
+        )
+        app = BackupApplication()
+        app.tuning = RuntimeTuning(CgroupLimits(4.0, 1000 * MIB))
+        env: list[str] = list()
+
+        def rclone_sync(args: Namespace) -> BackupReport:
+            env.append(app.rclone_service(args).client.env["GOMEMLIMIT"])
+            r = BackupReport(args.name)
+            r.successful = True
+            return r
+
+        app.rclone_sync = rclone_sync  # type: ignore
+        argv = [
+            "--name",
+            "N",
+            "--reporter",
+            "googlechat",
+            "run-manifest",
+            str(manifest),
+        ]
+        args = app.parse_args(app.argparser(), argv)
+
+        args.func(args)
+
+        assert env == ["400MiB"]
+        assert app.tuned_settings["Concurrent processes"] == "2"
+
+    def test_bwlimit(self) -> None:
+        """
+        Tests that --bwlimit and --bwlimit-probe configure an adaptive throttle on the
+        restic client.
+        """
+        argv = self.restic_backup_argv(
+            "--bwlimit", "08:00,1M 18:00,off", "--bwlimit-probe", "example.com:443"
+        )
+        app = BackupApplication()
+        args = app.argparser().parse_args(argv)
+        policy = app.bandwidth_policy(args.bwlimit, args.bwlimit_probe)
+
+        assert isinstance(policy, AdaptiveThrottle)
+        assert policy.probe.host == "example.com"
+        assert policy.probe.port == 443
+        assert app.bandwidth_policy(args.bwlimit, None) is args.bwlimit
+
+    def test_restic_state_next_to_cache_dir(
+        self, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """
+        Tests that state is kept next to the restic cache directory by default, even
+        if the cache directory has no name of its own.
+        """
+        app = BackupApplication()
+        cache_dir = tmp_path / "cache"
+        cache_dir.mkdir()
+        monkeypatch.chdir(cache_dir)
+
+        argv = self.restic_backup_argv()
+        argv[argv.index("/tmp/cache")] = "."
+        state = app.restic_state(app.argparser().parse_args(argv))
+
+        assert state.root == tmp_path / "cache.backupjob"
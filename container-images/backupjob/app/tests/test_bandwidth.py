@@ -0,0 +1,194 @@
+"""
+Tests bandwidth limits.
+"""
+
+from datetime import datetime
+from typing import Optional
+
+import pytest
+
+from backup.bandwidth import (
+    AdaptiveThrottle,
+    BandwidthLimit,
+    BandwidthSchedule,
+    KIB,
+    LatencyProbe,
+)
+from backup.metrics import MIB
+
+# A Monday.
+MONDAY = datetime(2024, 6, 3)
+
+
+class ScriptedProbe(LatencyProbe):
+    """
+    LatencyProbe returning scripted latencies.
+    """
+
+    def __init__(self, latencies: list[Optional[float]]) -> None:
+        super().__init__("localhost", 0)
+        self.latencies = latencies
+
+    def measure(self) -> Optional[float]:
+        return self.latencies.pop(0)
+
+
+class TestBandwidthSchedule:
+    """
+    Tests the BandwidthSchedule class.
+    """
+
+    @pytest.mark.parametrize(
+        "timetable, upload, download",
+        [
+            ("off", None, None),
+            ("512", 512 * KIB, 512 * KIB),
+            ("1.5M", int(1.5 * MIB), int(1.5 * MIB)),
+            ("10M:off", 10 * MIB, None),
+            ("100b:2g", 100, 2 * 1024 * MIB),
+        ],
+    )
+    def test_parse_static(
+        self, timetable: str, upload: Optional[int], download: Optional[int]
+    ) -> None:
+        """
+        Tests that a single bandwidth applies at all times.
+        """
+        schedule = BandwidthSchedule.parse(timetable)
+
+        assert schedule.limit(MONDAY) == BandwidthLimit(upload, download)
+        assert schedule.limit(MONDAY.replace(hour=23)) == BandwidthLimit(
+            upload, download
+        )
+
+    def test_parse_daily(self) -> None:
+        """
+        Tests that each entry applies until the next, wrapping around midnight.
+        """
+        schedule = BandwidthSchedule.parse("08:00,512k 19:00,10M 23:00,off")
+
+        assert schedule.limit(MONDAY.replace(hour=7)) == BandwidthLimit(None, None)
+        assert schedule.limit(MONDAY.replace(hour=8)) == BandwidthLimit(
+            512 * KIB, 512 * KIB
+        )
+        assert schedule.limit(MONDAY.replace(hour=20)) == BandwidthLimit(
+            10 * MIB, 10 * MIB
+        )
+
+    def test_parse_weekly(self) -> None:
+        """
+        Tests that entries restricted to a day only apply from that day on, and that
+        the last entry of the week applies before the first.
+        """
+        schedule = BandwidthSchedule.parse("Tue-08:00,1M Sat-00:00,off")
+
+        assert schedule.limit(MONDAY.replace(hour=12)) == BandwidthLimit(None, None)
+        assert schedule.limit(datetime(2024, 6, 4, 9)) == BandwidthLimit(MIB, MIB)
+        assert schedule.limit(datetime(2024, 6, 7, 23)) == BandwidthLimit(MIB, MIB)
+        assert schedule.limit(datetime(2024, 6, 8, 1)) == BandwidthLimit(None, None)
+
+    @pytest.mark.parametrize(
+        "timetable",
+        ["", "fast", "08:00,1M 09:00", "25:00,1M", "Xyz-08:00,1M", "08:00,1Q"],
+    )
+    def test_parse_invalid(self, timetable: str) -> None:
+        """
+        Tests that invalid timetables are rejected.
+        """
+        with pytest.raises(ValueError):
+            BandwidthSchedule.parse(timetable)
+
+    def test_rclone_bwlimit(self) -> None:
+        """
+        Tests that rclone is given the whole timetable.
+        """
+        timetable = "08:00,512k 23:00,off"
+        schedule = BandwidthSchedule.parse(timetable)
+
+        assert schedule.rclone_bwlimit(schedule.limit(MONDAY)) == timetable
+
+
+class TestBandwidthLimit:
+    """
+    Tests the BandwidthLimit class.
+    """
+
+    def test_restic_args(self) -> None:
+        """
+        Tests that limits are passed to restic in KiB/s.
+        """
+        assert BandwidthLimit(10 * MIB, None).restic_args() == [
+            "--limit-upload",
+            "10240",
+        ]
+        assert BandwidthLimit(None, 100).restic_args() == ["--limit-download", "1"]
+
+    def test_rclone_arg(self) -> None:
+        """
+        Tests that limits are passed to rclone in KiB/s.
+        """
+        assert BandwidthLimit(None, None).rclone_arg() == "off"
+        assert BandwidthLimit(MIB, MIB).rclone_arg() == "1024k"
+        assert BandwidthLimit(MIB, None).rclone_arg() == "1024k:off"
+
+
+class TestAdaptiveThrottle:
+    """
+    Tests the AdaptiveThrottle class.
+    """
+
+    def test_throttle_and_recover(self) -> None:
+        """
+        Tests that the upload limit is cut below the achieved throughput on
+        congestion and raised back to the scheduled limit afterwards.
+        """
+        probe = ScriptedProbe([0.01, 0.05, 0.01, 0.01, 0.01, None])
+        throttle = AdaptiveThrottle(BandwidthSchedule.parse("4M:off"), probe)
+
+        idle = throttle.limit(MONDAY)
+        throttle.observe(96 * MIB, 32.0)
+        congested = throttle.limit(MONDAY)
+        recovering = [throttle.limit(MONDAY) for _ in range(2)]
+        recovered = throttle.limit(MONDAY)
+        unreachable = throttle.limit(MONDAY)
+
+        assert idle == BandwidthLimit(4 * MIB, None)
+        assert congested == BandwidthLimit(int(1.5 * MIB), None)
+        assert congested.note == "probe latency 50 ms, throttled"
+        assert recovering == [
+            BandwidthLimit(int(2.5 * MIB), None),
+            BandwidthLimit(int(3.5 * MIB), None),
+        ]
+        assert recovered == BandwidthLimit(4 * MIB, None)
+        assert unreachable.note == "probe unreachable"
+
+    def test_throttle_unscheduled(self) -> None:
+        """
+        Tests that an unlimited schedule is throttled from the achieved throughput,
+        and that the limit is lifted once it is well above it.
+        """
+        probe = ScriptedProbe([0.01, 0.05, 0.01])
+        throttle = AdaptiveThrottle(BandwidthSchedule.parse("off"), probe)
+        throttle.increase_step = 4 * MIB
+
+        throttle.limit(MONDAY)
+        throttle.observe(64 * MIB, 32.0)
+        congested = throttle.limit(MONDAY)
+        lifted = throttle.limit(MONDAY)
+
+        assert congested == BandwidthLimit(MIB, None)
+        assert lifted == BandwidthLimit(None, None)
+
+    def test_throttle_ignores_small_transfers(self) -> None:
+        """
+        Tests that the throughput of commands that transferred little is not taken as
+        the throughput of the uplink.
+        """
+        probe = ScriptedProbe([0.01, 0.05])
+        throttle = AdaptiveThrottle(BandwidthSchedule.parse("4M:off"), probe)
+
+        throttle.limit(MONDAY)
+        throttle.observe(MIB, 600.0)
+        congested = throttle.limit(MONDAY)
+
+        assert congested == BandwidthLimit(2 * MIB, None)
@@ -2,11 +2,20 @@
 Tests command invocation helpers.
 """
 
+import os
 from pathlib import Path
+import sys
 
 import pytest
 
-from backup.cmd import cmdexec, CommandExecutorProtocol
+import backup.cmd
+from backup.cmd import (
+    cmdexec,
+    json_line_handler,
+    resource_usage,
+    CommandExecutorProtocol,
+)
+from backup.priority import ProcessPriority
 
 
 class TestCmdExec:
@@ -34,6 +43,75 @@ class TestCmdExec:
 
         assert result.returncode == 1
 
+    def test_resource_usage(self) -> None:
+        """
+        Tests that the resources used by a command are recorded.
+        """
+        result = cmdexec(
+            ["sh", "-c", "sleep 0.1; exit 3"],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=True,
+        )
+        usage = resource_usage(result)
+
+        assert result.returncode == 3
+        assert usage is not None
+        assert usage.wall_time >= 0.1
+        assert usage.max_rss > 0
+
+    def test_killed_cmd_returncode(self) -> None:
+        """
+        Tests that a command killed by a signal has a negative return code, as with
+        subprocess.
+        """
+        result = cmdexec(
+            ["sh", "-c", "kill -9 $$"], cwd=Path.cwd(), combine_stdout_stderr=True
+        )
+
+        assert result.returncode == -9
+
+    def test_timeout_interrupts_cmd(self) -> None:
+        """
+        Tests that a command whose timeout expires is interrupted with SIGINT.
+        """
+        script = (
+            "import time\n"
+            "try:\n"
+            "    time.sleep(10)\n"
+            "except KeyboardInterrupt:\n"
+            "    raise SystemExit(3)\n"
+        )
+        result = cmdexec(
+            [sys.executable, "-c", script],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=True,
+            timeout=0.2,
+        )
+
+        assert result.returncode == 3
+
+    def test_timeout_kills_cmd_ignoring_interrupt(
+        self, monkeypatch: pytest.MonkeyPatch
+    ) -> None:
+        """
+        Tests that a command that does not exit after being interrupted is killed
+        once the grace period expires.
+        """
+        monkeypatch.setattr(backup.cmd, "INTERRUPT_GRACE_PERIOD", 0.2)
+        script = (
+            "import signal, time\n"
+            "signal.signal(signal.SIGINT, signal.SIG_IGN)\n"
+            "time.sleep(10)\n"
+        )
+        result = cmdexec(
+            [sys.executable, "-c", script],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=True,
+            timeout=0.2,
+        )
+
+        assert result.returncode == -9
+
     def test_stdout_stderr_combined(self) -> None:
         """
         Tests that the output from stdout and stderr are combined when
@@ -62,3 +140,107 @@ class TestCmdExec:
 
         assert result.stdout == b"stdout data\n"
         assert result.stderr == b"stderr data\n"
+
+    def test_env(self) -> None:
+        """
+        Tests that env is added to the environment of the current process.
+        """
+        result = cmdexec(
+            ["sh", "-c", 'printf "%s %s" "$BACKUP_TEST_VAR" "$PATH"'],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=True,
+            env={"BACKUP_TEST_VAR": "value"},
+        )
+
+        test_var, path = result.stdout.decode("utf-8").split(" ", 1)
+        assert test_var == "value"
+        assert path != ""
+
+    def test_priority(self, tmp_path: Path) -> None:
+        """
+        Tests that a command runs with the given priority and is moved into the
+        priority's cgroup.
+        """
+        priority = ProcessPriority()
+        priority.nice = 5
+        priority.cgroup = tmp_path
+
+        result = cmdexec(
+            ["sh", "-c", "nice"],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=True,
+            priority=priority,
+        )
+
+        assert result.args == ["sh", "-c", "nice"]
+        assert int(result.stdout) == os.nice(0) + 5
+        assert (tmp_path / "cgroup.procs").read_text().strip().isdigit()
+
+    def test_priority_cgroup_failure(self, tmp_path: Path) -> None:
+        """
+        Tests that a command still runs if it cannot be moved into its cgroup.
+        """
+        priority = ProcessPriority()
+        priority.cgroup = tmp_path / "missing"
+
+        result = cmdexec(
+            ["sh", "-c", "exit 0"],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=True,
+            priority=priority,
+        )
+
+        assert result.returncode == 0
+
+    def test_line_handler_receives_lines(self) -> None:
+        """
+        Tests that each line of stdout is passed to the line handler, without its
+        trailing newline, and that stdout is not retained.
+        """
+        lines: list[bytes] = list()
+
+        result = cmdexec(
+            ["sh", "-c", "printf 'line 1\nline 2\nline 3'"],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=True,
+            line_handler=lines.append,
+        )
+
+        assert result.returncode == 0
+        assert result.stdout == b""
+        assert lines == [b"line 1", b"line 2", b"line 3"]
+
+    def test_line_handler_stderr_separate(self) -> None:
+        """
+        Tests that stderr is still captured when a line handler is given and
+        combine_stdout_stderr is falsy.
+        """
+        lines: list[bytes] = list()
+
+        result = cmdexec(
+            ["sh", "-c", "printf 'stdout data\n'; printf 'stderr data\n' >&2"],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=False,
+            line_handler=lines.append,
+        )
+
+        assert lines == [b"stdout data"]
+        assert result.stderr == b"stderr data\n"
+
+    def test_json_line_handler(self) -> None:
+        """
+        Tests that the JSON line handler decodes messages as they arrive and passes
+        invalid lines to the invalid line handler.
+        """
+        messages: list[dict] = list()
+        invalid: list[bytes] = list()
+
+        cmdexec(
+            ["sh", "-c", """printf '{"a": 1}\nnot json\n\n{"b": 2}\n'"""],
+            cwd=Path.cwd(),
+            combine_stdout_stderr=True,
+            line_handler=json_line_handler(messages.append, invalid.append),
+        )
+
+        assert messages == [{"a": 1}, {"b": 2}]
+        assert invalid == [b"not json"]
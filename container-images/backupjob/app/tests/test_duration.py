@@ -0,0 +1,43 @@
+"""
+Tests duration helpers.
+"""
+
+from datetime import timedelta
+
+import pytest
+
+from backup.duration import parse_duration
+
+
+class TestParseDuration:
+    """
+    Tests the parse_duration function.
+    """
+
+    @pytest.mark.parametrize(
+        "s, expected",
+        [
+            ("90", timedelta(seconds=90)),
+            ("1.5", timedelta(seconds=1.5)),
+            ("7d", timedelta(days=7)),
+            ("1h30m", timedelta(hours=1, minutes=30)),
+            ("2d12h", timedelta(days=2, hours=12)),
+            ("45s", timedelta(seconds=45)),
+        ],
+    )
+    def test_parse(self, s: str, expected: timedelta) -> None:
+        """
+        Tests that valid durations are parsed.
+        """
+        assert parse_duration(s) == expected
+
+    @pytest.mark.parametrize(
+        "s",
+        ["", "7x", "d7", "1h 30m", "1h30", "-5", "inf", "nan", "1e400", "1e12d"],
+    )
+    def test_parse_invalid(self, s: str) -> None:
+        """
+        Tests that invalid durations raise a ValueError.
+        """
+        with pytest.raises(ValueError):
+            parse_duration(s)
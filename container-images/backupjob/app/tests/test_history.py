@@ -0,0 +1,114 @@
+"""
+Tests the run history.
+"""
+
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import pytest
+
+from backup.history import ELAPSED, RunHistory, report_metrics
+from backup.metrics import MIB
+from backup.report import BackupReport, BackupReportFieldAnnotation as A
+
+
+NOW = datetime(2024, 6, 1, 12, 0, 0)
+
+
+def backup_report(data_added: int, elapsed: timedelta) -> BackupReport:
+    report = BackupReport("backup")
+    report.new_field("Start Time", NOW, lambda _: None)
+    report.new_field("End Time", NOW + elapsed, lambda _: None)
+    child = report.new_subreport("child")
+    child.new_field("Data Added", data_added, lambda _: None)
+    child.new_field("Snapshot ID", "abc", lambda _: None)
+    child.new_field("New Repo", False, lambda _: None)
+    child.successful = True
+    return report
+
+
+@pytest.fixture
+def history(tmp_path: Path) -> RunHistory:
+    return RunHistory(tmp_path / "history" / "history.sqlite")
+
+
+def test_report_metrics() -> None:
+    """
+    Tests that only numeric fields are metrics and that the elapsed time is derived
+    from the start and end time.
+    """
+    report = backup_report(100, timedelta(minutes=2))
+
+    assert report_metrics(report) == {ELAPSED: 120.0}
+    assert report_metrics(report.subreports[0]) == {"Data Added": 100.0}
+
+
+def test_record_values(history: RunHistory) -> None:
+    """
+    Tests that the metrics of every report are recorded and returned oldest first.
+    """
+    for i in range(5):
+        history.record(backup_report(i, timedelta(seconds=i)), NOW + timedelta(days=i))
+
+    assert history.values("backup / child", "Data Added", 3) == [
+        (NOW + timedelta(days=2), 2.0),
+        (NOW + timedelta(days=3), 3.0),
+        (NOW + timedelta(days=4), 4.0),
+    ]
+    assert history.median("backup", ELAPSED, 5) == 2.0
+    assert history.median("backup", "Data Added", 5) is None
+    assert history.median("unknown", ELAPSED, 5) is None
+
+
+def test_flag_anomalies(history: RunHistory) -> None:
+    """
+    Tests that a metric exceeding its median by the anomaly factor is flagged.
+    """
+    for i in range(3):
+        history.record(backup_report(100 * MIB, timedelta(minutes=10)), NOW)
+
+    report = backup_report(1000 * MIB, timedelta(minutes=10))
+    assert history.flag_anomalies(report) == 1
+
+    child = report.subreports[0]
+    anomalies = child.fields[-1]
+    assert anomalies.label == "Anomalies"
+    assert anomalies.data == "Data Added is 10x the median of the last 3 runs"
+    assert anomalies.annotation == A.WARNING
+    assert "Anomalies" not in [f.label for f in report.fields]
+
+
+def test_flag_and_record(history: RunHistory) -> None:
+    """
+    Tests that a run is flagged against previous runs only, then recorded.
+    """
+    for i in range(3):
+        history.record(backup_report(100 * MIB, timedelta(minutes=10)), NOW)
+
+    report = backup_report(1000 * MIB, timedelta(minutes=10))
+    assert history.flag_and_record(report, NOW + timedelta(days=1)) == 1
+    assert history.values("backup / child", "Data Added", 1) == [
+        (NOW + timedelta(days=1), 1000.0 * MIB)
+    ]
+
+
+def test_flag_anomalies_needs_history(history: RunHistory) -> None:
+    """
+    Tests that nothing is flagged until enough runs have been recorded.
+    """
+    for i in range(2):
+        history.record(backup_report(100 * MIB, timedelta(minutes=1)), NOW)
+
+    report = backup_report(1000 * MIB, timedelta(hours=1))
+    assert history.flag_anomalies(report) == 0
+
+
+def test_flag_anomalies_ignores_small_values(history: RunHistory) -> None:
+    """
+    Tests that metrics below their minimum are not flagged, however much they grew.
+    """
+    for i in range(3):
+        history.record(backup_report(1, timedelta(seconds=1)), NOW)
+
+    report = backup_report(1000, timedelta(seconds=50))
+    assert history.flag_anomalies(report) == 0
@@ -0,0 +1,138 @@
+"""
+Tests the Manifest and ManifestRunner classes.
+"""
+
+from threading import Lock
+import time
+
+import pytest
+
+from backup.manifest import Manifest, ManifestJob, ManifestRunner
+from backup.report import BackupReport
+
+
+def manifest(*jobs: ManifestJob, concurrency: int = 1) -> Manifest:
+    m = Manifest(list(jobs), concurrency)
+    m.validate()
+    return m
+
+
+def test_parse() -> None:
+    """
+    Tests that arguments may be given as a list or as a shell-quoted string.
+    """
+    m = Manifest.parse(
+        {
+            "concurrency": 2,
+            "jobs": [
+                {"name": "a", "args": "rclone sync '/data/my photos' s3:b"},
+                {"name": "b", "args": ["restic", "check"], "after": "a"},
+            ],
+        }
+    )
+
+    assert m.concurrency == 2
+    assert m.jobs[0].args == ["rclone", "sync", "/data/my photos", "s3:b"]
+    assert m.jobs[1].after == ["a"]
+
+
+@pytest.mark.parametrize(
+    "document,error",
+    [
+        ([], "mapping"),
+        ({"jobs": [{"name": "a"}]}, "args"),
+        ({"jobs": [{"name": "a", "args": "x"}] * 2}, "duplicate"),
+        ({"jobs": [{"name": "a", "args": "x", "after": ["b"]}]}, "unknown job"),
+        (
+            {
+                "jobs": [
+                    {"name": "a", "args": "x", "after": ["b"]},
+                    {"name": "b", "args": "x", "after": ["a"]},
+                    {"name": "c", "args": "x"},
+                ]
+            },
+            "cycle between jobs: a, b",
+        ),
+        ({"concurrency": 0, "jobs": []}, "concurrency"),
+    ],
+)
+def test_parse_invalid(document: object, error: str) -> None:
+    """
+    Tests that invalid manifests are rejected.
+    """
+    with pytest.raises(ValueError, match=error):
+        Manifest.parse(document)
+
+
+def test_run() -> None:
+    """
+    Tests that jobs run after their dependencies, no more than the concurrency at
+    a time, and are reported in manifest order.
+    """
+    m = manifest(
+        ManifestJob("backup", ["x"], ["sync-a", "sync-b"]),
+        ManifestJob("sync-a", ["x"], []),
+        ManifestJob("sync-b", ["x"], []),
+        ManifestJob("sync-c", ["x"], []),
+        concurrency=2,
+    )
+    lock = Lock()
+    finished: list[str] = list()
+    running = 0
+    max_running = 0
+
+    def run_job(job: ManifestJob) -> BackupReport:
+        nonlocal running, max_running
+        with lock:
+            assert all(d in finished for d in job.after)
+            running += 1
+            max_running = max(max_running, running)
+        time.sleep(0.01)
+        with lock:
+            running -= 1
+            finished.append(job.name)
+
+        r = BackupReport(job.name)
+        r.successful = True
+        return r
+
+    report = BackupReport("nightly")
+    ManifestRunner(m, run_job).run(report)
+
+    assert report.successful
+    assert [r.name for r in report.subreports] == [j.name for j in m.jobs]
+    assert finished.index("backup") > finished.index("sync-a")
+    assert finished.index("backup") > finished.index("sync-b")
+    assert max_running == 2
+
+
+def test_run_failures() -> None:
+    """
+    Tests that jobs that depend on a failed job are skipped, and that a job that
+    raises does not prevent others from running.
+    """
+    m = manifest(
+        ManifestJob("sync", ["x"], []),
+        ManifestJob("backup", ["x"], ["sync"]),
+        ManifestJob("check", ["x"], ["backup"]),
+        ManifestJob("other", ["x"], []),
+    )
+
+    def run_job(job: ManifestJob) -> BackupReport:
+        if job.name == "sync":
+            raise RuntimeError("rclone not found")
+        r = BackupReport(job.name)
+        r.successful = True
+        return r
+
+    report = BackupReport("nightly")
+    ManifestRunner(m, run_job).run(report)
+    subreports = {r.name: r for r in report.subreports}
+
+    assert not report.successful
+    assert subreports["sync"].find_one_field(lambda f: f.label == "Error") is not None
+    assert subreports["check"].find_one_field(lambda f: f.label == "Skipped")
+    assert subreports["other"].successful
+    assert report.find_one_field(lambda f: f.label == "Failed Jobs").data == (
+        "sync, backup, check"
+    )
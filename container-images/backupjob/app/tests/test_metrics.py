@@ -0,0 +1,56 @@
+"""
+Tests report metrics helpers.
+"""
+
+from datetime import timedelta
+
+from backup.cmd import ResourceUsage
+from backup.metrics import add_resource_usage_fields, add_throughput_fields
+from backup.report import BackupReport
+
+
+def field_data(report: BackupReport) -> dict:
+    return {f.label: f.data for f in report.fields}
+
+
+def test_add_throughput_fields() -> None:
+    """
+    Tests that throughput is computed from the duration of an operation.
+    """
+    report = BackupReport("test")
+    add_throughput_fields(report, timedelta(seconds=4), 10_000_000, 10)
+
+    assert field_data(report) == {
+        "Duration (s)": 4.0,
+        "Throughput (MB/s)": 2.5,
+        "Files/s": 2.5,
+    }
+
+
+def test_add_throughput_fields_zero_duration() -> None:
+    """
+    Tests that no throughput is reported for operations that took no time.
+    """
+    report = BackupReport("test")
+    add_throughput_fields(report, timedelta(0), 1024, 1)
+
+    assert field_data(report) == {"Duration (s)": 0.0}
+
+
+def test_add_resource_usage_fields() -> None:
+    """
+    Tests that CPU time and peak memory are reported.
+    """
+    report = BackupReport("test")
+    usage = ResourceUsage(
+        wall_time=10.0,
+        user_time=1.25,
+        system_time=0.5,
+        max_rss=256 * 1024 * 1024,
+        block_input=0,
+        block_output=8,
+    )
+    add_resource_usage_fields(report, usage)
+    add_resource_usage_fields(report, None)
+
+    assert field_data(report) == {"CPU Time (s)": 1.8, "Peak Memory (MiB)": 256.0}
@@ -0,0 +1,91 @@
+"""
+Tests process priority.
+"""
+
+from datetime import datetime, timedelta
+import os
+from pathlib import Path
+
+from backup.priority import ProcessPriority, drop_page_cache
+
+
+class TestProcessPriority:
+    """
+    Tests the ProcessPriority class.
+    """
+
+    def test_wrap(self) -> None:
+        """
+        Tests that commands are wrapped with nice and ionice.
+        """
+        priority = ProcessPriority()
+        priority.nice = 10
+        priority.ionice_class = "best-effort"
+        priority.ionice_level = 7
+
+        assert priority.wrap(["restic", "backup"]) == [
+            "nice",
+            "-n",
+            "10",
+            "ionice",
+            "-c",
+            "2",
+            "-n",
+            "7",
+            "restic",
+            "backup",
+        ]
+        assert priority.describe() == "nice 10, ionice best-effort 7"
+
+    def test_wrap_idle(self) -> None:
+        """
+        Tests that no level is given for the idle I/O scheduling class.
+        """
+        priority = ProcessPriority()
+        priority.ionice_class = "idle"
+        priority.ionice_level = 7
+
+        assert priority.wrap(["rclone"]) == ["ionice", "-c", "3", "rclone"]
+        assert priority.describe() == "ionice idle"
+
+    def test_wrap_nothing(self) -> None:
+        """
+        Tests that commands are left alone if no priority is set.
+        """
+        priority = ProcessPriority()
+
+        assert priority.wrap(["rclone"]) == ["rclone"]
+        assert priority.describe() == ""
+
+    def test_cgroup(self, tmp_path: Path) -> None:
+        """
+        Tests that the cgroup is created and configured, and that processes are
+        moved into it.
+        """
+        priority = ProcessPriority()
+        priority.cgroup = tmp_path / "backup"
+        priority.cpu_weight = 50
+        priority.io_max = ["8:0 rbps=1048576"]
+
+        priority.setup()
+        priority.attach(1234)
+
+        assert (tmp_path / "backup" / "cpu.weight").read_text() == "50\n"
+        assert (tmp_path / "backup" / "io.max").read_text() == "8:0 rbps=1048576\n"
+        assert (tmp_path / "backup" / "cgroup.procs").read_text() == "1234\n"
+
+
+def test_drop_page_cache(tmp_path: Path) -> None:
+    """
+    Tests that the regular files under a directory are advised, and that only files
+    changed since the given time are advised if one is given.
+    """
+    (tmp_path / "d").mkdir()
+    (tmp_path / "a").write_text("a")
+    (tmp_path / "d" / "b").write_text("b")
+    os.symlink(tmp_path / "a", tmp_path / "link")
+
+    assert drop_page_cache(tmp_path) == 2
+    assert drop_page_cache(tmp_path / "a") == 1
+    assert drop_page_cache(tmp_path, datetime.now() - timedelta(hours=1)) == 2
+    assert drop_page_cache(tmp_path, datetime.now() + timedelta(hours=1)) == 0
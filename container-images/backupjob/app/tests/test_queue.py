@@ -0,0 +1,90 @@
+"""
+Tests the work queue.
+"""
+
+from datetime import datetime, timedelta
+import os
+from pathlib import Path
+
+from backup.queue import WorkQueue
+
+
+def test_claim_complete(tmp_path: Path) -> None:
+    """
+    Tests that items are claimed once each, in order, and that the queue is finished
+    once every item has a result.
+    """
+    a = WorkQueue(tmp_path, "a")
+    b = WorkQueue(tmp_path, "b")
+    assert a.populate("run-1", ["x", "y"])
+
+    assert a.claim() == "x"
+    assert b.claim() == "y"
+    assert b.claim() is None
+    assert (tmp_path / "claimed" / "x").read_text() == "a"
+
+    a.complete("x", {"ok": True})
+    assert not b.finished()
+    b.complete("y", {"ok": False})
+
+    assert a.finished()
+    assert a.results() == {"x": {"ok": True}, "y": {"ok": False}}
+
+
+def test_populate_same_run(tmp_path: Path) -> None:
+    """
+    Tests that populating the queue again for the same run keeps its progress, and
+    that a new run starts over.
+    """
+    q = WorkQueue(tmp_path, "a")
+    q.populate("run-1", ["x", "y"])
+    q.claim()
+    q.complete("x", 1)
+
+    assert not q.populate("run-1", ["x", "y"])
+    assert q.results() == {"x": 1}
+    assert q.claim() == "y"
+
+    assert q.populate("run-2", ["z"])
+    assert q.run_id() == "run-2"
+    assert q.results() == {}
+    assert q.claim() == "z"
+
+
+def test_requeue_stale(tmp_path: Path) -> None:
+    """
+    Tests that claims that were not refreshed are returned to the queue, and that
+    items completed in the meantime are not claimed again.
+    """
+    q = WorkQueue(tmp_path, "a")
+    q.stale_after = timedelta(minutes=5)
+    q.populate("run-1", ["x", "y"])
+    q.claim()
+    q.claim()
+    q.heartbeat("y")
+
+    old = (datetime.now() - timedelta(minutes=10)).timestamp()
+    os.utime(tmp_path / "claimed" / "x", (old, old))
+
+    assert q.requeue_stale(datetime.now()) == ["x"]
+    assert WorkQueue(tmp_path, "b").claim() == "x"
+
+    # The claim on y is requeued just before its claimant completes it.
+    os.rename(tmp_path / "claimed" / "y", tmp_path / "pending" / "y")
+    q.complete("y", 1)
+    assert q.claim() is None
+
+
+def test_claim_is_fresh(tmp_path: Path) -> None:
+    """
+    Tests that an item that was pending for longer than stale_after is not requeued
+    as soon as it is claimed.
+    """
+    q = WorkQueue(tmp_path, "a")
+    q.stale_after = timedelta(minutes=5)
+    q.populate("run-1", ["x"])
+    old = (datetime.now() - timedelta(minutes=10)).timestamp()
+    os.utime(tmp_path / "pending" / "x", (old, old))
+
+    assert q.claim() == "x"
+    assert q.requeue_stale(datetime.now()) == []
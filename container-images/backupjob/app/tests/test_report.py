@@ -2,6 +2,8 @@
 Tests backup reporting code.
 """
 
+from datetime import datetime
+import json
 from typing import Optional
 
 import pytest
@@ -229,3 +231,30 @@ class TestBackupReport:
         actual_report_names = list(map(lambda r: r.name, backup_report.all_reports()))
 
         assert actual_report_names == expected_report_names
+
+    def test_dict_round_trip(self, backup_report: BackupReport) -> None:
+        """
+        Tests that a report tree survives conversion to and from JSON, with
+        annotations evaluated.
+        """
+        start = datetime(2024, 6, 1, 12, 30)
+        backup_report.new_field("Start Time", start, lambda _: None)
+        backup_report.new_field("Errors", 2, lambda x: A.OK if x == 0 else A.ERROR)
+        backup_report.successful = True
+        child = backup_report.new_subreport("child")
+        child.new_field("Snapshot ID", None, lambda _: A.WARNING)
+        child.omittable = True
+
+        restored = BackupReport.from_dict(
+            json.loads(json.dumps(backup_report.to_dict()))
+        )
+
+        assert restored.name == backup_report.name
+        assert restored.fields == backup_report.fields
+        assert restored.fields[0].data == start
+        assert restored.fields[1].annotation == A.ERROR
+        assert restored.successful
+        assert [r.name for r in restored.subreports] == [child.name]
+        assert restored.subreports[0].fields == child.fields
+        assert restored.subreports[0].omittable
+        assert not restored.subreports[0].successful
@@ -0,0 +1,175 @@
+"""
+Tests runtime tuning.
+"""
+
+from pathlib import Path
+
+import pytest
+
+from backup.metrics import MIB
+from backup.tuning import CgroupLimits, RuntimeTuning
+
+
+def write_cgroup(d: Path, cpu_max: str, memory_max: str) -> None:
+    d.mkdir(parents=True, exist_ok=True)
+    (d / "cpu.max").write_text(f"{cpu_max}\n")
+    (d / "memory.max").write_text(f"{memory_max}\n")
+
+
+class TestCgroupLimits:
+    """
+    Tests the CgroupLimits class.
+    """
+
+    def test_read_namespaced(self, tmp_path: Path) -> None:
+        """
+        Tests that the limits are read from the root in a cgroup namespace.
+        """
+        proc_cgroup = tmp_path / "cgroup"
+        proc_cgroup.write_text("0::/\n")
+        write_cgroup(tmp_path / "fs", "150000 100000", str(512 * MIB))
+
+        limits = CgroupLimits.read(tmp_path / "fs", proc_cgroup)
+
+        assert limits.cpus == 1.5
+        assert limits.memory == 512 * MIB
+
+    def test_read_tightest_ancestor(self, tmp_path: Path) -> None:
+        """
+        Tests that the tightest limit of the control group and its ancestors is read.
+        """
+        proc_cgroup = tmp_path / "cgroup"
+        proc_cgroup.write_text("0::/kubepods/pod/container\n")
+        write_cgroup(tmp_path / "fs", "max 100000", "max")
+        write_cgroup(tmp_path / "fs" / "kubepods" / "pod", "200000 100000", "max")
+        write_cgroup(
+            tmp_path / "fs" / "kubepods" / "pod" / "container",
+            "max 100000",
+            str(MIB),
+        )
+
+        limits = CgroupLimits.read(tmp_path / "fs", proc_cgroup)
+
+        assert limits.cpus == 2.0
+        assert limits.memory == MIB
+
+    def test_read_unavailable(self, tmp_path: Path) -> None:
+        """
+        Tests that limits that cannot be read are considered unlimited.
+        """
+        limits = CgroupLimits.read(tmp_path / "fs", tmp_path / "cgroup")
+
+        assert limits.cpus is None
+        assert limits.memory is None
+
+
+class TestRuntimeTuning:
+    """
+    Tests the RuntimeTuning class.
+    """
+
+    def test_unlimited(self) -> None:
+        """
+        Tests that nothing is tuned without limits if the host's resources are not
+        known.
+        """
+        tuning = RuntimeTuning(CgroupLimits(None, None))
+        tuning.host_cpus = None
+        tuning.host_memory = None
+
+        assert tuning.go_env({}) == {}
+        assert tuning.read_concurrency is None
+        assert tuning.s3_connections is None
+        assert tuning.transfers is None
+        assert tuning.checkers is None
+
+    def test_limited(self) -> None:
+        """
+        Tests the settings derived from CPU and memory limits.
+        """
+        tuning = RuntimeTuning(CgroupLimits(1.5, 1000 * MIB))
+
+        assert tuning.go_env({}) == {"GOMAXPROCS": "2", "GOMEMLIMIT": "800MiB"}
+        assert tuning.read_concurrency == 2
+        assert tuning.s3_connections == 4
+        assert tuning.transfers == 4
+        assert tuning.checkers == 8
+
+    @pytest.mark.parametrize(
+        "cpus, memory, transfers",
+        [
+            (4.0, None, 8),
+            (None, 160 * MIB, 2),
+            (64.0, 1000 * 1000 * MIB, 16),
+            (0.1, 10 * MIB, 1),
+        ],
+    )
+    def test_transfers(
+        self, cpus: float | None, memory: int | None, transfers: int
+    ) -> None:
+        """
+        Tests that concurrent uploads scale with CPUs, are bounded by memory, and are
+        kept within their range.
+        """
+        tuning = RuntimeTuning(CgroupLimits(cpus, memory))
+        tuning.host_cpus = None
+        tuning.host_memory = None
+
+        assert tuning.transfers == transfers
+
+    def test_host(self) -> None:
+        """
+        Tests that concurrency is sized from the host's resources without limits,
+        while the Go runtime is left to size itself.
+        """
+        tuning = RuntimeTuning(CgroupLimits(None, None))
+        tuning.host_cpus = 4
+        tuning.host_memory = 2000 * MIB
+
+        assert tuning.go_env({}) == {}
+        assert tuning.transfers == 8
+        assert tuning.checkers == 16
+        assert tuning.s3_upload_concurrency == 4
+        assert tuning.s3_chunk_size(8, 4) == 50 * MIB
+        assert tuning.share(2).transfers == 4
+
+    def test_s3_multipart(self) -> None:
+        """
+        Tests that chunks buffered by all concurrent uploads fit within the memory
+        limit, within the range of chunk sizes.
+        """
+        tuning = RuntimeTuning(CgroupLimits(2.0, 1000 * MIB))
+
+        assert tuning.s3_upload_concurrency == 2
+        assert tuning.s3_chunk_size(4, 2) == 64 * MIB
+        assert tuning.s3_chunk_size(16, 4) == 12 * MIB
+        assert tuning.s3_chunk_size(64, 8) == 5 * MIB
+
+        tuning = RuntimeTuning(CgroupLimits(2.0, None))
+        tuning.host_memory = None
+        assert tuning.s3_chunk_size(4, 2) is None
+
+    def test_shared(self) -> None:
+        """
+        Tests that processes running at the same time are each tuned to their share of
+        the limits.
+        """
+        tuning = RuntimeTuning(CgroupLimits(4.0, 2000 * MIB)).share(2)
+
+        assert tuning.processes == 2
+        assert tuning.go_env({}) == {"GOMAXPROCS": "2", "GOMEMLIMIT": "800MiB"}
+        assert tuning.transfers == 4
+        assert tuning.checkers == 8
+        assert tuning.s3_chunk_size(4, 2) == 64 * MIB
+        assert tuning.share(2).go_env({}) == {
+            "GOMAXPROCS": "1",
+            "GOMEMLIMIT": "400MiB",
+        }
+
+    def test_go_env_respects_environ(self) -> None:
+        """
+        Tests that variables already set in the environment are not overridden.
+        """
+        tuning = RuntimeTuning(CgroupLimits(2.0, 1000 * MIB))
+
+        assert tuning.go_env({"GOMAXPROCS": "8"}) == {"GOMEMLIMIT": "800MiB"}
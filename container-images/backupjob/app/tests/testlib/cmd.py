@@ -10,7 +10,8 @@ from pathlib import Path
 from subprocess import CompletedProcess
 from typing import Any, Callable, Optional, Tuple
 
-from backup.cmd import CommandExecutorProtocol
+from backup.cmd import CommandExecutorProtocol, LineHandler
+from backup.priority import ProcessPriority
 
 CommandResultFactoryOutput = Tuple[int, bytes, Optional[bytes]]
 CommandResultFactory = Callable[[list[str], Path, bool], CommandResultFactoryOutput]
@@ -58,15 +59,33 @@ class MockCommandExecutor:
         self.set_result(returncode, stdout.encode("utf-8"), None)
 
     def __call__(
-        self, cmd: list[str], cwd: Path, combine_stdout_stderr: bool
+        self,
+        cmd: list[str],
+        cwd: Path,
+        combine_stdout_stderr: bool,
+        line_handler: Optional[LineHandler] = None,
+        timeout: Optional[float] = None,
+        env: Optional[dict[str, str]] = None,
+        priority: Optional[ProcessPriority] = None,
     ) -> CompletedProcess:
         """
         Accepts a command and returns a result in accordance with this object's configuration.
+
+        If a line_handler is given, stdout is passed to it line by line, as a real
+        command executor would.
         """
         returncode, stdout, stderr = self.cmd_result_factory(
             cmd, cwd, combine_stdout_stderr
         )
-        self.invoked_commands.append(MockInvokedCommand(cmd, cwd))
+        self.invoked_commands.append(
+            MockInvokedCommand(cmd, cwd, timeout, env, priority)
+        )
+
+        if line_handler is not None:
+            for line in stdout.splitlines():
+                line_handler(line)
+            stdout = b""
+
         return CompletedProcess(cmd, returncode, stdout, stderr)
 
 
@@ -75,9 +94,19 @@ class MockInvokedCommand:
     Class representing a mock command invocation.
     """
 
-    def __init__(self, cmd: list[str], cwd: Path) -> None:
+    def __init__(
+        self,
+        cmd: list[str],
+        cwd: Path,
+        timeout: Optional[float] = None,
+        env: Optional[dict[str, str]] = None,
+        priority: Optional[ProcessPriority] = None,
+    ) -> None:
         self.cmd = cmd
         self.cwd = cwd
+        self.timeout = timeout
+        self.env = env
+        self.priority = priority
 
     def __eq__(self, other: Any) -> bool:
         if isinstance(other, self.__class__):
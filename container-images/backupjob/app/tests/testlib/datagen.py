@@ -6,7 +6,7 @@ Contains code to generate random data that can be used as a source
 dataset for testing backups.
 """
 
-from os import write
+from os import close, write
 from random import randbytes
 from tempfile import mkstemp
 from pathlib import Path
@@ -32,4 +32,7 @@ class DataGenerator:
 
         for _ in range(count):
             fd, _ = mkstemp(prefix="backupjob-datagen-", dir=d)
-            write(fd, randbytes(size))
+            try:
+                write(fd, randbytes(size))
+            finally:
+                close(fd)
@@ -5,6 +5,272 @@ testlib.restic
 Contains helper code for restic tests.
 """
 
-from typing import Callable
+from datetime import datetime, timedelta, timezone
+from hashlib import sha256
+import json
+from pathlib import Path
+from threading import Lock
+from typing import Callable, Optional
+
+from .cmd import CommandResultFactoryOutput
 
 ExpectedResticCommand = Callable[[list[str]], list[str]]
+
+
+class MockResticRepository:
+    """
+    Minimal in-memory stand-in for a restic repository.
+
+    An instance can be used as the result factory of a MockCommandExecutor. It answers
+    the restic subcommands used by the ResticService with plausible output, and keeps
+    track of the snapshots that "backups" create.
+    """
+
+    def __init__(self) -> None:
+        self.initialized = True
+        self.snapshots: list[dict] = list()
+
+        # Fields overriding those of the summaries of backups.
+        self.backup_summary: dict = dict()
+
+        # Lines restic writes to stderr while listing objects, such as warnings.
+        self.list_stderr: list[str] = list()
+
+        # Paths (as seen by restic, i.e. the working directory of the backup) for
+        # which backups should fail.
+        self.failing_paths: set[Path] = set()
+
+        # Arguments of each check that was run, and the summary checks produce.
+        self.checks: list[list[str]] = list()
+        self.check_summary = {
+            "message_type": "summary",
+            "num_errors": 0,
+            "broken_packs": None,
+            "suggest_repair_index": False,
+            "suggest_prune": False,
+        }
+
+        # Repositories that snapshots can be copied from, by repository path.
+        self.peers: dict[str, MockResticRepository] = dict()
+        self.init_args: Optional[list[str]] = None
+
+        # Arguments of each prune that was run, the output prunes produce and the
+        # return code of prunes that are not dry runs.
+        self.prunes: list[list[str]] = list()
+        self.prune_output = (
+            "used:         16107 blobs / 38.003 MiB\n"
+            "unused:          74 blobs / 1.072 MiB\n"
+            "total:        16181 blobs / 39.075 MiB\n"
+            "unused size: 2.74% of total size\n"
+            "\n"
+            "to repack:       69 blobs / 1.078 MiB\n"
+            "this removes:    67 blobs / 1.047 MiB\n"
+            "to delete:        7 blobs / 25.726 KiB\n"
+            "total prune:     74 blobs / 1.072 MiB\n"
+            "remaining:    16107 blobs / 38.003 MiB\n"
+            "unused size after prune: 0 B (0.00% of remaining size)\n"
+        )
+        self.prune_returncode = 0
+
+        self._lock = Lock()
+        self._time = datetime(2025, 11, 1, tzinfo=timezone.utc)
+
+    def __call__(
+        self, cmd: list[str], cwd: Path, combine_stdout_stderr: bool
+    ) -> CommandResultFactoryOutput:
+        subcmd = self.subcommand(cmd)
+
+        with self._lock:
+            match subcmd[0]:
+                case "cat" if subcmd[1] == "config":
+                    return self._cat_config()
+                case "init":
+                    self.initialized = True
+                    self.init_args = subcmd[1:]
+                    return self._json_lines(0, [{"message_type": "initialized"}])
+                case "copy":
+                    return self._copy(subcmd)
+                case "backup":
+                    return self._backup(subcmd, cwd)
+                case "forget":
+                    return self._forget()
+                case "prune":
+                    self.prunes.append(subcmd)
+                    returncode = 0 if "--dry-run" in subcmd else self.prune_returncode
+                    return (returncode, self.prune_output.encode("utf-8"), None)
+                case "check":
+                    self.checks.append(subcmd)
+                    return self._json_lines(0, [self.check_summary])
+                case "list" if subcmd[1] == "snapshots":
+                    ids = "".join(f"{s['id']}\n" for s in self.snapshots)
+                    stderr = "".join(f"{line}\n" for line in self.list_stderr)
+                    if combine_stdout_stderr:
+                        return (0, (stderr + ids).encode("utf-8"), None)
+                    return (0, ids.encode("utf-8"), stderr.encode("utf-8"))
+                case "snapshots":
+                    return self._snapshots(subcmd)
+
+        raise NotImplementedError(f"unsupported restic command: {subcmd}")
+
+    @classmethod
+    def subcommand(cls, cmd: list[str]) -> list[str]:
+        """
+        Returns the restic subcommand and its arguments from the full command.
+        """
+        return cmd[cmd.index("--json") + 1 :]
+
+    def _backup(self, subcmd: list[str], cwd: Path) -> CommandResultFactoryOutput:
+        path = cwd / subcmd[-1] if subcmd[-1] != "." else cwd
+
+        if path in self.failing_paths:
+            msg = {"message_type": "exit_error", "code": 1, "message": "Fatal: boom"}
+            return self._json_lines(1, [msg])
+
+        snapshot = self.add_snapshot(path, self.option(subcmd, "--host") or "test")
+        snapshot_id = snapshot["id"]
+        summary = snapshot["summary"]
+
+        status = {"message_type": "status", "percent_done": 1.0}
+        return self._json_lines(
+            0,
+            [
+                status,
+                {"message_type": "summary", "snapshot_id": snapshot_id, **summary},
+            ],
+        )
+
+    def _forget(self) -> CommandResultFactoryOutput:
+        document = [
+            {
+                "tags": None,
+                "host": "test",
+                "paths": [],
+                "keep": self.snapshots,
+                "remove": None,
+            }
+        ]
+        return (0, json.dumps(document).encode("utf-8"), None)
+
+    def _copy(self, subcmd: list[str]) -> CommandResultFactoryOutput:
+        source = self.peers[self.option(subcmd, "--from-repo") or ""]
+        ids = self.arguments(subcmd, {"--from-repo", "--from-password-file"})
+
+        lines = list()
+        for s in source.snapshots:
+            if s["id"] in ids:
+                original = s.get("original", s["id"])
+                copy = self.add_snapshot(Path(s["paths"][0]), s["hostname"], original)
+                lines.append(f"snapshot {s['short_id']} saved as {copy['short_id']}\n")
+
+        return (0, "".join(lines).encode("utf-8"), None)
+
+    @classmethod
+    def arguments(cls, subcmd: list[str], options: set[str]) -> list[str]:
+        """
+        Returns the positional arguments of a restic subcommand, given the options
+        passed to it that take a value.
+        """
+        args = list()
+        i = 1
+        while i < len(subcmd):
+            if subcmd[i] in options:
+                i += 2
+                continue
+            if not subcmd[i].startswith("-"):
+                args.append(subcmd[i])
+            i += 1
+        return args
+
+    def add_snapshot(
+        self, path: Path, hostname: str = "test", original: Optional[str] = None
+    ) -> dict:
+        """
+        Adds a snapshot of the given path to the repository, returning it.
+
+        If original is given, the snapshot is marked as having been copied from the
+        snapshot with that ID, as `restic copy` would.
+        """
+        self._time += timedelta(minutes=1)
+        snapshot_id = sha256(
+            f"{path}@{self._time}@{original}".encode("utf-8")
+        ).hexdigest()
+        summary = {
+            "backup_start": self._time.isoformat(),
+            "backup_end": (self._time + timedelta(seconds=10)).isoformat(),
+            "files_new": 1,
+            "files_changed": 0,
+            "files_unmodified": 0,
+            "dirs_new": 1,
+            "dirs_changed": 0,
+            "dirs_unmodified": 0,
+            "data_blobs": 1,
+            "tree_blobs": 1,
+            "data_added": 1024,
+            "data_added_packed": 512,
+            "total_files_processed": 1,
+            "total_bytes_processed": 1024,
+            **self.backup_summary,
+        }
+        snapshot = {
+            "time": self._time.isoformat(),
+            "tree": "0" * 64,
+            "paths": [str(path)],
+            "hostname": hostname,
+            "username": "root",
+            "program_version": "restic 0.18.1",
+            "summary": summary,
+            "id": snapshot_id,
+            "short_id": snapshot_id[:8],
+        }
+        if original is not None:
+            snapshot["original"] = original
+        self.snapshots.append(snapshot)
+
+        return snapshot
+
+    def _snapshots(self, subcmd: list[str]) -> CommandResultFactoryOutput:
+        snapshots = self.snapshots
+        latest = self.option(subcmd, "--latest")
+
+        ids = self.arguments(subcmd, {"--latest"})
+        if len(ids) > 0:
+            snapshots = [s for s in snapshots if s["id"] in ids]
+
+        if latest is not None:
+            # restic groups snapshots by host and paths when --latest is given.
+            groups: dict[tuple, list[dict]] = dict()
+            for s in snapshots:
+                key = (s["hostname"], tuple(sorted(s["paths"])))
+                groups.setdefault(key, list()).append(s)
+            snapshots = [
+                s
+                for group in groups.values()
+                for s in sorted(group, key=lambda s: s["time"])[-int(latest) :]
+            ]
+
+        return (0, json.dumps(snapshots).encode("utf-8"), None)
+
+    def _cat_config(self) -> CommandResultFactoryOutput:
+        if self.initialized:
+            config = {"version": 2, "id": "0" * 64, "chunker_polynomial": "0"}
+            return (0, json.dumps(config).encode("utf-8"), None)
+
+        msg = {"message_type": "exit_error", "code": 10, "message": "Fatal: no repo"}
+        return self._json_lines(10, [msg])
+
+    @classmethod
+    def option(cls, subcmd: list[str], name: str) -> Optional[str]:
+        """
+        Returns the value of an option passed to a restic subcommand, or None if the
+        option was not passed.
+        """
+        if name not in subcmd:
+            return None
+        return subcmd[subcmd.index(name) + 1]
+
+    @classmethod
+    def _json_lines(
+        cls, returncode: int, messages: list[dict]
+    ) -> CommandResultFactoryOutput:
+        stdout = "\n".join(json.dumps(m) for m in messages)
+        return (returncode, stdout.encode("utf-8"), None)